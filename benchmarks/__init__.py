@@ -0,0 +1,8 @@
+"""
+Инструменты для бенчмарков и нагрузочного тестирования без живого портала Bitrix24.
+
+- `portal.py` — детерминированный генератор синтетического портала (10k–1M сущностей)
+- `stub_server.py` — локальный HTTP-сервер, эмулирующий REST API вебхука Bitrix24
+- `harness.py` — бенчмарк MCP инструментов (время, запросы, трафик, память) с сохранением baseline
+- `budgets.py` — проверка бюджета REST-запросов инструментов в зависимости от размера портала
+"""
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк форматов дискового кэша результатов.
+
+Значение — список активностей CRM синтетического портала (все поля, как `get_crm_activities_by_filter`
+с `select: ['*']`), сохраняется под ключом `crm_activities_<md5>`. Для каждого доступного формата
+(`fast_bitrix24_mcp/tools/cache_codec.py`) фиксируются:
+- время записи (`TieredCache.set`: сериализация, сжатие, запись файла)
+- время холодного чтения (новый экземпляр кэша без уровня памяти: чтение файла, распаковка, разбор)
+- размер файла на диске
+
+Строка `json indent=2` — файл прежнего `_save_to_cache` (JSON с отступами, текущий кэш его читает).
+
+Использование:
+    python -m benchmarks.cache_formats
+    python -m benchmarks.cache_formats --rows 100000 --repeat 5 --output benchmarks/results/cache_formats.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from loguru import logger
+
+from fast_bitrix24_mcp.tools.cache import TieredCache
+from fast_bitrix24_mcp.tools.cache_codec import COMPRESSIONS, SERIALIZERS, CacheCodec
+
+from .portal import ENTITY_SHARES, generate_portal
+
+CACHE_KEY = 'crm_activities_0123456789abcdef0123456789abcdef'
+
+
+def activity_rows(rows: int) -> list[dict]:
+    """Активности синтетического портала в формате ответа `crm.activity.list` со всеми полями"""
+    portal = generate_portal(entities=int(rows / ENTITY_SHARES['activity']) + 1)
+    table = portal.table('activity')
+    return [table.render(row) for row in table.rows[:rows]]
+
+
+def measure(codec: CacheCodec, data: list, repeat: int, legacy: bool = False) -> dict:
+    """Медианы времени записи и холодного чтения, размер файла"""
+    writes, reads = [], []
+    size = 0
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix='bitrix-cache-') as directory:
+            cache = TieredCache(directory, codec=codec)
+            started = time.perf_counter()
+            if legacy:
+                path = Path(directory) / f'{CACHE_KEY}.json'
+                path.write_bytes(json.dumps({'cached_at': datetime.now().isoformat(), 'data': data},
+                                            ensure_ascii=False, indent=2).encode('utf-8'))
+            else:
+                cache.set(CACHE_KEY, data)
+            writes.append(time.perf_counter() - started)
+            size = sum(path.stat().st_size for path in Path(directory).glob(f'{CACHE_KEY}.*'))
+
+            cold = TieredCache(directory, codec=codec)
+            started = time.perf_counter()
+            value = cold.get(CACHE_KEY)
+            reads.append(time.perf_counter() - started)
+            if value is None or len(value) != len(data):
+                raise RuntimeError(f"Формат {codec.name}: значение не прочитано")
+    return {
+        'write_time': round(statistics.median(writes), 4),
+        'read_time': round(statistics.median(reads), 4),
+        'size': size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Бенчмарк форматов дискового кэша результатов",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument("--rows", type=int, default=100_000, help="Число активностей в значении")
+    parser.add_argument("--repeat", type=int, default=3, help="Число замеров каждого формата")
+    parser.add_argument("--output", type=Path, default=None, help="Файл для результатов (JSON)")
+    args = parser.parse_args()
+
+    logger.remove()
+    started = time.perf_counter()
+    data = activity_rows(args.rows)
+    print(f"Сгенерировано активностей: {len(data)} за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+    formats = {'json indent=2': (CacheCodec('json'), True)}
+    for serializer in SERIALIZERS:
+        for compression in COMPRESSIONS:
+            codec = CacheCodec(serializer, compression)
+            formats[codec.name] = (codec, False)
+
+    results = {}
+    for name, (codec, legacy) in formats.items():
+        results[name] = measure(codec, data, args.repeat, legacy=legacy)
+        result = results[name]
+        print(
+            f"{name:16} запись {result['write_time']:7.3f} с, холодное чтение {result['read_time']:7.3f} с, "
+            f"файл {result['size'] / (1 << 20):8.2f} МБ",
+            file=sys.stderr, flush=True,
+        )
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps({
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'rows': len(data),
+            'repeat': args.repeat,
+            'formats': results,
+        }, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"Результаты записаны в {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Проверка совпадения выборок с `bit.get_all` на синтетическом портале.
+
+Быстрые пути выборки списков (keyset-пагинация `pagination.py`) должны отдавать те же строки, что
+`bit.get_all` со смещением: те же ID, без повторов и пропусков. Эмулятор (stub_server.py) запускается в
+процессе, порог keyset-пагинации снижается (`--threshold`, по умолчанию 100 строк), чтобы небольшой портал
+шел по курсору и диапазонам ID. Для каждого списочного метода сравниваются:
+- `iter_list` — потоковая выборка по курсору;
+- `fetch_list` — выборка по курсору параллельными диапазонами ID;
+- оба с `order: {ID: DESC}` — те же ID по убыванию;
+- `delta_sync.fetch` (delta.py) — полная выборка списка сделок, активностей и задач, его досинхронизация
+  после изменения строки на портале и список из базы и журнала изменений в новом экземпляре `DeltaSync`;
+  блокировки синхронизаций после вызовов удалены; изменение строки не теряется, когда часы сервера спешат;
+- локальная копия (mirror.py) — таблицы всех сущностей, в том числе задач, после полной выборки и сверки ID;
+  перечитывание строк по событиям удаляет только строки, которых нет на портале, даже если фильтр по списку
+  ID не сработал; `plan` не открывает базу в цикле событий.
+
+Кэш результатов (cache.py): одновременные вызовы с промахом по одному ключу пересчитывают значение один
+раз, даже если вызов без права пересчета (попадание, ответ из копии) вызывает `release`; устаревшее значение
+отчета (stale-while-revalidate) отдается без права пересчета и без изменений (возраст — отдельным элементом
+ответа), и его вызов не снимает блокировку фонового пересчета.
+Файловую блокировку ключа, которую держит право пересчета, не получает другой процесс, а блокировки всех
+ключей хранятся в одном файле каталога кэша.
+
+Объединение запросов (singleflight.py): общий запрос фонового и интерактивного вызовов выполняется с
+интерактивным приоритетом (только фоновых — с фоновым), а метод, отклоненный предохранителем, отмечается
+недоступным у каждого вызова.
+
+Расхождение завершает скрипт с кодом 1.
+
+Использование:
+    python -m benchmarks.consistency
+    python -m benchmarks.consistency --entities 5000 --threshold 200
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from loguru import logger
+
+from .portal import generate_portal
+from .stub_server import BitrixStubServer
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+LIST_METHODS = ('crm.deal.list', 'crm.lead.list', 'crm.contact.list', 'crm.company.list', 'crm.activity.list',
+                'tasks.task.list')
+
+# Попытка получить право пересчета ключа в другом процессе: печатает, досталась ли файловая блокировка
+LOCK_PROBE = '''
+import asyncio, sys
+from fast_bitrix24_mcp.tools.cache import TieredCache
+
+async def probe():
+    cache = TieredCache(sys.argv[1], lock_timeout=0.3)
+    value, lease, _ = await cache.get_or_lock(sys.argv[2])
+    print(lease is not None and lease.stripe is not None)
+    cache.release(lease)
+
+asyncio.run(probe())
+'''
+
+# Списки delta.py: таблица портала и поле даты изменения
+DELTA_TABLES = {
+    'crm.deal.list': ('deal', 'DATE_MODIFY'),
+    'crm.activity.list': ('activity', 'LAST_UPDATED'),
+    'tasks.task.list': ('task', 'CHANGED_DATE'),
+}
+
+
+def row_ids(rows) -> list[int]:
+    """ID строк ответа в порядке выдачи (у задач — `{'tasks': [...]}` и ключ `id`)"""
+    if isinstance(rows, dict):
+        rows = rows.get('tasks') or rows.get('order0000000000') or []
+    return [int(row.get('ID') or row.get('id')) for row in rows]
+
+
+def check(name: str, ok: bool, detail: str) -> dict:
+    """Результат проверки для отчета"""
+    return {'name': name, 'ok': ok, 'detail': detail}
+
+
+def compare(name: str, expected: list[int], actual: list[int]) -> dict:
+    """Результат проверки: те же ID, без повторов"""
+    duplicates = sum(count - 1 for count in Counter(actual).values() if count > 1)
+    missing = len(set(expected) - set(actual))
+    extra = len(set(actual) - set(expected))
+    return check(
+        name, not (duplicates or missing or extra),
+        f"строк {len(actual)} (ожидалось {len(expected)}), повторов {duplicates}, пропущено {missing}, лишних {extra}",
+    )
+
+
+async def check_pagination(bit, threshold: int) -> list[dict]:
+    from fast_bitrix24_mcp.tools.pagination import fetch_list, iter_list
+
+    checks = []
+    for method in LIST_METHODS:
+        params = {'filter': {}, 'select': ['ID']}
+        expected = sorted(row_ids(await bit.get_all(method, params=params)))
+        streamed = [row_id async for page in iter_list(bit, method, params, threshold=threshold)
+                    for row_id in row_ids(page)]
+        checks.append(compare(f"iter_list {method}", expected, streamed))
+        fetched = row_ids(await fetch_list(bit, method, params, threshold=threshold, shards=4))
+        checks.append(compare(f"fetch_list {method}", expected, fetched))
+        # get_all не принимает order: сортировка по убыванию ID сверяется с развернутым списком
+        params = {**params, 'order': {'ID': 'DESC'}}
+        descending = expected[::-1]
+        for name, actual in (
+            ('iter_list', [row_id async for page in iter_list(bit, method, params, threshold=threshold)
+                           for row_id in row_ids(page)]),
+            ('fetch_list', row_ids(await fetch_list(bit, method, params, threshold=threshold, shards=4))),
+        ):
+            checks.append(check(f"{name} {method} DESC", actual == descending,
+                                f"строк {len(actual)}, порядок {'по убыванию ID' if actual == descending else 'другой'}"))
+    return checks
+
+
+async def check_delta(bitrixWork, portal) -> list[dict]:
+    from fast_bitrix24_mcp.tools import delta as delta_module
+    from fast_bitrix24_mcp.tools.delta import DeltaSync
+
+    bit = bitrixWork.get_bit()
+    delta_sync = bitrixWork.get_delta_sync()
+    # Каждый вызов после первого — досинхронизация
+    delta_sync.interval = 0
+    checks = []
+    for method, (table, modified_field) in DELTA_TABLES.items():
+        params = {'filter': {}, 'select': ['ID']}
+        expected = sorted(row_ids(await bit.get_all(method, params=params)))
+        checks.append(compare(f"delta full {method}", expected, row_ids(await delta_sync.fetch(method, params))))
+        portal.table(table).upsert({'ID': expected[len(expected) // 2], modified_field: int(time.time())})
+        checks.append(compare(f"delta sync {method}", expected, row_ids(await delta_sync.fetch(method, params))))
+        # Новый экземпляр (как после перезапуска) собирает список из базы и журнала изменений без запросов
+        restored = DeltaSync(delta_sync.cache, delta_sync._fetch, interval=3600)
+        checks.append(compare(f"delta journal {method}", expected, row_ids(await restored.fetch(method, params))))
+    checks.append(check("delta: блокировки синхронизаций", not delta_sync._locks,
+                        f"осталось блокировок {len(delta_sync._locks)}"))
+
+    # Часы сервера спешат на час: отметка полной выборки — по часам портала, изменение строки не теряется
+    class ServerClockAhead(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(hours=1)
+
+    skewed = DeltaSync(delta_sync.cache, delta_sync._fetch, interval=0, clock=delta_sync._clock)
+    params = {'filter': {}, 'select': ['ID', 'STAGE_ID']}
+    delta_module.datetime = ServerClockAhead
+    try:
+        rows = await skewed.fetch('crm.deal.list', params)
+        changed_id = rows[len(rows) // 2]['ID']
+        portal.table('deal').upsert({'ID': changed_id, 'STAGE_ID': 'CONSISTENCY', 'DATE_MODIFY': int(time.time())})
+        stage = {row['ID']: row.get('STAGE_ID') for row in await skewed.fetch('crm.deal.list', params)}.get(changed_id)
+    finally:
+        delta_module.datetime = datetime
+    checks.append(check("delta: часы сервера спешат", stage == 'CONSISTENCY',
+                        f"стадия измененной сделки {stage}, ожидалась CONSISTENCY"))
+    return checks
+
+
+async def check_mirror(bitrixWork, portal) -> list[dict]:
+    from fast_bitrix24_mcp.tools.mirror import MIRROR_ENTITIES, Mirror
+
+    bit = bitrixWork.get_bit()
+    mirror = bitrixWork.get_mirror()
+    mirror.enabled = True
+    interval, reconcile_interval = mirror.interval, mirror.reconcile_interval
+    for method in MIRROR_ENTITIES:
+        await mirror.sync(method)
+    # Досинхронизация и сверка ID: строки, ID которых не вернула выборка, удаляются из копии
+    mirror.interval = mirror.reconcile_interval = 0
+    for method in MIRROR_ENTITIES:
+        await mirror.sync(method)
+    mirror.interval, mirror.reconcile_interval = interval, reconcile_interval
+
+    checks = []
+    for method in MIRROR_ENTITIES:
+        params = {'filter': {}, 'select': ['ID']}
+        expected = sorted(row_ids(await bit.get_all(method, params=params)))
+        checks.append(compare(f"mirror {method}", expected, row_ids(await mirror.query(method, params) or [])))
+
+    # Первое обращение к копии не открывает базу в цикле событий: это делает синхронизация в потоке
+    fresh = Mirror(mirror.path, mirror._pages, enabled=True)
+    fresh.plan('crm.deal.list')
+    checks.append(check("mirror: plan не открывает базу", fresh._states is None,
+                        f"состояние {'не прочитано' if fresh._states is None else 'прочитано в цикле событий'}"))
+    fresh._task.cancel()
+
+    async def ignore_ids_filter(method: str, params: dict):
+        # Портал не понял фильтр по списку ID и ничего не вернул
+        if MIRROR_ENTITIES[method].ids_key in params['filter']:
+            return
+        async for page in mirror._pages(method, params):
+            yield page
+
+    blind = Mirror(mirror.path, ignore_ids_filter, enabled=True)
+    await asyncio.to_thread(blind._open)
+    for method, table in (('crm.deal.list', 'deal'), ('tasks.task.list', 'task')):
+        ids = row_ids(await mirror.query(method, {'filter': {}, 'select': ['ID']}))[:3]
+        portal.table(table).delete(ids[-1])
+        await mirror.refresh(method, set(ids))
+        await blind.refresh(method, set(ids[:-1]))
+        left = row_ids(await mirror.query(method, {'filter': {'@ID': ids}, 'select': ['ID']}) or [])
+        checks.append(check(f"mirror refresh {method}", left == ids[:-1],
+                            f"после событий по {ids} (удалена {ids[-1]}) в копии {left}"))
+    return checks
+
+
+async def check_cache_leases(directory: str) -> list[dict]:
+    from fast_bitrix24_mcp.tools.cache import TieredCache
+
+    cache = TieredCache(directory)
+    key = 'crm_activities_consistency'
+    computes = 0
+
+    async def compute() -> None:
+        nonlocal computes
+        value, lease, _ = await cache.get_or_lock(key)
+        if value is not None:
+            return
+        try:
+            computes += 1
+            await asyncio.sleep(0.2)
+            cache.set(key, [{'ID': computes}], lease=lease)
+        finally:
+            cache.release(lease)
+
+    async def bystander() -> None:
+        # Вызов без права пересчета (попадание, ответ из копии) тоже отдает "свое" право в finally
+        await asyncio.sleep(0.05)
+        cache.release(None)
+
+    await asyncio.gather(compute(), bystander(), compute(), compute())
+    checks = [check("cache: один пересчет ключа", computes == 1, f"пересчетов {computes} из 3 вызовов")]
+
+    stale_key = 'all_managers_activity_consistency'
+    cache.ttls['all_managers_activity'] = 0.1
+    cache.set(stale_key, {'version': 1})
+    await asyncio.sleep(0.2)
+    refreshing = asyncio.Event()
+
+    async def refresh() -> None:
+        value, lease, _ = await cache.get_or_lock(stale_key)
+        refreshing.set()
+        await asyncio.sleep(0.2)
+        cache.set(stale_key, {'version': 2}, lease=lease)
+
+    value, lease, stale_age = await cache.get_or_lock(stale_key, refresh=refresh)
+    await refreshing.wait()
+    cache.release(lease)
+    # Блокировку ключа держит фоновый пересчет: новый вызов ждет его значение
+    waiter = asyncio.create_task(cache.get_or_lock(stale_key))
+    await asyncio.sleep(0.05)
+    held = not waiter.done()
+    fresh, waiter_lease, _ = await waiter
+    cache.release(waiter_lease)
+    checks.append(check(
+        "cache: устаревшее значение без права", lease is None and held and fresh == {'version': 2},
+        f"право {'нет' if lease is None else 'выдано'}, пересчет {'держит' if held else 'потерял'} блокировку, "
+        f"значение {fresh}",
+    ))
+
+    # Возраст устаревшего значения возвращается отдельно: строки списка и словарь не меняются
+    rows_key = 'comments_consistency'
+    cache.ttls['comments'] = 0.1
+    cache.set(rows_key, [{'ID': 1}, {'ID': 2}])
+    await asyncio.sleep(0.2)
+
+    async def keep_rows() -> None:
+        _, rows_lease, _ = await cache.get_or_lock(rows_key)
+        cache.set(rows_key, [{'ID': 1}, {'ID': 2}], lease=rows_lease)
+
+    rows, rows_lease, rows_age = await cache.get_or_lock(rows_key, refresh=keep_rows)
+    cache.release(rows_lease)
+    checks.append(check(
+        "cache: возраст устаревшего значения", value == {'version': 1} and rows == [{'ID': 1}, {'ID': 2}]
+        and stale_age is not None and rows_age is not None,
+        f"значение {value}, строки {rows}, возраст {stale_age} и {rows_age} с",
+    ))
+
+    async def probe(key: str) -> bool:
+        # Скрипт работает во временном каталоге: пакет берется из корня репозитория
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [str(REPO_ROOT), os.getenv('PYTHONPATH')]))}
+        process = await asyncio.create_subprocess_exec(sys.executable, '-c', LOCK_PROBE, directory, key, env=env,
+                                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        output, _ = await process.communicate()
+        return output.decode().strip().endswith('True')
+
+    lock_key = 'crm_activities_consistency_lock'
+    value, lease, _ = await cache.get_or_lock(lock_key)
+    try:
+        blocked = not await probe(lock_key)
+    finally:
+        cache.release(lease)
+    acquired = await probe(lock_key)
+    lock_files = sorted(path.name for path in Path(directory).iterdir() if 'lock' in path.name)
+    checks.append(check(
+        "cache: файловая блокировка между процессами", blocked and acquired and lock_files == ['.lock'],
+        f"другой процесс {'ждет' if blocked else 'получил блокировку'} при праве пересчета, "
+        f"{'получает' if acquired else 'не получает'} ее после release; файлы блокировок {lock_files}",
+    ))
+    return checks
+
+
+async def check_singleflight() -> list[dict]:
+    from fast_bitrix24_mcp.tools.breaker import CircuitOpenError, collect_unavailable, mark_unavailable
+    from fast_bitrix24_mcp.tools.operating import BACKGROUND, INTERACTIVE, background, current_priority
+    from fast_bitrix24_mcp.tools.singleflight import coalesce
+
+    async def run(priorities: tuple[str, ...]) -> tuple[list[str], list[tuple[bool, set]]]:
+        seen = []
+
+        async def factory():
+            await asyncio.sleep(0.1)
+            seen.append(current_priority())
+            # Так вызов отклоняет разомкнутый предохранитель (BreakerRegistry.check)
+            mark_unavailable('crm.deal.list')
+            raise CircuitOpenError('crm.deal.list', 30)
+
+        async def caller(priority: str, delay: float) -> tuple[bool, set]:
+            await asyncio.sleep(delay)
+            with collect_unavailable() as unavailable:
+                try:
+                    if priority == BACKGROUND:
+                        with background():
+                            await coalesce('crm.deal.list', {'consistency': priorities}, factory)
+                    else:
+                        await coalesce('crm.deal.list', {'consistency': priorities}, factory)
+                except CircuitOpenError:
+                    return True, unavailable
+            return False, unavailable
+
+        results = await asyncio.gather(*(caller(priority, index * 0.02) for index, priority in enumerate(priorities)))
+        return seen, results
+
+    checks = []
+    for priorities, expected in (((BACKGROUND, INTERACTIVE), INTERACTIVE), ((BACKGROUND, BACKGROUND), BACKGROUND)):
+        seen, results = await run(priorities)
+        reported = all(raised and unavailable == {'crm.deal.list'} for raised, unavailable in results)
+        checks.append(check(
+            f"singleflight: {' + '.join(priorities)}", seen == [expected] and reported,
+            f"приоритет общего запроса {seen}, ожидался {expected}; CircuitOpenError и недоступный метод "
+            f"у {sum(raised and bool(unavailable) for raised, unavailable in results)} из {len(results)} вызовов",
+        ))
+    return checks
+
+
+async def run_checks(args: argparse.Namespace) -> list[dict]:
+    portal = generate_portal(entities=args.entities)
+    stub = BitrixStubServer(portal, enforce_limits=False)
+    os.environ['WEBHOOK'] = await stub.start()
+    try:
+        from fast_bitrix24_mcp.tools import bitrixWork
+
+        return [
+            *await check_pagination(bitrixWork.get_bit(), args.threshold),
+            *await check_delta(bitrixWork, portal),
+            *await check_mirror(bitrixWork, portal),
+            *await check_cache_leases(tempfile.mkdtemp(prefix='cache-', dir='.')),
+            *await check_singleflight(),
+        ]
+    finally:
+        await stub.stop()
+
+
+def report(checks: list[dict]) -> int:
+    failures = 0
+    for result in checks:
+        status = 'OK' if result['ok'] else 'FAIL'
+        failures += not result['ok']
+        print(f"{status:4} {result['name']:40} {result['detail']}", file=sys.stderr)
+    print(f"Расхождений: {failures}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Проверка совпадения выборок с bit.get_all на синтетическом портале",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument("--entities", type=int, default=2000, help="Размер синтетического портала")
+    parser.add_argument("--threshold", type=int, default=100, help="Порог keyset-пагинации, строк")
+    args = parser.parse_args()
+
+    logger.remove()
+    with tempfile.TemporaryDirectory(prefix='bitrix-consistency-') as directory:
+        # cache/ и logs/ — во временной папке: проверка не читает и не оставляет файлы рабочей папки
+        os.chdir(directory)
+        # Порог для выборок внутри bitrixWork (delta.py); pagination.py читает его при импорте
+        os.environ['BITRIX_KEYSET_THRESHOLD'] = str(args.threshold)
+        checks = asyncio.run(run_checks(args))
+    sys.exit(report(checks))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Отправка событий портала на обработчик POST /bitrix/events (fast_bitrix24_mcp/tools/events.py).
+
+События берутся из файла JSONL (по строке `{"event": "ONCRMDEALUPDATE", "data": {"FIELDS": {"ID": 1}}}` —
+например, записанные из запросов портала) или генерируются (`--synthetic N`): всплески событий `UPDATE`
+по `--rows` строкам выбранных сущностей, как при массовом редактировании. Каждое событие отправляется
+формой в формате PHP, как ее отправляет портал (`--json` — телом JSON), с токеном `--token` в
+`auth[application_token]`. Фиксируются число ответов по HTTP-статусам и результатам (`accepted`,
+`coalesced`, `ignored`, `rejected`) и скорость отправки.
+
+Сервер запускается с BITRIX_EVENTS_TOKEN (и BITRIX_MIRROR=1, чтобы события обновляли локальную копию),
+например с порталом из `benchmarks/stub_server.py`. Слияние видно в логе сервера (`События deal: изменено
+N строк`) и в метриках `bitrix_events_total`, `bitrix_mirror_sync_total{mode="event"}` на GET /metrics.
+
+Использование:
+    python -m benchmarks.events_replay --token secret --synthetic 500 --rows 20
+    python -m benchmarks.events_replay --url http://127.0.0.1:8000/bitrix/events --token secret --file events.jsonl --rate 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlencode
+
+import aiohttp
+
+from fast_bitrix24_mcp.tools.events import EVENT_ENTITIES, ROUTE
+
+DEFAULT_URL = f'http://127.0.0.1:8000{ROUTE}'
+
+# Сущность -> префикс имени события
+EVENT_PREFIXES = {entity.name: prefix for prefix, entity in EVENT_ENTITIES.items()}
+
+
+def form_pairs(value, prefix: str = '') -> list[tuple[str, str]]:
+    """Вложенные словари в пары формы PHP (`data[FIELDS][ID]`)"""
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return [(prefix, '' if value is None else str(value))]
+    pairs = []
+    for key, item in items:
+        pairs.extend(form_pairs(item, f'{prefix}[{key}]' if prefix else str(key)))
+    return pairs
+
+
+def synthetic_event(entity: str, row_id: int, action: str = 'UPDATE') -> dict:
+    """Событие портала в формате обработчика: ID в FIELDS (CRM), FIELDS_AFTER (задачи) или id (календарь)"""
+    if entity == 'task':
+        data = {'FIELDS_AFTER': {'ID': row_id}}
+    elif entity == 'calendar':
+        data = {'id': row_id}
+    else:
+        data = {'FIELDS': {'ID': row_id}}
+    return {'event': f'{EVENT_PREFIXES[entity]}{action}', 'data': data, 'ts': int(time.time())}
+
+
+def synthetic_events(count: int, entities: list[str], rows: int, seed: int) -> list[dict]:
+    """`count` событий UPDATE по `rows` строкам каждой сущности в случайном порядке"""
+    rng = random.Random(seed)
+    return [synthetic_event(rng.choice(entities), rng.randint(1, rows)) for _ in range(count)]
+
+
+def load_events(path: Path) -> list[dict]:
+    with path.open(encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+async def replay(events: list[dict], url: str, token: str, rate: float, concurrency: int,
+                 as_json: bool) -> dict:
+    """Отправляет события (не быстрее `rate` в секунду, 0 — без ограничения) и считает ответы"""
+    statuses, results = Counter(), Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(session: aiohttp.ClientSession, event: dict) -> None:
+        event = {**event, 'auth': {**(event.get('auth') or {}), 'domain': 'replay.local', 'application_token': token}}
+        if as_json:
+            body, content_type = json.dumps(event, ensure_ascii=False), 'application/json'
+        else:
+            body, content_type = urlencode(form_pairs(event)), 'application/x-www-form-urlencoded'
+        try:
+            async with semaphore, session.post(url, data=body.encode('utf-8'),
+                                               headers={'Content-Type': content_type}) as response:
+                statuses[response.status] += 1
+                payload = await response.json(content_type=None)
+                results[payload.get('result') or payload.get('error', 'error')] += 1
+        except (aiohttp.ClientError, ValueError) as e:
+            statuses['error'] += 1
+            results[type(e).__name__] += 1
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        tasks = []
+        for number, event in enumerate(events):
+            if rate > 0:
+                delay = started + number / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(session, event)))
+        await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    return {
+        'events': len(events),
+        'elapsed': round(elapsed, 3),
+        'events_per_second': round(len(events) / elapsed, 1) if elapsed else None,
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        'results': dict(results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Отправка событий портала на обработчик событий MCP сервера",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument("--url", default=DEFAULT_URL, help="Адрес обработчика событий")
+    parser.add_argument("--token", default=os.getenv('BITRIX_EVENTS_TOKEN', '').split(',')[0],
+                        help="Токен приложения (по умолчанию первый из BITRIX_EVENTS_TOKEN)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", type=Path, help="Файл событий JSONL")
+    source.add_argument("--synthetic", type=int, help="Число синтетических событий")
+    parser.add_argument("--entities", nargs='+', default=['deal', 'activity', 'task'], choices=sorted(EVENT_PREFIXES),
+                        help="Сущности синтетических событий")
+    parser.add_argument("--rows", type=int, default=20, help="Число разных строк каждой сущности в синтетических событиях")
+    parser.add_argument("--seed", type=int, default=42, help="Зерно генератора синтетических событий")
+    parser.add_argument("--rate", type=float, default=0.0, help="Событий в секунду (0 — без ограничения)")
+    parser.add_argument("--concurrency", type=int, default=10, help="Одновременных запросов")
+    parser.add_argument("--json", action='store_true', help="Отправлять события телом JSON вместо формы")
+    parser.add_argument("--output", type=Path, default=None, help="Файл для результатов (JSON)")
+    args = parser.parse_args()
+
+    events = load_events(args.file) if args.file else synthetic_events(args.synthetic, args.entities, args.rows, args.seed)
+    result = asyncio.run(replay(events, args.url, args.token, args.rate, args.concurrency, args.json))
+    print(
+        f"Отправлено событий: {result['events']} за {result['elapsed']:.2f} с "
+        f"({result['events_per_second']} в секунду)\n"
+        f"HTTP-статусы: {result['statuses']}\nРезультаты: {result['results']}",
+        file=sys.stderr,
+    )
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps({
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'url': args.url,
+            **result,
+        }, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"Результаты записаны в {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
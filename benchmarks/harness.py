@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк MCP инструментов на синтетическом портале разных размеров.
+
+Для каждого размера портала запускает эмулятор REST API (stub_server.py) в отдельном процессе
+и по очереди выполняет инструменты. Каждый инструмент запускается в собственном процессе-воркере
+(клиент `bit` из bitrixWork.py направляется на эмулятор), чтобы состояние клиента, незавершенные задачи
+и кэши в памяти одного инструмента не влияли на замеры следующего.
+Для каждого запуска фиксируются:
+- время выполнения (wall time)
+- количество HTTP-запросов к REST API, команд (с учетом batch) и страниц списочных методов
+- переданные байты (ответы сервера и тела запросов)
+- пиковое потребление памяти по tracemalloc
+- суммарное operating-время по методам и отказы по лимитам
+- соединения клиента: создано, переиспользовано, доля переиспользования, ожидание свободного соединения пула
+- дублирующие запросы (hedging) и повторы запросов с бюджетом
+- предохранители методов: размыкания и отклоненные вызовы (каждый запуск начинается с замкнутыми)
+
+Результаты пишутся в JSON (baseline), который можно сравнить с предыдущим запуском через --compare.
+
+Использование:
+    python -m benchmarks.harness --sizes 10k 100k
+    python -m benchmarks.harness --sizes 10k --tools get_deals_at_risk get_sales_funnel
+    BITRIX_HEDGE=1 python -m benchmarks.harness --sizes 10k --latency-ms 50 --slow-ratio 0.02 --slow-ms 2000
+    python -m benchmarks.harness --sizes 100k --output benchmarks/results/new.json --compare benchmarks/results/baseline.json
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import aiohttp
+
+from .portal import PORTAL_SIZES
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_OUTPUT = Path(__file__).parent / "results" / "baseline.json"
+RESULT_PREFIX = "RESULT="
+SERVER_START_TIMEOUT = 600
+
+# Сценарии: инструмент, модуль в fast_bitrix24_mcp/tools, аргументы и (опционально) подготовка,
+# которая выполняется до замера и может дополнить аргументы
+SCENARIOS = [
+    {'tool': 'get_all_managers_activity_report', 'module': 'user', 'kwargs': {'days': 30}},
+    {'tool': 'get_deals_at_risk', 'module': 'deal', 'kwargs': {}},
+    {'tool': 'get_sales_funnel', 'module': 'sales_funnel', 'kwargs': {'isText': False}},
+    {'tool': 'get_clients_without_activity', 'module': 'inactive_clients', 'kwargs': {'isText': False}},
+    {'tool': 'get_managers_needing_support', 'module': 'manager_support', 'kwargs': {'isText': False}},
+    {'tool': 'get_daily_summary', 'module': 'daily_summary', 'kwargs': {'group_by_managers': True, 'isText': False}},
+    {'tool': 'get_managers_with_declined_activity', 'module': 'activity_decline', 'kwargs': {'isText': False}},
+    {'tool': 'get_managers_with_overdue_tasks', 'module': 'overdue_tasks', 'kwargs': {'isText': False}},
+    {'tool': 'get_top_clients_by_deals_sum', 'module': 'top_clients', 'kwargs': {'isText': False}},
+    {'tool': 'export_entities_to_json', 'module': 'helper',
+     'kwargs': {'entity': 'deal', 'select_fields': ['ID', 'TITLE', 'STAGE_ID', 'OPPORTUNITY', 'ASSIGNED_BY_ID']}},
+    {'tool': 'analyze_export_file', 'module': 'helper', 'setup': 'export_deals',
+     'kwargs': {'operation': 'sum', 'fields': ['OPPORTUNITY'], 'group_by': ['ASSIGNED_BY_ID']}},
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _resolve_tool(module_name: str, tool_name: str):
+    """Возвращает корутину инструмента (FastMCP оборачивает функции в объекты Tool с атрибутом fn)"""
+    module = importlib.import_module(f"fast_bitrix24_mcp.tools.{module_name}")
+    tool = getattr(module, tool_name)
+    return getattr(tool, 'fn', tool)
+
+
+async def _setup_export_deals(kwargs: dict) -> dict:
+    export = _resolve_tool('helper', 'export_entities_to_json')
+    result = await export(entity='deal', select_fields=['ID', 'STAGE_ID', 'OPPORTUNITY', 'ASSIGNED_BY_ID'])
+    return {**kwargs, 'file_path': result['file']}
+
+
+SETUPS = {
+    'export_deals': _setup_export_deals,
+}
+
+
+class StubProcess:
+    """Эмулятор REST API в отдельном процессе, чтобы его работа не попадала в замеры инструмента"""
+
+    def __init__(self, entities: int, port: int, args: argparse.Namespace):
+        self.entities = entities
+        self.port = port
+        self.args = args
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.webhook = f"{self.base_url}/rest/1/benchmark/"
+
+    async def start(self) -> str:
+        command = [
+            sys.executable, '-m', 'benchmarks.stub_server',
+            '--entities', str(self.entities),
+            '--seed', str(self.args.seed),
+            '--port', str(self.port),
+            '--rps', str(self.args.rps),
+            '--burst', str(self.args.burst),
+            '--latency-ms', str(self.args.latency_ms),
+            '--slow-ratio', str(self.args.slow_ratio),
+            '--slow-ms', str(self.args.slow_ms),
+            '--quiet',
+        ]
+        if self.args.no_limits:
+            command.append('--no-limits')
+        self.process = await asyncio.create_subprocess_exec(
+            *command,
+            cwd=str(REPO_ROOT),
+            stdout=asyncio.subprocess.PIPE,
+        )
+        line = await asyncio.wait_for(self.process.stdout.readline(), timeout=SERVER_START_TIMEOUT)
+        text = line.decode('utf-8').strip()
+        if not text.startswith('WEBHOOK='):
+            raise RuntimeError(f"Эмулятор не запустился: {text!r}")
+        self.webhook = text[len('WEBHOOK='):]
+        return self.webhook
+
+    async def stop(self) -> None:
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+            await self.process.wait()
+
+    async def _request(self, method: str, path: str) -> dict:
+        async with aiohttp.ClientSession() as session:
+            async with session.request(method, self.base_url + path) as response:
+                return await response.json()
+
+    async def portal(self) -> dict:
+        return await self._request('GET', '/stub/portal')
+
+    async def stats(self) -> dict:
+        return await self._request('GET', '/stub/stats')
+
+    async def reset(self) -> None:
+        await self._request('POST', '/stub/reset')
+
+
+def _configure_client(args: argparse.Namespace) -> None:
+    """Выравнивает лимиты планировщика запросов bitrixWork с лимитами эмулятора"""
+    from fast_bitrix24_mcp.tools import bitrixWork
+
+    bitrixWork.scheduler.configure(requests_per_second=args.rps, burst=args.burst)
+
+
+def _stats_delta(after: dict, before: dict) -> dict:
+    """Изменение счетчиков за запуск инструмента (setup-сценарии тоже выполняют запросы)"""
+    return {key: round(value - before.get(key, 0), 4) for key, value in after.items()}
+
+
+async def run_scenario(scenario: dict, stub: StubProcess, args: argparse.Namespace) -> dict:
+    """Выполняет один инструмент в текущем процессе и возвращает метрики запуска"""
+    from fast_bitrix24_mcp.tools import bitrixWork
+
+    # Кэш результатов (память и cache/) очищается, чтобы каждый запуск был "холодным"
+    bitrixWork.cache.clear()
+
+    kwargs = dict(scenario.get('kwargs', {}))
+    if scenario.get('setup'):
+        kwargs = await SETUPS[scenario['setup']](kwargs)
+        bitrixWork.cache.clear()
+
+    tool = _resolve_tool(scenario['module'], scenario['tool'])
+    await stub.reset()
+    bitrixWork.get_transport().reset_stats()
+    hedging_before, retries_before = bitrixWork.hedger.snapshot(), bitrixWork.retry_policy.snapshot()
+    bitrixWork.breakers.reset()
+    bitrixWork.operating_budget.reset()
+    bitrixWork.get_delta_sync().reset()
+    bitrixWork.get_mirror().reset()
+
+    error = None
+    result_size = 0
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(tool(**kwargs), timeout=args.timeout)
+        result_size = len(json.dumps(result, ensure_ascii=False, default=str).encode('utf-8'))
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    wall_time = time.perf_counter() - started
+    peak_memory = None
+    if args.tracemalloc:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    stats = await stub.stats()
+    return {
+        'tool': scenario['tool'],
+        'wall_time': round(wall_time, 4),
+        'rest_requests': stats['requests'],
+        'rest_commands': stats['commands'],
+        'pages': stats['pages'],
+        'bytes_received': stats['bytes_sent'],
+        'bytes_sent': stats['bytes_received'],
+        'peak_memory': peak_memory,
+        'operating_time': round(sum(stats['operating'].values()), 4),
+        'rate_limit_rejections': stats['rejected'],
+        'methods': stats['methods'],
+        'connections': bitrixWork.get_transport().connection_stats(),
+        'hedging': _stats_delta(bitrixWork.hedger.snapshot(), hedging_before),
+        'retries': _stats_delta(bitrixWork.retry_policy.snapshot(), retries_before),
+        'breakers': bitrixWork.breakers.snapshot(),
+        'operating_budget': bitrixWork.operating_budget.snapshot(),
+        'cache': bitrixWork.cache.snapshot(),
+        'delta_sync': bitrixWork.get_delta_sync().snapshot(),
+        'mirror': bitrixWork.get_mirror().snapshot(),
+        'result_size': result_size,
+        'error': error,
+    }
+
+
+async def run_isolated(scenario: dict, port: int, args: argparse.Namespace) -> dict:
+    """Выполняет инструмент в отдельном процессе-воркере (см. --worker)"""
+    spec = {key: scenario[key] for key in ('tool', 'module', 'kwargs', 'setup') if key in scenario}
+    command = [
+        sys.executable, '-m', 'benchmarks.harness',
+        '--worker', json.dumps(spec, ensure_ascii=False),
+        '--port', str(port),
+        '--rps', str(args.rps),
+        '--burst', str(args.burst),
+        '--timeout', str(args.timeout),
+        '--workdir', str(Path.cwd()),
+    ]
+    if not args.tracemalloc:
+        command.append('--no-tracemalloc')
+    if getattr(args, 'verbose', False):
+        command.append('--verbose')
+
+    process = await asyncio.create_subprocess_exec(*command, cwd=str(REPO_ROOT), stdout=asyncio.subprocess.PIPE)
+    stdout, _ = await process.communicate()
+    for line in reversed(stdout.decode('utf-8', errors='replace').splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return {
+        'tool': scenario['tool'], 'wall_time': None, 'rest_requests': 0, 'rest_commands': 0, 'pages': 0,
+        'bytes_received': 0, 'bytes_sent': 0, 'peak_memory': None, 'operating_time': 0.0,
+        'rate_limit_rejections': {}, 'methods': {}, 'result_size': 0,
+        'error': f"Воркер завершился с кодом {process.returncode} без результата",
+    }
+
+
+async def _worker(args: argparse.Namespace) -> dict:
+    stub = StubProcess(0, args.port, args)
+    _configure_client(args)
+    return await run_scenario(json.loads(args.worker), stub, args)
+
+
+async def run_size(size: str, scenarios: list[dict], port: int, args: argparse.Namespace) -> list[dict]:
+    entities = PORTAL_SIZES[size] if size in PORTAL_SIZES else int(size)
+    stub = StubProcess(entities, port, args)
+    await stub.start()
+    try:
+        portal = await stub.portal()
+        runs = []
+        for scenario in scenarios:
+            print(f"[{size}] {scenario['tool']} ...", file=sys.stderr, flush=True)
+            run = await run_isolated(scenario, port, args)
+            run.update({'size': size, 'entities': entities, 'users': portal['tables'].get('user')})
+            wall_time = f"{run['wall_time']:.2f} с" if run['wall_time'] is not None else "—"
+            print(
+                f"[{size}] {scenario['tool']}: {wall_time}, запросов {run['rest_requests']}, "
+                f"страниц {run['pages']}, {run['bytes_received'] / 1024:.0f} КБ"
+                + (f", ошибка: {run['error']}" if run['error'] else ""),
+                file=sys.stderr, flush=True,
+            )
+            runs.append(run)
+        return runs
+    finally:
+        await stub.stop()
+
+
+def compare(current: dict, baseline: dict) -> list[str]:
+    """Сравнивает два файла результатов по ключу (инструмент, размер)"""
+    previous = {(run['tool'], run['size']): run for run in baseline.get('runs', [])}
+    lines = []
+    for run in current.get('runs', []):
+        old = previous.get((run['tool'], run['size']))
+        if old is None:
+            continue
+        parts = []
+        for metric in ('wall_time', 'rest_requests', 'pages', 'bytes_received', 'peak_memory'):
+            before, after = old.get(metric), run.get(metric)
+            if not before or after is None:
+                continue
+            parts.append(f"{metric} {before} -> {after} ({(after - before) / before * 100:+.1f}%)")
+        if run.get('error') and not old.get('error'):
+            parts.append(f"новая ошибка: {run['error']}")
+        elif old.get('error') and not run.get('error'):
+            parts.append("ошибка исправлена")
+        lines.append(f"[{run['size']}] {run['tool']}: " + "; ".join(parts))
+    return lines
+
+
+async def run_benchmarks(args: argparse.Namespace) -> dict:
+    scenarios = [s for s in SCENARIOS if not args.tools or s['tool'] in args.tools]
+    if not scenarios:
+        raise ValueError(f"Неизвестные инструменты: {args.tools}")
+
+    # Порт эмулятора один и тот же для всех размеров портала
+    port = _free_port()
+    runs = []
+    for size in args.sizes:
+        runs.extend(await run_size(size, scenarios, port, args))
+
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'settings': {
+            'seed': args.seed,
+            'rps': args.rps,
+            'burst': args.burst,
+            'latency_ms': args.latency_ms,
+            'slow_ratio': args.slow_ratio,
+            'slow_ms': args.slow_ms,
+            'limits': not args.no_limits,
+            'tracemalloc': args.tracemalloc,
+        },
+        'runs': runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Бенчмарк MCP инструментов на синтетическом портале Bitrix24",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument("--sizes", nargs="+", default=['10k'],
+                        help=f"Размеры портала: {', '.join(PORTAL_SIZES)} или число сущностей")
+    parser.add_argument("--tools", nargs="+", default=None, help="Запускать только указанные инструменты")
+    parser.add_argument("--seed", type=int, default=42, help="Зерно генератора портала")
+    parser.add_argument("--rps", type=float, default=2.0, help="Лимит запросов в секунду (эмулятор и клиент)")
+    parser.add_argument("--burst", type=int, default=50, help="Емкость leaky bucket (эмулятор и клиент)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Сетевая задержка эмулятора, мс")
+    parser.add_argument("--slow-ratio", type=float, default=0.0, help="Доля \"отстающих\" ответов эмулятора (0..1)")
+    parser.add_argument("--slow-ms", type=float, default=0.0, help="Дополнительная задержка \"отстающего\" ответа, мс")
+    parser.add_argument("--no-limits", action="store_true", help="Отключить ошибки лимитов в эмуляторе")
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false",
+                        help="Не замерять память (tracemalloc замедляет выполнение)")
+    parser.add_argument("--timeout", type=float, default=1800, help="Таймаут одного инструмента, секунды")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help="Файл для результатов (JSON)")
+    parser.add_argument("--compare", type=Path, default=None, help="Файл предыдущих результатов для сравнения")
+    parser.add_argument("--workdir", type=Path, default=None,
+                        help="Рабочая папка для cache/, exports/ и logs/ (по умолчанию временная)")
+    parser.add_argument("--verbose", action="store_true", help="Показывать INFO-логи инструментов")
+    # Служебные параметры процесса-воркера
+    parser.add_argument("--worker", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    output = args.output.resolve()
+    baseline_path = args.compare.resolve() if args.compare else None
+    sys.path.insert(0, str(REPO_ROOT))
+
+    # Инструменты пишут cache/, exports/ и logs/ относительно текущей папки
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="bitrix24_bench_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)
+
+    if args.worker:
+        # Клиент bit создается при импорте bitrixWork, поэтому вебхук задается до импорта инструментов
+        os.environ['WEBHOOK'] = StubProcess(0, args.port, args).webhook
+        from loguru import logger
+        logger.remove()
+        logger.add(sys.stderr, level="INFO" if args.verbose else "CRITICAL")
+        run = asyncio.run(_worker(args))
+        print(RESULT_PREFIX + json.dumps(run, ensure_ascii=False), flush=True)
+        return
+
+    results = asyncio.run(run_benchmarks(args))
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(f"Результаты сохранены в {output}")
+
+    if baseline_path is not None:
+        baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+        for line in compare(results, baseline):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,977 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетического портала Bitrix24 для бенчмарков и нагрузочных тестов.
+
+Портал детерминирован: одинаковые seed, размер и опорная дата (anchor) дают одинаковые данные,
+поэтому замеры разных версий кода можно сравнивать между собой.
+
+Строки хранятся компактно (кортежи, даты - unix time), словари в формате REST API собираются
+только для отдаваемых страниц. Это позволяет держать в памяти порталы до 1M сущностей.
+
+Использование:
+    python -m benchmarks.portal --entities 100000 --seed 42
+"""
+import argparse
+import json
+import random
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Optional
+
+# Портал работает в московском времени, как и большинство порталов клиентов
+PORTAL_TZ = timezone(timedelta(hours=3))
+
+# Доли типов сущностей в общем объеме портала
+ENTITY_SHARES = {
+    'company': 0.05,
+    'contact': 0.15,
+    'lead': 0.12,
+    'deal': 0.15,
+    'activity': 0.35,
+    'task': 0.10,
+    'comment': 0.06,
+    'calendar_event': 0.02,
+}
+
+# Стандартные размеры порталов для бенчмарков
+PORTAL_SIZES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+# Операторы фильтра Bitrix24 в порядке разбора (длинные раньше коротких)
+FILTER_OPERATORS = ('>=', '<=', '!=', '!@', '!%', '>', '<', '=', '!', '@', '%')
+
+# Типы владельцев активностей (OWNER_TYPE_ID)
+OWNER_TYPES = {1: 'lead', 2: 'deal', 3: 'contact', 4: 'company'}
+OWNER_PREFIXES = {'lead': 'L', 'deal': 'D', 'contact': 'C', 'company': 'CO'}
+
+DEAL_CATEGORIES = [(1, 'Опт'), (2, 'Сервис'), (3, 'Архив 2023')]
+DEAL_STAGES = [
+    ('NEW', 'Новая', None),
+    ('PREPARATION', 'Подготовка документов', None),
+    ('PREPAYMENT_INVOICE', 'Счёт на предоплату', None),
+    ('EXECUTING', 'В работе', None),
+    ('FINAL_INVOICE', 'Финальный счёт', None),
+    ('WON', 'Сделка успешна', 'S'),
+    ('LOSE', 'Сделка провалена', 'F'),
+]
+LEAD_STATUSES = [
+    ('NEW', 'Не обработан', None),
+    ('IN_PROCESS', 'В работе', None),
+    ('PROCESSED', 'Обработан', None),
+    ('CONVERTED', 'Качественный лид', 'S'),
+    ('JUNK', 'Некачественный лид', 'F'),
+]
+SOURCES = ['CALL', 'EMAIL', 'WEB', 'ADVERTISING', 'PARTNER', 'RECOMMENDATION']
+
+# Пользовательские поля (enumeration), которые используют инструменты сервера
+USER_FIELDS = {
+    'deal': {
+        'UF_CRM_1749724770090': ('Этаж доставки', [('45', 'в подвал'), ('47', '1 этаж'), ('49', 'выше 1 этажа')]),
+    },
+    'contact': {
+        'UF_CRM_1659553251682': ('Категория клиента', [('775', 'A'), ('777', 'B'), ('779', 'C')]),
+    },
+    'company': {
+        'UF_CRM_1659553251682': ('Категория клиента', [('775', 'A'), ('777', 'B'), ('779', 'C')]),
+    },
+}
+
+FIRST_NAMES = ['Александр', 'Мария', 'Дмитрий', 'Анна', 'Сергей', 'Елена', 'Андрей', 'Ольга',
+               'Иван', 'Наталья', 'Павел', 'Татьяна', 'Михаил', 'Ирина', 'Никита', 'Светлана']
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов',
+              'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров']
+TITLE_WORDS = ['Альфа', 'Вектор', 'Гранит', 'Дельта', 'Импульс', 'Континент', 'Меридиан', 'Орбита',
+               'Прогресс', 'Ресурс', 'Сфера', 'Техно', 'Эталон', 'Север', 'Восток', 'Магистраль']
+POSITIONS = ['Менеджер по продажам', 'Старший менеджер', 'Руководитель отдела продаж',
+             'Аккаунт-менеджер', 'Специалист поддержки']
+CITIES = ['Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург']
+TEXT_WORDS = ['клиент', 'просил', 'перезвонить', 'после', 'обеда', 'отправили', 'коммерческое',
+              'предложение', 'согласовали', 'условия', 'поставки', 'ждём', 'оплату', 'счёта',
+              'уточнить', 'объём', 'заказа', 'доставка', 'на', 'следующей', 'неделе', 'договор',
+              'подписан', 'обсудили', 'скидку', 'для', 'постоянного', 'партнёра', 'встреча', 'в', 'офисе']
+
+
+def parse_portal_datetime(value: Any) -> Optional[int]:
+    """Преобразует дату из фильтра или ответа Bitrix24 в unix time (наивные даты - время портала)"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    text = str(value).strip()
+    for fmt in ('%d.%m.%Y %H:%M:%S', '%d.%m.%Y'):
+        try:
+            dt = datetime.strptime(text, fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        try:
+            dt = datetime.fromisoformat(text)
+        except ValueError:
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=PORTAL_TZ)
+    return int(dt.timestamp())
+
+
+def format_portal_datetime(timestamp: Optional[int], style: str = 'iso') -> Optional[str]:
+    """Форматирует unix time как Bitrix24: ISO-8601 для CRM/задач, dd.mm.YYYY для календаря"""
+    if timestamp is None:
+        return None
+    dt = datetime.fromtimestamp(timestamp, PORTAL_TZ)
+    if style == 'calendar':
+        return dt.strftime('%d.%m.%Y %H:%M:%S')
+    return dt.isoformat()
+
+
+def split_filter_key(key: str) -> tuple[str, str]:
+    """Отделяет оператор от имени поля: '>=DATE_CREATE' -> ('>=', 'DATE_CREATE')"""
+    key = str(key).strip()
+    for operator in FILTER_OPERATORS:
+        if key.startswith(operator):
+            operator_name = '!' if operator == '!=' else operator
+            return operator_name, key[len(operator):].strip().upper()
+    return '=', key.upper()
+
+
+def _camel_case(name: str) -> str:
+    """UF_CRM_TASK -> ufCrmTask (формат ключей tasks.task.list)"""
+    parts = name.lower().split('_')
+    return parts[0] + ''.join(part.capitalize() for part in parts[1:])
+
+
+def _coerce(column_type: str, value: Any) -> Any:
+    """Приводит значение из фильтра к типу колонки"""
+    if value is None:
+        return None
+    if column_type in ('int', 'ref'):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return None
+    if column_type == 'float':
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if column_type == 'date':
+        return parse_portal_datetime(value)
+    if column_type == 'bool':
+        return str(value).strip().lower() in ('y', 'true', '1')
+    if column_type == 'ci':
+        return str(value).lower()
+    return str(value)
+
+
+def _freeze(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class EntityTable:
+    """Таблица сущностей портала: строки-кортежи, отсортированные по ID
+
+    Если у таблицы указана `date_column`, значения в ней не убывают вместе с ID (как DATE_CREATE
+    на реальном портале), и фильтры по диапазону дат сужаются бинарным поиском без полного скана.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        columns: tuple,
+        types: dict,
+        date_column: Optional[str] = None,
+        derived: Optional[dict[str, Callable]] = None,
+        uf_columns: tuple = (),
+        key_style: str = 'upper',
+        date_style: str = 'iso',
+    ):
+        self.name = name
+        self.columns = tuple(columns)
+        self.position = {column: i for i, column in enumerate(self.columns)}
+        self.types = types
+        self.date_column = date_column
+        self.derived = derived or {}
+        self.uf_columns = tuple(uf_columns)
+        self.key_style = key_style
+        self.date_style = date_style
+        self.rows: list[tuple] = []
+        self.ids: list[int] = []
+        self.dates: list[int] = []
+        self.dates_sorted = date_column is not None
+        self.version = 0
+        self._date_pos = self.position[date_column] if date_column else None
+        self._match_cache: OrderedDict = OrderedDict()
+        self._select_cache: dict = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def append(self, row: tuple) -> None:
+        """Добавляет строку с ID больше всех существующих (используется генератором)"""
+        self.rows.append(row)
+        self.ids.append(row[0])
+        if self._date_pos is not None:
+            self.dates.append(row[self._date_pos])
+
+    def get(self, entity_id: int) -> Optional[tuple]:
+        index = bisect_left(self.ids, entity_id)
+        if index < len(self.ids) and self.ids[index] == entity_id:
+            return self.rows[index]
+        return None
+
+    def upsert(self, values: dict) -> tuple:
+        """Создает или обновляет строку по ID; значения задаются в формате колонок таблицы"""
+        entity_id = int(values['ID'])
+        index = bisect_left(self.ids, entity_id)
+        exists = index < len(self.ids) and self.ids[index] == entity_id
+        base = list(self.rows[index]) if exists else [None] * len(self.columns)
+        for column, value in values.items():
+            position = self.position.get(column)
+            if position is not None:
+                base[position] = value
+        base[0] = entity_id
+        row = tuple(base)
+        if exists:
+            self.rows[index] = row
+            if self._date_pos is not None:
+                self.dates[index] = row[self._date_pos]
+        else:
+            self.rows.insert(index, row)
+            self.ids.insert(index, entity_id)
+            if self._date_pos is not None:
+                self.dates.insert(index, row[self._date_pos])
+        if self._date_pos is not None and self.dates_sorted:
+            neighbours = self.dates[max(index - 1, 0):index + 2]
+            if any(a is None or b is None or a > b for a, b in zip(neighbours, neighbours[1:])):
+                self.dates_sorted = False
+        self._changed()
+        return row
+
+    def delete(self, entity_id: int) -> bool:
+        index = bisect_left(self.ids, entity_id)
+        if index >= len(self.ids) or self.ids[index] != entity_id:
+            return False
+        del self.rows[index]
+        del self.ids[index]
+        if self._date_pos is not None:
+            del self.dates[index]
+        self._changed()
+        return True
+
+    def _changed(self) -> None:
+        self.version += 1
+        self._match_cache.clear()
+
+    def _compile(self, filter_fields: Optional[dict]) -> tuple[list, int, int]:
+        """Разбирает фильтр в список предикатов и диапазон позиций для просмотра"""
+        predicates = []
+        lo, hi = 0, len(self.rows)
+        for raw_key, raw_value in (filter_fields or {}).items():
+            operator, field = split_filter_key(raw_key)
+            position = self.position.get(field)
+            if position is None:
+                # Как и Bitrix24, неизвестные поля фильтра игнорируем
+                continue
+            column_type = self.types.get(field, 'str')
+            if isinstance(raw_value, dict):
+                raw_value = list(raw_value.values())
+            if isinstance(raw_value, (list, tuple, set)):
+                operator = {'=': '@', '!': '!@'}.get(operator, operator)
+                if operator not in ('@', '!@'):
+                    continue
+                value = frozenset(_coerce(column_type, item) for item in raw_value)
+            else:
+                value = _coerce(column_type, raw_value)
+                if operator in ('@', '!@'):
+                    value = frozenset([value])
+                elif value is None and operator not in ('=', '!'):
+                    continue
+                if operator == '%' or operator == '!%':
+                    value = str(raw_value).lower()
+            predicates.append((position, operator, value, column_type == 'list'))
+
+            if field == 'ID' and column_type in ('int', 'ref'):
+                lo, hi = self._narrow(self.ids, operator, value, lo, hi)
+            elif field == self.date_column and self.dates_sorted:
+                lo, hi = self._narrow(self.dates, operator, value, lo, hi)
+        return predicates, lo, hi
+
+    @staticmethod
+    def _narrow(keys: list, operator: str, value: Any, lo: int, hi: int) -> tuple[int, int]:
+        if value is None or isinstance(value, frozenset):
+            return lo, hi
+        if operator == '>':
+            lo = max(lo, bisect_right(keys, value))
+        elif operator == '>=':
+            lo = max(lo, bisect_left(keys, value))
+        elif operator == '<':
+            hi = min(hi, bisect_left(keys, value))
+        elif operator == '<=':
+            hi = min(hi, bisect_right(keys, value))
+        elif operator == '=':
+            lo = max(lo, bisect_left(keys, value))
+            hi = min(hi, bisect_right(keys, value))
+        return lo, hi
+
+    @staticmethod
+    def _row_matches(row: tuple, predicates: list) -> bool:
+        for position, operator, value, is_list in predicates:
+            current = row[position]
+            if is_list:
+                members = current or ()
+                if operator == '=':
+                    ok = value in members
+                elif operator == '!':
+                    ok = value not in members
+                elif operator == '@':
+                    ok = any(member in value for member in members)
+                elif operator == '!@':
+                    ok = not any(member in value for member in members)
+                elif operator == '%':
+                    ok = any(value in str(member).lower() for member in members)
+                else:
+                    ok = False
+            elif operator == '=':
+                ok = current == value
+            elif operator == '!':
+                ok = current != value
+            elif operator == '@':
+                ok = current in value
+            elif operator == '!@':
+                ok = current not in value
+            elif operator == '%':
+                ok = current is not None and value in str(current).lower()
+            elif operator == '!%':
+                ok = current is None or value not in str(current).lower()
+            elif current is None:
+                ok = False
+            elif operator == '>':
+                ok = current > value
+            elif operator == '>=':
+                ok = current >= value
+            elif operator == '<':
+                ok = current < value
+            else:
+                ok = current <= value
+            if not ok:
+                return False
+        return True
+
+    def query(
+        self,
+        filter_fields: Optional[dict] = None,
+        descending: bool = False,
+        start: int = 0,
+        limit: int = 50,
+        count: bool = True,
+    ) -> tuple[list[int], Optional[int], int]:
+        """Выборка страницы строк по фильтру
+
+        Returns:
+            (позиции строк страницы, total или None при count=False, число просмотренных строк)
+        """
+        predicates, lo, hi = self._compile(filter_fields)
+        rows = self.rows
+        positions = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+
+        if count:
+            # Результат фильтра кэшируется, чтобы постраничная выборка не сканировала таблицу
+            # на каждой странице. Стоимость подсчета total учитывается отдельно (см. stub_server).
+            cache_key = (self.version, _freeze(filter_fields), descending)
+            matched = self._match_cache.get(cache_key)
+            if matched is None:
+                matched = array('l', (i for i in positions if self._row_matches(rows[i], predicates)))
+                self._match_cache[cache_key] = matched
+                if len(self._match_cache) > 32:
+                    self._match_cache.popitem(last=False)
+            else:
+                self._match_cache.move_to_end(cache_key)
+            start = max(start, 0)
+            return list(matched[start:start + limit]), len(matched), hi - lo
+
+        page = []
+        scanned = 0
+        for i in positions:
+            scanned += 1
+            if self._row_matches(rows[i], predicates):
+                page.append(i)
+                if len(page) >= limit:
+                    break
+        return page, None, scanned
+
+    def _select_plan(self, select: Optional[list]) -> list[tuple[str, str, Any]]:
+        key = tuple(select) if select else ()
+        plan = self._select_cache.get(key)
+        if plan is not None:
+            return plan
+
+        base = [c for c in self.columns if c not in self.uf_columns]
+        wanted: list[str] = []
+        requested = [str(s).upper() for s in select] if select else ['*']
+        for name in requested:
+            if name == '*':
+                wanted.extend(base)
+                wanted.extend(self.derived)
+            elif name == 'UF_*':
+                wanted.extend(self.uf_columns)
+            elif name in self.position or name in self.derived:
+                wanted.append(name)
+        if 'ID' not in wanted:
+            wanted.insert(0, 'ID')
+
+        plan = []
+        seen = set()
+        for name in wanted:
+            if name in seen:
+                continue
+            seen.add(name)
+            output_name = _camel_case(name) if self.key_style == 'camel' else name
+            if name in self.position:
+                plan.append((output_name, self.types.get(name, 'str'), self.position[name]))
+            else:
+                plan.append((output_name, 'derived', self.derived[name]))
+        self._select_cache[key] = plan
+        return plan
+
+    def render(self, row: tuple, select: Optional[list] = None) -> dict:
+        """Собирает словарь строки в формате ответа REST API с учетом select"""
+        item = {}
+        for output_name, column_type, source in self._select_plan(select):
+            if column_type == 'derived':
+                item[output_name] = source(row)
+                continue
+            value = row[source]
+            if value is None:
+                item[output_name] = None
+            elif column_type == 'date':
+                item[output_name] = format_portal_datetime(value, self.date_style)
+            elif column_type == 'float':
+                item[output_name] = f"{value:.2f}"
+            elif column_type in ('int', 'ref'):
+                item[output_name] = str(value)
+            elif column_type == 'list':
+                item[output_name] = list(value)
+            else:
+                item[output_name] = value
+        return item
+
+    def describe_fields(self, entity: str) -> dict:
+        """Описание полей в формате crm.*.fields"""
+        type_names = {'int': 'integer', 'ref': 'user', 'float': 'double', 'date': 'datetime',
+                      'bool': 'char', 'list': 'crm', 'ci': 'string', 'str': 'string'}
+        user_fields = USER_FIELDS.get(entity, {})
+        fields = {}
+        for column in (*self.columns, *self.derived):
+            if column in user_fields:
+                label, items = user_fields[column]
+                fields[column] = {
+                    'type': 'enumeration', 'isRequired': False, 'isReadOnly': False,
+                    'isMultiple': False, 'title': column, 'formLabel': label,
+                    'listLabel': label, 'filterLabel': label,
+                    'items': [{'ID': item_id, 'VALUE': value} for item_id, value in items],
+                }
+            else:
+                fields[column] = {
+                    'type': type_names.get(self.types.get(column, 'str'), 'string'),
+                    'isRequired': False, 'isReadOnly': column in ('ID', 'DATE_CREATE', 'DATE_MODIFY'),
+                    'isMultiple': False, 'title': column,
+                }
+        return fields
+
+
+class SyntheticPortal:
+    """Синтетический портал: набор таблиц и индексов, которые обслуживает stub_server"""
+
+    def __init__(self, seed: int, anchor: datetime, days: int, entities: int):
+        self.seed = seed
+        self.anchor = anchor
+        self.days = days
+        self.entities = entities
+        self.tables: dict[str, EntityTable] = {}
+        # (ENTITY_TYPE, ENTITY_ID) -> ID комментариев таймлайна
+        self.comment_index: dict[tuple[str, int], list[int]] = defaultdict(list)
+        # OWNER_ID -> ID событий и секций календаря пользователя
+        self.calendar_index: dict[int, list[int]] = defaultdict(list)
+        self.section_index: dict[int, list[int]] = defaultdict(list)
+
+    def table(self, name: str) -> EntityTable:
+        return self.tables[name]
+
+    def summary(self) -> dict:
+        return {
+            'seed': self.seed,
+            'entities': self.entities,
+            'anchor': self.anchor.isoformat(),
+            'days': self.days,
+            'tables': {name: len(table) for name, table in self.tables.items()},
+        }
+
+
+def _text_pool(rng: random.Random, words: int = 3000) -> str:
+    return ' '.join(rng.choice(TEXT_WORDS) for _ in range(words))
+
+
+def generate_portal(
+    entities: int = 10_000,
+    seed: int = 42,
+    users: Optional[int] = None,
+    days: int = 365,
+    anchor: Optional[datetime] = None,
+) -> SyntheticPortal:
+    """Генерирует синтетический портал
+
+    Args:
+        entities: Общее количество CRM-сущностей, задач, активностей, комментариев и событий календаря
+        seed: Зерно генератора случайных чисел
+        users: Количество пользователей (по умолчанию entities // 200, от 10 до 500)
+        days: Глубина истории портала в днях
+        anchor: Опорная дата "сейчас" (по умолчанию текущая минута). Все даты лежат в [anchor - days, anchor]
+
+    Returns:
+        SyntheticPortal
+    """
+    rng = random.Random(seed)
+    if anchor is None:
+        anchor = datetime.now(PORTAL_TZ).replace(second=0, microsecond=0)
+    elif anchor.tzinfo is None:
+        anchor = anchor.replace(tzinfo=PORTAL_TZ)
+
+    anchor_ts = int(anchor.timestamp())
+    start_ts = anchor_ts - days * 86400
+    span = anchor_ts - start_ts
+    counts = {name: max(1, int(entities * share)) for name, share in ENTITY_SHARES.items()}
+    n_users = users if users is not None else min(500, max(10, entities // 200))
+
+    portal = SyntheticPortal(seed, anchor, days, entities)
+    text = _text_pool(rng)
+    text_len = len(text)
+
+    def blob(entity_id: int, min_len: int, max_len: int) -> str:
+        offset = (entity_id * 2654435761) % (text_len - max_len)
+        length = min_len + (entity_id * 40503) % (max_len - min_len)
+        return text[offset:offset + length]
+
+    def created_at(i: int, n: int) -> int:
+        # Даты создания не убывают вместе с ID, как на реальном портале
+        step = span / n
+        jitter = int(step)
+        return start_ts + int(i * step) + (rng.randrange(jitter) if jitter > 1 else 0)
+
+    def modified_at(created: int) -> int:
+        return created + int((anchor_ts - created) * rng.random() ** 2)
+
+    # === ПОЛЬЗОВАТЕЛИ ===
+    user_table = EntityTable(
+        'user',
+        ('ID', 'ACTIVE', 'NAME', 'LAST_NAME', 'EMAIL', 'WORK_POSITION', 'PERSONAL_CITY',
+         'UF_DEPARTMENT', 'DATE_REGISTER', 'LAST_LOGIN'),
+        {'ID': 'int', 'ACTIVE': 'bool', 'UF_DEPARTMENT': 'list', 'DATE_REGISTER': 'date', 'LAST_LOGIN': 'date'},
+    )
+    active_users = []
+    for user_id in range(1, n_users + 1):
+        active = user_id == 1 or rng.random() > 0.1
+        if active:
+            active_users.append(user_id)
+        user_table.append((
+            user_id, active,
+            FIRST_NAMES[user_id % len(FIRST_NAMES)],
+            LAST_NAMES[(user_id * 7) % len(LAST_NAMES)],
+            f"user{user_id}@example.ru",
+            POSITIONS[user_id % len(POSITIONS)],
+            CITIES[user_id % len(CITIES)],
+            (1 + user_id % 5,),
+            start_ts - rng.randrange(86400 * 365),
+            anchor_ts - rng.randrange(86400 * (3 if active else 120)),
+        ))
+    portal.tables['user'] = user_table
+
+    # Нагрузка между менеджерами неравномерная: у первых в списке сущностей больше
+    managers = list(active_users)
+    rng.shuffle(managers)
+    weights = [1 / (k ** 0.6) for k in range(1, len(managers) + 1)]
+    assignee_pool = rng.choices(managers, weights=weights, k=4096)
+
+    def assignee() -> int:
+        return assignee_pool[rng.getrandbits(12)]
+
+    # === ВОРОНКИ И СТАДИИ ===
+    category_table = EntityTable(
+        'deal_category', ('ID', 'NAME', 'SORT', 'IS_LOCKED', 'CREATED_DATE'),
+        {'ID': 'int', 'SORT': 'int', 'CREATED_DATE': 'date'},
+    )
+    for category_id, name in DEAL_CATEGORIES:
+        category_table.append((category_id, name, category_id * 100, 'N', start_ts))
+    portal.tables['deal_category'] = category_table
+
+    status_table = EntityTable(
+        'status', ('ID', 'ENTITY_ID', 'STATUS_ID', 'NAME', 'SORT', 'SEMANTICS', 'CATEGORY_ID'),
+        {'ID': 'int', 'SORT': 'int', 'CATEGORY_ID': 'int'},
+    )
+    status_id = 0
+    for category_id in [0] + [c for c, _ in DEAL_CATEGORIES]:
+        for sort, (code, name, semantics) in enumerate(DEAL_STAGES, start=1):
+            status_id += 1
+            status_table.append((
+                status_id,
+                'DEAL_STAGE' if category_id == 0 else f'DEAL_STAGE_{category_id}',
+                code if category_id == 0 else f'C{category_id}:{code}',
+                name, sort * 10, semantics, None if category_id == 0 else category_id,
+            ))
+    for sort, (code, name, semantics) in enumerate(LEAD_STATUSES, start=1):
+        status_id += 1
+        status_table.append((status_id, 'STATUS', code, name, sort * 10, semantics, None))
+    for sort, code in enumerate(SOURCES, start=1):
+        status_id += 1
+        status_table.append((status_id, 'SOURCE', code, code.capitalize(), sort * 10, None, None))
+    portal.tables['status'] = status_table
+
+    # === КОМПАНИИ ===
+    n_companies = counts['company']
+    company_table = EntityTable(
+        'company',
+        ('ID', 'COMPANY_TYPE', 'INDUSTRY', 'REVENUE', 'CURRENCY_ID', 'ASSIGNED_BY_ID', 'CREATED_BY_ID',
+         'DATE_CREATE', 'DATE_MODIFY', 'OPENED', 'UF_CRM_1659553251682'),
+        {'ID': 'int', 'REVENUE': 'float', 'ASSIGNED_BY_ID': 'ref', 'CREATED_BY_ID': 'ref',
+         'DATE_CREATE': 'date', 'DATE_MODIFY': 'date'},
+        date_column='DATE_CREATE',
+        derived={
+            'TITLE': lambda row: f'ООО "{TITLE_WORDS[row[0] % len(TITLE_WORDS)]} {row[0]}"',
+            'COMMENTS': lambda row: blob(row[0], 40, 400),
+        },
+        uf_columns=('UF_CRM_1659553251682',),
+    )
+    for i in range(n_companies):
+        created = created_at(i, n_companies)
+        company_table.append((
+            i + 1, rng.choice(('CUSTOMER', 'PARTNER', 'SUPPLIER')), rng.choice(('IT', 'MANUFACTURING', 'RETAIL')),
+            float(rng.randrange(100, 100_000) * 1000), 'RUB', assignee(), assignee(),
+            created, modified_at(created), 'Y', rng.choices(('775', '777', '779'), weights=(3, 4, 3))[0],
+        ))
+    portal.tables['company'] = company_table
+
+    # === КОНТАКТЫ ===
+    n_contacts = counts['contact']
+    contact_table = EntityTable(
+        'contact',
+        ('ID', 'TYPE_ID', 'SOURCE_ID', 'COMPANY_ID', 'ASSIGNED_BY_ID', 'CREATED_BY_ID',
+         'DATE_CREATE', 'DATE_MODIFY', 'OPENED', 'UF_CRM_1659553251682'),
+        {'ID': 'int', 'COMPANY_ID': 'int', 'ASSIGNED_BY_ID': 'ref', 'CREATED_BY_ID': 'ref',
+         'DATE_CREATE': 'date', 'DATE_MODIFY': 'date'},
+        date_column='DATE_CREATE',
+        derived={
+            'NAME': lambda row: FIRST_NAMES[row[0] % len(FIRST_NAMES)],
+            'LAST_NAME': lambda row: LAST_NAMES[(row[0] // 7) % len(LAST_NAMES)],
+            'COMMENTS': lambda row: blob(row[0], 40, 400),
+        },
+        uf_columns=('UF_CRM_1659553251682',),
+    )
+    for i in range(n_contacts):
+        created = created_at(i, n_contacts)
+        company_id = 1 + int(rng.random() * max(1, n_companies * (i + 1) / n_contacts)) if rng.random() < 0.6 else None
+        contact_table.append((
+            i + 1, 'CLIENT', rng.choice(SOURCES), company_id, assignee(), assignee(),
+            created, modified_at(created), 'Y', rng.choices(('775', '777', '779'), weights=(3, 4, 3))[0],
+        ))
+    portal.tables['contact'] = contact_table
+
+    # === ЛИДЫ ===
+    n_leads = counts['lead']
+    lead_table = EntityTable(
+        'lead',
+        ('ID', 'STATUS_ID', 'STATUS_SEMANTIC_ID', 'SOURCE_ID', 'OPPORTUNITY', 'CURRENCY_ID', 'ASSIGNED_BY_ID',
+         'CREATED_BY_ID', 'DATE_CREATE', 'DATE_MODIFY', 'DATE_CLOSED', 'CONTACT_ID', 'COMPANY_ID', 'OPENED'),
+        {'ID': 'int', 'OPPORTUNITY': 'float', 'ASSIGNED_BY_ID': 'ref', 'CREATED_BY_ID': 'ref',
+         'DATE_CREATE': 'date', 'DATE_MODIFY': 'date', 'DATE_CLOSED': 'date', 'CONTACT_ID': 'int', 'COMPANY_ID': 'int'},
+        date_column='DATE_CREATE',
+        derived={
+            'TITLE': lambda row: f'Лид #{row[0]} с сайта',
+            'NAME': lambda row: FIRST_NAMES[(row[0] * 3) % len(FIRST_NAMES)],
+            'LAST_NAME': lambda row: LAST_NAMES[(row[0] * 5) % len(LAST_NAMES)],
+            'COMMENTS': lambda row: blob(row[0], 40, 600),
+        },
+    )
+    lead_history = []
+    for i in range(n_leads):
+        created = created_at(i, n_leads)
+        age = (anchor_ts - created) / span
+        if rng.random() < 0.15 + 0.75 * age:
+            status_index = 3 if rng.random() < 0.35 else 4
+        else:
+            status_index = rng.randrange(3)
+        code, _, semantics = LEAD_STATUSES[status_index]
+        modified = modified_at(created)
+        lead_table.append((
+            i + 1, code, semantics or 'P', rng.choice(SOURCES), float(rng.randrange(0, 500) * 1000), 'RUB',
+            assignee(), assignee(), created, modified, modified if semantics else None,
+            1 + rng.randrange(n_contacts) if rng.random() < 0.3 else None, None, 'Y',
+        ))
+        lead_history.append((i + 1, created, modified, status_index))
+    portal.tables['lead'] = lead_table
+
+    # === СДЕЛКИ ===
+    n_deals = counts['deal']
+    deal_table = EntityTable(
+        'deal',
+        ('ID', 'TYPE_ID', 'CATEGORY_ID', 'STAGE_ID', 'STAGE_SEMANTIC_ID', 'IS_NEW', 'CLOSED', 'OPPORTUNITY',
+         'CURRENCY_ID', 'ASSIGNED_BY_ID', 'CREATED_BY_ID', 'MODIFY_BY_ID', 'CONTACT_ID', 'COMPANY_ID', 'LEAD_ID',
+         'SOURCE_ID', 'BEGINDATE', 'CLOSEDATE', 'DATE_CREATE', 'DATE_MODIFY', 'OPENED', 'UF_CRM_1749724770090'),
+        {'ID': 'int', 'CATEGORY_ID': 'int', 'OPPORTUNITY': 'float', 'ASSIGNED_BY_ID': 'ref',
+         'CREATED_BY_ID': 'ref', 'MODIFY_BY_ID': 'ref', 'CONTACT_ID': 'int', 'COMPANY_ID': 'int',
+         'LEAD_ID': 'int', 'BEGINDATE': 'date', 'CLOSEDATE': 'date', 'DATE_CREATE': 'date', 'DATE_MODIFY': 'date'},
+        date_column='DATE_CREATE',
+        derived={
+            'TITLE': lambda row: f'Сделка #{row[0]} {TITLE_WORDS[(row[0] * 11) % len(TITLE_WORDS)]}',
+            'COMMENTS': lambda row: blob(row[0], 40, 800),
+        },
+        uf_columns=('UF_CRM_1749724770090',),
+    )
+    deal_history = []
+    for i in range(n_deals):
+        created = created_at(i, n_deals)
+        age = (anchor_ts - created) / span
+        category_id = 0 if rng.random() < 0.7 else rng.choice(DEAL_CATEGORIES)[0]
+        if rng.random() < 0.1 + 0.8 * age:
+            stage_index = 5 if rng.random() < 0.4 else 6
+        else:
+            stage_index = rng.randrange(5)
+        code, _, semantics = DEAL_STAGES[stage_index]
+        stage_id = code if category_id == 0 else f'C{category_id}:{code}'
+        modified = modified_at(created)
+        company_id = 1 + int(rng.random() * max(1, n_companies * (i + 1) / n_deals)) if rng.random() < 0.5 else None
+        contact_id = 1 + int(rng.random() * max(1, n_contacts * (i + 1) / n_deals)) if rng.random() < 0.7 else None
+        manager_id = assignee()
+        deal_table.append((
+            i + 1, 'SALE', category_id, stage_id, semantics or 'P', 'N' if stage_index else 'Y',
+            'Y' if semantics else 'N', float(rng.randrange(1, 2000) * 500), 'RUB', manager_id, manager_id,
+            manager_id, contact_id, company_id, None, rng.choice(SOURCES), created,
+            modified if semantics else created + 86400 * rng.randrange(7, 60), created, modified, 'Y',
+            rng.choice(('45', '47', '49')),
+        ))
+        deal_history.append((i + 1, created, modified, category_id, stage_index))
+    portal.tables['deal'] = deal_table
+
+    # === ИСТОРИЯ СТАДИЙ ===
+    deal_history_table = EntityTable(
+        'stagehistory_deal',
+        ('ID', 'TYPE_ID', 'OWNER_ID', 'CREATED_TIME', 'CATEGORY_ID', 'STAGE_SEMANTIC_ID', 'STAGE_ID'),
+        {'ID': 'int', 'TYPE_ID': 'int', 'OWNER_ID': 'int', 'CREATED_TIME': 'date', 'CATEGORY_ID': 'int'},
+    )
+    history_id = 0
+    for deal_id, created, modified, category_id, stage_index in deal_history:
+        path = [0] + sorted(rng.sample(range(1, 5), rng.randrange(0, 3)))
+        if stage_index not in path:
+            path.append(stage_index)
+        for step, index in enumerate(path):
+            history_id += 1
+            code, _, semantics = DEAL_STAGES[index]
+            moment = created + (modified - created) * step // max(len(path) - 1, 1)
+            deal_history_table.append((
+                history_id, 1 if step == 0 else (3 if semantics else 2), deal_id, moment, category_id,
+                semantics or 'P', code if category_id == 0 else f'C{category_id}:{code}',
+            ))
+    portal.tables['stagehistory_deal'] = deal_history_table
+
+    lead_history_table = EntityTable(
+        'stagehistory_lead',
+        ('ID', 'TYPE_ID', 'OWNER_ID', 'CREATED_TIME', 'STATUS_SEMANTIC_ID', 'STATUS_ID'),
+        {'ID': 'int', 'TYPE_ID': 'int', 'OWNER_ID': 'int', 'CREATED_TIME': 'date'},
+    )
+    history_id = 0
+    for lead_id, created, modified, status_index in lead_history:
+        path = [0] if status_index == 0 else [0, status_index]
+        for step, index in enumerate(path):
+            history_id += 1
+            code, _, semantics = LEAD_STATUSES[index]
+            lead_history_table.append((
+                history_id, 1 if step == 0 else (3 if semantics else 2), lead_id,
+                created if step == 0 else modified, semantics or 'P', code,
+            ))
+    portal.tables['stagehistory_lead'] = lead_history_table
+
+    owner_tables = {'lead': lead_table, 'deal': deal_table, 'contact': contact_table, 'company': company_table}
+    owner_assignee_pos = {name: table.position['ASSIGNED_BY_ID'] for name, table in owner_tables.items()}
+
+    def pick_owner(owner_type: str, fraction: float) -> tuple[int, int]:
+        """Выбирает уже существующую на момент события сущность и ее ответственного"""
+        table = owner_tables[owner_type]
+        owner_id = 1 + int(rng.random() * max(1.0, len(table) * fraction))
+        owner_id = min(owner_id, len(table))
+        return owner_id, table.rows[owner_id - 1][owner_assignee_pos[owner_type]]
+
+    # === АКТИВНОСТИ CRM ===
+    n_activities = counts['activity']
+    activity_types = (
+        # (TYPE_ID, PROVIDER_ID, PROVIDER_TYPE_ID, вес)
+        (2, 'VOXIMPLANT_CALL', 'CALL', 45),
+        (4, 'CRM_EMAIL', 'EMAIL', 20),
+        (1, 'CRM_MEETING', 'MEETING', 10),
+        (6, 'CRM_TODO', 'TODO', 15),
+        (3, 'TASKS', 'TASK', 10),
+    )
+    activity_type_pool = [t for t in activity_types for _ in range(t[3])]
+    activity_table = EntityTable(
+        'activity',
+        ('ID', 'OWNER_ID', 'OWNER_TYPE_ID', 'TYPE_ID', 'PROVIDER_ID', 'PROVIDER_TYPE_ID', 'DIRECTION',
+         'RESPONSIBLE_ID', 'AUTHOR_ID', 'COMPLETED', 'PRIORITY', 'CREATED', 'LAST_UPDATED'),
+        {'ID': 'int', 'OWNER_ID': 'int', 'OWNER_TYPE_ID': 'int', 'TYPE_ID': 'int', 'DIRECTION': 'int',
+         'RESPONSIBLE_ID': 'ref', 'AUTHOR_ID': 'ref', 'PRIORITY': 'int', 'CREATED': 'date', 'LAST_UPDATED': 'date'},
+        date_column='CREATED',
+        derived={
+            'SUBJECT': lambda row: f'Активность #{row[0]}',
+            'START_TIME': lambda row: format_portal_datetime(row[11]),
+            'END_TIME': lambda row: format_portal_datetime(row[11] + 60 * (1 + row[0] % 45)),
+            'DEADLINE': lambda row: format_portal_datetime(row[11] + 60 * (1 + row[0] % 45)),
+            'DESCRIPTION': lambda row: blob(row[0], 200, 2000),
+            'DESCRIPTION_TYPE': lambda row: '1',
+            'SETTINGS': lambda row: {
+                'DURATION': 60 * (1 + row[0] % 45),
+                'MISSED_CALL': row[6] == 0,
+                'RECORD_URL': f'https://example.ru/records/{row[0]}.mp3',
+                'NOTES': blob(row[0] * 3, 100, 600),
+            },
+        },
+    )
+    owner_type_pool = (2,) * 50 + (1,) * 20 + (3,) * 20 + (4,) * 10
+    for i in range(n_activities):
+        created = created_at(i, n_activities)
+        type_id, provider_id, provider_type_id, _ = activity_type_pool[rng.randrange(len(activity_type_pool))]
+        owner_type_id = owner_type_pool[rng.randrange(100)]
+        owner_id, responsible_id = pick_owner(OWNER_TYPES[owner_type_id], (i + 1) / n_activities)
+        if rng.random() < 0.2:
+            responsible_id = assignee()
+        activity_table.append((
+            i + 1, owner_id, owner_type_id, type_id, provider_id, provider_type_id,
+            rng.choice((0, 1, 1, 2, 2)) if type_id == 2 else 0, responsible_id, responsible_id,
+            'Y' if rng.random() < 0.8 else 'N', 2, created, modified_at(created),
+        ))
+    portal.tables['activity'] = activity_table
+
+    # === ЗАДАЧИ ===
+    n_tasks = counts['task']
+    task_table = EntityTable(
+        'task',
+        ('ID', 'STATUS', 'PRIORITY', 'RESPONSIBLE_ID', 'CREATED_BY', 'GROUP_ID', 'CREATED_DATE',
+         'CHANGED_DATE', 'CLOSED_DATE', 'DEADLINE', 'UF_CRM_TASK'),
+        {'ID': 'int', 'STATUS': 'int', 'PRIORITY': 'int', 'RESPONSIBLE_ID': 'ref', 'CREATED_BY': 'ref',
+         'GROUP_ID': 'int', 'CREATED_DATE': 'date', 'CHANGED_DATE': 'date', 'CLOSED_DATE': 'date',
+         'DEADLINE': 'date', 'UF_CRM_TASK': 'list'},
+        date_column='CREATED_DATE',
+        derived={
+            'TITLE': lambda row: f'Задача #{row[0]}: {TEXT_WORDS[row[0] % len(TEXT_WORDS)]}',
+            'DESCRIPTION': lambda row: blob(row[0] * 5, 100, 1500),
+        },
+        key_style='camel',
+    )
+    for i in range(n_tasks):
+        created = created_at(i, n_tasks)
+        age = (anchor_ts - created) / span
+        link = ()
+        responsible_id = assignee()
+        if rng.random() < 0.6:
+            owner_type = rng.choice(('deal', 'deal', 'deal', 'contact', 'company', 'lead'))
+            owner_id, responsible_id = pick_owner(owner_type, (i + 1) / n_tasks)
+            link = (f"{OWNER_PREFIXES[owner_type]}_{owner_id}",)
+        deadline = created + 86400 * rng.randrange(1, 15)
+        if rng.random() < 0.2 + 0.75 * age:
+            status = 5
+            closed = min(anchor_ts, created + int((deadline - created) * rng.uniform(0.3, 1.5)))
+        else:
+            status = rng.choice((2, 2, 3, 3, 4, 6))
+            closed = None
+        changed = max(closed or created, modified_at(created))
+        task_table.append((
+            i + 1, status, rng.choice((1, 1, 2)), responsible_id, assignee(), 0,
+            created, changed, closed, deadline, link,
+        ))
+    portal.tables['task'] = task_table
+
+    # === КОММЕНТАРИИ ТАЙМЛАЙНА ===
+    n_comments = counts['comment']
+    comment_table = EntityTable(
+        'comment',
+        ('ID', 'ENTITY_ID', 'ENTITY_TYPE', 'AUTHOR_ID', 'CREATED'),
+        {'ID': 'int', 'ENTITY_ID': 'int', 'ENTITY_TYPE': 'ci', 'AUTHOR_ID': 'ref', 'CREATED': 'date'},
+        date_column='CREATED',
+        derived={
+            'COMMENT': lambda row: blob(row[0] * 7, 20, 500),
+            'FILES': lambda row: [],
+        },
+    )
+    comment_type_pool = ('deal',) * 60 + ('lead',) * 15 + ('contact',) * 15 + ('company',) * 10
+    for i in range(n_comments):
+        created = created_at(i, n_comments)
+        entity_type = comment_type_pool[rng.randrange(100)]
+        entity_id, author_id = pick_owner(entity_type, (i + 1) / n_comments)
+        if rng.random() < 0.2:
+            author_id = assignee()
+        comment_table.append((i + 1, entity_id, entity_type, author_id, created))
+        portal.comment_index[(entity_type, entity_id)].append(i + 1)
+    portal.tables['comment'] = comment_table
+
+    # === КАЛЕНДАРЬ ===
+    section_table = EntityTable(
+        'calendar_section', ('ID', 'CAL_TYPE', 'OWNER_ID', 'NAME', 'COLOR', 'ACTIVE'),
+        {'ID': 'int', 'OWNER_ID': 'int'},
+    )
+    section_id = 0
+    sections_by_owner: dict[int, list[int]] = {}
+    for user_id in active_users:
+        sections_by_owner[user_id] = []
+        for name in (('Мой календарь', 'Встречи с клиентами') if rng.random() < 0.3 else ('Мой календарь',)):
+            section_id += 1
+            section_table.append((section_id, 'user', user_id, name, '#9dcf00', 'Y'))
+            sections_by_owner[user_id].append(section_id)
+            portal.section_index[user_id].append(section_id)
+    portal.tables['calendar_section'] = section_table
+
+    n_events = counts['calendar_event']
+    event_table = EntityTable(
+        'calendar_event',
+        ('ID', 'SECT_ID', 'OWNER_ID', 'CAL_TYPE', 'DATE_FROM', 'DATE_TO', 'IS_MEETING', 'MEETING_STATUS'),
+        {'ID': 'int', 'SECT_ID': 'int', 'OWNER_ID': 'int', 'DATE_FROM': 'date', 'DATE_TO': 'date', 'IS_MEETING': 'bool'},
+        derived={
+            'NAME': lambda row: f'Встреча #{row[0]}',
+            'DESCRIPTION': lambda row: blob(row[0] * 11, 20, 300),
+        },
+        date_style='calendar',
+    )
+    for i in range(n_events):
+        owner_id = assignee()
+        date_from = start_ts + rng.randrange(span + 14 * 86400)
+        is_meeting = rng.random() < 0.4
+        event_table.append((
+            i + 1, rng.choice(sections_by_owner[owner_id]), owner_id, 'user', date_from,
+            date_from + 60 * rng.choice((30, 60, 90, 120)), is_meeting, 'Y' if is_meeting else 'H',
+        ))
+        portal.calendar_index[owner_id].append(i + 1)
+    portal.tables['calendar_event'] = event_table
+
+    return portal
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Генерация синтетического портала Bitrix24 и вывод его состава",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument("--entities", type=int, default=PORTAL_SIZES['10k'], help="Общее количество сущностей портала")
+    parser.add_argument("--seed", type=int, default=42, help="Зерно генератора")
+    parser.add_argument("--users", type=int, default=None, help="Количество пользователей")
+    parser.add_argument("--days", type=int, default=365, help="Глубина истории в днях")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    portal = generate_portal(args.entities, seed=args.seed, users=args.users, days=args.days)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({**portal.summary(), 'generated_in_sec': round(elapsed, 2)}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного запуска MCP сервера.
+
+Каждый замер выполняется в новом процессе интерпретатора (как при старте пода или stdio-сессии агента)
+в двух режимах: ленивое подключение серверов инструментов (по умолчанию, см. fast_bitrix24_mcp/mounts.py)
+и подключение всех серверов при импорте (`BITRIX_LAZY_TOOLS=0`). Фиксируются:
+- время импорта `fast_bitrix24_mcp.main`
+- время первого запроса списка инструментов (in-memory клиент FastMCP, без сети и портала)
+- суммарное время до готового списка инструментов и число загруженных модулей после импорта
+
+С --top N дополнительно выводятся самые тяжелые модули по `python -X importtime` в каждом режиме.
+
+Использование:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeat 10 --top 15 --output benchmarks/results/startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULT_PREFIX = "RESULT="
+MODES = {'lazy': '1', 'eager': '0'}
+
+# Код процесса-замера: импорт главного сервера и первый список инструментов
+PROBE = f"""
+import time
+started = time.perf_counter()
+import fast_bitrix24_mcp.main as main
+imported = time.perf_counter()
+import asyncio, json, sys
+modules = len(sys.modules)
+from fastmcp import Client
+
+async def first_list():
+    async with Client(main.mcp) as client:
+        listed = time.perf_counter()
+        tools = await client.list_tools()
+        return len(tools), time.perf_counter() - listed
+
+tools, list_time = asyncio.run(first_list())
+print({RESULT_PREFIX!r} + json.dumps({{
+    'import_time': imported - started, 'first_list_time': list_time,
+    'ready_time': time.perf_counter() - started, 'tools': tools, 'modules': modules,
+}}))
+"""
+
+
+def _environment(mode: str) -> dict:
+    env = dict(os.environ)
+    env['BITRIX_LAZY_TOOLS'] = MODES[mode]
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(REPO_ROOT), env.get('PYTHONPATH')]))
+    # Замер не обращается к порталу, нужны только обязательные переменные
+    env.setdefault('WEBHOOK', 'http://127.0.0.1:9/rest/1/startup/')
+    env.setdefault('AUTH_TOKEN', 'startup-benchmark')
+    return env
+
+
+def measure(mode: str) -> dict:
+    """Один холодный запуск в новом процессе"""
+    process = subprocess.run([sys.executable, '-c', PROBE], cwd=str(REPO_ROOT), env=_environment(mode),
+                             capture_output=True, text=True)
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"Замер в режиме {mode} завершился с кодом {process.returncode}: {process.stderr[-2000:]}")
+
+
+def heaviest_modules(mode: str, top: int) -> list[tuple[str, float]]:
+    """Модули с наибольшим собственным временем импорта по `python -X importtime`, секунды"""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import fast_bitrix24_mcp.main'],
+                             cwd=str(REPO_ROOT), env=_environment(mode), capture_output=True, text=True)
+    modules = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, _, name = line[len('import time:'):].split('|', 2)
+        modules.append((name.strip(), int(self_time) / 1e6))
+    return sorted(modules, key=lambda item: item[1], reverse=True)[:top]
+
+
+def summarize(runs: list[dict]) -> dict:
+    return {
+        metric: round(statistics.median(run[metric] for run in runs), 4)
+        for metric in ('import_time', 'first_list_time', 'ready_time', 'modules', 'tools')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Бенчмарк холодного запуска MCP сервера",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Число запусков в каждом режиме")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES), help="Режимы подключения")
+    parser.add_argument("--top", type=int, default=0, help="Показать N самых тяжелых модулей по -X importtime")
+    parser.add_argument("--output", type=Path, default=None, help="Файл для результатов (JSON)")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes:
+        runs = [measure(mode) for _ in range(args.repeat)]
+        summary = summarize(runs)
+        results[mode] = {'median': summary, 'runs': runs}
+        print(
+            f"[{mode}] импорт {summary['import_time']:.3f} с, первый список инструментов "
+            f"{summary['first_list_time']:.3f} с, готов за {summary['ready_time']:.3f} с, "
+            f"инструментов {summary['tools']}, модулей после импорта {summary['modules']}",
+            file=sys.stderr, flush=True,
+        )
+        if args.top:
+            results[mode]['heaviest_modules'] = heaviest_modules(mode, args.top)
+            for name, seconds in results[mode]['heaviest_modules']:
+                print(f"    {seconds * 1000:8.1f} мс  {name}", file=sys.stderr)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps({
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'repeat': args.repeat,
+            'modes': results,
+        }, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"Результаты записаны в {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
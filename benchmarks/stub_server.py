@@ -0,0 +1,707 @@
+#!/usr/bin/env python3
+"""
+Локальный эмулятор REST API вебхука Bitrix24 поверх синтетического портала (см. portal.py).
+
+Эмулирует поведение, важное для производительности клиента:
+- постраничная выдача по 50 записей с `total`/`next` (и без подсчета `total` при `start=-1`)
+- метод `batch` (до 50 команд в формате `method?http_build_query`) со ссылками на результаты предыдущих
+  команд (`filter[>ID]=$result[cmd0][49][ID]`)
+- блок `time` с `operating` в каждом ответе
+- "отстающие" ответы: доля запросов (`--slow-ratio`) получает дополнительную задержку `--slow-ms`
+  (тяжелый хвост задержек реального портала)
+- ошибки лимитов: `QUERY_LIMIT_EXCEEDED` (leaky bucket на вебхук) и `OPERATION_TIME_LIMIT`
+  (суммарное operating-время метода за 10 минут), оба с HTTP 503, как на реальном портале
+
+Стоимость запроса (operating) растет с числом просмотренных строк, подсчетом total и смещением `start`,
+поэтому эмулятор "наказывает" offset-пагинацию так же, как реальный портал.
+
+Служебные маршруты (для harness.py):
+    GET  /stub/stats  — статистика запросов с последнего сброса
+    GET  /stub/portal — сводка по сущностям портала
+    POST /stub/reset  — сброс статистики и счетчиков лимитов
+
+Использование:
+    python -m benchmarks.stub_server --entities 100000 --port 8765
+    WEBHOOK=http://127.0.0.1:8765/rest/1/benchmark/ python main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+from typing import Any, Optional
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+from .portal import PORTAL_SIZES, PORTAL_TZ, SyntheticPortal, generate_portal, parse_portal_datetime
+
+PAGE_SIZE = 50
+BATCH_LIMIT = 50
+
+# Модель operating-времени запроса (секунды работы сервера Bitrix24)
+BASE_OPERATING = 0.002
+SCAN_OPERATING = 0.000001     # за каждую просмотренную строку
+COUNT_OPERATING = 0.0000005   # за каждую строку при подсчете total
+OFFSET_OPERATING = 0.000002   # за каждую строку, пропущенную через start
+
+# Лимиты портала по умолчанию (как у облачного Bitrix24)
+OPERATING_WINDOW_SECONDS = 600
+OPERATING_LIMIT_SECONDS = 480.0
+
+LIST_METHODS = {
+    'crm.deal.list': 'deal',
+    'crm.lead.list': 'lead',
+    'crm.contact.list': 'contact',
+    'crm.company.list': 'company',
+    'crm.activity.list': 'activity',
+    'crm.dealcategory.list': 'deal_category',
+    'crm.status.list': 'status',
+}
+GET_METHODS = {
+    'crm.deal.get': 'deal',
+    'crm.lead.get': 'lead',
+    'crm.contact.get': 'contact',
+    'crm.company.get': 'company',
+    'crm.activity.get': 'activity',
+}
+FIELDS_METHODS = {
+    'crm.deal.fields': 'deal',
+    'crm.lead.fields': 'lead',
+    'crm.contact.fields': 'contact',
+    'crm.company.fields': 'company',
+    'crm.activity.fields': 'activity',
+}
+STAGE_HISTORY_TABLES = {1: 'stagehistory_lead', 2: 'stagehistory_deal'}
+
+
+class StubError(Exception):
+    """Ошибка REST API в формате Bitrix24: HTTP-статус, код и описание"""
+
+    def __init__(self, status: int, code: str, description: str):
+        super().__init__(description)
+        self.status = status
+        self.code = code
+        self.description = description
+
+    def payload(self) -> dict:
+        return {'error': self.code, 'error_description': self.description}
+
+
+def parse_php_query(query: str) -> dict:
+    """Разбирает строку http_build_query (`filter[>=DATE_CREATE]=...&select[0]=ID`) во вложенный dict"""
+    result: dict = {}
+    for raw_key, value in parse_qsl(query, keep_blank_values=True):
+        head, _, rest = raw_key.partition('[')
+        path = [head] + (rest.rstrip(']').split('][') if rest else [])
+        node = result
+        for part in path[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+        node[path[-1]] = value
+    return _listify(result)
+
+
+def _listify(value: Any) -> Any:
+    """Превращает словари с ключами 0..N (так PHP кодирует списки) обратно в списки"""
+    if isinstance(value, dict):
+        converted = {key: _listify(item) for key, item in value.items()}
+        if converted and all(str(key).isdigit() for key in converted):
+            return [converted[key] for key in sorted(converted, key=int)]
+        return converted
+    if isinstance(value, list):
+        return [_listify(item) for item in value]
+    return value
+
+
+def _resolve_references(value: Any, results: dict) -> Any:
+    """Подставляет ссылки `$result[cmd][index][FIELD]` на результаты предыдущих команд batch
+
+    Как и Bitrix24, неразрешимая ссылка (например, на 50-ю строку короткой страницы) заменяется пустой строкой.
+    """
+    if isinstance(value, dict):
+        return {key: _resolve_references(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve_references(item, results) for item in value]
+    if not isinstance(value, str) or not value.startswith('$result['):
+        return value
+    node: Any = results
+    for part in re.findall(r'\[([^\]]*)\]', value):
+        if isinstance(node, dict):
+            node = node.get(part)
+        elif isinstance(node, list) and part.isdigit() and int(part) < len(node):
+            node = node[int(part)]
+        else:
+            node = None
+        if node is None:
+            return ''
+    return node if not isinstance(node, (dict, list)) else ''
+
+
+def _param(params: dict, name: str, default: Any = None) -> Any:
+    """Параметр запроса без учета регистра ключа (filter/FILTER)"""
+    for key, value in params.items():
+        if str(key).lower() == name:
+            return value
+    return default
+
+
+def _as_list(value: Any) -> Optional[list]:
+    if value is None or value == '':
+        return None
+    if isinstance(value, dict):
+        return list(value.values())
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+class BitrixStubServer:
+    """HTTP-сервер, отвечающий на запросы вебхука `http://host:port/rest/{user_id}/{token}/{method}`
+
+    Args:
+        portal: Синтетический портал
+        latency: Фиксированная сетевая задержка на HTTP-запрос, секунды
+        requests_per_second: Скорость "утечки" leaky bucket (лимит запросов вебхука)
+        burst: Емкость leaky bucket
+        operating_limit: Лимит operating-времени метода за 10 минут, секунды
+        enforce_limits: Возвращать ли ошибки QUERY_LIMIT_EXCEEDED / OPERATION_TIME_LIMIT
+        operating_time_scale: Доля operating-времени, добавляемая к задержке ответа (0 - не ждать)
+        slow_ratio: Доля запросов с дополнительной задержкой `slow_latency` (хвост задержек)
+        slow_latency: Дополнительная задержка "отстающего" ответа, секунды
+        seed: Зерно генератора "отстающих" ответов
+    """
+
+    def __init__(
+        self,
+        portal: SyntheticPortal,
+        latency: float = 0.0,
+        requests_per_second: float = 2.0,
+        burst: int = 50,
+        operating_limit: float = OPERATING_LIMIT_SECONDS,
+        enforce_limits: bool = True,
+        operating_time_scale: float = 0.0,
+        slow_ratio: float = 0.0,
+        slow_latency: float = 0.0,
+        seed: int = 42,
+        user_id: int = 1,
+        token: str = 'benchmark',
+    ):
+        self.portal = portal
+        self.latency = latency
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.operating_limit = operating_limit
+        self.enforce_limits = enforce_limits
+        self.operating_time_scale = operating_time_scale
+        self.slow_ratio = slow_ratio
+        self.slow_latency = slow_latency
+        self._slow_random = random.Random(seed)
+        self.user_id = str(user_id)
+        self.token = token
+        self.webhook: Optional[str] = None
+
+        self._bucket_level = 0.0
+        self._bucket_checked_at = time.monotonic()
+        self._operating_log: dict[str, deque] = defaultdict(deque)
+        self._operating_used: dict[str, float] = defaultdict(float)
+        self._runner: Optional[web.AppRunner] = None
+        self.reset_stats()
+
+    # === СТАТИСТИКА ===
+
+    def reset_stats(self) -> None:
+        self.stats = {
+            'requests': 0,
+            'commands': 0,
+            'pages': 0,
+            'bytes_sent': 0,
+            'bytes_received': 0,
+            'methods': Counter(),
+            'rejected': Counter(),
+            'operating': defaultdict(float),
+            'slow': 0,
+        }
+
+    def snapshot_stats(self) -> dict:
+        """Копия статистики в JSON-совместимом виде"""
+        return {
+            'requests': self.stats['requests'],
+            'commands': self.stats['commands'],
+            'pages': self.stats['pages'],
+            'bytes_sent': self.stats['bytes_sent'],
+            'bytes_received': self.stats['bytes_received'],
+            'methods': dict(self.stats['methods']),
+            'rejected': dict(self.stats['rejected']),
+            'operating': {k: round(v, 4) for k, v in self.stats['operating'].items()},
+            'slow': self.stats['slow'],
+        }
+
+    def reset(self) -> None:
+        """Сбрасывает статистику и накопленные счетчики лимитов"""
+        self.reset_stats()
+        self._bucket_level = 0.0
+        self._bucket_checked_at = time.monotonic()
+        self._operating_log.clear()
+        self._operating_used.clear()
+
+    # === ЖИЗНЕННЫЙ ЦИКЛ ===
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/rest/{user_id}/{token}/{method}', self._handle)
+        app.router.add_get('/stub/stats', self._handle_stats)
+        app.router.add_get('/stub/portal', self._handle_portal)
+        app.router.add_post('/stub/reset', self._handle_reset)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запускает сервер и возвращает URL вебхука"""
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_host, bound_port = self._runner.addresses[0][:2]
+        self.webhook = f"http://{bound_host}:{bound_port}/rest/{self.user_id}/{self.token}/"
+        return self.webhook
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> 'BitrixStubServer':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    # === HTTP ===
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        started = time.time()
+        raw_body = await request.read()
+        self.stats['requests'] += 1
+        self.stats['bytes_received'] += len(raw_body)
+
+        if request.match_info['user_id'] != self.user_id or request.match_info['token'] != self.token:
+            return self._respond(401, {'error': 'INVALID_CREDENTIALS', 'error_description': 'Invalid request credentials'})
+
+        method = request.match_info['method'].lower()
+        if method.endswith('.json'):
+            method = method[:-len('.json')]
+
+        try:
+            params = self._parse_params(request, raw_body)
+        except ValueError:
+            return self._respond(400, {'error': 'INVALID_REQUEST', 'error_description': 'Request body is not valid'})
+
+        if self.enforce_limits and not self._take_token():
+            self.stats['rejected']['QUERY_LIMIT_EXCEEDED'] += 1
+            return self._respond(503, {'error': 'QUERY_LIMIT_EXCEEDED', 'error_description': 'Too many requests'})
+
+        status, payload, operating = self.dispatch(method, params, started)
+
+        delay = self.latency + operating * self.operating_time_scale
+        if self.slow_ratio and self._slow_random.random() < self.slow_ratio:
+            self.stats['slow'] += 1
+            delay += self.slow_latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self._respond(status, payload)
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.snapshot_stats())
+
+    async def _handle_portal(self, request: web.Request) -> web.Response:
+        return web.json_response(self.portal.summary())
+
+    async def _handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({'result': True})
+
+    def _respond(self, status: int, payload: dict) -> web.Response:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.stats['bytes_sent'] += len(body)
+        return web.Response(body=body, status=status, content_type='application/json', charset='utf-8')
+
+    @staticmethod
+    def _parse_params(request: web.Request, raw_body: bytes) -> dict:
+        if request.method == 'GET':
+            return parse_php_query(request.query_string)
+        if not raw_body:
+            return {}
+        if request.content_type == 'application/json':
+            params = json.loads(raw_body.decode('utf-8'))
+            if isinstance(params, list):
+                # PHP превращает JSON-массив в массив с числовыми ключами
+                params = {str(i): item for i, item in enumerate(params)}
+            if not isinstance(params, dict):
+                raise ValueError("params")
+            return params
+        return parse_php_query(raw_body.decode('utf-8'))
+
+    def _take_token(self) -> bool:
+        """Leaky bucket: не более `burst` запросов подряд, далее `requests_per_second`"""
+        now = time.monotonic()
+        self._bucket_level = max(0.0, self._bucket_level - (now - self._bucket_checked_at) * self.requests_per_second)
+        self._bucket_checked_at = now
+        if self._bucket_level + 1 > self.burst:
+            return False
+        self._bucket_level += 1
+        return True
+
+    # === ДИСПЕТЧЕРИЗАЦИЯ ===
+
+    def dispatch(self, method: str, params: dict, started: Optional[float] = None) -> tuple[int, dict, float]:
+        """Выполняет вызов REST-метода (в том числе batch) без HTTP-обвязки
+
+        Returns:
+            (HTTP-статус, тело ответа, суммарное operating-время)
+        """
+        started = started if started is not None else time.time()
+        if method == 'batch':
+            return self._dispatch_batch(params, started)
+
+        try:
+            result, total, next_start, operating = self._execute(method, params)
+        except StubError as error:
+            if error.code == 'OPERATION_TIME_LIMIT':
+                self.stats['rejected'][error.code] += 1
+            return error.status, error.payload(), 0.0
+
+        payload: dict = {'result': result}
+        if total is not None:
+            payload['total'] = total
+        if next_start is not None:
+            payload['next'] = next_start
+        payload['time'] = self._time_block(started, operating)
+        return 200, payload, operating
+
+    def _dispatch_batch(self, params: dict, started: float) -> tuple[int, dict, float]:
+        commands = _param(params, 'cmd') or {}
+        if isinstance(commands, list):
+            commands = {str(i): command for i, command in enumerate(commands)}
+        if len(commands) > BATCH_LIMIT:
+            return 400, {'error': 'ERROR_BATCH_LENGTH_EXCEEDED', 'error_description': 'Max batch length exceeded'}, 0.0
+        halt = str(_param(params, 'halt', 0)).lower() in ('1', 'true', 'y')
+
+        results, errors, totals, nexts, times = {}, {}, {}, {}, {}
+        operating_total = 0.0
+        for label, command in commands.items():
+            command_method, _, query = str(command).partition('?')
+            try:
+                command_params = _resolve_references(parse_php_query(query), results)
+                result, total, next_start, operating = self._execute(command_method.strip().lower(), command_params)
+            except StubError as error:
+                if error.code == 'OPERATION_TIME_LIMIT':
+                    self.stats['rejected'][error.code] += 1
+                errors[label] = error.payload()
+                if halt:
+                    break
+                continue
+            operating_total += operating
+            results[label] = result
+            if total is not None:
+                totals[label] = total
+            if next_start is not None:
+                nexts[label] = next_start
+            times[label] = self._time_block(started, operating)
+
+        payload = {
+            'result': {
+                # Пустые ассоциативные массивы PHP сериализует как []
+                'result': results or [],
+                'result_error': errors or [],
+                'result_total': totals or [],
+                'result_next': nexts or [],
+                'result_time': times or [],
+            },
+            'time': self._time_block(started, operating_total),
+        }
+        return 200, payload, operating_total
+
+    def _execute(self, method: str, params: dict) -> tuple[Any, Optional[int], Optional[int], float]:
+        """Выполняет одну команду с учетом лимита operating-времени метода"""
+        self.stats['commands'] += 1
+        self.stats['methods'][method] += 1
+
+        if self.enforce_limits and self._operating_exhausted(method):
+            raise StubError(503, 'OPERATION_TIME_LIMIT', f'Method is blocked due to operation time limit: {method}')
+
+        handler = self._resolve(method)
+        result, total, next_start, operating = handler(method, params)
+        self._record_operating(method, operating)
+        return result, total, next_start, operating
+
+    def _resolve(self, method: str):
+        if method in LIST_METHODS:
+            return self._crm_list
+        if method in GET_METHODS:
+            return self._crm_get
+        if method in FIELDS_METHODS:
+            return self._crm_fields
+        handlers = {
+            'tasks.task.list': self._tasks_list,
+            'tasks.task.get': self._tasks_get,
+            'tasks.task.getfields': self._tasks_fields,
+            'crm.timeline.comment.list': self._timeline_comments,
+            'crm.stagehistory.list': self._stage_history,
+            'calendar.section.get': self._calendar_sections,
+            'calendar.event.get': self._calendar_events,
+            'user.get': self._users,
+            'user.fields': self._user_fields,
+        }
+        handler = handlers.get(method)
+        if handler is None:
+            raise StubError(404, 'ERROR_METHOD_NOT_FOUND', 'Method not found!')
+        return handler
+
+    def _operating_exhausted(self, method: str) -> bool:
+        log = self._operating_log[method]
+        cutoff = time.monotonic() - OPERATING_WINDOW_SECONDS
+        while log and log[0][0] < cutoff:
+            self._operating_used[method] -= log.popleft()[1]
+        return self._operating_used[method] >= self.operating_limit
+
+    def _record_operating(self, method: str, operating: float) -> None:
+        self._operating_log[method].append((time.monotonic(), operating))
+        self._operating_used[method] += operating
+        self.stats['operating'][method] += operating
+
+    @staticmethod
+    def _time_block(started: float, operating: float) -> dict:
+        finish = time.time()
+        return {
+            'start': started,
+            'finish': finish,
+            'duration': finish - started,
+            'processing': finish - started,
+            'date_start': datetime.fromtimestamp(started, PORTAL_TZ).isoformat(),
+            'date_finish': datetime.fromtimestamp(finish, PORTAL_TZ).isoformat(),
+            'operating_reset_at': int(started) + OPERATING_WINDOW_SECONDS,
+            'operating': round(operating, 6),
+        }
+
+    # === ОБРАБОТЧИКИ МЕТОДОВ ===
+
+    def _page(self, table_name: str, params: dict, filter_fields: Optional[dict] = None):
+        """Общая постраничная выборка для *.list методов"""
+        table = self.portal.table(table_name)
+        if filter_fields is None:
+            filter_fields = _param(params, 'filter') or {}
+        if not isinstance(filter_fields, dict):
+            filter_fields = {}
+        select = _as_list(_param(params, 'select'))
+        order = _param(params, 'order') or {}
+        descending = isinstance(order, dict) and any(
+            str(key).upper() == 'ID' and str(value).upper() == 'DESC' for key, value in order.items()
+        )
+        try:
+            start = int(_param(params, 'start', 0) or 0)
+        except (TypeError, ValueError):
+            start = 0
+        count = start != -1
+        positions, total, scanned = table.query(filter_fields, descending, start if count else 0, PAGE_SIZE, count)
+        self.stats['pages'] += 1
+        items = [table.render(table.rows[position], select) for position in positions]
+
+        operating = BASE_OPERATING + SCAN_OPERATING * scanned
+        next_start = None
+        if count:
+            operating += COUNT_OPERATING * total + OFFSET_OPERATING * max(start, 0)
+            if start + PAGE_SIZE < total:
+                next_start = start + PAGE_SIZE
+        return items, total, next_start, operating
+
+    def _crm_list(self, method: str, params: dict):
+        return self._page(LIST_METHODS[method], params)
+
+    def _crm_get(self, method: str, params: dict):
+        table = self.portal.table(GET_METHODS[method])
+        row = table.get(self._int_param(params, 'id'))
+        if row is None:
+            raise StubError(400, 'ERROR_NOT_FOUND', 'Not found')
+        return table.render(row, ['*', 'UF_*']), None, None, BASE_OPERATING
+
+    def _crm_fields(self, method: str, params: dict):
+        entity = FIELDS_METHODS[method]
+        return self.portal.table(entity).describe_fields(entity), None, None, BASE_OPERATING
+
+    def _tasks_list(self, method: str, params: dict):
+        items, total, next_start, operating = self._page('task', params)
+        return {'tasks': items}, total, next_start, operating
+
+    def _tasks_get(self, method: str, params: dict):
+        table = self.portal.table('task')
+        row = table.get(self._int_param(params, 'taskid'))
+        if row is None:
+            raise StubError(400, 'ERROR_CORE', 'Задача не найдена или доступ запрещен')
+        return {'task': table.render(row)}, None, None, BASE_OPERATING
+
+    def _tasks_fields(self, method: str, params: dict):
+        fields = self.portal.table('task').describe_fields('task')
+        fields['STATUS']['type'] = 'enum'
+        fields['STATUS']['values'] = {'2': 'Ждет выполнения', '3': 'Выполняется', '4': 'Ожидает контроля',
+                                      '5': 'Завершена', '6': 'Отложена'}
+        return {'fields': fields}, None, None, BASE_OPERATING
+
+    def _timeline_comments(self, method: str, params: dict):
+        table = self.portal.table('comment')
+        filter_fields = _param(params, 'filter') or {}
+        if not isinstance(filter_fields, dict):
+            filter_fields = {}
+        normalized = {str(key).upper(): value for key, value in filter_fields.items()}
+        if not normalized.get('ENTITY_TYPE') or not normalized.get('ENTITY_ID'):
+            raise StubError(400, 'ERROR_ARGUMENT', 'ENTITY_TYPE and ENTITY_ID filter fields are required')
+        try:
+            key = (str(normalized['ENTITY_TYPE']).lower(), int(normalized['ENTITY_ID']))
+        except (TypeError, ValueError):
+            raise StubError(400, 'ERROR_ARGUMENT', 'ENTITY_ID is not defined or invalid')
+
+        # Выборка по индексу сущности, остальные условия фильтра применяются как в *.list
+        predicates, _, _ = table._compile(filter_fields)
+        matched = []
+        for comment_id in self.portal.comment_index.get(key, ()):
+            row = table.get(comment_id)
+            if row is not None and table._row_matches(row, predicates):
+                matched.append(row)
+        try:
+            start = max(int(_param(params, 'start', 0) or 0), 0)
+        except (TypeError, ValueError):
+            start = 0
+        select = _as_list(_param(params, 'select'))
+        page = [table.render(row, select) for row in matched[start:start + PAGE_SIZE]]
+        self.stats['pages'] += 1
+        next_start = start + PAGE_SIZE if start + PAGE_SIZE < len(matched) else None
+        operating = BASE_OPERATING + SCAN_OPERATING * len(matched)
+        return page, len(matched), next_start, operating
+
+    def _stage_history(self, method: str, params: dict):
+        try:
+            entity_type_id = int(_param(params, 'entitytypeid'))
+        except (TypeError, ValueError):
+            raise StubError(400, 'ERROR_ARGUMENT', 'entityTypeId is required')
+        table_name = STAGE_HISTORY_TABLES.get(entity_type_id)
+        if table_name is None:
+            raise StubError(400, 'ERROR_ARGUMENT', f'Entity type {entity_type_id} is not supported')
+        items, total, next_start, operating = self._page(table_name, params)
+        return {'items': items}, total, next_start, operating
+
+    def _calendar_sections(self, method: str, params: dict):
+        if not _param(params, 'type'):
+            raise StubError(400, 'ERROR_ARGUMENT', 'Type is required')
+        table = self.portal.table('calendar_section')
+        owner_id = self._int_param(params, 'ownerid')
+        rows = [table.get(section_id) for section_id in self.portal.section_index.get(owner_id, ())]
+        return [table.render(row) for row in rows if row is not None], None, None, BASE_OPERATING
+
+    def _calendar_events(self, method: str, params: dict):
+        if not _param(params, 'type'):
+            raise StubError(400, 'ERROR_ARGUMENT', 'Type is required')
+        table = self.portal.table('calendar_event')
+        owner_id = self._int_param(params, 'ownerid')
+        sections = _as_list(_param(params, 'section'))
+        section_ids = {int(s) for s in sections} if sections else None
+        date_from = parse_portal_datetime(_param(params, 'from'))
+        date_to = parse_portal_datetime(_param(params, 'to'))
+        sect_pos = table.position['SECT_ID']
+        from_pos = table.position['DATE_FROM']
+        to_pos = table.position['DATE_TO']
+
+        event_ids = self.portal.calendar_index.get(owner_id, ())
+        events = []
+        for event_id in event_ids:
+            row = table.get(event_id)
+            if row is None:
+                continue
+            if section_ids is not None and row[sect_pos] not in section_ids:
+                continue
+            if date_to is not None and row[from_pos] > date_to:
+                continue
+            if date_from is not None and row[to_pos] < date_from:
+                continue
+            events.append(table.render(row))
+        return events, None, None, BASE_OPERATING + SCAN_OPERATING * len(event_ids)
+
+    def _users(self, method: str, params: dict):
+        filter_fields = _param(params, 'filter')
+        if not isinstance(filter_fields, dict):
+            # user.get принимает условия фильтра и на верхнем уровне параметров
+            reserved = {'sort', 'order', 'start', 'admin_mode', 'adminmode', 'filter'}
+            filter_fields = {key: value for key, value in params.items() if str(key).lower() not in reserved}
+        page_params = {key: value for key, value in params.items() if str(key).lower() != 'order'}
+        return self._page('user', page_params, filter_fields)
+
+    def _user_fields(self, method: str, params: dict):
+        table = self.portal.table('user')
+        return {column: column for column in table.columns}, None, None, BASE_OPERATING
+
+    @staticmethod
+    def _int_param(params: dict, name: str) -> Optional[int]:
+        try:
+            return int(_param(params, name))
+        except (TypeError, ValueError):
+            return None
+
+
+async def serve(args) -> None:
+    portal = generate_portal(args.entities, seed=args.seed, users=args.users, days=args.days)
+    server = BitrixStubServer(
+        portal,
+        latency=args.latency_ms / 1000,
+        requests_per_second=args.rps,
+        burst=args.burst,
+        enforce_limits=not args.no_limits,
+        operating_time_scale=args.operating_scale,
+        slow_ratio=args.slow_ratio,
+        slow_latency=args.slow_ms / 1000,
+        seed=args.seed,
+    )
+    webhook = await server.start(args.host, args.port)
+    if not args.quiet:
+        print(json.dumps(portal.summary(), ensure_ascii=False, indent=2))
+    print(f"WEBHOOK={webhook}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Локальный эмулятор REST API Bitrix24 на синтетическом портале",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument("--entities", type=int, default=PORTAL_SIZES['10k'], help="Общее количество сущностей портала")
+    parser.add_argument("--seed", type=int, default=42, help="Зерно генератора")
+    parser.add_argument("--users", type=int, default=None, help="Количество пользователей")
+    parser.add_argument("--days", type=int, default=365, help="Глубина истории в днях")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Адрес сервера")
+    parser.add_argument("--port", type=int, default=8765, help="Порт сервера")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Сетевая задержка на запрос, мс")
+    parser.add_argument("--rps", type=float, default=2.0, help="Лимит запросов в секунду (leaky bucket)")
+    parser.add_argument("--burst", type=int, default=50, help="Емкость leaky bucket")
+    parser.add_argument("--operating-scale", type=float, default=0.0,
+                        help="Доля operating-времени, добавляемая к задержке ответа")
+    parser.add_argument("--slow-ratio", type=float, default=0.0, help="Доля \"отстающих\" ответов (0..1)")
+    parser.add_argument("--slow-ms", type=float, default=0.0, help="Дополнительная задержка \"отстающего\" ответа, мс")
+    parser.add_argument("--no-limits", action="store_true", help="Отключить ошибки лимитов портала")
+    parser.add_argument("--quiet", action="store_true", help="Выводить только строку WEBHOOK=...")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
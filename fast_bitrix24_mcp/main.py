@@ -1,27 +1,15 @@
 # math_server.py
 from fastmcp import FastMCP, Context
-from .promts.promts import mcp as promts_mcp
-from .resources.userfields import mcp as userfields_mcp_resource
-from .tools.deal import mcp as deal_mcp
-from .tools.userfields import mcp as userfields_mcp
-from .tools.user import mcp as user_mcp
-from .tools.company import mcp as company_mcp
-from .tools.contact import mcp as contact_mcp
-from .tools.task import mcp as task_mcp
-from .tools.helper import mcp as helper_mcp
-from .tools.lead import mcp as lead_mcp
-from .tools.activity_decline import mcp as activity_decline_mcp
-from .tools.daily_summary import mcp as daily_summary_mcp
-from .tools.sales_funnel import mcp as sales_funnel_mcp
-from .tools.top_clients import mcp as top_clients_mcp
-from .tools.inactive_clients import mcp as inactive_clients_mcp
-from .tools.manager_support import mcp as manager_support_mcp
-from .tools.overdue_tasks import mcp as overdue_tasks_mcp
 from fastmcp.prompts.prompt import Message, PromptMessage, TextContent
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 from fastmcp.server.auth.providers.jwt import StaticTokenVerifier
+from contextlib import asynccontextmanager
+from .mounts import SUBSERVERS, LazyMounts, LazyMountMiddleware
+from .tools.metrics import ToolMetricsMiddleware, install_metrics_route, metrics_enabled
+from .tools.tracing import ToolTracingMiddleware
+from .tools.events import events_enabled, install_events_route
 today=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 # from fastmcp.server.auth import BearerAuthProvider
 # from fastmcp.server.auth.providers.bearer import RSAKeyPair
@@ -54,26 +42,35 @@ auth = StaticTokenVerifier(
     },
     required_scopes=["read"]
 )
-mcp = FastMCP("bitrix24-main", auth=auth)
-
-
-mcp.mount(prefix="userfields", server=userfields_mcp_resource, as_proxy=True)
-mcp.mount(prefix="promts", server=promts_mcp, as_proxy=True)
-mcp.mount(prefix="deal", server=deal_mcp, as_proxy=True)
-mcp.mount(prefix="fields", server=userfields_mcp, as_proxy=True)
-mcp.mount(prefix="user", server=user_mcp, as_proxy=True)
-mcp.mount(prefix="company", server=company_mcp, as_proxy=True)
-mcp.mount(prefix="contact", server=contact_mcp, as_proxy=True)
-mcp.mount(prefix="task", server=task_mcp, as_proxy=True)
-mcp.mount(prefix="helper", server=helper_mcp, as_proxy=True)
-mcp.mount(prefix="lead", server=lead_mcp, as_proxy=True)
-mcp.mount(prefix="activity_decline", server=activity_decline_mcp, as_proxy=True)
-mcp.mount(prefix="daily_summary", server=daily_summary_mcp, as_proxy=True)
-mcp.mount(prefix="sales_funnel", server=sales_funnel_mcp, as_proxy=True)
-mcp.mount(prefix="top_clients", server=top_clients_mcp, as_proxy=True)
-mcp.mount(prefix="inactive_clients", server=inactive_clients_mcp, as_proxy=True)
-mcp.mount(prefix="manager_support", server=manager_support_mcp, as_proxy=True)
-mcp.mount(prefix="overdue_tasks", server=overdue_tasks_mcp, as_proxy=True)
+
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    # Модули инструментов загружаются в фоне сразу после запуска сервера
+    mounts.preload()
+    yield {}
+
+
+mcp = FastMCP("bitrix24-main", auth=auth, lifespan=lifespan)
+
+# Серверы инструментов подключаются лениво (см. mounts.py): импорт main.py не загружает модули инструментов
+mounts = LazyMounts(mcp)
+if os.getenv("BITRIX_LAZY_TOOLS", "1").strip().lower() in ("0", "false", "no"):
+    mounts.mount_all()
+else:
+    mcp.add_middleware(LazyMountMiddleware(mounts))
+
+# Трассировка вызовов инструментов (BITRIX_TRACE, см. tools/tracing.py)
+mcp.add_middleware(ToolTracingMiddleware())
+
+# Время вызовов инструментов и метрики запросов к порталу по GET /metrics (см. tools/metrics.py)
+mcp.add_middleware(ToolMetricsMiddleware(prefix for prefix, _ in SUBSERVERS))
+if metrics_enabled():
+    install_metrics_route(mcp)
+
+# События портала для инвалидации кэша по POST /bitrix/events, если задан BITRIX_EVENTS_TOKEN (см. tools/events.py)
+if events_enabled():
+    install_events_route(mcp)
 
 @mcp.prompt(description="главный промт для взаимодействия с сервером который нужно использовать каждый раз при взаимодействии с сервером")
 def main_prompt() -> str:
@@ -106,5 +103,6 @@ def main_prompt() -> str:
 
 
 if __name__ == "__main__":
+    mounts.preload()
     # mcp.run(transport="stdio")
     mcp.run(transport="http", host="0.0.0.0", port=8000, timeout=10)
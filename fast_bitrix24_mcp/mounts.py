@@ -0,0 +1,123 @@
+"""
+Ленивое подключение серверов инструментов к главному серверу
+
+Модули инструментов импортируют fast_bitrix24, aiohttp, pytz и создают по серверу FastMCP на модуль, поэтому
+импорт всех модулей при старте занимает заметную часть холодного запуска. Главный сервер стартует без них:
+- в фоне (`preload`) модули импортируются в отдельном потоке сразу после запуска сервера;
+- первый запрос MCP (список или вызов инструментов, ресурсы, промты) ждет завершения импорта
+  (`LazyMountMiddleware`), подключает серверы через `mount` и дальше обрабатывается как обычно.
+
+`BITRIX_LAZY_TOOLS=0` возвращает прежнее поведение: все серверы подключаются при импорте main.py.
+"""
+import asyncio
+import importlib
+import threading
+import time
+from typing import Any, Optional
+
+from fastmcp import FastMCP
+from fastmcp.server.middleware import CallNext, Middleware, MiddlewareContext
+from loguru import logger
+
+# Префикс -> модуль с сервером `mcp` (в порядке подключения)
+SUBSERVERS = [
+    ("userfields", "fast_bitrix24_mcp.resources.userfields"),
+    ("promts", "fast_bitrix24_mcp.promts.promts"),
+    ("deal", "fast_bitrix24_mcp.tools.deal"),
+    ("fields", "fast_bitrix24_mcp.tools.userfields"),
+    ("user", "fast_bitrix24_mcp.tools.user"),
+    ("company", "fast_bitrix24_mcp.tools.company"),
+    ("contact", "fast_bitrix24_mcp.tools.contact"),
+    ("task", "fast_bitrix24_mcp.tools.task"),
+    ("helper", "fast_bitrix24_mcp.tools.helper"),
+    ("lead", "fast_bitrix24_mcp.tools.lead"),
+    ("activity_decline", "fast_bitrix24_mcp.tools.activity_decline"),
+    ("daily_summary", "fast_bitrix24_mcp.tools.daily_summary"),
+    ("sales_funnel", "fast_bitrix24_mcp.tools.sales_funnel"),
+    ("top_clients", "fast_bitrix24_mcp.tools.top_clients"),
+    ("inactive_clients", "fast_bitrix24_mcp.tools.inactive_clients"),
+    ("manager_support", "fast_bitrix24_mcp.tools.manager_support"),
+    ("overdue_tasks", "fast_bitrix24_mcp.tools.overdue_tasks"),
+]
+
+
+class LazyMounts:
+    """Импорт модулей инструментов и подключение их серверов к главному серверу"""
+
+    def __init__(self, server: FastMCP, subservers: list[tuple[str, str]] = SUBSERVERS):
+        self.server = server
+        self.subservers = list(subservers)
+        self.mounted = False
+        self.stats = {'import_time': None, 'mounted_at': None}
+        # Импорт из нескольких потоков по очереди: модули импортируют друг друга
+        self._import_lock = threading.Lock()
+        self._preload: Optional[threading.Thread] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop = None
+
+    def _import_all(self) -> list[tuple[str, Any]]:
+        with self._import_lock:
+            started = time.perf_counter()
+            servers = [(prefix, importlib.import_module(module).mcp) for prefix, module in self.subservers]
+            if self.stats['import_time'] is None:
+                self.stats['import_time'] = round(time.perf_counter() - started, 4)
+            return servers
+
+    def _mount(self, servers: list[tuple[str, Any]]) -> None:
+        for prefix, server in servers:
+            self.server.mount(prefix=prefix, server=server, as_proxy=True)
+        self.mounted = True
+        self.stats['mounted_at'] = time.time()
+        logger.info(f"Подключено серверов инструментов: {len(servers)} (импорт {self.stats['import_time']} с)")
+
+    def mount_all(self) -> None:
+        """Импортирует модули и подключает серверы сразу (без цикла событий)"""
+        if not self.mounted:
+            self._mount(self._import_all())
+
+    def preload(self) -> None:
+        """Запускает импорт модулей в фоновом потоке; серверы подключаются при первом запросе"""
+        if self.mounted or self._preload is not None:
+            return
+
+        def run():
+            try:
+                self._import_all()
+            except Exception as e:
+                # Ошибку импорта получит первый запрос, который повторит импорт
+                logger.error(f"Ошибка при фоновой загрузке модулей инструментов: {e}")
+
+        self._preload = threading.Thread(target=run, name="bitrix-tools-preload", daemon=True)
+        self._preload.start()
+
+    async def ensure_mounted(self) -> None:
+        """Дожидается импорта модулей и подключает серверы (один раз для всех одновременных запросов)"""
+        if self.mounted:
+            return
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._loop is not loop:
+            self._loop = loop
+            self._task = loop.create_task(self._load())
+        await asyncio.shield(self._task)
+
+    async def _load(self) -> None:
+        try:
+            servers = await asyncio.to_thread(self._import_all)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке модулей инструментов: {e}")
+            # Следующий запрос попробует загрузить модули заново
+            self._task = None
+            raise
+        if not self.mounted:
+            self._mount(servers)
+
+
+class LazyMountMiddleware(Middleware):
+    """Перед обработкой запроса MCP подключает серверы инструментов, если они еще не подключены"""
+
+    def __init__(self, mounts: LazyMounts):
+        self.mounts = mounts
+
+    async def on_request(self, context: MiddlewareContext, call_next: CallNext) -> Any:
+        await self.mounts.ensure_mounted()
+        return await call_next(context)
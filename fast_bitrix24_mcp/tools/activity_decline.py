@@ -1,4 +1,4 @@
-from .bitrixWork import bit, get_users_by_filter, get_crm_activities_by_filter, get_tasks_by_filter, get_leads_by_filter, get_deals_by_filter
+from .bitrixWork import get_users_by_filter, get_crm_activities_by_filter, get_tasks_by_filter, get_leads_by_filter, get_deals_by_filter
 import asyncio
 from mcp.server.fastmcp import FastMCP
 from datetime import datetime, timedelta, timezone
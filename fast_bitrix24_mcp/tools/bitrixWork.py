@@ -1,4 +1,3 @@
-from fast_bitrix24 import Bitrix
 import os
 from dotenv import load_dotenv
 from pprint import pprint
@@ -9,25 +8,147 @@ import traceback
 import logging
 import json
 import hashlib
-from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import TYPE_CHECKING, Optional, List, Dict, Any, AsyncIterator
 from collections import defaultdict
 
+from .singleflight import coalesce
+from .scheduler import create_scheduler_from_env, install_scheduler
+from .operating import create_operating_budget_from_env, install_operating_budget
+from .hedging import create_hedger_from_env, create_retry_policy_from_env, install_retry_policy
+from .breaker import (
+    CircuitOpenError, collect_unavailable, create_breakers_from_env, failure_errors, install_circuit_breaker,
+    mark_unavailable,
+)
+from .microbatch import MicroBatcher
+from .cache import STALE_AGE_FIELD, create_cache_from_env
+from .pagination import fetch_list, iter_list
+from .projection import projection, track_select
+from . import metrics, tracing
+from .tracing import traced
+
+if TYPE_CHECKING:
+    from fast_bitrix24 import Bitrix
+
+    from .delta import DeltaSync
+    from .events import EventReceiver
+    from .mirror import Mirror
+    from .transport import BitrixTransport
+
 # Настройка уровня логирования для библиотеки fast_bitrix24 - отключаем DEBUG логи
 logging.getLogger('fast_bitrix24').setLevel(logging.WARNING)
 
 load_dotenv()
 webhook = os.getenv('WEBHOOK')
-if webhook:
-    bit = Bitrix(webhook, ssl=False, verbose=False)
-else:
-    raise ValueError("WEBHOOK environment variable is required")
 
-logger.add("logs/workBitrix_{time}.log",format="{time:YYYY-MM-DD HH:mm}:{level}:{file}:{line}:{message} ", rotation="100 MB", retention="10 days", level="INFO")
+# Общий для процесса планировщик запросов (token bucket + адаптивное окно параллельности, см. scheduler.py)
+scheduler = create_scheduler_from_env()
+
+# Скользящее окно operating-времени по методам: фоновая работа замедляется раньше интерактивной (см. operating.py)
+operating_budget = create_operating_budget_from_env()
+
+# Дублирующие запросы на чтение после p95 задержки (BITRIX_HEDGE) и бюджет повторов на запрос (см. hedging.py)
+hedger = create_hedger_from_env()
+retry_policy = create_retry_policy_from_env()
+
+# Предохранители по методам: после серии неудач вызовы метода сразу отклоняются (см. breaker.py)
+breakers = create_breakers_from_env()
+
+# Клиент создается при первом обращении (get_bit): импорт модуля не загружает fast_bitrix24 и aiohttp, не
+# требует WEBHOOK, не открывает транспорт и не добавляет файловый лог
+_client: Optional["Bitrix"] = None
+_transport: Optional["BitrixTransport"] = None
+
+
+def get_bit() -> "Bitrix":
+    """
+    Возвращает клиент Bitrix24, при первом вызове создает его
+
+    Клиенту устанавливаются транспорт из `transport.py` (пул keep-alive соединений, таймауты, счетчики
+    соединений, режимы записи/воспроизведения; по умолчанию запросы идут в портал) с дублирующими
+    запросами `hedger`, бюджет operating-времени `operating_budget`, планировщик `scheduler`, бюджет повторов `retry_policy` и предохранители `breakers`.
+    """
+    global _client, _transport
+    if _client is None:
+        if not webhook:
+            raise ValueError("WEBHOOK environment variable is required")
+        from fast_bitrix24 import Bitrix
+
+        from .transport import create_transport_from_env, install_transport
+
+        logger.add("logs/workBitrix_{time}.log",format="{time:YYYY-MM-DD HH:mm}:{level}:{file}:{line}:{message} ", rotation="100 MB", retention="10 days", level="INFO")
+        client = Bitrix(webhook, ssl=False, verbose=False)
+        transport = create_transport_from_env(webhook)
+        transport.hedger = hedger
+        install_transport(client, transport)
+        install_operating_budget(client, operating_budget)
+        install_scheduler(client, scheduler)
+        install_retry_policy(client, retry_policy)
+        install_circuit_breaker(client, breakers)
+        _client, _transport = client, transport
+    return _client
+
+
+def get_transport() -> "BitrixTransport":
+    """Транспорт клиента (счетчики соединений, режимы записи/воспроизведения); создается вместе с клиентом"""
+    get_bit()
+    return _transport
+
+
+# Одиночные вызовы (комментарии, календари) объединяются в batch-запросы до 50 команд (см. microbatch.py)
+batcher = MicroBatcher(get_bit, window=float(os.getenv('BITRIX_BATCH_WINDOW_MS', '10')) / 1000, breakers=breakers)
+
+# Кэш результатов: LRU в памяти + файлы в cache/ с TTL по пространствам ключей (см. cache.py)
+cache = create_cache_from_env()
+
+# Локальная копия, синхронизация списков и прием событий создаются при первом обращении, как и клиент
+_mirror: Optional["Mirror"] = None
+_delta_sync: Optional["DeltaSync"] = None
+_events: Optional["EventReceiver"] = None
+
 
-# Настройка кэша для активности
-CACHE_DIR = Path("cache")
-CACHE_TTL_SECONDS = 3600  # 1 час
+def get_mirror() -> "Mirror":
+    """
+    Локальная копия сделок, лидов, контактов, компаний, активностей и задач в SQLite: выборки и агрегаты
+    аналитических инструментов без запросов к порталу (см. mirror.py, включается BITRIX_MIRROR=1)
+    """
+    global _mirror
+    if _mirror is None:
+        from .mirror import create_mirror_from_env
+
+        _mirror = create_mirror_from_env(lambda method, params: iter_list(get_bit(), method, params))
+    return _mirror
+
+
+def get_delta_sync() -> "DeltaSync":
+    """Списки сделок, задач и активностей в кэше с досинхронизацией по дате изменения (см. delta.py)"""
+    global _delta_sync
+    if _delta_sync is None:
+        from .delta import create_delta_sync_from_env
+
+        _delta_sync = create_delta_sync_from_env(cache, _get_list, _portal_time)
+    return _delta_sync
+
+
+def get_events() -> "EventReceiver":
+    """События портала (POST /bitrix/events, см. events.py): точечно обновляют локальную копию и устаревают кэш"""
+    global _events
+    if _events is None:
+        from .events import create_event_receiver_from_env
+
+        _events = create_event_receiver_from_env(cache, get_delta_sync(), get_mirror())
+    return _events
+
+
+async def _from_mirror(method: str, params: dict = None) -> Optional[list[dict]]:
+    """Строки выборки из локальной копии или None, если выборку нужно выполнить в REST API"""
+    mirror = get_mirror()
+    plan = mirror.plan(method, params)
+    if plan is None:
+        return None
+    with tracing.span(f"mirror {method}", method=method) as span:
+        rows = await mirror.execute(plan)
+        span.set_attribute('rows', len(rows))
+    return rows
 
 
 def _generate_activity_cache_key(prefix: str, **kwargs) -> str:
@@ -42,58 +163,86 @@ def _generate_activity_cache_key(prefix: str, **kwargs) -> str:
     return f"{prefix}_{cache_hash}"
 
 
-def _get_cache_path(cache_key: str) -> Path:
-    """Возвращает путь к файлу кэша"""
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
-    return CACHE_DIR / f"{cache_key}.json"
+async def _get_all(method: str, params: dict = None) -> list[dict] | dict:
+    """bit.get_all с объединением одинаковых одновременных запросов (см. singleflight.py)"""
+    if params and 'select' in params:
+        track_select(method, params['select'])
+    with tracing.span(f"fetch {method}", method=method) as span:
+        rows = await coalesce(method, params, lambda: get_bit().get_all(method, params=params))
+        span.set_attribute('rows', tracing.result_size(rows))
+    metrics.record_list_pages(method, rows)
+    return rows
 
 
-def _load_from_cache(cache_key: str) -> Optional[Any]:
-    """Загружает данные из кэша, если они не устарели"""
-    cache_path = _get_cache_path(cache_key)
-    if not cache_path.exists():
-        return None
-    
+async def _get_list(method: str, params: dict = None) -> list[dict]:
+    """Полная выборка списочного метода CRM: keyset-пагинация по ID для больших списков (см. pagination.py)"""
+    rows = await _from_mirror(method, params)
+    if rows is not None:
+        return rows
+    with tracing.span(f"fetch {method}", method=method) as span:
+        rows = await coalesce(method, params, lambda: fetch_list(get_bit(), method, params))
+        span.set_attribute('rows', tracing.result_size(rows))
+    metrics.record_list_pages(method, rows)
+    return rows
+
+
+async def _call_raw(method: str, params: dict = None) -> dict:
+    """bit.call(raw=True) для методов чтения с объединением одинаковых одновременных запросов"""
+    return await coalesce(method, params, lambda: get_bit().call(method, params, raw=True))
+
+
+async def _portal_time(method: str) -> Optional[str]:
+    """Время портала из блока `time` ответа метода (`date_start`, ISO 8601 с поясом портала)"""
+    # Выборка без строк: нужен только блок time
+    response = await _call_raw(method, {'filter': {'ID': 0}, 'select': ['ID']})
+    block = response.get('time') if isinstance(response, dict) else None
+    return block.get('date_start') if isinstance(block, dict) else None
+
+
+async def call_batched(method: str, params: dict) -> dict:
+    """Одиночный вызов метода в составе общего batch-запроса, ответ в формате bit.call(raw=True)"""
+    return await batcher.call(method, params)
+
+
+async def call_batched_or_empty(method: str, params: dict) -> dict:
+    """
+    call_batched для необязательного раздела отчета: при разомкнутом предохранителе метода или неудаче
+    вызова возвращается пустой результат, а метод отмечается недоступным (см. breaker.collect_unavailable)
+    """
     try:
-        with cache_path.open("r", encoding="utf-8") as f:
-            cache_data = json.load(f)
-        
-        # Проверяем TTL
-        cached_at = datetime.fromisoformat(cache_data["cached_at"])
-        age = (datetime.now() - cached_at).total_seconds()
-        
-        if age > CACHE_TTL_SECONDS:
-            logger.info(f"Кэш для ключа {cache_key} устарел (возраст: {age:.0f} сек), удаляем")
-            cache_path.unlink()
-            return None
-        
-        logger.info(f"Используем кэш для ключа {cache_key} (возраст: {age:.0f} сек)")
-        return cache_data["data"]
-    except Exception as e:
-        logger.warning(f"Ошибка при чтении кэша {cache_key}: {e}")
-        return None
+        return await call_batched(method, params)
+    except CircuitOpenError:
+        return {'result': []}
+    except failure_errors():
+        mark_unavailable(method)
+        return {'result': []}
 
 
-def _save_to_cache(cache_key: str, data: Any) -> None:
-    """Сохраняет данные в кэш"""
+# Разделы отчетов об активности, которые отдаются пустыми при разомкнутом предохранителе их методов
+DEGRADABLE_SECTIONS = {
+    'comments': ('crm.timeline.comment.list',),
+    'calendar': ('calendar.section.get', 'calendar.event.get'),
+}
+
+
+async def _section_or_empty(coro, empty: Any) -> Any:
+    """Раздел отчета: при разомкнутом предохранителе метода — пустое значение"""
     try:
-        cache_path = _get_cache_path(cache_key)
-        cache_data = {
-            "cached_at": datetime.now().isoformat(),
-            "data": data
-        }
-        with cache_path.open("w", encoding="utf-8") as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
-        logger.info(f"Данные сохранены в кэш для ключа {cache_key}")
-    except Exception as e:
-        logger.warning(f"Ошибка при сохранении кэша {cache_key}: {e}")
+        return await coro
+    except CircuitOpenError:
+        return empty
+
+
+def _unavailable_sections(methods: set) -> list[str]:
+    """Разделы из DEGRADABLE_SECTIONS, методы которых были отклонены предохранителями"""
+    return [section for section, section_methods in DEGRADABLE_SECTIONS.items() if methods & set(section_methods)]
 
 
 async def get_deal_by_id(deal_id: int) -> dict:
     """
     Получает сделку по ID
     """
-    deal = await bit.call('crm.deal.get', {'ID': deal_id})
+    deal = await get_bit().call('crm.deal.get', {'ID': deal_id})
     return deal
 
 
@@ -103,7 +252,7 @@ async def get_fields_by_deal() -> list[dict]:
         try:
             logger.info(f"Получение всех полей для сделки")
             # Метод .fields не требует параметров, используем get_all
-            result = await bit.get_all(f'crm.deal.fields')
+            result = await _get_all('crm.deal.fields')
             
             if not result:
                 logger.warning(f"Не получены поля для сделки")
@@ -135,10 +284,10 @@ async def get_fields_by_deal() -> list[dict]:
 
 async def get_fields_by_user() -> list[dict]:
     """Получение всех пользовательских полей"""
-    # userfieldsUser = await bit.call('user.userfield.list', raw=True)
+    # userfieldsUser = await get_bit().call('user.userfield.list', raw=True)
     # pprint(userfieldsUser)
     
-    userfields = await bit.call('user.fields', raw=True)
+    userfields = await _call_raw('user.fields')
     userfields=userfields['result']
     userfieldsTemp=[]
     for key, value in userfields.items():
@@ -152,7 +301,7 @@ async def get_fields_by_user() -> list[dict]:
     
 async def get_fields_by_contact() -> list[dict]:
     """Получение всех полей для контакта (включая пользовательские)"""
-    fields = await bit.get_all('crm.contact.fields')
+    fields = await _get_all('crm.contact.fields')
     # pprint(fields)
     fieldsTemp=[]
     
@@ -172,7 +321,7 @@ async def get_fields_by_contact() -> list[dict]:
 
 async def get_fields_by_company() -> list[dict]:
     """Получение всех полей для компании (включая пользовательские)"""
-    fields = await bit.get_all('crm.company.fields')
+    fields = await _get_all('crm.company.fields')
     # pprint(fields)
     fieldsTemp=[]
     
@@ -196,7 +345,7 @@ async def get_fields_by_lead() -> list[dict]:
     try:
         logger.info(f"Получение всех полей для сделки")
         # Метод .fields не требует параметров, используем get_all
-        result = await bit.get_all(f'crm.lead.fields')
+        result = await _get_all('crm.lead.fields')
         
         if not result:
             logger.warning(f"Не получены поля для лида")
@@ -227,14 +376,16 @@ async def get_fields_by_lead() -> list[dict]:
         raise
 
 
+@traced()
 async def get_users_by_filter(filter_fields: dict={}) -> list[dict] | dict:
     """Получение пользователей по фильтру"""
-    users = await bit.get_all('user.get', params={'filter': filter_fields})
+    users = await _get_all('user.get', params={'filter': filter_fields})
     if isinstance(users, dict):
         if users.get('order0000000000'):
             users=users['order0000000000']
     return users
 
+@traced()
 async def get_deal_categories() -> list[dict]:
     """Получение всех воронок сделок через crm.dealcategory.list
     
@@ -243,7 +394,7 @@ async def get_deal_categories() -> list[dict]:
     """
     try:
         logger.info(f"Получение воронок сделок")
-        result = await bit.get_all('crm.dealcategory.list')
+        result = await _get_all('crm.dealcategory.list')
         
         if not result:
             logger.warning(f"Не получены воронки сделок")
@@ -265,6 +416,7 @@ async def get_deal_categories() -> list[dict]:
         logger.error(f"Ошибка при получении воронок сделок: {e}")
         raise
 
+@traced()
 async def get_deal_stages(entity_id: str = "DEAL_STAGE", category_id: str | None = None) -> list[dict]:
     """Получение стадий сделок через crm.status.list
     
@@ -281,7 +433,7 @@ async def get_deal_stages(entity_id: str = "DEAL_STAGE", category_id: str | None
             filter_params['CATEGORY_ID'] = category_id
         
         logger.info(f"Получение стадий для сущности {entity_id}, воронка: {category_id}")
-        result = await bit.get_all('crm.status.list', params={'filter': filter_params})
+        result = await _get_all('crm.status.list', params={'filter': filter_params})
         
         if not result:
             logger.warning(f"Не получены стадии для сущности {entity_id}, воронка: {category_id}")
@@ -315,7 +467,7 @@ async def get_category_stages(category_id: int) -> list[dict]:
     try:
         logger.info(f"Получение стадий для воронки {category_id} через crm.status.list")
         # Пробуем получить стадии через crm.status.list с фильтром по CATEGORY_ID
-        result = await bit.get_all('crm.status.list', params={
+        result = await _get_all('crm.status.list', params={
             'filter': {
                 '%ENTITY_ID': 'DEAL_STAGE',
                 'CATEGORY_ID': str(category_id)
@@ -342,6 +494,7 @@ async def get_category_stages(category_id: int) -> list[dict]:
         logger.warning(f"Ошибка при получении стадий для воронки {category_id}: {e}")
         return []
 
+@traced()
 async def get_all_deal_stages_by_categories(entity_id: str = "DEAL_STAGE") -> list[dict]:
     """Получение всех стадий сделок для всех воронок
     
@@ -425,6 +578,7 @@ async def get_all_deal_stages_by_categories(entity_id: str = "DEAL_STAGE") -> li
         logger.error(f"Ошибка при получении всех стадий для сущности {entity_id}: {e}")
         raise
 
+@traced()
 async def get_stage_history(entity_type_id: int, owner_id: int = None, filter_fields: dict = None, select_fields: list[str] = None) -> list[dict]:
     """Получение истории движения по стадиям через crm.stagehistory.list
     
@@ -456,7 +610,7 @@ async def get_stage_history(entity_type_id: int, owner_id: int = None, filter_fi
             params['select'] = select_fields
         
         logger.info(f"Получение истории стадий для entity_type_id={entity_type_id}, owner_id={owner_id}")
-        result = await bit.get_all('crm.stagehistory.list', params=params)
+        result = await _get_all('crm.stagehistory.list', params=params)
         
         if not result:
             logger.warning(f"Не получена история стадий для entity_type_id={entity_type_id}, owner_id={owner_id}")
@@ -483,11 +637,18 @@ async def get_stage_history(entity_type_id: int, owner_id: int = None, filter_fi
         logger.error(f"Ошибка при получении истории стадий для entity_type_id={entity_type_id}, owner_id={owner_id}: {e}")
         raise
 
+@traced()
 async def get_deals_by_filter(filter_fields: dict, select_fields: list[str]) -> list[dict] | dict:
     """
     Получает сделку по фильтру
     """
-    deal = await bit.get_all('crm.deal.list', params={'filter': filter_fields, 'select': select_fields})
+    params = {'filter': filter_fields, 'select': select_fields}
+    deals = await _from_mirror('crm.deal.list', params)
+    if deals is not None:
+        return deals
+    if get_delta_sync().supports('crm.deal.list', params):
+        return await get_delta_sync().fetch('crm.deal.list', params)
+    deal = await _get_list('crm.deal.list', params=params)
     # pprint(deal)
     if isinstance(deal, dict):
         if deal.get('order0000000000'):
@@ -495,17 +656,19 @@ async def get_deals_by_filter(filter_fields: dict, select_fields: list[str]) ->
     
     return deal
 
+@traced()
 async def get_contacts_by_filter(filter_fields: dict={}, select_fields: list[str]=["*", "UF_*"]) -> list[dict] | dict:
     """Получение контактов по фильтру"""
-    contacts = await bit.get_all('crm.contact.list', params={'filter': filter_fields, 'select': select_fields})
+    contacts = await _get_list('crm.contact.list', params={'filter': filter_fields, 'select': select_fields})
     if isinstance(contacts, dict):
         if contacts.get('order0000000000'):
             contacts=contacts['order0000000000']
     return contacts
 
+@traced()
 async def get_companies_by_filter(filter_fields: dict={}, select_fields: list[str]=["*", "UF_*"]) -> list[dict] | dict:
     """Получение компаний по фильтру"""
-    companies = await bit.get_all('crm.company.list', params={'filter': filter_fields, 'select': select_fields})
+    companies = await _get_list('crm.company.list', params={'filter': filter_fields, 'select': select_fields})
     if isinstance(companies, dict):
         if companies.get('order0000000000'):
             companies=companies['order0000000000']
@@ -519,7 +682,7 @@ async def get_fields_by_task() -> list[dict]:
     try:
         logger.info(f"Получение всех полей для задач")
         # Fix: use correct API method without parameters
-        result = await bit.call('tasks.task.getFields', raw=True)
+        result = await _call_raw('tasks.task.getFields')
         # pprint(result)  # Отключаем для чистоты вывода
         
         if not result:
@@ -585,13 +748,14 @@ async def get_fields_by_task() -> list[dict]:
 async def get_task_by_id(task_id: int) -> dict:
     """Получает задачу по ID"""
     try:
-        task = await bit.call('tasks.task.get', {'taskId': task_id})
+        task = await get_bit().call('tasks.task.get', {'taskId': task_id})
         return task
     except Exception as e:
         logger.error(f"Ошибка при получении задачи {task_id}: {e}")
         raise
 
 
+@traced()
 async def get_tasks_by_filter(filter_fields: dict={}, select_fields: list[str]=["*"], order: dict={'ID': 'DESC'}) -> list[dict]:
     """Получение задач по фильтру"""
     try:
@@ -629,7 +793,11 @@ async def get_tasks_by_filter(filter_fields: dict={}, select_fields: list[str]=[
                 'select': select_fields
             }
             
-            result = await bit.get_all('tasks.task.list', params=params)
+            result = await _from_mirror('tasks.task.list', params)
+            if result is None and get_delta_sync().supports('tasks.task.list', params):
+                result = await get_delta_sync().fetch('tasks.task.list', params)
+            elif result is None:
+                result = await _get_all('tasks.task.list', params=params)
             
             # Обрабатываем результат
             if isinstance(result, dict):
@@ -687,7 +855,7 @@ async def get_tasks_by_filter(filter_fields: dict={}, select_fields: list[str]=[
                 if start > 0:
                     params['limit'] = limit
                 
-                result = await bit.call('tasks.task.list', params)
+                result = await get_bit().call('tasks.task.list', params)
                 
                 if isinstance(result, dict):
                     # Обрабатываем пакетный ответ с order0000000000
@@ -740,7 +908,7 @@ async def get_tasks_by_filter(filter_fields: dict={}, select_fields: list[str]=[
 async def create_task(fields: dict) -> dict:
     """Создание новой задачи"""
     try:
-        result = await bit.call('tasks.task.add', {'fields': fields})
+        result = await get_bit().call('tasks.task.add', {'fields': fields})
         
         # Правильное извлечение ID задачи из ответа
         task_id = result.get('id')
@@ -756,7 +924,7 @@ async def create_task(fields: dict) -> dict:
 async def update_task(task_id: int, fields: dict) -> dict:
     """Обновление задачи"""
     try:
-        result = await bit.call('tasks.task.update', {'taskId': task_id, 'fields': fields})
+        result = await get_bit().call('tasks.task.update', {'taskId': task_id, 'fields': fields})
         logger.info(f"Обновлена задача с ID: {task_id}")
         return result
     except Exception as e:
@@ -767,7 +935,7 @@ async def update_task(task_id: int, fields: dict) -> dict:
 async def delete_task(task_id: int) -> dict:
     """Удаление задачи"""
     try:
-        result = await bit.call('tasks.task.delete', {'taskId': task_id})
+        result = await get_bit().call('tasks.task.delete', {'taskId': task_id})
         logger.info(f"Удалена задача с ID: {task_id}")
         return result
     except Exception as e:
@@ -781,7 +949,7 @@ async def get_task_comments(task_id: int) -> list[dict]:
     """Получение комментариев к задаче"""
     try:
         # Fix: Use correct API method
-        comments = await bit.get_all('task.commentitem.getlist', params={'TASKID': int(task_id)})
+        comments = await _get_all('task.commentitem.getlist', params={'TASKID': int(task_id)})
         return comments if isinstance(comments, list) else []
     except Exception as e:
         logger.error(f"Ошибка при получении комментариев для задачи {task_id}: {e}")
@@ -794,7 +962,7 @@ async def add_task_comment(task_id: int, fields: dict) -> dict:
         # Fix: Use correct API method
         items={'TASKID': int(task_id), 'FIELDS': fields}
         
-        result = await bit.call('task.commentitem.add', items, raw=True)
+        result = await get_bit().call('task.commentitem.add', items, raw=True)
         logger.info(f"Добавлен комментарий к задаче {task_id}")
         return result
     except Exception as e:
@@ -806,7 +974,7 @@ async def update_task_comment(task_id: int, comment_id: int, fields: dict) -> di
     """Обновление комментария к задаче"""
     try:
         # Fix: Use correct API method
-        result = await bit.call('task.commentitem.update', [int(task_id), int(comment_id), fields])
+        result = await get_bit().call('task.commentitem.update', [int(task_id), int(comment_id), fields])
         logger.info(f"Обновлен комментарий {comment_id} к задаче {task_id}")
         return result
     except Exception as e:
@@ -818,7 +986,7 @@ async def delete_task_comment(task_id: int, comment_id: int) -> dict:
     """Удаление комментария к задаче"""
     try:
         # Fix: Use correct API method
-        result = await bit.call('task.commentitem.delete', [int(task_id), int(comment_id)])
+        result = await get_bit().call('task.commentitem.delete', [int(task_id), int(comment_id)])
         logger.info(f"Удален комментарий {comment_id} к задаче {task_id}")
         return result
     except Exception as e:
@@ -832,7 +1000,7 @@ async def get_task_checklist(task_id: int) -> list[dict]:
     """Получение чеклиста задачи"""
     try:
         # Fix: Use correct API method
-        checklist = await bit.get_all('task.checklistitem.list', params={'TASKID': int(task_id)})
+        checklist = await _get_all('task.checklistitem.list', params={'TASKID': int(task_id)})
         return checklist if isinstance(checklist, list) else []
     except Exception as e:
         logger.error(f"Ошибка при получении чеклиста для задачи {task_id}: {e}")
@@ -843,7 +1011,7 @@ async def add_checklist_item(task_id: int, fields: dict) -> dict:
     """Добавление пункта в чеклист задачи"""
     try:
         # Fix: Use correct API method
-        result = await bit.call('task.checklistitem.add', {'TASKID': int(task_id), 'FIELDS': fields})
+        result = await get_bit().call('task.checklistitem.add', {'TASKID': int(task_id), 'FIELDS': fields})
         logger.info(f"Добавлен пункт в чеклист задачи {task_id}")
         return result
     except Exception as e:
@@ -855,7 +1023,7 @@ async def delete_checklist_item(task_id: int, item_id: int) -> dict:
     """Удаление пункта из чеклиста задачи"""
     try:
         # Fix: Use correct API method
-        result = await bit.call('task.checklistitem.delete', [int(task_id), int(item_id)])
+        result = await get_bit().call('task.checklistitem.delete', [int(task_id), int(item_id)])
         logger.info(f"Удален пункт {item_id} из чеклиста задачи {task_id}")
         return result
     except Exception as e:
@@ -869,7 +1037,7 @@ async def get_task_elapsed_time(task_id: int) -> list[dict]:
     """Получение записей затраченного времени по задаче"""
     try:
         # Fix: Use correct API method
-        elapsed = await bit.get_all('task.elapseditem.list', params={'TASKID': int(task_id)})
+        elapsed = await _get_all('task.elapseditem.list', params={'TASKID': int(task_id)})
         return elapsed if isinstance(elapsed, list) else []
     except Exception as e:
         logger.error(f"Ошибка при получении затраченного времени для задачи {task_id}: {e}")
@@ -880,7 +1048,7 @@ async def add_elapsed_time(task_id: int, fields: dict) -> dict:
     """Добавление записи о затраченном времени"""
     try:
         # Fix: Use correct API method
-        result = await bit.call('task.elapseditem.add', {'TASKID': int(task_id), 'FIELDS': fields})
+        result = await get_bit().call('task.elapseditem.add', {'TASKID': int(task_id), 'FIELDS': fields})
         logger.info(f"Добавлена запись о времени для задачи {task_id}")
         return result
     except Exception as e:
@@ -892,7 +1060,7 @@ async def delete_elapsed_time(task_id: int, item_id: int) -> dict:
     """Удаление записи о затраченном времени"""
     try:
         # Fix: Use correct API method
-        result = await bit.call('task.elapseditem.delete', {'TASKID': int(task_id), 'ITEMID': int(item_id)})
+        result = await get_bit().call('task.elapseditem.delete', {'TASKID': int(task_id), 'ITEMID': int(item_id)})
         logger.info(f"Удалена запись {item_id} о времени для задачи {task_id}")
         return result
     except Exception as e:
@@ -900,30 +1068,94 @@ async def delete_elapsed_time(task_id: int, item_id: int) -> dict:
         raise
 
 
+# === ПОТОКОВАЯ ВЫБОРКА ===
+# Асинхронные генераторы страниц (по 50 строк) для агрегации больших списков без загрузки их в память
+# целиком; следующий batch-запрос выполняется, пока обрабатывается текущая страница (см. pagination.iter_list).
+# В отличие от get_*_by_filter не используют кэш и объединение одинаковых запросов; если выборку может выполнить
+# локальная копия (mirror.py), страницы читаются из нее.
+
+async def _iter_pages(method: str, params: dict) -> AsyncIterator[list[dict]]:
+    mirror = get_mirror()
+    plan = mirror.plan(method, params)
+    pages = mirror.pages(plan) if plan is not None else iter_list(get_bit(), method, params)
+    async for page in pages:
+        yield page
+
+async def iter_deals(filter_fields: dict={}, select_fields: list[str]=["*", "UF_*"]) -> AsyncIterator[list[dict]]:
+    """Постраничная выборка сделок по фильтру"""
+    async for page in _iter_pages('crm.deal.list', {'filter': filter_fields, 'select': select_fields}):
+        yield page
+
+async def iter_leads(filter_fields: dict={}, select_fields: list[str]=["*", "UF_*"]) -> AsyncIterator[list[dict]]:
+    """Постраничная выборка лидов по фильтру"""
+    async for page in _iter_pages('crm.lead.list', {'filter': filter_fields, 'select': select_fields}):
+        yield page
+
+async def iter_contacts(filter_fields: dict={}, select_fields: list[str]=["*", "UF_*"]) -> AsyncIterator[list[dict]]:
+    """Постраничная выборка контактов по фильтру"""
+    async for page in _iter_pages('crm.contact.list', {'filter': filter_fields, 'select': select_fields}):
+        yield page
+
+async def iter_companies(filter_fields: dict={}, select_fields: list[str]=["*", "UF_*"]) -> AsyncIterator[list[dict]]:
+    """Постраничная выборка компаний по фильтру"""
+    async for page in _iter_pages('crm.company.list', {'filter': filter_fields, 'select': select_fields}):
+        yield page
+
+async def iter_activities(filter_fields: dict={}, select_fields: list[str]=["*"]) -> AsyncIterator[list[dict]]:
+    """Постраничная выборка активностей CRM (звонки, встречи, email-письма) по фильтру"""
+    async for page in _iter_pages('crm.activity.list', {'filter': filter_fields, 'select': select_fields}):
+        yield page
+
+async def iter_tasks(filter_fields: dict={}, select_fields: list[str]=["*"]) -> AsyncIterator[list[dict]]:
+    """Постраничная выборка задач по фильтру (фильтр по STATUS применяется на клиенте, как в get_tasks_by_filter)"""
+    status_filter = None
+    other_filters = {}
+    for key, value in filter_fields.items():
+        if key.upper() == 'STATUS':
+            status_filter = value
+        else:
+            other_filters[key] = value
+
+    async for page in _iter_pages('tasks.task.list', {'filter': other_filters, 'select': select_fields}):
+        if status_filter is not None:
+            page = [task for task in page if str(task.get('status', task.get('STATUS'))) == str(status_filter)]
+        if page:
+            yield page
+
 # === АКТИВНОСТИ CRM ===
 
+@traced()
 async def get_crm_activities_by_filter(filter_fields: dict={}, select_fields: list[str]=["*"]) -> list[dict]:
     """Получение активностей CRM (звонки, встречи, email-письма) по фильтру с кэшированием"""
+    # Генерируем ключ кэша
+    cache_key = _generate_activity_cache_key(
+        "crm_activities",
+        filter_fields=filter_fields,
+        select_fields=select_fields
+    )
+
+    params = {
+        'filter': filter_fields,
+        'select': select_fields
+    }
+
+    lease = None
     try:
-        # Генерируем ключ кэша
-        cache_key = _generate_activity_cache_key(
-            "crm_activities",
-            filter_fields=filter_fields,
-            select_fields=select_fields
-        )
-        
-        # Проверяем кэш
-        cached_activities = _load_from_cache(cache_key)
+        activities = await _from_mirror('crm.activity.list', params)
+        if activities is not None:
+            return activities
+
+        # Список за период досинхронизируется по LAST_UPDATED вместо полной выборки после TTL
+        if get_delta_sync().supports('crm.activity.list', params):
+            return await get_delta_sync().fetch('crm.activity.list', params)
+
+        # Кэш crm_activities — только для вызовов вне delta_sync: BITRIX_DELTA_SYNC=0 или фильтр по LAST_UPDATED
+        cached_activities, lease, _ = await cache.get_or_lock(cache_key)
         if cached_activities is not None:
             return cached_activities
         
         # Выполняем запрос
-        params = {
-            'filter': filter_fields,
-            'select': select_fields
-        }
-        
-        activities = await bit.get_all('crm.activity.list', params=params)
+        activities = await _get_list('crm.activity.list', params=params)
         
         # Обрабатываем возможный словарь с ключом order0000000000
         if isinstance(activities, dict):
@@ -933,14 +1165,27 @@ async def get_crm_activities_by_filter(filter_fields: dict={}, select_fields: li
         activities = activities if isinstance(activities, list) else []
         
         # Сохраняем в кэш
-        _save_to_cache(cache_key, activities)
+        cache.set(cache_key, activities, lease=lease)
         
         return activities
     except Exception as e:
         logger.error(f"Ошибка при получении активностей CRM: {e}")
         raise
+    finally:
+        # Право пересчета есть только у вызова с промахом: попадание (и устаревшее значение) его не получает
+        if lease is not None:
+            cache.release(lease)
+
 
 
+# Поля активностей для get_deal_activities_by_type: тип, направление, провайдер и сведения для отображения
+# (без DESCRIPTION, SETTINGS и COMMUNICATIONS)
+DEAL_ACTIVITY_FIELDS = projection(
+    'TYPE_ID', 'DIRECTION', 'PROVIDER_ID', 'PROVIDER_TYPE_ID', 'SUBJECT', 'CREATED', 'DEADLINE',
+    'START_TIME', 'END_TIME', 'COMPLETED', 'STATUS', 'RESPONSIBLE_ID', 'OWNER_ID', 'OWNER_TYPE_ID'
+)
+
+@traced()
 async def get_deal_activities_by_type(deal_id: int | str, from_date: str = None, to_date: str = None) -> dict:
     """Получение всех активностей сделки по всем типам с группировкой
     
@@ -1000,7 +1245,7 @@ async def get_deal_activities_by_type(deal_id: int | str, from_date: str = None,
         # Получаем все активности
         activities = await get_crm_activities_by_filter(
             filter_fields=filter_fields,
-            select_fields=['*']
+            select_fields=DEAL_ACTIVITY_FIELDS
         )
         
         # Группируем по типам
@@ -1089,10 +1334,11 @@ async def get_deal_activities_by_type(deal_id: int | str, from_date: str = None,
         raise
 
 
+@traced()
 async def get_leads_by_filter(filter_fields: dict={}, select_fields: list[str]=["*", "UF_*"]) -> list[dict] | dict:
     """Получение лидов по фильтру"""
     try:
-        leads = await bit.get_all('crm.lead.list', params={'filter': filter_fields, 'select': select_fields})
+        leads = await _get_list('crm.lead.list', params={'filter': filter_fields, 'select': select_fields})
         if isinstance(leads, dict):
             if leads.get('order0000000000'):
                 leads = leads['order0000000000']
@@ -1102,21 +1348,25 @@ async def get_leads_by_filter(filter_fields: dict={}, select_fields: list[str]=[
         raise
 
 
+@traced()
 async def get_all_entity_comments(entity_type: str, author_id: int, from_date: str = None, date_filter: dict = None) -> list[dict]:
     """Получение всех комментариев пользователя в сущностях CRM (deal, lead, contact, company) с использованием батчей и кэширования"""
+    # Генерируем ключ кэша
+    cache_key = _generate_activity_cache_key(
+        f"comments_{entity_type}",
+        author_id=author_id,
+        from_date=from_date,
+        date_filter=date_filter
+    )
+
+    lease = None
     try:
         logger.info(f"Получение комментариев {entity_type} для автора {author_id}")
         
-        # Генерируем ключ кэша
-        cache_key = _generate_activity_cache_key(
-            f"comments_{entity_type}",
-            author_id=author_id,
-            from_date=from_date,
-            date_filter=date_filter
-        )
-        
         # Проверяем кэш
-        cached_comments = _load_from_cache(cache_key)
+        cached_comments, lease, _ = await cache.get_or_lock(
+            cache_key, refresh=lambda: get_all_entity_comments(entity_type, author_id, from_date, date_filter)
+        )
         if cached_comments is not None:
             logger.info(f"Использованы кэшированные комментарии {entity_type} для автора {author_id}")
             return cached_comments
@@ -1169,11 +1419,12 @@ async def get_all_entity_comments(entity_type: str, author_id: int, from_date: s
             }
             batch_requests.append(params)
         
-        # Шаг 3: Выполняем запросы батчами (fast-bitrix24 автоматически разобьет на батчи по 50)
+        # Шаг 3: Выполняем запросы батчами (микробатчер упаковывает вызовы в batch по 50 команд)
         logger.info(f"Выполнение {len(batch_requests)} запросов комментариев через батчи")
         
-        # Используем call() с массивом запросов для автоматического батчинга
-        results = await bit.call('crm.timeline.comment.list', batch_requests, raw=True)
+        results = await asyncio.gather(*[
+            call_batched_or_empty('crm.timeline.comment.list', params) for params in batch_requests
+        ])
         
         # Обрабатываем результаты батчей
         if isinstance(results, list):
@@ -1213,30 +1464,35 @@ async def get_all_entity_comments(entity_type: str, author_id: int, from_date: s
         logger.info(f"Получено {len(all_comments)} комментариев {entity_type} от автора {author_id}")
         
         # Сохраняем в кэш
-        _save_to_cache(cache_key, all_comments)
+        cache.set(cache_key, all_comments, lease=lease)
         
         return all_comments
         
     except Exception as e:
         logger.error(f"Ошибка при получении комментариев {entity_type} для автора {author_id}: {e}")
         raise
+    finally:
+        if lease is not None:
+            cache.release(lease)
 
 
+@traced()
 async def get_calendar_events(from_date: str, to_date: str, owner_id: int = None) -> list[dict]:
     """Получение событий календаря пользователя через секции с кэшированием"""
+    # Генерируем ключ кэша
+    cache_key = _generate_activity_cache_key(
+        "calendar_events",
+        owner_id=owner_id,
+        from_date=from_date,
+        to_date=to_date
+    )
+
+    lease = None
     try:
         logger.info(f"Получение событий календаря для пользователя {owner_id} с {from_date} по {to_date}")
         
-        # Генерируем ключ кэша
-        cache_key = _generate_activity_cache_key(
-            "calendar_events",
-            owner_id=owner_id,
-            from_date=from_date,
-            to_date=to_date
-        )
-        
         # Проверяем кэш
-        cached_events = _load_from_cache(cache_key)
+        cached_events, lease, _ = await cache.get_or_lock(cache_key)
         if cached_events is not None:
             logger.info(f"Использованы кэшированные события календаря для пользователя {owner_id}")
             return cached_events
@@ -1248,7 +1504,7 @@ async def get_calendar_events(from_date: str, to_date: str, owner_id: int = None
             'type': 'user',
             'ownerId': owner_id if owner_id else 1
         }
-        sections_result = await bit.call('calendar.section.get', sections_params, raw=True)
+        sections_result = await get_bit().call('calendar.section.get', sections_params, raw=True)
         
         sections = []
         if sections_result and 'result' in sections_result:
@@ -1269,7 +1525,7 @@ async def get_calendar_events(from_date: str, to_date: str, owner_id: int = None
                 'from': from_date,
                 'to': to_date
             }
-            events_result = await bit.call('calendar.event.get', events_params, raw=True)
+            events_result = await get_bit().call('calendar.event.get', events_params, raw=True)
             
             if events_result and 'result' in events_result:
                 section_events = events_result['result'] if isinstance(events_result['result'], list) else []
@@ -1278,15 +1534,23 @@ async def get_calendar_events(from_date: str, to_date: str, owner_id: int = None
         logger.info(f"Получено {len(all_events)} событий календаря")
         
         # Сохраняем в кэш
-        _save_to_cache(cache_key, all_events)
+        cache.set(cache_key, all_events, lease=lease)
         
         return all_events
         
     except Exception as e:
         logger.error(f"Ошибка при получении событий календаря: {e}")
         raise
+    finally:
+        if lease is not None:
+            cache.release(lease)
+
+
 
+# Поля активностей, которые читает get_manager_full_activity
+MANAGER_ACTIVITY_FIELDS = projection('TYPE_ID', 'DIRECTION')
 
+@traced()
 async def get_manager_full_activity(manager_id: int, days: int = 30) -> dict:
     """Получение полной активности менеджера за указанный период с кэшированием
     
@@ -1297,24 +1561,30 @@ async def get_manager_full_activity(manager_id: int, days: int = 30) -> dict:
       вместо 4 отдельных запросов для каждого типа сущности (deal, lead, contact, company)
     Это значительно ускоряет работу функции по сравнению с последовательным выполнением запросов.
     """
+    # Генерируем ключ кэша для полной активности
+    end_date = datetime.now().strftime("%Y-%m-%d")
+    start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    cache_key = _generate_activity_cache_key(
+        "manager_full_activity",
+        manager_id=manager_id,
+        days=days,
+        start_date=start_date,
+        end_date=end_date
+    )
+
+    lease = None
     try:
         logger.info(f"Получение активности менеджера {manager_id} за {days} дней")
         
-        # Генерируем ключ кэша для полной активности
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
-        cache_key = _generate_activity_cache_key(
-            "manager_full_activity",
-            manager_id=manager_id,
-            days=days,
-            start_date=start_date,
-            end_date=end_date
-        )
-        
         # Проверяем кэш
-        cached_activity = _load_from_cache(cache_key)
+        cached_activity, lease, stale_age = await cache.get_or_lock(
+            cache_key, refresh=lambda: get_manager_full_activity(manager_id, days)
+        )
         if cached_activity is not None:
             logger.info(f"Использована кэшированная активность менеджера {manager_id}")
+            # Устаревший отчет пересчитывается в фоне: возраст — в ответе
+            if stale_age is not None and isinstance(cached_activity, dict):
+                cached_activity[STALE_AGE_FIELD] = stale_age
             return cached_activity
         
         # Получение информации о менеджере
@@ -1354,21 +1624,22 @@ async def get_manager_full_activity(manager_id: int, days: int = 30) -> dict:
         
         # Выполняем все независимые запросы параллельно для ускорения
         logger.info(f"Параллельное получение всех данных для менеджера {manager_id}")
-        activities, tasks, deals, leads, calendar_events, all_comments_by_manager = await asyncio.gather(
-            get_crm_activities_by_filter(date_filter),
-            get_tasks_by_filter(
-                tasks_filter,
-                select_fields=['ID', 'TITLE', 'STATUS', 'CREATED_DATE', 'CLOSED_DATE', 'RESPONSIBLE_ID']
-            ),
-            get_deals_by_filter(deals_filter, select_fields=['ID', 'TITLE', 'STAGE_ID', 'DATE_CREATE']),
-            get_leads_by_filter(leads_filter, select_fields=['ID', 'TITLE', 'STATUS_ID', 'DATE_CREATE']),
-            get_calendar_events(
-                from_date=f"{start_date}T00:00:00",
-                to_date=f"{end_date}T23:59:59",
-                owner_id=manager_id
-            ),
-            get_all_comments_batch(date_filter_for_comments, [manager_id])
-        )
+        with collect_unavailable() as unavailable_methods:
+            activities, tasks, deals, leads, calendar_events, all_comments_by_manager = await asyncio.gather(
+                get_crm_activities_by_filter(date_filter, select_fields=MANAGER_ACTIVITY_FIELDS),
+                get_tasks_by_filter(
+                    tasks_filter,
+                    select_fields=['ID', 'TITLE', 'STATUS', 'CREATED_DATE', 'CLOSED_DATE', 'RESPONSIBLE_ID']
+                ),
+                get_deals_by_filter(deals_filter, select_fields=['ID', 'TITLE', 'STAGE_ID', 'DATE_CREATE']),
+                get_leads_by_filter(leads_filter, select_fields=['ID', 'TITLE', 'STATUS_ID', 'DATE_CREATE']),
+                _section_or_empty(get_calendar_events(
+                    from_date=f"{start_date}T00:00:00",
+                    to_date=f"{end_date}T23:59:59",
+                    owner_id=manager_id
+                ), []),
+                get_all_comments_batch(date_filter_for_comments, [manager_id])
+            )
         
         # Анализ типов активностей
         calls_total = 0
@@ -1503,16 +1774,25 @@ async def get_manager_full_activity(manager_id: int, days: int = 30) -> dict:
         
         logger.info(f"Активность менеджера {manager_id} собрана: {total_activities} активностей")
         
-        # Сохраняем в кэш
-        _save_to_cache(cache_key, result)
+        # Отчет без недоступных разделов возвращается, но не кэшируется
+        unavailable_sections = _unavailable_sections(unavailable_methods)
+        if unavailable_sections:
+            result['unavailable_sections'] = unavailable_sections
+            logger.warning(f"Активность менеджера {manager_id} собрана без разделов {unavailable_sections}: предохранители разомкнуты")
+        else:
+            cache.set(cache_key, result, lease=lease)
         
         return result
         
     except Exception as e:
         logger.error(f"Ошибка при получении активности менеджера {manager_id}: {e}")
         raise
+    finally:
+        if lease is not None:
+            cache.release(lease)
 
 
+@traced()
 async def get_all_comments_batch(date_filter: dict, manager_ids: list[int] = None) -> dict[int, dict]:
     """Получение всех комментариев для всех типов сущностей батчами с группировкой по менеджерам
     
@@ -1594,7 +1874,9 @@ async def get_all_comments_batch(date_filter: dict, manager_ids: list[int] = Non
             
             # Выполняем запросы батчами
             logger.info(f"Выполнение {len(batch_requests)} запросов комментариев {entity_type} через батчи")
-            results = await bit.call('crm.timeline.comment.list', batch_requests, raw=True)
+            results = await asyncio.gather(*[
+                call_batched_or_empty('crm.timeline.comment.list', params) for params in batch_requests
+            ])
             
             # Обрабатываем результаты батчей и группируем по менеджерам
             if isinstance(results, list):
@@ -1650,12 +1932,13 @@ async def get_all_comments_batch(date_filter: dict, manager_ids: list[int] = Non
         raise
 
 
+@traced()
 async def get_all_calendar_events_batch(from_date: str, to_date: str, manager_ids: list[int]) -> dict[int, list[dict]]:
     """Получение всех событий календаря для всех менеджеров параллельно с группировкой по owner_id
     
     Оптимизированная версия: получает секции календаря и события для всех менеджеров параллельно
-    через asyncio.gather (API Bitrix24 не поддерживает батчинг для calendar.section.get и calendar.event.get),
-    затем группирует по owner_id на клиенте.
+    через asyncio.gather, вызовы calendar.section.get и calendar.event.get упаковываются микробатчером
+    в batch-запросы по 50 команд (microbatch.py), затем события группируются по owner_id на клиенте.
     Это значительно ускоряет работу при большом количестве менеджеров по сравнению с последовательными запросами.
     
     Args:
@@ -1673,8 +1956,7 @@ async def get_all_calendar_events_batch(from_date: str, to_date: str, manager_id
         for manager_id in manager_ids:
             result[manager_id] = []
         
-        # Шаг 1: Получаем секции календаря для каждого менеджера отдельно (API не поддерживает батчинг)
-        # Выполняем запросы параллельно через asyncio.gather для ускорения
+        # Шаг 1: Получаем секции календаря для каждого менеджера (вызовы объединяются в batch по 50 команд)
         logger.info("Получение секций календаря для всех менеджеров (параллельно)")
         
         async def get_sections_for_manager(manager_id: int):
@@ -1684,10 +1966,10 @@ async def get_all_calendar_events_batch(from_date: str, to_date: str, manager_id
                     'type': 'user',
                     'ownerId': manager_id
                 }
-                sections_result = await bit.call('calendar.section.get', sections_params, raw=True)
+                sections_result = await call_batched_or_empty('calendar.section.get', sections_params)
                 
                 sections = []
-                if sections_result and 'result' in sections_result:
+                if sections_result and sections_result.get('result'):
                     sections = sections_result['result'] if isinstance(sections_result['result'], list) else [sections_result['result']]
                 
                 return manager_id, sections
@@ -1707,7 +1989,7 @@ async def get_all_calendar_events_batch(from_date: str, to_date: str, manager_id
         
         logger.info(f"Получено секций календаря для {len(manager_sections)} менеджеров")
         
-        # Шаг 2: Получаем события для всех секций параллельно (API не поддерживает батчинг)
+        # Шаг 2: Получаем события для всех секций (вызовы объединяются в batch по 50 команд)
         # Группируем секции по менеджерам для более эффективных запросов
         async def get_events_for_manager(manager_id: int, section_ids: list):
             """Получение событий календаря для одного менеджера со всеми его секциями"""
@@ -1719,10 +2001,10 @@ async def get_all_calendar_events_batch(from_date: str, to_date: str, manager_id
                     'from': from_date,
                     'to': to_date
                 }
-                events_result = await bit.call('calendar.event.get', events_params, raw=True)
+                events_result = await call_batched_or_empty('calendar.event.get', events_params)
                 
                 events = []
-                if events_result and 'result' in events_result:
+                if events_result and events_result.get('result'):
                     # Результат может быть словарем или списком
                     if isinstance(events_result['result'], dict):
                         # Если результат - словарь, преобразуем в список
@@ -1775,12 +2057,12 @@ def _create_manager_activity_structure(
     calls_missed: int,
     meetings: int,
     emails: int,
-    tasks: list,
+    tasks_count: int,
     tasks_completed: int,
     tasks_in_progress: int,
-    deals: list,
+    deals_count: int,
     deals_won: int,
-    leads: list,
+    leads_count: int,
     leads_converted: int,
     calendar_events: list,
     calendar_meetings: int,
@@ -1811,16 +2093,16 @@ def _create_manager_activity_structure(
         'meetings': meetings,
         'emails': emails,
         'tasks': {
-            'total': len(tasks),
+            'total': tasks_count,
             'completed': tasks_completed,
             'in_progress': tasks_in_progress
         },
         'deals': {
-            'created': len(deals),
+            'created': deals_count,
             'won': deals_won
         },
         'leads': {
-            'created': len(leads),
+            'created': leads_count,
             'converted': leads_converted
         },
         'calendar': {
@@ -1838,6 +2120,7 @@ def _create_manager_activity_structure(
     }
 
 
+@traced()
 async def get_all_managers_activity(days: int = 30, include_inactive: bool = True, only_inactive: bool = False) -> dict:
     """Получение активности всех менеджеров за указанный период с определением неактивных пользователей
     
@@ -1848,25 +2131,31 @@ async def get_all_managers_activity(days: int = 30, include_inactive: bool = Tru
         include_inactive: Включать ли информацию о неактивных менеджерах в результат
         only_inactive: Если True, возвращает только список неактивных менеджеров без детальной статистики активных
     """
+    # Генерируем ключ кэша
+    end_date = datetime.now().strftime("%Y-%m-%d")
+    start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    cache_key = _generate_activity_cache_key(
+        "all_managers_activity",
+        days=days,
+        start_date=start_date,
+        end_date=end_date,
+        include_inactive=include_inactive,
+        only_inactive=only_inactive
+    )
+
+    lease = None
     try:
         logger.info(f"Получение активности всех менеджеров за {days} дней (оптимизированная версия)")
         
-        # Генерируем ключ кэша
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
-        cache_key = _generate_activity_cache_key(
-            "all_managers_activity",
-            days=days,
-            start_date=start_date,
-            end_date=end_date,
-            include_inactive=include_inactive,
-            only_inactive=only_inactive
-        )
-        
         # Проверяем кэш
-        cached_result = _load_from_cache(cache_key)
+        cached_result, lease, stale_age = await cache.get_or_lock(
+            cache_key, refresh=lambda: get_all_managers_activity(days, include_inactive, only_inactive)
+        )
         if cached_result is not None:
             logger.info(f"Использована кэшированная активность всех менеджеров")
+            # Устаревший отчет пересчитывается в фоне: возраст — в ответе
+            if stale_age is not None and isinstance(cached_result, dict):
+                cached_result[STALE_AGE_FIELD] = stale_age
             return cached_result
         
         # Получаем список всех пользователей
@@ -1884,8 +2173,36 @@ async def get_all_managers_activity(days: int = 30, include_inactive: bool = Tru
         
         logger.info(f"Найдено {len(all_users)} пользователей для анализа активности")
         
-        # Шаг 1: Получаем все сущности за период параллельно (оптимизация)
-        logger.info("Параллельное получение всех сущностей за период для группировки по менеджерам")
+        # Создаем словарь пользователей со счетчиками активности
+        managers_data = {}
+        user_id_to_str = {}
+        for user in all_users:
+            user_id = user.get('ID')
+            if not user_id:
+                continue
+            user_id_str = str(user_id)
+            managers_data[user_id_str] = {
+                'user': user,
+                'deals': 0,
+                'deals_won': 0,
+                'leads': 0,
+                'leads_converted': 0,
+                'tasks': 0,
+                'tasks_completed': 0,
+                'tasks_in_progress': 0,
+                'calls_total': 0,
+                'calls_incoming': 0,
+                'calls_outgoing': 0,
+                'calls_missed': 0,
+                'meetings': 0,
+                'emails': 0
+            }
+            user_id_to_str[user_id] = user_id_str
+        
+        def manager_counters(user_id) -> Optional[dict]:
+            """Счетчики менеджера по ID из строки сущности"""
+            user_id_str = user_id_to_str.get(user_id) if user_id else None
+            return managers_data.get(user_id_str) if user_id_str else None
         
         # Подготовка фильтров
         deals_filter = {
@@ -1905,34 +2222,104 @@ async def get_all_managers_activity(days: int = 30, include_inactive: bool = Tru
             '<=CREATED': f"{end_date}T23:59:59"
         }
         
-        # Выполняем все запросы параллельно
-        deals_result, leads_result, all_tasks, all_activities = await asyncio.gather(
-            get_deals_by_filter(deals_filter, select_fields=['ID', 'TITLE', 'STAGE_ID', 'DATE_CREATE', 'ASSIGNED_BY_ID']),
-            get_leads_by_filter(leads_filter, select_fields=['ID', 'TITLE', 'STATUS_ID', 'DATE_CREATE', 'ASSIGNED_BY_ID']),
-            get_tasks_by_filter(
-                tasks_filter,
-                select_fields=['ID', 'TITLE', 'STATUS', 'CREATED_DATE', 'CLOSED_DATE', 'RESPONSIBLE_ID']
-            ),
-            get_crm_activities_by_filter(activities_filter)
-        )
-        
-        # Нормализуем результаты
-        if isinstance(deals_result, dict):
-            all_deals = deals_result.get('order0000000000', [])
-        else:
-            all_deals = deals_result if isinstance(deals_result, list) else []
-        
-        if isinstance(leads_result, dict):
-            all_leads = leads_result.get('order0000000000', [])
-        else:
-            all_leads = leads_result if isinstance(leads_result, list) else []
-        
-        all_tasks = all_tasks if isinstance(all_tasks, list) else []
-        all_activities = all_activities if isinstance(all_activities, list) else []
-        
-        logger.info(f"Получено: {len(all_deals)} сделок, {len(all_leads)} лидов, {len(all_tasks)} задач, {len(all_activities)} активностей CRM")
+        # Шаг 1: Сущности за период читаются постранично и сразу раскладываются по счетчикам менеджеров,
+        # поэтому память не зависит от размера портала, а подсчет идет параллельно с загрузкой страниц
+        received = defaultdict(int)
+        
+        async def count_in_mirror(method: str, filter_fields: dict, group_by: str, measures: dict, entity: str) -> bool:
+            """Счетчики SQL-агрегатами по локальной копии (mirror.py); False — копия не может выполнить выборку"""
+            totals = await get_mirror().aggregate(method, filter_fields, group_by, {'rows': 'COUNT(*)', **measures})
+            if totals is None:
+                return False
+            for user_id, values in totals.items():
+                received[entity] += values['rows']
+                counters = manager_counters(str(user_id)) if user_id is not None else None
+                if counters:
+                    for name in measures:
+                        counters[name] += values[name] or 0
+            return True
+        
+        async def count_deals():
+            if await count_in_mirror('crm.deal.list', deals_filter, 'ASSIGNED_BY_ID', {
+                'deals': 'COUNT(*)',
+                'deals_won': "SUM(STAGE_ID LIKE '%WON%')",
+            }, 'deals'):
+                return
+            async for page in iter_deals(deals_filter, select_fields=['ID', 'STAGE_ID', 'ASSIGNED_BY_ID']):
+                received['deals'] += len(page)
+                for deal in page:
+                    counters = manager_counters(deal.get('ASSIGNED_BY_ID'))
+                    if counters:
+                        counters['deals'] += 1
+                        if 'WON' in str(deal.get('STAGE_ID', '')).upper():
+                            counters['deals_won'] += 1
+        
+        async def count_leads():
+            if await count_in_mirror('crm.lead.list', leads_filter, 'ASSIGNED_BY_ID', {
+                'leads': 'COUNT(*)',
+                'leads_converted': "SUM(STATUS_ID = 'CONVERTED')",
+            }, 'leads'):
+                return
+            async for page in iter_leads(leads_filter, select_fields=['ID', 'STATUS_ID', 'ASSIGNED_BY_ID']):
+                received['leads'] += len(page)
+                for lead in page:
+                    counters = manager_counters(lead.get('ASSIGNED_BY_ID'))
+                    if counters:
+                        counters['leads'] += 1
+                        if str(lead.get('STATUS_ID', '')) == 'CONVERTED':
+                            counters['leads_converted'] += 1
+        
+        async def count_tasks():
+            if await count_in_mirror('tasks.task.list', tasks_filter, 'RESPONSIBLE_ID', {
+                'tasks': 'COUNT(*)',
+                'tasks_completed': 'SUM(STATUS = 5)',
+                'tasks_in_progress': 'SUM(STATUS IN (2, 3))',
+            }, 'tasks'):
+                return
+            async for page in iter_tasks(tasks_filter, select_fields=['ID', 'STATUS', 'RESPONSIBLE_ID']):
+                received['tasks'] += len(page)
+                for task in page:
+                    counters = manager_counters(task.get('RESPONSIBLE_ID') or task.get('responsibleId'))
+                    if counters:
+                        counters['tasks'] += 1
+                        status = str(task.get('STATUS', task.get('status', '')))
+                        if status == '5':
+                            counters['tasks_completed'] += 1
+                        elif status in ['2', '3']:
+                            counters['tasks_in_progress'] += 1
+        
+        async def count_activities():
+            if await count_in_mirror('crm.activity.list', activities_filter, 'RESPONSIBLE_ID', {
+                'calls_total': 'SUM(TYPE_ID = 2)',
+                'calls_outgoing': 'SUM(TYPE_ID = 2 AND DIRECTION = 1)',
+                'calls_incoming': 'SUM(TYPE_ID = 2 AND DIRECTION = 2)',
+                'calls_missed': 'SUM(TYPE_ID = 2 AND DIRECTION = 0)',
+                'meetings': 'SUM(TYPE_ID = 1)',
+                'emails': 'SUM(TYPE_ID = 4)',
+            }, 'activities'):
+                return
+            async for page in iter_activities(activities_filter, select_fields=['ID', 'TYPE_ID', 'DIRECTION', 'RESPONSIBLE_ID']):
+                received['activities'] += len(page)
+                for activity in page:
+                    counters = manager_counters(activity.get('RESPONSIBLE_ID'))
+                    if not counters:
+                        continue
+                    type_id = activity.get('TYPE_ID')
+                    if type_id == '2':  # Звонки
+                        counters['calls_total'] += 1
+                        direction = activity.get('DIRECTION', '')
+                        if direction == '1':
+                            counters['calls_outgoing'] += 1
+                        elif direction == '2':
+                            counters['calls_incoming'] += 1
+                        elif direction == '0':
+                            counters['calls_missed'] += 1
+                    elif type_id == '1':  # Встречи
+                        counters['meetings'] += 1
+                    elif type_id == '4':  # Email
+                        counters['emails'] += 1
         
-        # Шаг 2: Получаем все комментарии и события календаря батчами параллельно (оптимизация)
+        # Шаг 2: Комментарии и события календаря батчами для всех менеджеров — параллельно с шагом 1
         manager_ids = [int(u.get('ID', 0)) for u in all_users if u.get('ID')]
         manager_ids = [mid for mid in manager_ids if mid > 0]
         
@@ -1941,68 +2328,24 @@ async def get_all_managers_activity(days: int = 30, include_inactive: bool = Tru
             '<=DATE_CREATE': f"{end_date}T23:59:59"
         }
         
-        # Получаем комментарии и календарь параллельно
-        logger.info("Параллельное получение всех комментариев и событий календаря батчами для всех менеджеров")
-        all_comments_by_manager, all_calendar_events_by_manager = await asyncio.gather(
-            get_all_comments_batch(date_filter_for_comments, manager_ids),
-            get_all_calendar_events_batch(
-                from_date=f"{start_date}T00:00:00",
-                to_date=f"{end_date}T23:59:59",
-                manager_ids=manager_ids
+        logger.info("Параллельное получение сущностей за период, комментариев и событий календаря для всех менеджеров")
+        with collect_unavailable() as unavailable_methods:
+            _, _, _, _, all_comments_by_manager, all_calendar_events_by_manager = await asyncio.gather(
+                count_deals(),
+                count_leads(),
+                count_tasks(),
+                count_activities(),
+                get_all_comments_batch(date_filter_for_comments, manager_ids),
+                get_all_calendar_events_batch(
+                    from_date=f"{start_date}T00:00:00",
+                    to_date=f"{end_date}T23:59:59",
+                    manager_ids=manager_ids
+                )
             )
-        )
         
-        # Шаг 3: Группируем сущности по менеджерам (оптимизированная версия)
-        # Создаем словарь пользователей
-        managers_data = {}
-        user_id_to_str = {}
-        for user in all_users:
-            user_id = user.get('ID')
-            if not user_id:
-                continue
-            user_id_str = str(user_id)
-            managers_data[user_id_str] = {
-                'user': user,
-                'deals': [],
-                'leads': [],
-                'tasks': [],
-                'activities': []
-            }
-            user_id_to_str[user_id] = user_id_str
+        logger.info(f"Получено: {received['deals']} сделок, {received['leads']} лидов, {received['tasks']} задач, {received['activities']} активностей CRM")
         
-        # Группируем сделки по менеджерам (оптимизированная версия)
-        for deal in all_deals:
-            assigned_by_id = deal.get('ASSIGNED_BY_ID')
-            if assigned_by_id:
-                user_id_str = user_id_to_str.get(assigned_by_id)
-                if user_id_str:
-                    managers_data[user_id_str]['deals'].append(deal)
-        
-        # Группируем лиды по менеджерам (оптимизированная версия)
-        for lead in all_leads:
-            assigned_by_id = lead.get('ASSIGNED_BY_ID')
-            if assigned_by_id:
-                user_id_str = user_id_to_str.get(assigned_by_id)
-                if user_id_str:
-                    managers_data[user_id_str]['leads'].append(lead)
-        
-        # Группируем задачи по менеджерам (оптимизированная версия)
-        for task in all_tasks:
-            responsible_id = task.get('RESPONSIBLE_ID') or task.get('responsibleId')
-            if responsible_id:
-                user_id_str = user_id_to_str.get(responsible_id)
-                if user_id_str:
-                    managers_data[user_id_str]['tasks'].append(task)
-        
-        # Группируем активности CRM по менеджерам (оптимизированная версия)
-        for activity in all_activities:
-            responsible_id = activity.get('RESPONSIBLE_ID')
-            if responsible_id:
-                user_id_str = user_id_to_str.get(responsible_id)
-                if user_id_str:
-                    managers_data[user_id_str]['activities'].append(activity)
-        
-        # Шаг 4: Формируем активность для каждого менеджера
+        # Шаг 3: Формируем активность для каждого менеджера
         managers_activity = []
         inactive_managers = []
         total_calls = 0
@@ -2016,49 +2359,17 @@ async def get_all_managers_activity(days: int = 30, include_inactive: bool = Tru
         for user_id_str, manager_data in managers_data.items():
             user_id = int(user_id_str)
             user = manager_data['user']
-            deals = manager_data['deals']
-            leads = manager_data['leads']
-            tasks = manager_data['tasks']
-            activities = manager_data['activities']
+            calls_total = manager_data['calls_total']
+            meetings = manager_data['meetings']
+            emails = manager_data['emails']
+            tasks_count = manager_data['tasks']
+            deals_count = manager_data['deals']
+            leads_count = manager_data['leads']
             
             try:
                 # Получаем информацию о менеджере
                 manager_name = f"{user.get('NAME', '')} {user.get('LAST_NAME', '')}".strip()
                 
-                # Анализ активностей CRM (оптимизированная версия)
-                calls_total = 0
-                calls_incoming = 0
-                calls_outgoing = 0
-                calls_missed = 0
-                meetings = 0
-                emails = 0
-                
-                for activity in activities:
-                    type_id = activity.get('TYPE_ID')
-                    if type_id == '2':  # Звонки
-                        calls_total += 1
-                        direction = activity.get('DIRECTION', '')
-                        if direction == '1':
-                            calls_outgoing += 1
-                        elif direction == '2':
-                            calls_incoming += 1
-                        elif direction == '0':
-                            calls_missed += 1
-                    elif type_id == '1':  # Встречи
-                        meetings += 1
-                    elif type_id == '4':  # Email
-                        emails += 1
-                
-                # Анализ задач (оптимизированная версия)
-                tasks_completed = sum(1 for t in tasks if str(t.get('STATUS', t.get('status', ''))) == '5')
-                tasks_in_progress = sum(1 for t in tasks if str(t.get('STATUS', t.get('status', ''))) in ['2', '3'])
-                
-                # Анализ сделок (оптимизированная версия)
-                deals_won = sum(1 for d in deals if 'WON' in str(d.get('STAGE_ID', '')).upper())
-                
-                # Анализ лидов (оптимизированная версия)
-                leads_converted = sum(1 for l in leads if str(l.get('STATUS_ID', '')) == 'CONVERTED')
-                
                 # Получаем события календаря и комментарии из предварительно загруженных данных
                 calendar_events = all_calendar_events_by_manager.get(user_id, [])
                 calendar_meetings = len([
@@ -2077,13 +2388,12 @@ async def get_all_managers_activity(days: int = 30, include_inactive: bool = Tru
                 lead_comments = manager_comments.get('lead', [])
                 contact_comments = manager_comments.get('contact', [])
                 company_comments = manager_comments.get('company', [])
-                
                 total_comments_count = len(deal_comments) + len(lead_comments) + len(contact_comments) + len(company_comments)
                 
                 # Подсчет общей активности (включая календарь и комментарии)
                 total_activities_count = (
                     calls_total + meetings + emails + 
-                    len(tasks) + len(deals) + len(leads) + 
+                    tasks_count + deals_count + leads_count + 
                     len(calendar_events) + total_comments_count
                 )
                 
@@ -2110,18 +2420,18 @@ async def get_all_managers_activity(days: int = 30, include_inactive: bool = Tru
                         end_date=end_date,
                         days=days,
                         calls_total=calls_total,
-                        calls_incoming=calls_incoming,
-                        calls_outgoing=calls_outgoing,
-                        calls_missed=calls_missed,
+                        calls_incoming=manager_data['calls_incoming'],
+                        calls_outgoing=manager_data['calls_outgoing'],
+                        calls_missed=manager_data['calls_missed'],
                         meetings=meetings,
                         emails=emails,
-                        tasks=tasks,
-                        tasks_completed=tasks_completed,
-                        tasks_in_progress=tasks_in_progress,
-                        deals=deals,
-                        deals_won=deals_won,
-                        leads=leads,
-                        leads_converted=leads_converted,
+                        tasks_count=tasks_count,
+                        tasks_completed=manager_data['tasks_completed'],
+                        tasks_in_progress=manager_data['tasks_in_progress'],
+                        deals_count=deals_count,
+                        deals_won=manager_data['deals_won'],
+                        leads_count=leads_count,
+                        leads_converted=manager_data['leads_converted'],
                         calendar_events=calendar_events,
                         calendar_meetings=calendar_meetings,
                         deal_comments=deal_comments,
@@ -2137,9 +2447,9 @@ async def get_all_managers_activity(days: int = 30, include_inactive: bool = Tru
                     total_calls += calls_total
                     total_meetings += meetings
                     total_emails += emails
-                    total_tasks += len(tasks)
-                    total_deals += len(deals)
-                    total_leads += len(leads)
+                    total_tasks += tasks_count
+                    total_deals += deals_count
+                    total_leads += leads_count
                     total_comments += total_comments_count
                 
             except Exception as e:
@@ -2195,14 +2505,22 @@ async def get_all_managers_activity(days: int = 30, include_inactive: bool = Tru
             }
             logger.info(f"Активность всех менеджеров собрана: {len(managers_activity)} активных, {len(inactive_managers)} неактивных")
         
-        # Сохраняем в кэш
-        _save_to_cache(cache_key, result)
+        # Отчет без недоступных разделов возвращается, но не кэшируется
+        unavailable_sections = _unavailable_sections(unavailable_methods)
+        if unavailable_sections:
+            result['unavailable_sections'] = unavailable_sections
+            logger.warning(f"Активность всех менеджеров собрана без разделов {unavailable_sections}: предохранители разомкнуты")
+        else:
+            cache.set(cache_key, result, lease=lease)
         
         return result
         
     except Exception as e:
         logger.error(f"Ошибка при получении активности всех менеджеров: {e}")
         raise
+    finally:
+        if lease is not None:
+            cache.release(lease)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,225 @@
+"""
+Предохранители (circuit breaker) по методам REST API Bitrix24 и деградированный режим инструментов
+
+Когда один метод портала перестает отвечать (например, `calendar.event.get` или `crm.timeline.comment.list`
+отдают 5xx или таймауты), каждый вызов этого метода расходует весь бюджет повторов (`hedging.RetryPolicy`)
+и задерживает отчет, хотя остальные разделы отчета уже готовы. Предохранитель считает неудачи по каждому
+методу отдельно:
+- closed — вызовы проходят; после `failure_threshold` неудач подряд (BITRIX_BREAKER_THRESHOLD, по умолчанию 5)
+  предохранитель размыкается;
+- open — вызовы метода сразу завершаются `CircuitOpenError` без запроса к порталу;
+- half-open — через `reset_timeout` секунд (BITRIX_BREAKER_RESET, по умолчанию 30) проходит один пробный
+  вызов: успех замыкает предохранитель, неудача снова размыкает его.
+
+Неудача — исчерпанные повторы (RuntimeError fast_bitrix24), ошибки соединения, таймауты и HTTP 5xx, а в
+batch-запросах микробатчера (microbatch.py) — ошибки команды из `SERVER_ERROR_CODES`. Ответ портала с
+другой ошибкой (неверные параметры, нет доступа) считается ответом метода.
+
+Инструмент, которому не нужен весь отчет целиком, перехватывает `CircuitOpenError` (или неудачу вызова) и
+возвращает раздел пустым, а внутри `collect_unavailable()` получает множество методов, вызовы которых были
+отклонены или не выполнены (`mark_unavailable`), — по нему раздел отмечается в результате как недоступный. BITRIX_BREAKER=0 отключает предохранители.
+"""
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from loguru import logger
+
+# Ошибки команд batch-запроса, которые говорят о сбое метода на стороне портала
+SERVER_ERROR_CODES = ('INTERNAL_SERVER_ERROR', 'ERROR_UNEXPECTED_ANSWER', 'QUERY_LIMIT_EXCEEDED', 'OPERATION_TIME_LIMIT')
+
+# Исключения запроса, которые считаются неудачей метода (см. failure_errors)
+_failure_errors: Optional[tuple] = None
+
+
+def failure_errors() -> tuple:
+    """Исключения запроса, которые считаются неудачей метода; fast_bitrix24 загружается при первом вызове"""
+    global _failure_errors
+    if _failure_errors is None:
+        from fast_bitrix24.srh import RETRIED_ERRORS
+
+        _failure_errors = (RuntimeError, *RETRIED_ERRORS)
+    return _failure_errors
+
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+# Методы, вызовы которых отклонены в текущей задаче (см. collect_unavailable)
+_unavailable: ContextVar[Optional[set]] = ContextVar('bitrix_unavailable_methods', default=None)
+
+
+class CircuitOpenError(Exception):
+    """Вызов метода отклонен: предохранитель метода разомкнут"""
+
+    def __init__(self, method: str, retry_after: float):
+        self.method = method
+        self.retry_after = retry_after
+        super().__init__(f"Метод {method} временно недоступен (предохранитель разомкнут, повтор через {retry_after:.0f} с)")
+
+
+class CircuitBreaker:
+    """Состояние предохранителя одного метода"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_at = 0.0
+
+    def allow(self) -> bool:
+        """Можно ли выполнить вызов (в half-open — только один пробный вызов)"""
+        now = time.monotonic()
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self.probe_at = now
+            return True
+        # Пробный вызов, который не вернул результат (отменен), не держит метод закрытым дольше reset_timeout
+        if self.state == HALF_OPEN and now - self.probe_at >= self.reset_timeout:
+            self.probe_at = now
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def success(self) -> bool:
+        """Учитывает ответ метода; True, если предохранитель замкнулся"""
+        recovered = self.state != CLOSED
+        self.state = CLOSED
+        self.failures = 0
+        return recovered
+
+    def failure(self) -> bool:
+        """Учитывает неудачу; True, если предохранитель разомкнулся"""
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+
+class BreakerRegistry:
+    """Предохранители всех методов процесса"""
+
+    def __init__(self, enabled: bool = True, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.enabled = enabled
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.stats = {'opened': 0, 'closed': 0, 'failures': 0, 'short_circuits': Counter()}
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def breaker(self, method: str) -> CircuitBreaker:
+        method = method.strip().lower()
+        if method not in self._breakers:
+            self._breakers[method] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return self._breakers[method]
+
+    def check(self, method: str) -> None:
+        """Поднимает CircuitOpenError, если предохранитель метода разомкнут"""
+        if not self.enabled:
+            return
+        breaker = self.breaker(method)
+        if breaker.allow():
+            return
+        method = method.strip().lower()
+        self.stats['short_circuits'][method] += 1
+        mark_unavailable(method)
+        raise CircuitOpenError(method, breaker.retry_after())
+
+    def record_success(self, method: str) -> None:
+        if self.enabled and self.breaker(method).success():
+            self.stats['closed'] += 1
+            logger.info(f"Предохранитель метода {method} замкнут: метод снова отвечает")
+
+    def record_failure(self, method: str, error: object = None) -> None:
+        if not self.enabled:
+            return
+        self.stats['failures'] += 1
+        if self.breaker(method).failure():
+            self.stats['opened'] += 1
+            logger.warning(f"Предохранитель метода {method} разомкнут на {self.reset_timeout:.0f} с "
+                           f"после {self.breaker(method).failures} неудач подряд: {error!r}")
+
+    def reset(self) -> None:
+        """Замыкает все предохранители и обнуляет счетчики"""
+        self.stats = {'opened': 0, 'closed': 0, 'failures': 0, 'short_circuits': Counter()}
+        self._breakers.clear()
+
+    def snapshot(self) -> dict:
+        return {
+            'opened': self.stats['opened'],
+            'closed': self.stats['closed'],
+            'failures': self.stats['failures'],
+            'short_circuits': dict(self.stats['short_circuits']),
+            'open_methods': sorted(method for method, breaker in self._breakers.items() if breaker.state != CLOSED),
+        }
+
+
+def mark_unavailable(method: str) -> None:
+    """Отмечает метод недоступным в текущем collect_unavailable() (вне блока ничего не делает)"""
+    unavailable = _unavailable.get()
+    if unavailable is not None:
+        unavailable.add(method.strip().lower())
+
+
+@contextmanager
+def collect_unavailable() -> Iterator[set]:
+    """
+    Собирает методы, вызовы которых были отклонены предохранителями внутри блока
+
+    Задачи asyncio, созданные внутри блока (`asyncio.gather`), пишут в то же множество.
+    """
+    methods: set = set()
+    token = _unavailable.set(methods)
+    try:
+        yield methods
+    finally:
+        _unavailable.reset(token)
+
+
+def install_circuit_breaker(bit, breakers: BreakerRegistry) -> None:
+    """
+    Оборачивает `srh.single_request` клиента проверкой предохранителя метода
+
+    Ставится поверх бюджета повторов (`hedging.install_retry_policy`): неудача — это запрос, исчерпавший
+    повторы. Запросы `batch` проверяются по командам в микробатчере.
+    """
+    srh = bit.srh
+    single_request = srh.single_request
+
+    async def guarded_request(method: str, params=None) -> dict:
+        name = method.strip().lower()
+        if name == 'batch':
+            return await single_request(method, params)
+
+        breakers.check(name)
+        try:
+            result = await single_request(method, params)
+        except failure_errors() as err:
+            breakers.record_failure(name, err)
+            raise
+        except Exception:
+            # Портал ответил ошибкой запроса — метод доступен
+            breakers.record_success(name)
+            raise
+        breakers.record_success(name)
+        return result
+
+    srh.single_request = guarded_request
+
+
+def create_breakers_from_env() -> BreakerRegistry:
+    """Предохранители по переменным окружения (BITRIX_BREAKER, BITRIX_BREAKER_THRESHOLD, BITRIX_BREAKER_RESET)"""
+    return BreakerRegistry(
+        enabled=os.getenv('BITRIX_BREAKER', '1').strip().lower() in ('1', 'true', 'yes'),
+        failure_threshold=int(os.getenv('BITRIX_BREAKER_THRESHOLD', '5')),
+        reset_timeout=float(os.getenv('BITRIX_BREAKER_RESET', '30')),
+    )
@@ -0,0 +1,602 @@
+"""
+Двухуровневый кэш результатов: LRU в памяти процесса + файлы на диске
+
+Раньше `bitrixWork.py` и `helper.py` держали по своей копии `_load_from_cache`/`_save_to_cache`: каждый
+результат писался в `cache/` JSON с отступами, каждое попадание заново разбирало весь файл (список
+активностей на 50 МБ — полный `json.load` на каждый вызов), а файлы удалялись только при чтении после TTL.
+`TieredCache` объединяет оба кэша:
+- память — LRU по размеру значений в байтах (BITRIX_CACHE_MEMORY_MB, по умолчанию 64): попадание не
+  читает диск и не разбирает JSON;
+- диск — файлы `<ключ>.cache` в BITRIX_CACHE_DIR (по умолчанию `cache`) с ограничением суммарного размера
+  (BITRIX_CACHE_DISK_MB, по умолчанию 1024) и вытеснением давно не читанных файлов (время последнего
+  чтения — mtime файла, поэтому порядок переживает перезапуск). Попадание на диске поднимает значение в память;
+- TTL по пространству ключа (ключ без хэша параметров: `crm_activities`, `comments_deal`, `export_deal`):
+  `DEFAULT_TTLS` по самому длинному совпадающему префиксу, остальное — BITRIX_CACHE_TTL (3600 с);
+  переопределения — BITRIX_CACHE_TTLS=`crm_activities=300,comments=900`.
+
+Значение в памяти общее для всех вызовов, поэтому `get` возвращает копию строк (`singleflight.copy_rows`),
+а `set` сохраняет копию: вызывающий код дополняет словари результата. Формат файла (сериализатор, сжатие
+и версия в заголовке) — `cache_codec.py`, BITRIX_CACHE_FORMAT (по умолчанию `auto`); JSON-файлы
+`<ключ>.json` прежних версий читаются и заменяются при следующей записи ключа.
+
+Защита от одновременного пересчета (cache stampede): `get_or_lock` при промахе выдает право пересчета
+(`CacheLease`) одному вызову — он держит асинхронную блокировку ключа и файловую блокировку байта
+`<каталог>/.lock` со смещением по md5 ключа (`LOCK_STRIPES` полос в одном файле, ее ждут и другие
+процессы с тем же каталогом кэша; открытие файла и попытки блокировки выполняются в потоке), пока не передаст право в
+`set(..., lease=...)` или `release(lease)`. Отдать право может только его держатель: вызов, получивший
+значение (в том числе устаревшее), права не получает и ничего не отдает. Остальные вызовы ждут и получают
+сохраненное значение; если пересчет не сохранил значение (ошибка, неполный отчет), право переходит
+следующему ожидающему. Файловую блокировку ждут не дольше BITRIX_CACHE_LOCK_TIMEOUT
+(по умолчанию 300 с), после этого значение пересчитывается без нее.
+
+Устаревшее значение тяжелых отчетов (stale-while-revalidate, пространства `STALE_NAMESPACES`:
+`all_managers_activity`, `manager_full_activity`, `comments`): вызов `get_or_lock(..., refresh=...)` после
+TTL, но не позже BITRIX_CACHE_MAX_STALE секунд сверх него (по умолчанию 6 часов), сразу получает прежнее
+значение без изменений и его возраст третьим элементом ответа, а `refresh()` пересчитывает
+его фоновой задачей с фоновым приоритетом запросов (`operating.background()`). Устаревшее значение
+отдается без права пересчета: блокировку ключа держит фоновая задача, и вызов ее не снимает. Старше этого значение
+не отдается, и пересчет выполняется синхронно. BITRIX_CACHE_MAX_STALE=0 отключает режим.
+"""
+import asyncio
+import contextvars
+import errno
+import hashlib
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки только внутри процесса
+    fcntl = None
+
+from loguru import logger
+
+from . import metrics, tracing
+from .cache_codec import CacheCodec, resolve_codec
+from .operating import background
+from .singleflight import copy_rows
+
+DEFAULT_TTL = 3600
+
+# TTL по пространствам ключей, секунды: активности меняются быстрее отчетов и выгрузок
+DEFAULT_TTLS = {
+    'crm_activities': 900,
+    'comments': 1800,
+    'calendar_events': 1800,
+    # Списки с инкрементальной синхронизацией (delta.py): TTL — срок до полной выборки
+    'delta': 24 * 3600,
+}
+
+# Пространства, устаревшие значения которых отдаются во время фонового пересчета, и предел устаревания, секунды
+STALE_NAMESPACES = ('all_managers_activity', 'manager_full_activity', 'comments')
+MAX_STALE = 6 * 3600
+
+# Поле отчета-словаря с возрастом устаревшего значения, секунды (добавляют сами отчеты, см. get_or_lock)
+STALE_AGE_FIELD = 'cache_age_seconds'
+
+MEMORY_LIMIT_MB = 64
+DISK_LIMIT_MB = 1024
+
+# Файлы значений: текущий формат и JSON прежних версий
+CACHE_SUFFIX = '.cache'
+LEGACY_SUFFIX = '.json'
+
+# Ожидание файловой блокировки ключа: предел и интервал проверки, секунды
+LOCK_TIMEOUT = 300.0
+LOCK_POLL_INTERVAL = 0.1
+
+# Файловые блокировки ключей — байты одного файла каталога кэша: смещение — md5 ключа по модулю числа полос
+LOCK_FILE = '.lock'
+LOCK_STRIPES = 4096
+
+# Ключ, который пересчитывает текущая фоновая задача (ей устаревшее значение не отдается)
+_refreshing: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('bitrix_cache_refreshing', default=None)
+
+
+class _Entry:
+    __slots__ = ('value', 'size', 'cached_at', 'namespace')
+
+    def __init__(self, value: Any, size: int, cached_at: float, namespace: str):
+        self.value = value
+        self.size = size
+        self.cached_at = cached_at
+        self.namespace = namespace
+
+
+class _KeyLock:
+    """Блокировка ключа внутри процесса и число вызовов, которые ее держат или ждут"""
+
+    __slots__ = ('lock', 'users')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class CacheLease:
+    """Право пересчета ключа, выданное `get_or_lock`: блокировка ключа и полоса файловой блокировки"""
+
+    __slots__ = ('key', 'lock_key', 'key_lock', 'stripe', 'active')
+
+    def __init__(self, key: str, lock_key: tuple[int, str], key_lock: _KeyLock, stripe: Optional[int]):
+        self.key = key
+        self.lock_key = lock_key
+        self.key_lock = key_lock
+        self.stripe = stripe
+        self.active = True
+
+
+class TieredCache:
+    """Кэш результатов: LRU в памяти по байтам и файлы на диске с ограничением размера"""
+
+    def __init__(self, directory: str = 'cache', memory_bytes: int = MEMORY_LIMIT_MB << 20,
+                 disk_bytes: int = DISK_LIMIT_MB << 20, default_ttl: float = DEFAULT_TTL,
+                 ttls: Optional[dict] = None, lock_timeout: float = LOCK_TIMEOUT, max_stale: float = MAX_STALE,
+                 stale_namespaces: tuple = STALE_NAMESPACES, codec: Optional[CacheCodec] = None):
+        self.directory = Path(directory)
+        self.codec = codec or resolve_codec()
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.default_ttl = default_ttl
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.lock_timeout = lock_timeout
+        self.max_stale = max_stale
+        self.stale_namespaces = tuple(stale_namespaces)
+        self.stats = {'requests': Counter(), 'evictions': Counter(), 'lock_waits': 0, 'coalesced': 0, 'revalidations': 0}
+        self._memory: OrderedDict[str, _Entry] = OrderedDict()
+        self._memory_used = 0
+        # Файлы на диске: ключ -> размер, давно читанные в начале; строится при первом обращении
+        self._disk: Optional[OrderedDict[str, int]] = None
+        self._disk_used = 0
+        # Блокировки ключей: (id цикла событий, ключ) -> блокировка
+        self._locks: dict[tuple[int, str], _KeyLock] = {}
+        # Файл блокировок и число прав процесса на полосу: блокировки lockf принадлежат процессу, поэтому
+        # полоса снимается, когда ее отдает последнее право (дескриптор не закрывается — это сняло бы все)
+        self._lock_fd: Optional[int] = None
+        self._stripes: Counter = Counter()
+        self._stripes_guard = threading.Lock()
+        # Фоновые пересчеты устаревших значений: ключ -> задача
+        self._refreshes: dict[str, asyncio.Task] = {}
+        # Изменения данных на портале (события, см. events.py): префикс ключей -> время изменения
+        self._changed: dict[str, float] = {}
+
+    def ttl(self, namespace: str) -> float:
+        """TTL пространства ключей по самому длинному совпадающему префиксу"""
+        matches = [prefix for prefix in self.ttls if namespace == prefix or namespace.startswith(prefix + '_')]
+        return self.ttls[max(matches, key=len)] if matches else self.default_ttl
+
+    def stale_limit(self, namespace: str) -> float:
+        """Сколько секунд сверх TTL значение пространства может отдаваться устаревшим"""
+        if any(namespace == prefix or namespace.startswith(prefix + '_') for prefix in self.stale_namespaces):
+            return self.max_stale
+        return 0.0
+
+    def _path(self, key: str, suffix: str = CACHE_SUFFIX) -> Path:
+        return self.directory / f"{key}{suffix}"
+
+    def _count(self, namespace: str, result: str) -> None:
+        self.stats['requests'][(namespace, result)] += 1
+        if result in ('memory', 'disk', 'stale'):
+            metrics.record_cache(namespace, hit=True)
+            metrics.cache_tier_hits.inc(tier=result)
+            tracing.set_attribute('cache', 'hit')
+            tracing.set_attribute('cache_tier', result)
+        else:
+            metrics.record_cache(namespace, hit=False)
+            tracing.set_attribute('cache', result)
+
+    # === ПАМЯТЬ ===
+
+    def _remember(self, key: str, entry: _Entry) -> None:
+        self._forget(key)
+        if entry.size > self.memory_bytes:
+            return
+        self._memory[key] = entry
+        self._memory_used += entry.size
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= evicted.size
+            self.stats['evictions']['memory'] += 1
+            metrics.cache_evictions.inc(tier='memory')
+        metrics.cache_bytes.set(self._memory_used, tier='memory')
+
+    def _forget(self, key: str) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_used -= entry.size
+            metrics.cache_bytes.set(self._memory_used, tier='memory')
+
+    # === ДИСК ===
+
+    def _disk_index(self) -> OrderedDict:
+        if self._disk is None:
+            files = []
+            if self.directory.is_dir():
+                for suffix in (CACHE_SUFFIX, LEGACY_SUFFIX):
+                    for path in self.directory.glob(f'*{suffix}'):
+                        try:
+                            stat = path.stat()
+                        except OSError:
+                            continue
+                        files.append((stat.st_mtime, path.stem, stat.st_size))
+            self._disk = OrderedDict()
+            for _, key, size in sorted(files):
+                self._disk[key] = self._disk.pop(key, 0) + size
+            self._disk_used = sum(self._disk.values())
+            metrics.cache_bytes.set(self._disk_used, tier='disk')
+        return self._disk
+
+    def _unlink(self, key: str) -> None:
+        index = self._disk_index()
+        self._disk_used -= index.pop(key, 0)
+        for suffix in (CACHE_SUFFIX, LEGACY_SUFFIX):
+            try:
+                self._path(key, suffix).unlink()
+            except FileNotFoundError:
+                pass
+        metrics.cache_bytes.set(self._disk_used, tier='disk')
+
+    def _evict_disk(self, keep: str) -> None:
+        index = self._disk_index()
+        for key in list(index):
+            if self._disk_used <= self.disk_bytes:
+                break
+            if key == keep:
+                continue
+            self._unlink(key)
+            self.stats['evictions']['disk'] += 1
+            metrics.cache_evictions.inc(tier='disk')
+
+    def _read_disk(self, key: str, namespace: str) -> Optional[_Entry]:
+        for suffix in (CACHE_SUFFIX, LEGACY_SUFFIX):
+            path = self._path(key, suffix)
+            try:
+                raw = path.read_bytes()
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            self._disk_used -= self._disk_index().pop(key, 0)
+            return None
+        cached_at, data, size = self.codec.decode(raw)
+        index = self._disk_index()
+        if key not in index:
+            # Файл записан другим процессом
+            index[key] = len(raw)
+            self._disk_used += len(raw)
+        index.move_to_end(key)
+        os.utime(path)
+        return _Entry(data, size, cached_at, namespace)
+
+    # === БЛОКИРОВКИ ===
+
+    @staticmethod
+    def _stripe(key: str) -> int:
+        # md5, а не hash(): hash строк случаен в каждом процессе
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:8], 16) % LOCK_STRIPES
+
+    def _try_lock_stripe(self, stripe: int) -> bool:
+        """Блокирует полосу без ожидания (выполняется в потоке): False — полосу держит другой процесс"""
+        with self._stripes_guard:
+            if not self._stripes[stripe]:
+                if self._lock_fd is None:
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    self._lock_fd = os.open(self.directory / LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.lockf(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, stripe)
+                except OSError as e:
+                    if e.errno in (errno.EACCES, errno.EAGAIN):
+                        return False
+                    raise
+            self._stripes[stripe] += 1
+            return True
+
+    def _unlock_stripe(self, stripe: Optional[int]) -> None:
+        if stripe is None:
+            return
+        with self._stripes_guard:
+            self._stripes[stripe] -= 1
+            if not self._stripes[stripe]:
+                del self._stripes[stripe]
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, stripe)
+
+    async def _lock_file(self, key: str) -> Optional[int]:
+        """Файловая блокировка ключа для процессов с общим каталогом кэша: полоса или None — без блокировки"""
+        if fcntl is None:
+            return None
+        stripe = self._stripe(key)
+        waited = 0.0
+        while True:
+            attempt = asyncio.ensure_future(asyncio.to_thread(self._try_lock_stripe, stripe))
+            try:
+                locked = await asyncio.shield(attempt)
+            except asyncio.CancelledError:
+                # Попытка в потоке завершится и без нас: полученную полосу сразу отдаем
+                def drop(done: asyncio.Future) -> None:
+                    if not done.cancelled() and done.exception() is None and done.result():
+                        self._unlock_stripe(stripe)
+
+                attempt.add_done_callback(drop)
+                raise
+            if locked:
+                return stripe
+            if waited >= self.lock_timeout:
+                logger.warning(f"Кэш {key} пересчитывается другим процессом дольше {self.lock_timeout:.0f} с, "
+                               f"пересчитываем без блокировки")
+                return None
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            waited += LOCK_POLL_INTERVAL
+
+    def _key_lock(self, key: str) -> tuple[tuple[int, str], _KeyLock]:
+        lock_key = (id(asyncio.get_running_loop()), key)
+        if lock_key not in self._locks:
+            self._locks[lock_key] = _KeyLock()
+        return lock_key, self._locks[lock_key]
+
+    def _drop_user(self, lock_key: tuple[int, str], key_lock: _KeyLock) -> None:
+        key_lock.users -= 1
+        if key_lock.users == 0 and self._locks.get(lock_key) is key_lock:
+            del self._locks[lock_key]
+
+    async def get_or_lock(
+        self, key: str, namespace: Optional[str] = None, refresh: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> tuple[Optional[Any], Optional[CacheLease], Optional[int]]:
+        """
+        Значение по ключу или право его пересчитать
+
+        При промахе возвращает право пересчета: вызывающий держит блокировку ключа, пока не передаст право
+        в `set(..., lease=lease)` или `release(lease)` (вызов `release` в `finally` обязателен). Одновременные
+        вызовы с тем же ключом ждут и получают сохраненное значение без права.
+
+        Args:
+            key: Ключ кэша (`<пространство>_<md5 параметров>`)
+            namespace: Пространство ключа (по умолчанию — ключ без хэша)
+            refresh: Пересчет значения (обычно повторный вызов той же функции); с ним устаревшее значение
+                пространства из `STALE_NAMESPACES` отдается сразу (без права пересчета), а `refresh()`
+                выполняется фоновой задачей
+
+        Returns:
+            (копия строк значения, None, возраст устаревшего значения в секундах или None)
+            или (None, право пересчета, None)
+        """
+        namespace = namespace or metrics.cache_namespace(key)
+        value, result, age = self._lookup(key, namespace, stale=refresh is not None and _refreshing.get() != key)
+        if value is not None:
+            if result == 'stale':
+                self._revalidate(key, refresh)
+            self._count(namespace, result)
+            return value, None, age
+
+        lock_key, key_lock = self._key_lock(key)
+        key_lock.users += 1
+        try:
+            if key_lock.lock.locked():
+                self.stats['lock_waits'] += 1
+                logger.info(f"Кэш {key} уже пересчитывается, ожидаем результат")
+            await key_lock.lock.acquire()
+        except BaseException:
+            self._drop_user(lock_key, key_lock)
+            raise
+
+        try:
+            value, retry_result, _ = self._lookup(key, namespace)
+            stripe = None
+            if value is None:
+                stripe = await self._lock_file(key)
+                # Значение мог сохранить другой процесс, пока мы ждали файловую блокировку
+                value, retry_result, _ = self._lookup(key, namespace)
+        except BaseException:
+            key_lock.lock.release()
+            self._drop_user(lock_key, key_lock)
+            raise
+
+        if value is not None:
+            self._unlock_stripe(stripe)
+            key_lock.lock.release()
+            self._drop_user(lock_key, key_lock)
+            self.stats['coalesced'] += 1
+            self._count(namespace, retry_result)
+            return value, None, None
+
+        self._count(namespace, result)
+        return None, CacheLease(key, lock_key, key_lock, stripe), None
+
+    def _revalidate(self, key: str, refresh: Callable[[], Awaitable[Any]]) -> None:
+        """Запускает фоновый пересчет устаревшего значения, если он еще не идет"""
+        if key in self._refreshes:
+            return
+        self.stats['revalidations'] += 1
+        # Новый контекст: пересчет не продолжает спан и сбор недоступных разделов вызова, который его запустил
+        task = asyncio.create_task(self._refresh(key, refresh), context=contextvars.Context())
+        self._refreshes[key] = task
+        task.add_done_callback(lambda done: self._refreshes.pop(key, None))
+
+    @staticmethod
+    async def _refresh(key: str, refresh: Callable[[], Awaitable[Any]]) -> None:
+        _refreshing.set(key)
+        logger.info(f"Фоновый пересчет устаревшего кэша {key}")
+        try:
+            with background():
+                await refresh()
+        except Exception as e:
+            logger.warning(f"Фоновый пересчет кэша {key} не выполнен: {e}")
+
+    def release(self, lease: Optional[CacheLease]) -> None:
+        """Отдает право пересчета ключа (None или уже отданное право — ничего не делает)"""
+        if lease is None or not lease.active:
+            return
+        lease.active = False
+        self._unlock_stripe(lease.stripe)
+        lease.stripe = None
+        lease.key_lock.lock.release()
+        self._drop_user(lease.lock_key, lease.key_lock)
+
+    # === ИНТЕРФЕЙС ===
+
+    def get(self, key: str, namespace: Optional[str] = None) -> Optional[Any]:
+        """
+        Значение по ключу, если оно не устарело
+
+        Args:
+            key: Ключ кэша (`<пространство>_<md5 параметров>`)
+            namespace: Пространство ключа (по умолчанию — ключ без хэша)
+
+        Returns:
+            Копия строк значения или None
+        """
+        namespace = namespace or metrics.cache_namespace(key)
+        value, result, _ = self._lookup(key, namespace)
+        self._count(namespace, result)
+        return value
+
+    def _lookup(self, key: str, namespace: str, stale: bool = False) -> tuple[Optional[Any], str, Optional[int]]:
+        """
+        Значение, результат обращения (`memory`, `disk`, `stale`, `miss`, `expired`) без учета в счетчиках и
+        возраст устаревшего значения
+
+        Устаревшее значение в пределах `stale_limit` остается в кэше и возвращается только при `stale`.
+        """
+        ttl = self.ttl(namespace)
+        now = time.time()
+
+        entry = self._memory.get(key)
+        tier = 'memory'
+        if entry is None:
+            tier = 'disk'
+            try:
+                entry = self._read_disk(key, namespace)
+            except Exception as e:
+                logger.warning(f"Ошибка при чтении кэша {key}: {e}")
+                return None, 'miss', None
+            if entry is None:
+                return None, 'miss', None
+
+        age = now - entry.cached_at
+        # Значение, сохраненное до изменения его данных на портале, устарело независимо от TTL
+        changed = entry.cached_at < self._changed_at(key)
+        if age > ttl + self.stale_limit(namespace) or (changed and not self.stale_limit(namespace)):
+            logger.info(f"Кэш для ключа {key} устарел (возраст: {age:.0f} сек, TTL {ttl:.0f} сек), удаляем")
+            self.invalidate(key)
+            return None, 'expired', None
+        if (age > ttl or changed) and not stale:
+            return None, 'expired', None
+
+        if tier == 'disk':
+            self._remember(key, entry)
+        else:
+            self._memory.move_to_end(key)
+        value = copy_rows(entry.value)
+        if age > ttl or changed:
+            logger.info(f"Используем устаревший кэш для ключа {key} (возраст: {age:.0f} сек, TTL {ttl:.0f} сек)")
+            return value, 'stale', round(age)
+        logger.info(f"Используем кэш для ключа {key} ({tier}, возраст: {age:.0f} сек)")
+        return value, tier, None
+
+    def set(self, key: str, data: Any, namespace: Optional[str] = None, lease: Optional[CacheLease] = None) -> None:
+        """Сохраняет значение в памяти и на диске и отдает право пересчета `lease`, если оно передано"""
+        namespace = namespace or metrics.cache_namespace(key)
+        now = time.time()
+        try:
+            self._store(key, data, namespace, now)
+        finally:
+            self.release(lease)
+
+    def _store(self, key: str, data: Any, namespace: str, now: float) -> None:
+        try:
+            raw, size = self.codec.encode(now, data)
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(key)
+            # Запись во временный файл и переименование: читатель не увидит половину файла
+            temporary = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+            temporary.write_bytes(raw)
+            os.replace(temporary, path)
+            self._path(key, LEGACY_SUFFIX).unlink(missing_ok=True)
+        except Exception as e:
+            logger.warning(f"Ошибка при сохранении кэша {key}: {e}")
+            return
+
+        index = self._disk_index()
+        self._disk_used += len(raw) - index.pop(key, 0)
+        index[key] = len(raw)
+        self._evict_disk(keep=key)
+        metrics.cache_bytes.set(self._disk_used, tier='disk')
+        self._remember(key, _Entry(copy_rows(data), size, now, namespace))
+        logger.info(f"Данные сохранены в кэш для ключа {key}")
+
+    def invalidate(self, key: str) -> None:
+        """Удаляет значение из памяти и с диска"""
+        self._forget(key)
+        self._unlink(key)
+
+    def _changed_at(self, key: str) -> float:
+        return max((changed for prefix, changed in self._changed.items()
+                    if key == prefix or key.startswith(prefix + '_')), default=0.0)
+
+    def expire(self, *prefixes: str) -> None:
+        """
+        Значения ключей с префиксами, сохраненные до этого момента, устаревают (данные изменились на портале)
+
+        Значения пространств stale-while-revalidate отдаются как устаревшие с фоновым пересчетом, остальные
+        удаляются при следующем чтении. Отметка хранится в памяти процесса.
+        """
+        now = time.time()
+        for prefix in prefixes:
+            self._changed[prefix] = now
+
+    def clear(self) -> None:
+        """Очищает оба уровня и счетчики, отменяет фоновые пересчеты"""
+        for task in self._refreshes.values():
+            task.cancel()
+        self._refreshes.clear()
+        self._changed.clear()
+        for key in list(self._disk_index()):
+            self._unlink(key)
+        self._memory.clear()
+        self._memory_used = 0
+        metrics.cache_bytes.set(0, tier='memory')
+        self.stats = {'requests': Counter(), 'evictions': Counter(), 'lock_waits': 0, 'coalesced': 0, 'revalidations': 0}
+
+    def snapshot(self) -> dict:
+        results = Counter()
+        for (_, result), count in self.stats['requests'].items():
+            results[result] += count
+        return {
+            **{result: results[result] for result in ('memory', 'disk', 'stale', 'miss', 'expired')},
+            'evictions': dict(self.stats['evictions']),
+            'lock_waits': self.stats['lock_waits'],
+            'coalesced': self.stats['coalesced'],
+            'revalidations': self.stats['revalidations'],
+            'memory_bytes': self._memory_used,
+            'memory_entries': len(self._memory),
+            'disk_bytes': self._disk_used,
+            'format': self.codec.name,
+        }
+
+
+def _parse_ttls(value: str) -> dict:
+    """`crm_activities=300,comments=900` -> {'crm_activities': 300.0, 'comments': 900.0}"""
+    ttls = {}
+    for item in value.split(','):
+        if '=' in item:
+            namespace, seconds = item.split('=', 1)
+            ttls[namespace.strip()] = float(seconds)
+    return ttls
+
+
+def create_cache_from_env() -> TieredCache:
+    """Кэш по переменным окружения (BITRIX_CACHE_DIR, BITRIX_CACHE_MEMORY_MB, BITRIX_CACHE_DISK_MB,
+    BITRIX_CACHE_TTL, BITRIX_CACHE_TTLS, BITRIX_CACHE_LOCK_TIMEOUT, BITRIX_CACHE_MAX_STALE, BITRIX_CACHE_FORMAT)"""
+    return TieredCache(
+        directory=os.getenv('BITRIX_CACHE_DIR', 'cache'),
+        memory_bytes=int(float(os.getenv('BITRIX_CACHE_MEMORY_MB', str(MEMORY_LIMIT_MB))) * (1 << 20)),
+        disk_bytes=int(float(os.getenv('BITRIX_CACHE_DISK_MB', str(DISK_LIMIT_MB))) * (1 << 20)),
+        default_ttl=float(os.getenv('BITRIX_CACHE_TTL', str(DEFAULT_TTL))),
+        ttls=_parse_ttls(os.getenv('BITRIX_CACHE_TTLS', '')),
+        lock_timeout=float(os.getenv('BITRIX_CACHE_LOCK_TIMEOUT', str(LOCK_TIMEOUT))),
+        max_stale=float(os.getenv('BITRIX_CACHE_MAX_STALE', str(MAX_STALE))),
+        codec=resolve_codec(os.getenv('BITRIX_CACHE_FORMAT', 'auto')),
+    )
@@ -0,0 +1,196 @@
+"""
+Формат файлов дискового уровня кэша результатов (cache.py): сериализатор, сжатие и версия формата
+
+Файл — заголовок `MAGIC` + версия формата + коды сериализатора и сжатия, затем сжатая запись
+`{"cached_at": <unix time>, "data": <значение>}`. Заголовок описывает сам файл, поэтому смена
+BITRIX_CACHE_FORMAT не делает старые файлы нечитаемыми: каждый файл разбирается своим сериализатором.
+Файлы без заголовка — JSON прежних версий (`cached_at` в ISO-формате).
+
+Сериализаторы: `json` (стандартная библиотека, компактный), `orjson` и `msgpack` (необязательные пакеты).
+Сжатие: `none`, `zlib` (стандартная библиотека), `zstd` (`compression.zstd` Python 3.14 или пакет
+`zstandard`) и `lz4` (пакет `lz4`). BITRIX_CACHE_FORMAT=`<сериализатор>+<сжатие>` (`msgpack+zstd`,
+`json+zlib`, `json`), по умолчанию `auto` — самые быстрые из установленных. Новые сериализаторы и
+алгоритмы сжатия подключаются `register_serializer`/`register_compression` с неиспользованным кодом.
+
+Сравнение форматов на списке активностей: `python -m benchmarks.cache_formats`.
+"""
+import json
+import struct
+from datetime import datetime
+from typing import Any, Callable, NamedTuple, Optional
+
+from loguru import logger
+
+MAGIC = b'BXC'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('>3sBBB')
+
+# Коды в заголовке файла не меняются: по ним читаются файлы, записанные с другими настройками
+SERIALIZER_CODES = {'json': 1, 'orjson': 2, 'msgpack': 3}
+COMPRESSION_CODES = {'none': 0, 'zlib': 1, 'zstd': 2, 'lz4': 3}
+
+# Порядок выбора для `auto`: первые из установленных
+AUTO_SERIALIZERS = ('msgpack', 'orjson', 'json')
+AUTO_COMPRESSIONS = ('zstd', 'lz4', 'zlib')
+
+
+class CacheFormatError(ValueError):
+    """Файл кэша записан в неизвестном формате или нужная библиотека не установлена"""
+
+
+class Codec(NamedTuple):
+    """Сериализатор или алгоритм сжатия: код в заголовке и функции преобразования байтов"""
+    name: str
+    code: int
+    encode: Callable[[Any], bytes]
+    decode: Callable[[bytes], Any]
+
+
+SERIALIZERS: dict[str, Codec] = {}
+COMPRESSIONS: dict[str, Codec] = {}
+
+
+def register_serializer(name: str, code: int, dumps: Callable[[Any], bytes], loads: Callable[[bytes], Any]) -> None:
+    """Подключает сериализатор (код — один байт, уникальный среди сериализаторов)"""
+    SERIALIZER_CODES.setdefault(name, code)
+    SERIALIZERS[name] = Codec(name, code, dumps, loads)
+
+
+def register_compression(name: str, code: int, compress: Callable[[bytes], bytes],
+                         decompress: Callable[[bytes], bytes]) -> None:
+    """Подключает алгоритм сжатия (код — один байт, уникальный среди алгоритмов)"""
+    COMPRESSION_CODES.setdefault(name, code)
+    COMPRESSIONS[name] = Codec(name, code, compress, decompress)
+
+
+def _json_dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _identity(raw: bytes) -> bytes:
+    return raw
+
+
+def _register_builtin() -> None:
+    import zlib
+
+    register_serializer('json', SERIALIZER_CODES['json'], _json_dumps, json.loads)
+    register_compression('none', COMPRESSION_CODES['none'], _identity, _identity)
+    # Уровень 1: в несколько раз меньше файла почти без замедления записи
+    register_compression('zlib', COMPRESSION_CODES['zlib'], lambda raw: zlib.compress(raw, 1), zlib.decompress)
+
+    try:
+        import orjson
+    except ImportError:
+        pass
+    else:
+        register_serializer('orjson', SERIALIZER_CODES['orjson'], orjson.dumps, orjson.loads)
+
+    try:
+        import msgpack
+    except ImportError:
+        pass
+    else:
+        register_serializer(
+            'msgpack', SERIALIZER_CODES['msgpack'],
+            lambda value: msgpack.packb(value, use_bin_type=True),
+            lambda raw: msgpack.unpackb(raw, raw=False, strict_map_key=False),
+        )
+
+    try:
+        from compression import zstd
+    except ImportError:
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = None
+        if zstandard is not None:
+            register_compression(
+                'zstd', COMPRESSION_CODES['zstd'],
+                lambda raw: zstandard.ZstdCompressor(level=3).compress(raw),
+                lambda raw: zstandard.ZstdDecompressor().decompress(raw),
+            )
+    else:
+        register_compression('zstd', COMPRESSION_CODES['zstd'], lambda raw: zstd.compress(raw, level=3),
+                             zstd.decompress)
+
+    try:
+        import lz4.frame
+    except ImportError:
+        pass
+    else:
+        register_compression('lz4', COMPRESSION_CODES['lz4'], lz4.frame.compress, lz4.frame.decompress)
+
+
+_register_builtin()
+
+
+def _by_code(codecs: dict[str, Codec], codes: dict[str, int], code: int, kind: str) -> Codec:
+    for codec in codecs.values():
+        if codec.code == code:
+            return codec
+    names = [name for name, known in codes.items() if known == code]
+    if names:
+        raise CacheFormatError(f"{kind} {names[0]} не установлен")
+    raise CacheFormatError(f"{kind}: неизвестный код {code}")
+
+
+class CacheCodec:
+    """Запись и чтение файлов кэша: сериализатор `serializer` со сжатием `compression`"""
+
+    def __init__(self, serializer: str = 'json', compression: str = 'none'):
+        if serializer not in SERIALIZERS:
+            raise CacheFormatError(f"Сериализатор {serializer} недоступен, доступны: {', '.join(SERIALIZERS)}")
+        if compression not in COMPRESSIONS:
+            raise CacheFormatError(f"Сжатие {compression} недоступно, доступны: {', '.join(COMPRESSIONS)}")
+        self.serializer = SERIALIZERS[serializer]
+        self.compression = COMPRESSIONS[compression]
+        self._header = _HEADER.pack(MAGIC, FORMAT_VERSION, self.serializer.code, self.compression.code)
+
+    @property
+    def name(self) -> str:
+        if self.compression.name == 'none':
+            return self.serializer.name
+        return f"{self.serializer.name}+{self.compression.name}"
+
+    def encode(self, cached_at: float, data: Any) -> tuple[bytes, int]:
+        """Содержимое файла и размер несжатой записи (оценка объема значения в памяти), байты"""
+        payload = self.serializer.encode({'cached_at': cached_at, 'data': data})
+        return self._header + self.compression.encode(payload), len(payload)
+
+    @staticmethod
+    def decode(raw: bytes) -> tuple[float, Any, int]:
+        """Время записи, значение и размер несжатой записи файла любого поддерживаемого формата"""
+        if not raw.startswith(MAGIC):
+            # JSON прежних версий
+            cache_data = json.loads(raw)
+            return datetime.fromisoformat(cache_data['cached_at']).timestamp(), cache_data['data'], len(raw)
+
+        if len(raw) < _HEADER.size:
+            raise CacheFormatError("Файл кэша обрезан")
+        _, version, serializer_code, compression_code = _HEADER.unpack_from(raw)
+        if version != FORMAT_VERSION:
+            raise CacheFormatError(f"Версия формата файла кэша {version} не поддерживается")
+        serializer = _by_code(SERIALIZERS, SERIALIZER_CODES, serializer_code, 'Сериализатор')
+        compression = _by_code(COMPRESSIONS, COMPRESSION_CODES, compression_code, 'Алгоритм сжатия')
+        payload = compression.decode(raw[_HEADER.size:])
+        cache_data = serializer.decode(payload)
+        return float(cache_data['cached_at']), cache_data['data'], len(payload)
+
+
+def resolve_codec(spec: Optional[str] = 'auto') -> CacheCodec:
+    """
+    Формат по строке `<сериализатор>[+<сжатие>]` или `auto`
+
+    Недоступный сериализатор или алгоритм сжатия заменяется выбором `auto` с предупреждением.
+    """
+    spec = (spec or 'auto').strip().lower()
+    if spec != 'auto':
+        serializer, _, compression = spec.partition('+')
+        try:
+            return CacheCodec(serializer, compression or 'none')
+        except CacheFormatError as e:
+            logger.warning(f"Формат кэша {spec} недоступен ({e}), используется auto")
+    serializer = next(name for name in AUTO_SERIALIZERS if name in SERIALIZERS)
+    compression = next(name for name in AUTO_COMPRESSIONS if name in COMPRESSIONS)
+    return CacheCodec(serializer, compression)
@@ -1,4 +1,4 @@
-from .bitrixWork import bit, get_fields_by_user, get_contacts_by_filter
+from .bitrixWork import get_fields_by_user, get_contacts_by_filter
 from mcp.server.fastmcp import FastMCP, Context
 from pprint import pprint
 from .userfields import get_all_info_fields
@@ -1,5 +1,4 @@
 from .bitrixWork import (
-    bit, 
     get_crm_activities_by_filter, 
     get_tasks_by_filter, 
     get_leads_by_filter, 
@@ -1,6 +1,4 @@
 from mcp.server.fastmcp import FastMCP, Context
-from dotenv import load_dotenv
-load_dotenv()
 import os
 import json
 from datetime import datetime, timedelta, timezone
@@ -11,7 +9,7 @@ from pathlib import Path
 # from userfields import get_all_info_fields
 # from bitrixWork import bit, get_deals_by_filter
 from .userfields import get_all_info_fields
-from .bitrixWork import bit, get_deals_by_filter, get_deal_stages, get_deal_categories, get_all_deal_stages_by_categories, get_stage_history, get_crm_activities_by_filter, get_tasks_by_filter
+from .bitrixWork import collect_unavailable, call_batched_or_empty, get_deals_by_filter, get_deal_stages, get_deal_categories, get_all_deal_stages_by_categories, get_stage_history, get_crm_activities_by_filter, get_tasks_by_filter
 
 from .helper import prepare_fields_to_humman_format
 from loguru import logger
@@ -20,8 +18,6 @@ WEBHOOK=os.getenv("WEBHOOK")
 # class Deal(_Deal):
 #     pass
 # Deal.get_manager(bitrix)
-BATCH_SIZE = 50
-DELAY_BETWEEN_BATCHES = 0.5  # секунды задержки между батчами
 mcp = FastMCP("bitrix24")
 
 
@@ -505,7 +501,7 @@ async def _get_deal_activity(deal_id: int, days: int = 3) -> dict:
                     'ENTITY_ID': deal_id
                 }
             }
-            comments_result = await bit.call('crm.timeline.comment.list', comments_params, raw=True)
+            comments_result = await call_batched_or_empty('crm.timeline.comment.list', comments_params)
             
             if comments_result and 'result' in comments_result:
                 comments = comments_result['result'] if isinstance(comments_result['result'], list) else []
@@ -739,58 +735,37 @@ async def _get_all_deals_activity_batch(deal_ids: list[int | str], days: int = 3
                     except Exception:
                         pass
         
-        # Шаг 2: Получаем комментарии батчами с ограниченным параллелизмом (если включено)
-        # Обрабатываем батчами по 10 запросов параллельно с задержкой между батчами
-        # Это предотвращает перегрузку API Bitrix24
+        # Шаг 2: Получаем комментарии (если включено)
+        # Вызовы объединяются в batch-запросы по 50 команд (microbatch.py), скорость ограничивает планировщик bitrixWork
         if include_comments:
-            semaphore = asyncio.Semaphore(BATCH_SIZE)
-            
-            logger.info(f"Получение комментариев для {len(deal_ids_normalized)} сделок батчами (размер батча: {BATCH_SIZE}, задержка: {DELAY_BETWEEN_BATCHES}с)")
+            logger.info(f"Получение комментариев для {len(deal_ids_normalized)} сделок")
             
             async def get_comments_for_deal(deal_id: int) -> tuple[int, list]:
-                """Получает комментарии для одной сделки с ограничением через семафор"""
-                async with semaphore:  # Ограничиваем количество одновременных запросов
-                    try:
-                        comments_params = {
-                            'filter': {
-                                'ENTITY_TYPE': 'DEAL',
-                                'ENTITY_ID': deal_id
-                            }
+                """Получает комментарии для одной сделки"""
+                try:
+                    comments_params = {
+                        'filter': {
+                            'ENTITY_TYPE': 'DEAL',
+                            'ENTITY_ID': deal_id
                         }
-                        comments_result = await bit.call('crm.timeline.comment.list', comments_params, raw=True)
-                        
-                        comments = []
-                        if isinstance(comments_result, dict):
-                            if 'result' in comments_result and isinstance(comments_result['result'], list):
-                                comments = comments_result['result']
-                            elif 'error' in comments_result:
-                                logger.warning(f"Ошибка при получении комментариев для сделки {deal_id}: {comments_result.get('error')}")
-                        elif isinstance(comments_result, list):
-                            comments = comments_result
-                        
-                        return deal_id, comments
-                    except Exception as e:
-                        logger.warning(f"Ошибка при получении комментариев для сделки {deal_id}: {e}")
-                        return deal_id, []
-            
-            # Обрабатываем батчами с задержками
-            total_batches = (len(deal_ids_normalized) + BATCH_SIZE - 1) // BATCH_SIZE
-            all_comments_results = []
+                    }
+                    comments_result = await call_batched_or_empty('crm.timeline.comment.list', comments_params)
+                    
+                    comments = []
+                    if isinstance(comments_result, dict):
+                        if 'result' in comments_result and isinstance(comments_result['result'], list):
+                            comments = comments_result['result']
+                        elif 'error' in comments_result:
+                            logger.warning(f"Ошибка при получении комментариев для сделки {deal_id}: {comments_result.get('error')}")
+                    elif isinstance(comments_result, list):
+                        comments = comments_result
+                    
+                    return deal_id, comments
+                except Exception as e:
+                    logger.warning(f"Ошибка при получении комментариев для сделки {deal_id}: {e}")
+                    return deal_id, []
             
-            for batch_idx in range(0, len(deal_ids_normalized), BATCH_SIZE):
-                batch_deal_ids = deal_ids_normalized[batch_idx:batch_idx + BATCH_SIZE]
-                batch_num = (batch_idx // BATCH_SIZE) + 1
-                
-                logger.info(f"Обработка батча комментариев {batch_num}/{total_batches}: сделки {batch_idx+1}-{min(batch_idx+BATCH_SIZE, len(deal_ids_normalized))} из {len(deal_ids_normalized)}")
-                
-                # Выполняем запросы для текущего батча
-                comments_tasks = [get_comments_for_deal(deal_id) for deal_id in batch_deal_ids]
-                batch_results = await asyncio.gather(*comments_tasks)
-                all_comments_results.extend(batch_results)
-                
-                # Добавляем задержку между батчами (кроме последнего)
-                if batch_idx + BATCH_SIZE < len(deal_ids_normalized):
-                    await asyncio.sleep(DELAY_BETWEEN_BATCHES)
+            all_comments_results = await asyncio.gather(*[get_comments_for_deal(deal_id) for deal_id in deal_ids_normalized])
             
             # Обрабатываем результаты
             for deal_id, comments in all_comments_results:
@@ -1039,7 +1014,10 @@ async def get_deals_at_risk(filter_fields: dict[str, str] = None, fields_id: lis
         
         # Получаем активность для всех сделок батчами (оптимизация)
         logger.info(f"Получение активности для {len(deal_ids)} сделок батчами (включая комментарии: {include_comments})")
-        all_activities = await _get_all_deals_activity_batch(deal_ids, days=3, include_comments=include_comments)
+        with collect_unavailable() as unavailable_methods:
+            all_activities = await _get_all_deals_activity_batch(deal_ids, days=3, include_comments=include_comments)
+        # Комментарии недоступны (разомкнут предохранитель crm.timeline.comment.list): риск оценивается без них
+        comments_unavailable = 'crm.timeline.comment.list' in unavailable_methods
         
         # Проверяем каждую сделку
         for deal_id_int, deal in deal_id_to_deal.items():
@@ -1116,7 +1094,10 @@ async def get_deals_at_risk(filter_fields: dict[str, str] = None, fields_id: lis
         
         result_text = f"=== Сделки в риске ===\n\n"
         result_text += f"Всего проверено сделок: {len(deals)}\n"
-        result_text += f"Сделок в риске: {len(deals_at_risk)}\n\n"
+        result_text += f"Сделок в риске: {len(deals_at_risk)}\n"
+        if comments_unavailable:
+            result_text += "Раздел комментариев недоступен: портал временно не отвечает, активность оценена без комментариев\n"
+        result_text += "\n"
         
         for idx, deal_info in enumerate(deals_at_risk, 1):
             result_text += f"{idx}. {deal_info['title']} (ID: {deal_info['deal_id']})\n"
@@ -0,0 +1,347 @@
+"""
+Инкрементальная синхронизация закэшированных списков сделок, задач и активностей по дате изменения
+
+Без нее каждый вызов `get_deals_by_filter`/`get_tasks_by_filter` выбирает весь список заново, а
+`get_crm_activities_by_filter` после TTL (15 минут) — тоже весь список за период. `DeltaSync` хранит
+выбранный список в кэше результатов (пространство `delta_<сущность>`, см. cache.py) вместе с отметкой
+синхронизации — наибольшей датой изменения (`DATE_MODIFY` сделок, `CHANGED_DATE` задач, `LAST_UPDATED`
+активностей) среди измененных строк сущности, после полной выборки — не раньше ее начала по часам портала
+(`time.date_start` ответа, `clock`; часы сервера не используются). Следующий вызов:
+- в течение `interval` секунд после синхронизации (BITRIX_DELTA_INTERVAL, по умолчанию 30) отдает список
+  без запросов;
+- иначе запрашивает ID и даты изменения строк сущности, измененных с отметки (без фильтра вызова, обычно
+  один запрос). Если таких нет, синхронизация закончена; иначе измененные строки выбираются с фильтром
+  вызова: подходящие заменяют строки списка по ID, не подходящие больше (сделка ушла со стадии фильтра)
+  удаляются. Отметка сдвигается назад на `overlap` секунд (BITRIX_DELTA_OVERLAP, по умолчанию 300):
+  строки, измененные во время выборки, и расхождение часов перечитываются, слияние по ID их не дублирует;
+- раз в `reconcile_interval` секунд (BITRIX_DELTA_RECONCILE, по умолчанию 3600) сверяет список с ID всех
+  строк по фильтру вызова (`select: ['ID']`): удаленные на портале строки не попадают в выборку
+  измененных, поэтому удаляются сверкой. ID, которых нет в списке, запускают полную выборку.
+
+Список хранится базой (строки после полной выборки) и журналом изменений с нее (`delta_<сущность>_changes`):
+досинхронизация перезаписывает только журнал — измененные и удаленные строки, а не весь список. Когда в
+журнале больше `COMPACT_RATIO` строк списка, журнал сливается в базу.
+
+Полная выборка — при первом вызове, после TTL пространства `delta` (сутки с записи базы, BITRIX_CACHE_TTLS)
+и после сверки с новыми ID. Вызовы с фильтром по самой дате изменения и сортировкой не по возрастанию ID
+выполняются как раньше (`supports` — False): вызывающий код выбирает их сам, например
+`get_crm_activities_by_filter` — через пространство кэша `crm_activities` с TTL 15 минут.
+BITRIX_DELTA_SYNC=0 отключает режим.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
+
+from loguru import logger
+
+from . import metrics
+from .singleflight import copy_rows
+
+
+class DeltaEntity(NamedTuple):
+    """Сущность с инкрементальной синхронизацией: поле даты изменения в фильтре и ключи строк ответа"""
+    name: str
+    modified_field: str
+    row_keys: tuple[str, ...]
+    id_keys: tuple[str, ...] = ('ID',)
+
+
+DELTA_ENTITIES = {
+    'crm.deal.list': DeltaEntity('deal', 'DATE_MODIFY', ('DATE_MODIFY',)),
+    'crm.activity.list': DeltaEntity('activity', 'LAST_UPDATED', ('LAST_UPDATED',)),
+    # tasks.task.list отдает ключи в camelCase
+    'tasks.task.list': DeltaEntity('task', 'CHANGED_DATE', ('changedDate', 'CHANGED_DATE'), ('id', 'ID')),
+}
+
+INTERVAL = 30.0
+RECONCILE_INTERVAL = 3600.0
+OVERLAP = 300.0
+# Доля строк списка в журнале изменений, после которой журнал сливается в базу
+COMPACT_RATIO = 0.25
+
+
+def _row_value(row: dict, keys: tuple[str, ...]) -> Any:
+    for key in keys:
+        value = row.get(key)
+        if value is not None:
+            return value
+    return None
+
+
+def _row_id(entity: DeltaEntity, row: dict) -> Optional[int]:
+    try:
+        return int(_row_value(row, entity.id_keys))
+    except (TypeError, ValueError):
+        return None
+
+
+def _modified_at(entity: DeltaEntity, row: dict) -> Optional[datetime]:
+    value = _row_value(row, entity.row_keys)
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _high_water(entity: DeltaEntity, rows: list[dict], current: Optional[str] = None) -> Optional[str]:
+    """Наибольшая дата изменения среди строк и текущей отметки (ISO 8601)"""
+    marks = [mark for mark in (_modified_at(entity, row) for row in rows) if mark is not None]
+    if current:
+        marks.append(datetime.fromisoformat(current))
+    return max(marks).isoformat() if marks else current
+
+
+def _apply(entity: DeltaEntity, base: dict, journal: dict) -> dict:
+    """Состояние списка: строки базы с изменениями журнала (удаленные убираются, измененные заменяются по ID)"""
+    by_id = {_row_id(entity, row): row for row in base['rows']}
+    for row_id in journal['removed']:
+        by_id.pop(row_id, None)
+    for row in journal['upserts']:
+        by_id[_row_id(entity, row)] = row
+    rows = [by_id[row_id] for row_id in sorted(row_id for row_id in by_id if row_id is not None)]
+    return {**base, 'rows': rows, 'high_water': journal['high_water'], 'synced_at': journal['synced_at'],
+            'reconciled_at': journal['reconciled_at'], 'journal': journal}
+
+
+def _field(key: str) -> str:
+    """Поле ключа фильтра без оператора (`>=DATE_MODIFY` -> `DATE_MODIFY`)"""
+    return key.lstrip('<>=!@%').upper()
+
+
+class _SyncLock:
+    """Блокировка синхронизации ключа и число вызовов, которые ее держат или ждут"""
+
+    __slots__ = ('lock', 'users')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class DeltaSync:
+    """Списки сущностей в кэше результатов с досинхронизацией измененных строк и периодической сверкой ID"""
+
+    def __init__(self, cache, fetch: Callable[[str, dict], Awaitable[Any]], enabled: bool = True,
+                 interval: float = INTERVAL, reconcile_interval: float = RECONCILE_INTERVAL,
+                 overlap: float = OVERLAP, clock: Optional[Callable[[str], Awaitable[Optional[str]]]] = None):
+        self.cache = cache
+        self._fetch = fetch
+        # Текущее время портала для метода (ISO 8601) или None
+        self._clock = clock
+        self.enabled = enabled
+        self.interval = interval
+        self.reconcile_interval = reconcile_interval
+        self.overlap = overlap
+        self.stats = Counter()
+        # Синхронизации ключей: (id цикла событий, ключ) -> блокировка; удаляется, когда ее никто не ждет
+        self._locks: dict[tuple[int, str], _SyncLock] = {}
+        # Изменения сущностей на портале (события, см. events.py): сущность -> время изменения
+        self._changed: dict[str, float] = {}
+
+    def supports(self, method: str, params: Optional[dict]) -> bool:
+        """Можно ли выполнить выборку инкрементально"""
+        entity = DELTA_ENTITIES.get(method)
+        if not self.enabled or entity is None:
+            return False
+        params = params or {}
+        order = params.get('order')
+        # Список хранится по возрастанию ID
+        if order and {str(key).upper(): str(value).upper() for key, value in order.items()} != {'ID': 'ASC'}:
+            return False
+        # Фильтр по дате изменения пересекается с фильтром выборки измененных строк
+        return all(_field(str(key)) != entity.modified_field for key in (params.get('filter') or {}))
+
+    def _key(self, entity: DeltaEntity, params: dict) -> str:
+        fingerprint = json.dumps({'filter': params.get('filter') or {}, 'select': params.get('select') or []},
+                                 sort_keys=True, ensure_ascii=False, default=str)
+        return f"delta_{entity.name}_{hashlib.md5(fingerprint.encode('utf-8')).hexdigest()}"
+
+    @staticmethod
+    def _journal_key(key: str) -> str:
+        """Ключ журнала изменений списка (`delta_deal_<md5>` -> `delta_deal_changes_<md5>`)"""
+        prefix, digest = key.rsplit('_', 1)
+        return f"{prefix}_changes_{digest}"
+
+    def _load(self, entity: DeltaEntity, key: str) -> Optional[dict]:
+        base = self.cache.get(key)
+        if base is None:
+            return None
+        journal = self.cache.get(self._journal_key(key))
+        # Журнал другой базы (ее перезаписал другой процесс или она истекла и выбрана заново) не применяется
+        if journal is None or journal['base'] != base.get('base'):
+            return base
+        return _apply(entity, base, journal)
+
+    def _store(self, key: str, state: dict) -> dict:
+        """Сохраняет журнал изменений; большой журнал сливается в базу"""
+        journal = state['journal']
+        if len(journal['upserts']) + len(journal['removed']) <= len(state['rows']) * COMPACT_RATIO:
+            self.cache.set(self._journal_key(key), journal)
+            return state
+        return self._store_base(key, state['rows'], state['high_water'], state['synced_at'], state['reconciled_at'])
+
+    def _store_base(self, key: str, rows: list[dict], high_water: Optional[str], synced_at: float,
+                    reconciled_at: float) -> dict:
+        state = {'rows': rows, 'high_water': high_water, 'synced_at': synced_at, 'reconciled_at': reconciled_at,
+                 'base': time.time_ns()}
+        self.cache.set(key, state)
+        self.cache.invalidate(self._journal_key(key))
+        return state
+
+    async def _rows(self, method: str, params: dict) -> list[dict]:
+        rows = await self._fetch(method, params)
+        if isinstance(rows, dict) and rows.get('order0000000000'):
+            rows = rows['order0000000000']
+        if isinstance(rows, dict):
+            rows = rows.get('tasks')
+        return rows if isinstance(rows, list) else []
+
+    def _count(self, entity: DeltaEntity, mode: str) -> None:
+        self.stats[mode] += 1
+        metrics.delta_syncs.inc(entity=entity.name, mode=mode)
+
+    async def fetch(self, method: str, params: Optional[dict] = None) -> list[dict]:
+        """
+        Список строк по фильтру с инкрементальной синхронизацией
+
+        Args:
+            method: `crm.deal.list`, `crm.activity.list` или `tasks.task.list`
+            params: Параметры метода (`filter`, `select`)
+
+        Returns:
+            Копия строк списка, отсортированных по ID
+        """
+        entity = DELTA_ENTITIES[method]
+        params = {'filter': dict((params or {}).get('filter') or {}), 'select': list((params or {}).get('select') or [])}
+        select = params['select']
+        # Для слияния нужна дата изменения (ID выборка добавляет сама); если ее не просили, она убирается из результата
+        extra = bool(select) and '*' not in select and entity.modified_field not in select
+        if extra:
+            params['select'] = [*select, entity.modified_field]
+        key = self._key(entity, params)
+
+        lock_key = (id(asyncio.get_running_loop()), key)
+        sync_lock = self._locks.setdefault(lock_key, _SyncLock())
+        sync_lock.users += 1
+        try:
+            async with sync_lock.lock:
+                state = self._load(entity, key)
+                now = time.time()
+                if state is None:
+                    state = await self._full(method, entity, params, now)
+                elif now - state['synced_at'] >= self.interval or state['synced_at'] < self._changed.get(entity.name, 0):
+                    state = await self._sync(method, entity, params, state, now)
+                else:
+                    self._count(entity, 'cached')
+        finally:
+            sync_lock.users -= 1
+            if sync_lock.users == 0 and self._locks.get(lock_key) is sync_lock:
+                del self._locks[lock_key]
+
+        if extra:
+            return [{name: value for name, value in row.items() if name not in entity.row_keys} for row in state['rows']]
+        return copy_rows(state['rows'])
+
+    async def _portal_time(self, method: str) -> Optional[str]:
+        if self._clock is None:
+            return None
+        try:
+            return await self._clock(method)
+        except Exception as e:
+            logger.warning(f"Время портала для {method} не получено: {e}")
+            return None
+
+    async def _full(self, method: str, entity: DeltaEntity, params: dict, now: float) -> dict:
+        # Отметка — не раньше начала выборки: иначе первая досинхронизация списка со старыми строками
+        # выбрала бы все изменения сущности с даты его последней строки. Начало — по часам портала: если
+        # часы сервера спешат больше чем на overlap, отметка по ним пропустила бы изменения. Без времени
+        # портала отметка — дата последней строки (досинхронизация перечитает больше, но ничего не пропустит)
+        started = await self._portal_time(method)
+        rows = await self._rows(method, params)
+        high_water = _high_water(entity, rows, started)
+        self._count(entity, 'full')
+        logger.info(f"Полная синхронизация {method}: {len(rows)} строк, отметка {high_water}")
+        return self._store_base(self._key(entity, params), rows, high_water, now, now)
+
+    async def _sync(self, method: str, entity: DeltaEntity, params: dict, state: dict, now: float) -> dict:
+        since = (datetime.fromisoformat(state['high_water']) - timedelta(seconds=self.overlap)).isoformat()
+        changed_filter = {f">={entity.modified_field}": since}
+        touched = await self._rows(method, {'filter': changed_filter, 'select': ['ID', entity.modified_field]})
+
+        # Изменения с базы: журнал прошлых досинхронизаций дополняется новыми
+        journal = state.get('journal') or {'base': state.get('base'), 'upserts': [], 'removed': []}
+        upserts = {_row_id(entity, row): row for row in journal['upserts']}
+        removed = set(journal['removed'])
+        rows = state['rows']
+        if touched:
+            changed = await self._rows(method, {**params, 'filter': {**params['filter'], **changed_filter}})
+            by_id = {_row_id(entity, row): row for row in rows}
+            for row in touched:
+                row_id = _row_id(entity, row)
+                by_id.pop(row_id, None)
+                upserts.pop(row_id, None)
+                removed.add(row_id)
+            for row in changed:
+                row_id = _row_id(entity, row)
+                by_id[row_id] = upserts[row_id] = row
+            rows = [by_id[row_id] for row_id in sorted(row_id for row_id in by_id if row_id is not None)]
+            logger.info(f"Синхронизация {method}: изменено {len(touched)} строк, по фильтру {len(changed)}")
+        self._count(entity, 'delta')
+        high_water = _high_water(entity, touched, state['high_water'])
+        reconciled_at = state['reconciled_at']
+
+        if now - reconciled_at >= self.reconcile_interval:
+            ids = {_row_id(entity, row) for row in await self._rows(method, {'filter': params['filter'], 'select': ['ID']})}
+            self._count(entity, 'reconcile')
+            cached_ids = {_row_id(entity, row) for row in rows}
+            if ids - cached_ids:
+                logger.info(f"Сверка {method}: {len(ids - cached_ids)} строк нет в списке, полная синхронизация")
+                return await self._full(method, entity, params, now)
+            if cached_ids - ids:
+                logger.info(f"Сверка {method}: удалено {len(cached_ids - ids)} строк")
+                removed.update(cached_ids - ids)
+                for row_id in cached_ids - ids:
+                    upserts.pop(row_id, None)
+                rows = [row for row in rows if _row_id(entity, row) in ids]
+            reconciled_at = now
+
+        journal = {'base': journal['base'], 'upserts': list(upserts.values()), 'removed': sorted(removed - set(upserts)),
+                   'high_water': high_water, 'synced_at': now, 'reconciled_at': reconciled_at}
+        state = {**state, 'rows': rows, 'high_water': high_water, 'synced_at': now, 'reconciled_at': reconciled_at,
+                 'journal': journal}
+        return self._store(self._key(entity, params), state)
+
+    def expire(self, method: str) -> None:
+        """Следующий вызов досинхронизирует списки сущности, не дожидаясь `interval` (она изменилась на портале)"""
+        entity = DELTA_ENTITIES.get(method)
+        if entity is not None:
+            self._changed[entity.name] = time.time()
+
+    def reset(self) -> None:
+        """Сбрасывает счетчики (списки хранятся в кэше результатов)"""
+        self.stats = Counter()
+
+    def snapshot(self) -> dict:
+        return dict(self.stats)
+
+
+def create_delta_sync_from_env(cache, fetch: Callable[[str, dict], Awaitable[Any]],
+                               clock: Optional[Callable[[str], Awaitable[Optional[str]]]] = None) -> DeltaSync:
+    """Синхронизация списков по переменным окружения (BITRIX_DELTA_SYNC, BITRIX_DELTA_INTERVAL,
+    BITRIX_DELTA_RECONCILE, BITRIX_DELTA_OVERLAP)"""
+    return DeltaSync(
+        cache,
+        fetch,
+        clock=clock,
+        enabled=os.getenv('BITRIX_DELTA_SYNC', '1').strip().lower() in ('1', 'true', 'yes'),
+        interval=float(os.getenv('BITRIX_DELTA_INTERVAL', str(INTERVAL))),
+        reconcile_interval=float(os.getenv('BITRIX_DELTA_RECONCILE', str(RECONCILE_INTERVAL))),
+        overlap=float(os.getenv('BITRIX_DELTA_OVERLAP', str(OVERLAP))),
+    )
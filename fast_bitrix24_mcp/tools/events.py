@@ -0,0 +1,250 @@
+"""
+Прием событий портала (исходящие вебхуки Bitrix24): точечная инвалидация кэша результатов и локальной копии
+
+Без событий кэш результатов (cache.py) либо отдает данные, устаревшие на TTL, либо с коротким TTL заново
+выбирает списки, которые не менялись. Портал сам отправляет POST на обработчик при изменении сущностей
+(`ONCRMDEALUPDATE`, `ONCRMACTIVITYADD`, `ONTASKUPDATE`, ...), поэтому TTL можно держать длинным, а
+изменения применять по событиям.
+
+Маршрут POST /bitrix/events HTTP-сервера FastMCP (main.py) включается переменной BITRIX_EVENTS_TOKEN —
+токеном приложения (`auth[application_token]` события, для исходящего вебхука — его токен в настройках
+портала; несколько — через запятую). События с другим токеном отклоняются с кодом 401. Тело — форма
+в формате PHP (`event=ONCRMDEALUPDATE&data[FIELDS][ID]=1&auth[application_token]=...`), как его
+отправляет портал, или JSON того же вида.
+
+События по одной строке копятся `window` секунд (BITRIX_EVENTS_WINDOW_MS, по умолчанию 1000): всплеск
+событий сделки при одном сохранении (поля, стадия, товары) дает одно обновление. Затем в фоне (приоритет
+`background()`, см. operating.py):
+- строки из событий перечитываются в локальную копию по ID (`Mirror.refresh`, если копия включена и
+  сущность загружена), удаленные на портале строки удаляются из нее;
+- списки сущности в delta.py досинхронизируются при следующем вызове, не дожидаясь BITRIX_DELTA_INTERVAL;
+- значения кэша результатов, которые зависят от сущности (экспорт, отчеты активности менеджеров,
+  активности, комментарии, календарь), сохраненные до события, устаревают (`TieredCache.expire`).
+Кэш устаревает после обновления копии: иначе отчет, пересчитанный из копии до обновления, снова
+сохранился бы с изменением, которого в нем нет.
+
+Проверка без портала: `python -m benchmarks.events_replay` отправляет записанные или синтетические события.
+"""
+import asyncio
+import hmac
+import json
+import os
+import re
+from collections import Counter
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qsl
+
+from loguru import logger
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from . import metrics
+from .operating import background
+
+ROUTE = '/bitrix/events'
+WINDOW = 1.0
+
+ACTIONS = ('ADD', 'UPDATE', 'DELETE')
+
+# Отчеты активности менеджеров собираются из сделок, лидов, задач, активностей, комментариев и календаря
+MANAGER_REPORTS = ('all_managers_activity', 'manager_full_activity')
+
+
+class EventEntity(NamedTuple):
+    """Сущность событий: списочный метод копии и delta.py и префиксы ключей кэша результатов, которые от нее зависят"""
+    name: str
+    method: Optional[str]
+    cache_prefixes: tuple[str, ...]
+
+
+# Префикс имени события (без ADD/UPDATE/DELETE) -> сущность
+EVENT_ENTITIES = {
+    'ONCRMDEAL': EventEntity('deal', 'crm.deal.list', (*MANAGER_REPORTS, 'deal')),
+    'ONCRMLEAD': EventEntity('lead', 'crm.lead.list', (*MANAGER_REPORTS, 'lead')),
+    'ONCRMCONTACT': EventEntity('contact', 'crm.contact.list', ('contact',)),
+    'ONCRMCOMPANY': EventEntity('company', 'crm.company.list', ('company',)),
+    'ONCRMACTIVITY': EventEntity('activity', 'crm.activity.list', (*MANAGER_REPORTS, 'crm_activities')),
+    'ONTASK': EventEntity('task', 'tasks.task.list', (*MANAGER_REPORTS, 'task')),
+    'ONCRMTIMELINECOMMENT': EventEntity('comment', None, (*MANAGER_REPORTS, 'comments')),
+    'ONCALENDARENTRY': EventEntity('calendar', None, (*MANAGER_REPORTS, 'calendar_events')),
+}
+
+_KEY_PART = re.compile(r'\[([^\]]*)\]')
+
+
+class EventError(ValueError):
+    """Тело запроса не разбирается как событие портала"""
+
+
+def parse_form(body: str) -> dict:
+    """Форма в формате PHP (`data[FIELDS][ID]=1`) во вложенные словари"""
+    result: dict = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        name = key.split('[', 1)[0]
+        node = result
+        parts = [name, *_KEY_PART.findall(key[len(name):])]
+        for part in parts[:-1]:
+            child = node.setdefault(part, {})
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+        # `key[]=...` — следующий элемент списка
+        node[parts[-1] or str(len(node))] = value
+    return result
+
+
+def parse_event(body: bytes, content_type: str = '') -> dict:
+    """Событие из тела запроса: JSON или форма"""
+    try:
+        text = body.decode('utf-8')
+        event = json.loads(text) if 'json' in content_type else parse_form(text)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise EventError(f"Тело события не разобрано: {e}") from e
+    if not isinstance(event, dict) or not event.get('event'):
+        raise EventError("В теле нет имени события")
+    return event
+
+
+def event_entity(name: str) -> tuple[Optional[EventEntity], str]:
+    """Сущность и действие по имени события (`ONCRMDEALUPDATE` -> deal, UPDATE); неизвестное — (None, '')"""
+    name = name.upper()
+    for action in ACTIONS:
+        if name.endswith(action):
+            return EVENT_ENTITIES.get(name[:-len(action)]), action
+    return None, ''
+
+
+def _event_id(event: dict) -> Optional[int]:
+    data = event.get('data')
+    if not isinstance(data, dict):
+        return None
+    # CRM — FIELDS, задачи — FIELDS_AFTER (удаление — FIELDS_BEFORE), календарь — id
+    for fields in (data.get('FIELDS'), data.get('FIELDS_AFTER'), data.get('FIELDS_BEFORE'), data):
+        value = fields.get('ID', fields.get('id')) if isinstance(fields, dict) else None
+        if value is not None:
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+class EventReceiver:
+    """Проверка токена, слияние событий одной строки в окне и инвалидация кэша, delta.py и локальной копии"""
+
+    def __init__(self, cache, delta_sync, mirror, tokens: tuple[str, ...] = (), window: float = WINDOW):
+        self.cache = cache
+        self.delta_sync = delta_sync
+        self.mirror = mirror
+        self.tokens = tuple(token for token in tokens if token)
+        self.window = window
+        self.stats = Counter()
+        # Изменения, накопленные в окне: префикс события -> {ID строки (None — без ID): действие}
+        self._pending: dict[str, dict[Optional[int], str]] = {}
+        self._flushes: set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.tokens)
+
+    def authorized(self, event: dict) -> bool:
+        auth = event.get('auth')
+        token = auth.get('application_token') if isinstance(auth, dict) else None
+        if not isinstance(token, str):
+            return False
+        return any(hmac.compare_digest(token.encode(), allowed.encode()) for allowed in self.tokens)
+
+    def _count(self, entity: Optional[EventEntity], result: str) -> str:
+        self.stats[result] += 1
+        metrics.events.inc(entity=entity.name if entity else '', result=result)
+        return result
+
+    def receive(self, event: dict) -> str:
+        """
+        Принимает событие в окно слияния
+
+        Returns:
+            `accepted`, `coalesced` (строка уже есть в окне), `ignored` (событие не влияет на кэш) или
+            `rejected` (неверный токен)
+        """
+        if not self.authorized(event):
+            logger.warning(f"Событие {event.get('event')} отклонено: неверный токен приложения")
+            return self._count(None, 'rejected')
+        name = str(event.get('event')).upper()
+        entity, action = event_entity(name)
+        if entity is None:
+            logger.debug(f"Событие {name} не влияет на кэш")
+            return self._count(None, 'ignored')
+
+        if not self._pending:
+            self._schedule()
+        rows = self._pending.setdefault(name[:-len(action)], {})
+        row_id = _event_id(event)
+        coalesced = row_id in rows
+        rows[row_id] = action
+        return self._count(entity, 'coalesced' if coalesced else 'accepted')
+
+    def _schedule(self) -> None:
+        with background():
+            task = asyncio.get_running_loop().create_task(self._flush_later(), name='bitrix-events-flush')
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.window)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Применяет накопленные изменения: копия, затем delta.py и кэш результатов"""
+        pending, self._pending = self._pending, {}
+        for prefix, rows in pending.items():
+            entity = EVENT_ENTITIES[prefix]
+            ids = {row_id for row_id in rows if row_id is not None}
+            if entity.method is not None:
+                try:
+                    await self.mirror.refresh(entity.method, ids)
+                except Exception as e:
+                    logger.error(f"Ошибка обновления локальной копии {entity.name} по событиям: {e}")
+                self.delta_sync.expire(entity.method)
+            self.cache.expire(*entity.cache_prefixes)
+            self.stats['flushes'] += 1
+            logger.info(f"События {entity.name}: изменено {len(rows)} строк, кэш {', '.join(entity.cache_prefixes)} устарел")
+
+    def reset(self) -> None:
+        self.stats = Counter()
+
+    def snapshot(self) -> dict:
+        return {**dict(self.stats), 'pending': sum(len(rows) for rows in self._pending.values())}
+
+
+def events_enabled() -> bool:
+    return bool(os.getenv('BITRIX_EVENTS_TOKEN', '').strip())
+
+
+def create_event_receiver_from_env(cache, delta_sync, mirror) -> EventReceiver:
+    """Прием событий по переменным окружения (BITRIX_EVENTS_TOKEN, BITRIX_EVENTS_WINDOW_MS)"""
+    return EventReceiver(
+        cache,
+        delta_sync,
+        mirror,
+        tokens=tuple(token.strip() for token in os.getenv('BITRIX_EVENTS_TOKEN', '').split(',')),
+        window=float(os.getenv('BITRIX_EVENTS_WINDOW_MS', str(WINDOW * 1000))) / 1000,
+    )
+
+
+def install_events_route(server) -> None:
+    """Добавляет маршрут POST /bitrix/events HTTP-серверу FastMCP"""
+    @server.custom_route(ROUTE, methods=['POST'], include_in_schema=False)
+    async def events_endpoint(request: Request) -> JSONResponse:
+        # bitrixWork загружается с модулями инструментов (см. mounts.py), не при импорте main.py
+        from .bitrixWork import get_events
+
+        try:
+            event = parse_event(await request.body(), request.headers.get('content-type', ''))
+        except EventError as e:
+            logger.warning(f"Событие портала не принято: {e}")
+            return JSONResponse({'error': str(e)}, status_code=400)
+        result = get_events().receive(event)
+        return JSONResponse({'result': result}, status_code=401 if result == 'rejected' else 200)
+
+    logger.debug(f"События портала принимаются по POST {ROUTE}")
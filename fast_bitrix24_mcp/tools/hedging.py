@@ -0,0 +1,219 @@
+"""
+Хвостовые задержки запросов к Bitrix24: дублирующие запросы (hedging) и бюджет повторов
+
+Задержки REST API портала имеют тяжелый хвост: одна медленная страница `get_all` задерживает весь отчет,
+который ждет `asyncio.gather` нескольких выборок. Два механизма:
+
+- `RequestHedger` (BITRIX_HEDGE=1, по умолчанию выключен) — если запрос на чтение (`*.list`, `*.get`,
+  `*.fields`, batch только из таких команд) не получил ответ за p95 задержки этого метода (по последним
+  ответам), транспорт отправляет такой же запрос еще раз и берет первый ответ, второй отменяется.
+  Дублей не больше доли `ratio` от всех запросов (BITRIX_HEDGE_RATIO, по умолчанию 5%). Пока по методу
+  нет `MIN_SAMPLES` ответов, используется p95 всех методов, а до первых `MIN_SAMPLES` ответов процесса —
+  фиксированная задержка `initial_delay` (BITRIX_HEDGE_INITIAL_DELAY, по умолчанию 1 с). Дубль занимает то же место в окне планировщика,
+  что и исходный запрос, но расходует лимиты и operating-время портала. Запросы на запись не дублируются.
+- `RetryPolicy` — бюджет повторов на каждый запрос вместо общего счетчика неудач fast_bitrix24: ошибки,
+  которые библиотека повторяет (соединение, таймаут, HTTP 5xx), повторяются не больше `attempts` раз
+  (BITRIX_RETRY_ATTEMPTS, по умолчанию 5) с экспоненциальной паузой со случайным разбросом
+  (`random.uniform(0, min(cap, base * 2 ** n))`, BITRIX_RETRY_BASE, BITRIX_RETRY_CAP). Собственная пауза
+  fast_bitrix24 перед повтором не работает с планировщиком (`scheduler.install_scheduler`), поэтому без
+  бюджета повторы шли бы сразу друг за другом.
+
+Счетчики дублей и повторов — `stats` объектов (`snapshot()`), они же попадают в результаты бенчмарка.
+"""
+import asyncio
+import math
+import os
+import random
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Optional
+
+from loguru import logger
+
+# Окончания методов чтения, которые безопасно отправлять повторно
+READ_METHOD_SUFFIXES = ('.list', '.get', '.fields', '.getfields', '.getlist')
+
+# Сколько последних ответов метода учитывается в квантиле и сколько нужно для его оценки
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+
+
+def is_read_request(method: str, params: Any) -> bool:
+    """Только чтение: метод `*.list`/`*.get`/`*.fields` или batch, все команды которого такие"""
+    method = method.strip().lower()
+    if method != 'batch':
+        return method.endswith(READ_METHOD_SUFFIXES)
+    commands = params.get('cmd') if isinstance(params, dict) else None
+    if not isinstance(commands, dict) or not commands:
+        return False
+    return all(
+        isinstance(command, str) and command.split('?', 1)[0].strip().lower().endswith(READ_METHOD_SUFFIXES)
+        for command in commands.values()
+    )
+
+
+def _quantile(values: list[float], quantile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(math.ceil(quantile * len(ordered)) - 1, len(ordered) - 1)]
+
+
+class RequestHedger:
+    """Дублирующий запрос после квантиля задержки метода"""
+
+    def __init__(self, enabled: bool = False, quantile: float = 0.95, ratio: float = 0.05,
+                 initial_delay: Optional[float] = 1.0, min_delay: float = 0.05):
+        self.enabled = enabled
+        self.initial_delay = initial_delay
+        self.quantile = quantile
+        self.ratio = ratio
+        self.min_delay = min_delay
+        self.stats = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'skipped_budget': 0}
+        self._latencies: dict[str, deque] = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self._all_latencies: deque = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, method: str, elapsed: float) -> None:
+        """Учитывает время ответа метода"""
+        self._latencies[method].append(elapsed)
+        self._all_latencies.append(elapsed)
+
+    def hedge_delay(self, method: str) -> Optional[float]:
+        """Через сколько секунд отправлять дубль (None — не дублировать)"""
+        samples = self._latencies.get(method)
+        if samples is None or len(samples) < MIN_SAMPLES:
+            samples = self._all_latencies
+        if len(samples) < MIN_SAMPLES:
+            return self.initial_delay
+        return max(_quantile(list(samples), self.quantile), self.min_delay)
+
+    def _within_budget(self) -> bool:
+        return self.stats['hedged'] < self.ratio * self.stats['requests'] + 1
+
+    async def run(self, method: str, params: Any, send: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет запрос `send()`, при необходимости дублируя его
+
+        Args:
+            method: Метод REST API
+            params: Параметры запроса (для batch проверяются команды)
+            send: Функция, отправляющая запрос
+
+        Returns:
+            Первый полученный ответ
+        """
+        self.stats['requests'] += 1
+        started = time.perf_counter()
+        delay = self.hedge_delay(method) if self.enabled and is_read_request(method, params) else None
+        if delay is None:
+            result = await send()
+            self.record(method, time.perf_counter() - started)
+            return result
+
+        tasks = [asyncio.ensure_future(send())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                if self._within_budget():
+                    self.stats['hedged'] += 1
+                    tasks.append(asyncio.ensure_future(send()))
+                else:
+                    self.stats['skipped_budget'] += 1
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    if task is not tasks[0]:
+                        self.stats['hedge_wins'] += 1
+                        logger.debug(f"Дублирующий запрос {method} ответил раньше исходного ({delay:.3f} с)")
+                    self.record(method, time.perf_counter() - started)
+                    return task.result()
+            raise error
+        finally:
+            # Проигравший запрос (или оба при отмене вызова) отменяется
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def snapshot(self) -> dict:
+        return dict(self.stats)
+
+
+class RetryPolicy:
+    """Бюджет повторов на запрос с экспоненциальной паузой со случайным разбросом"""
+
+    def __init__(self, attempts: int = 5, base: float = 0.5, cap: float = 10.0):
+        self.attempts = max(int(attempts), 0)
+        self.base = base
+        self.cap = cap
+        self.stats = {'requests': 0, 'retries': 0, 'retried_requests': 0, 'exhausted': 0, 'backoff_time': 0.0}
+
+    def backoff(self, retry: int) -> float:
+        """Пауза перед повтором номер `retry` (с 1)"""
+        return random.uniform(0, min(self.cap, self.base * 2 ** (retry - 1)))
+
+    def snapshot(self) -> dict:
+        return {**self.stats, 'backoff_time': round(self.stats['backoff_time'], 4)}
+
+
+def install_retry_policy(bit, policy: RetryPolicy) -> None:
+    """
+    Заменяет цикл повторов `srh.single_request` fast_bitrix24 на повторы с бюджетом `policy`
+
+    Исчерпав бюджет, запрос поднимает RuntimeError с последней ошибкой, как fast_bitrix24.
+    """
+    from fast_bitrix24.srh import RETRIED_ERRORS, TokenRejectedError
+
+    srh = bit.srh
+
+    async def single_request(method: str, params=None) -> dict:
+        if srh.token_func and not srh.token:
+            await srh.ensure_new_token()
+
+        policy.stats['requests'] += 1
+        retry = 0
+        while True:
+            try:
+                result = await srh.request_attempt(method.strip().lower(), params)
+                srh.success()
+                return result
+            except TokenRejectedError:
+                await srh.ensure_new_token()
+            except RETRIED_ERRORS as err:
+                retry += 1
+                if retry > policy.attempts:
+                    policy.stats['exhausted'] += 1
+                    logger.error(f"Запрос {method} не выполнен после {policy.attempts} повторов: {err!r}")
+                    raise RuntimeError("All attempts to get data from server exhausted") from err
+                policy.stats['retries'] += 1
+                if retry == 1:
+                    policy.stats['retried_requests'] += 1
+                delay = policy.backoff(retry)
+                policy.stats['backoff_time'] += delay
+                logger.warning(f"Повтор {retry}/{policy.attempts} запроса {method} через {delay:.2f} с: {err!r}")
+                await asyncio.sleep(delay)
+
+    srh.single_request = single_request
+
+
+def create_hedger_from_env() -> RequestHedger:
+    """Дублирующие запросы по переменным окружения (BITRIX_HEDGE, BITRIX_HEDGE_QUANTILE, BITRIX_HEDGE_RATIO,
+    BITRIX_HEDGE_INITIAL_DELAY)"""
+    return RequestHedger(
+        enabled=os.getenv('BITRIX_HEDGE', '0').strip().lower() in ('1', 'true', 'yes'),
+        quantile=float(os.getenv('BITRIX_HEDGE_QUANTILE', '0.95')),
+        ratio=float(os.getenv('BITRIX_HEDGE_RATIO', '0.05')),
+        initial_delay=float(os.getenv('BITRIX_HEDGE_INITIAL_DELAY', '1')),
+    )
+
+
+def create_retry_policy_from_env() -> RetryPolicy:
+    """Бюджет повторов по переменным окружения (BITRIX_RETRY_ATTEMPTS, BITRIX_RETRY_BASE, BITRIX_RETRY_CAP)"""
+    return RetryPolicy(
+        attempts=int(os.getenv('BITRIX_RETRY_ATTEMPTS', '5')),
+        base=float(os.getenv('BITRIX_RETRY_BASE', '0.5')),
+        cap=float(os.getenv('BITRIX_RETRY_CAP', '10')),
+    )
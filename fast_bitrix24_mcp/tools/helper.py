@@ -8,19 +8,15 @@ from typing import List, Dict, Any, Optional, Union
 from datetime import datetime, timedelta, timezone, tzinfo
 from pathlib import Path
 import json
-from dotenv import load_dotenv
-load_dotenv()
 import os
-from .bitrixWork import bit
+from .bitrixWork import _get_all, _get_list, cache
+from .operating import background
+from . import metrics
 from loguru import logger
 
 
 mcp = FastMCP("helper")
 
-# Настройка кэша
-CACHE_DIR = Path("cache")
-CACHE_TTL_SECONDS = 3600  # 1 час
-
 
 def prepare_fields_to_humman_format(fields: dict, all_info_fields: dict) -> dict:
     """
@@ -89,51 +85,9 @@ def _generate_cache_key(entity: str, filter_fields: Dict[str, Any], select_field
     return f"{entity.lower()}_{cache_hash}"
 
 
-def _get_cache_path(cache_key: str) -> Path:
-    """Возвращает путь к файлу кэша."""
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
-    return CACHE_DIR / f"{cache_key}.json"
-
-
-def _load_from_cache(cache_key: str) -> Optional[List[Dict[str, Any]]]:
-    """Загружает данные из кэша, если они не устарели."""
-    cache_path = _get_cache_path(cache_key)
-    if not cache_path.exists():
-        return None
-    
-    try:
-        with cache_path.open("r", encoding="utf-8") as f:
-            cache_data = json.load(f)
-        
-        # Проверяем TTL
-        cached_at = datetime.fromisoformat(cache_data["cached_at"])
-        age = (datetime.now() - cached_at).total_seconds()
-        
-        if age > CACHE_TTL_SECONDS:
-            logger.info(f"Кэш для ключа {cache_key} устарел (возраст: {age:.0f} сек), удаляем")
-            cache_path.unlink()
-            return None
-        
-        logger.info(f"Используем кэш для ключа {cache_key} (возраст: {age:.0f} сек)")
-        return cache_data["data"]
-    except Exception as e:
-        logger.warning(f"Ошибка при чтении кэша {cache_key}: {e}")
-        return None
-
-
-def _save_to_cache(cache_key: str, data: List[Dict[str, Any]]) -> None:
-    """Сохраняет данные в кэш."""
-    try:
-        cache_path = _get_cache_path(cache_key)
-        cache_data = {
-            "cached_at": datetime.now().isoformat(),
-            "data": data
-        }
-        with cache_path.open("w", encoding="utf-8") as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
-        logger.info(f"Данные сохранены в кэш для ключа {cache_key}")
-    except Exception as e:
-        logger.warning(f"Ошибка при сохранении кэша {cache_key}: {e}")
+def _cache_namespace(cache_key: str) -> str:
+    """Пространство ключа кэша выгрузок для метрик (`deal_<md5>` -> `export_deal`)."""
+    return f"export_{metrics.cache_namespace(cache_key)}"
 
 
 @mcp.tool()
@@ -165,33 +119,41 @@ async def export_entities_to_json(entity: str, filter_fields: Dict[str, Any] = {
     
     # Проверяем кэш перед запросом к API
     cache_key = _generate_cache_key(entity, filter_fields_for_cache, select_fields)
-    cached_items = _load_from_cache(cache_key)
+    # Одновременные выгрузки с теми же параметрами ждут первую, а не выгружают данные повторно
+    cached_items, lease, _ = await cache.get_or_lock(cache_key, namespace=_cache_namespace(cache_key))
     
     if cached_items is not None:
         items = cached_items
         logger.info(f"Использованы данные из кэша для {entity}, количество записей: {len(items)}")
     else:
-        # Выполняем запрос к API
+        # Выполняем запрос к API. Выгрузка — фоновая работа: при расходе operating-времени метода она
+        # замедляется раньше интерактивных вызовов (см. operating.py)
         try:
-            if entity == "task":
-                # Используем кастомную функцию для задач
-                order = {"ID": "DESC"}  # По умолчанию
-                filter_fields_for_api = filter_fields.copy()  # Копия для API запроса
-                if 'order' in filter_fields_for_api:
-                    order = filter_fields_for_api.pop('order')
-                items = await get_tasks_by_filter(filter_fields_for_api, select_fields, order)
-            else:
-                # Стандартные сущности CRM
-                params: Dict[str, Any] = {"filter": filter_fields}
-                if select_fields and select_fields != ["*"]:
-                    params["select"] = select_fields
-                items = await bit.get_all(method_map[entity], params=params)
+            with background():
+                if entity == "task":
+                    # Используем кастомную функцию для задач
+                    order = {"ID": "DESC"}  # По умолчанию
+                    filter_fields_for_api = filter_fields.copy()  # Копия для API запроса
+                    if 'order' in filter_fields_for_api:
+                        order = filter_fields_for_api.pop('order')
+                    items = await get_tasks_by_filter(filter_fields_for_api, select_fields, order)
+                else:
+                    # Стандартные сущности CRM
+                    params: Dict[str, Any] = {"filter": filter_fields}
+                    if select_fields and select_fields != ["*"]:
+                        params["select"] = select_fields
+                    if entity == "user":
+                        items = await _get_all(method_map[entity], params=params)
+                    else:
+                        items = await _get_list(method_map[entity], params=params)
             
             # Сохраняем в кэш только при успешном запросе
-            _save_to_cache(cache_key, items)
+            cache.set(cache_key, items, namespace=_cache_namespace(cache_key), lease=lease)
         except Exception as exc:
             logger.error(f"Ошибка при запросе к Bitrix24 для {entity}: {exc}")
             return {"error": str(exc), "count": 0}
+        finally:
+            cache.release(lease)
 
     # Обработка результата
     if isinstance(items, dict):
@@ -1,6 +1,4 @@
 from mcp.server.fastmcp import FastMCP, Context
-from dotenv import load_dotenv
-load_dotenv()
 import os
 from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Any, Optional, Union
@@ -8,7 +6,8 @@ import asyncio
 from loguru import logger
 
 from .bitrixWork import (
-    bit, 
+    collect_unavailable,
+    call_batched_or_empty,
     get_contacts_by_filter, 
     get_companies_by_filter,
     get_crm_activities_by_filter,
@@ -19,10 +18,6 @@ from .deal import _get_all_deals_activity_batch
 
 mcp = FastMCP("inactive_clients")
 
-BATCH_SIZE = 50
-DELAY_BETWEEN_BATCHES = 0.5  # секунды задержки между батчами
-
-
 def _parse_datetime_from_bitrix(dt_str: str) -> datetime:
     """Парсинг даты/времени из формата Bitrix24"""
     try:
@@ -234,70 +229,40 @@ async def _get_client_activity_batch(
                 except (ValueError, TypeError):
                     pass
         
-        # Шаг 2: Получаем комментарии батчами (если включено)
+        # Шаг 2: Получаем комментарии (если включено)
+        # Вызовы объединяются в batch-запросы по 50 команд (microbatch.py), скорость ограничивает планировщик bitrixWork
         if include_comments:
-            semaphore = asyncio.Semaphore(BATCH_SIZE)
-            
             async def get_comments_for_client(entity_type: str, entity_id: int) -> tuple[str, list]:
                 """Получает комментарии для одного клиента"""
-                async with semaphore:
-                    try:
-                        comments_params = {
-                            'filter': {
-                                'ENTITY_TYPE': entity_type,
-                                'ENTITY_ID': entity_id
-                            }
+                client_key = f"C_{entity_id}" if entity_type == 'CONTACT' else f"CO_{entity_id}"
+                try:
+                    comments_params = {
+                        'filter': {
+                            'ENTITY_TYPE': entity_type,
+                            'ENTITY_ID': entity_id
                         }
-                        comments_result = await bit.call('crm.timeline.comment.list', comments_params, raw=True)
-                        
-                        comments = []
-                        if isinstance(comments_result, dict):
-                            if 'result' in comments_result and isinstance(comments_result['result'], list):
-                                comments = comments_result['result']
-                            elif 'error' in comments_result:
-                                logger.warning(f"Ошибка при получении комментариев для {entity_type} {entity_id}: {comments_result.get('error')}")
-                        elif isinstance(comments_result, list):
-                            comments = comments_result
-                        
-                        client_key = f"C_{entity_id}" if entity_type == 'CONTACT' else f"CO_{entity_id}"
-                        return client_key, comments
-                    except Exception as e:
-                        logger.warning(f"Ошибка при получении комментариев для {entity_type} {entity_id}: {e}")
-                        client_key = f"C_{entity_id}" if entity_type == 'CONTACT' else f"CO_{entity_id}"
-                        return client_key, []
-            
-            # Обрабатываем контакты батчами
-            all_comments_results = []
-            if contact_ids:
-                total_batches = (len(contact_ids) + BATCH_SIZE - 1) // BATCH_SIZE
-                for batch_idx in range(0, len(contact_ids), BATCH_SIZE):
-                    batch_contact_ids = contact_ids[batch_idx:batch_idx + BATCH_SIZE]
-                    batch_num = (batch_idx // BATCH_SIZE) + 1
-                    
-                    logger.info(f"Обработка батча комментариев контактов {batch_num}/{total_batches}")
+                    }
+                    comments_result = await call_batched_or_empty('crm.timeline.comment.list', comments_params)
                     
-                    comments_tasks = [get_comments_for_client('CONTACT', cid) for cid in batch_contact_ids]
-                    batch_results = await asyncio.gather(*comments_tasks)
-                    all_comments_results.extend(batch_results)
+                    comments = []
+                    if isinstance(comments_result, dict):
+                        if 'result' in comments_result and isinstance(comments_result['result'], list):
+                            comments = comments_result['result']
+                        elif 'error' in comments_result:
+                            logger.warning(f"Ошибка при получении комментариев для {entity_type} {entity_id}: {comments_result.get('error')}")
+                    elif isinstance(comments_result, list):
+                        comments = comments_result
                     
-                    if batch_idx + BATCH_SIZE < len(contact_ids):
-                        await asyncio.sleep(DELAY_BETWEEN_BATCHES)
+                    return client_key, comments
+                except Exception as e:
+                    logger.warning(f"Ошибка при получении комментариев для {entity_type} {entity_id}: {e}")
+                    return client_key, []
             
-            # Обрабатываем компании батчами
-            if include_companies and company_ids:
-                total_batches = (len(company_ids) + BATCH_SIZE - 1) // BATCH_SIZE
-                for batch_idx in range(0, len(company_ids), BATCH_SIZE):
-                    batch_company_ids = company_ids[batch_idx:batch_idx + BATCH_SIZE]
-                    batch_num = (batch_idx // BATCH_SIZE) + 1
-                    
-                    logger.info(f"Обработка батча комментариев компаний {batch_num}/{total_batches}")
-                    
-                    comments_tasks = [get_comments_for_client('COMPANY', cid) for cid in batch_company_ids]
-                    batch_results = await asyncio.gather(*comments_tasks)
-                    all_comments_results.extend(batch_results)
-                    
-                    if batch_idx + BATCH_SIZE < len(company_ids):
-                        await asyncio.sleep(DELAY_BETWEEN_BATCHES)
+            comments_tasks = [get_comments_for_client('CONTACT', cid) for cid in contact_ids]
+            if include_companies:
+                comments_tasks.extend(get_comments_for_client('COMPANY', cid) for cid in company_ids)
+            logger.info(f"Получение комментариев для {len(comments_tasks)} клиентов")
+            all_comments_results = await asyncio.gather(*comments_tasks)
             
             # Обрабатываем результаты комментариев
             for client_key, comments in all_comments_results:
@@ -703,14 +668,17 @@ async def get_clients_without_activity(
         
         # Получаем активность для всех клиентов батчами
         logger.info(f"Получение активности для {len(contact_ids)} контактов и {len(company_ids)} компаний батчами (включая комментарии: {include_comments})")
-        all_activities = await _get_client_activity_batch(
-            contact_ids=contact_ids if include_contacts else [],
-            company_ids=company_ids if include_companies else [],
-            days=days,
-            include_comments=include_comments,
-            include_contacts=include_contacts,
-            include_companies=include_companies
-        )
+        with collect_unavailable() as unavailable_methods:
+            all_activities = await _get_client_activity_batch(
+                contact_ids=contact_ids if include_contacts else [],
+                company_ids=company_ids if include_companies else [],
+                days=days,
+                include_comments=include_comments,
+                include_contacts=include_contacts,
+                include_companies=include_companies
+            )
+        # Комментарии недоступны (разомкнут предохранитель crm.timeline.comment.list): клиенты оценены без них
+        unavailable_sections = ['comments'] if 'crm.timeline.comment.list' in unavailable_methods else []
         
         # Находим клиентов без активности
         clients_without_activity = []
@@ -762,7 +730,10 @@ async def get_clients_without_activity(
             
             result_text = f"=== Клиенты без активности за последние {days} дней ===\n\n"
             result_text += f"Всего проверено клиентов: {total_checked}\n"
-            result_text += f"Клиентов без активности: {len(clients_without_activity)}\n\n"
+            result_text += f"Клиентов без активности: {len(clients_without_activity)}\n"
+            if unavailable_sections:
+                result_text += "Раздел комментариев недоступен: портал временно не отвечает, активность оценена без комментариев\n"
+            result_text += "\n"
             
             for idx, client_info in enumerate(clients_without_activity, 1):
                 client_type_ru = "Контакт" if client_info['client_type'] == 'contact' else "Компания"
@@ -791,7 +762,8 @@ async def get_clients_without_activity(
                 'summary': {
                     'total_checked': total_checked,
                     'without_activity': len(clients_without_activity)
-                }
+                },
+                'unavailable_sections': unavailable_sections
             }
         
     except Exception as e:
@@ -1,11 +1,9 @@
 from mcp.server.fastmcp import FastMCP, Context
-from dotenv import load_dotenv
-load_dotenv()
 import os
 from typing import List, Dict, Any
 from pprint import pprint
 
-from .bitrixWork import bit
+from .bitrixWork import _get_list
 from .helper import prepare_fields_to_humman_format
 from .userfields import get_all_info_fields
 
@@ -45,12 +43,12 @@ async def list_lead(filter_fields: Dict[str, Any] = {}, fields_id: List[str] = [
 
     text = f"Список лидов по фильтру {filter_fields}:\n"
 
-    # Получение лидов напрямую через Bitrix API
     params: Dict[str, Any] = {"filter": filter_fields}
     if "*" not in fields_id:
         params["select"] = fields_id
 
-    leads = await bit.get_all('crm.lead.list', params=params)
+    # Общий путь списков CRM: локальная копия, объединение запросов, трассировка и метрики
+    leads = await _get_list('crm.lead.list', params=params)
 
     prepared_leads: List[Dict[str, Any]] = []
     if "*" in fields_id:
@@ -1,6 +1,4 @@
 from mcp.server.fastmcp import FastMCP, Context
-from dotenv import load_dotenv
-load_dotenv()
 import os
 from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Any, Optional, Union
@@ -8,7 +6,6 @@ import asyncio
 from loguru import logger
 
 from .bitrixWork import (
-    bit, 
     get_users_by_filter,
     get_crm_activities_by_filter,
     get_tasks_by_filter,
@@ -18,10 +15,6 @@ from .bitrixWork import (
 
 mcp = FastMCP("manager_support")
 
-BATCH_SIZE = 50
-DELAY_BETWEEN_BATCHES = 0.5  # секунды задержки между батчами
-
-
 def _parse_datetime_from_bitrix(dt_str: str) -> datetime:
     """Парсинг даты/времени из формата Bitrix24"""
     try:
@@ -0,0 +1,265 @@
+"""
+Метрики процесса в текстовом формате Prometheus (`/metrics` HTTP-сервера, см. main.py)
+
+Без метрик о работе сервера можно судить только по строкам loguru в `logs/workBitrix_*.log`. Модуль держит
+счетчики, gauge и гистограммы в памяти процесса и отдает их в формате exposition 0.0.4, который читают
+Prometheus, VictoriaMetrics и агенты Grafana; зависимость `prometheus_client` не нужна.
+
+Метрики:
+- `bitrix_tool_duration_seconds{prefix, tool, status}` — время выполнения инструментов MCP (`ToolMetricsMiddleware`)
+- `bitrix_tools_in_flight` — выполняющиеся вызовы инструментов
+- `bitrix_rest_request_duration_seconds{method}` — задержка HTTP-запросов к REST API по методам (транспорт)
+- `bitrix_rest_requests_in_flight` — запросы к порталу в работе
+- `bitrix_rest_errors_total{method, status}` — ответы портала с HTTP-статусом >= 400
+- `bitrix_rate_limit_rejections_total{method, code}` — отказы по лимитам портала (`QUERY_LIMIT_EXCEEDED`,
+  `OPERATION_TIME_LIMIT`, в том числе в командах batch-запросов)
+- `bitrix_operating_seconds_total{method}` — operating-время портала по методам из ответов (operating.py;
+  `increase(...[10m])` сравнивается с лимитом портала 480 с)
+- `bitrix_operating_wait_seconds_total{method, priority}` — ожидание бюджета operating-времени
+- `bitrix_list_pages{method}` — число страниц по 50 строк в полной выборке списка (`_get_all`/`_get_list`)
+- `bitrix_cache_requests_total{namespace, result}` — попадания (`hit`) и промахи (`miss`) кэша результатов
+  по пространствам ключей (`all_managers_activity`, `comments_deal`, `export_deal` и т.д.)
+- `bitrix_cache_tier_hits_total{tier}`, `bitrix_cache_evictions_total{tier}`, `bitrix_cache_bytes{tier}` —
+  попадания (`memory`, `disk`, `stale`), вытеснения и занятый объем уровней кэша (см. cache.py)
+- `bitrix_delta_sync_total{entity, mode}` — синхронизации списков сущностей: `full`, `delta`, `reconcile`,
+  `cached` (см. delta.py)
+- `bitrix_mirror_queries_total{entity, result}` — выборки из локальной копии: `hit`, `not_ready` (копия не
+  загружена или отстала), `unsupported` (фильтр или select вне копии); `bitrix_mirror_sync_total{entity, mode}` —
+  синхронизации копии (`full`, `delta`, `reconcile`, `event`); `bitrix_mirror_rows{entity}` — строк в копии (см. mirror.py)
+- `bitrix_events_total{entity, result}` — события портала: `accepted`, `coalesced` (слито с событием той же
+  строки в окне), `ignored` (неизвестное событие), `rejected` (неверный токен приложения) (см. events.py)
+
+BITRIX_METRICS=0 отключает маршрут `/metrics` (значения все равно считаются, это несколько операций со словарем).
+"""
+import bisect
+import os
+import time
+from typing import Any, Iterable
+
+from fastmcp.server.middleware import CallNext, Middleware, MiddlewareContext
+from loguru import logger
+from starlette.requests import Request
+from starlette.responses import Response
+
+# Границы гистограмм задержки (секунды) и числа страниц
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PAGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+# Коды ошибок портала, которые означают отказ по лимитам
+RATE_LIMIT_CODES = ('QUERY_LIMIT_EXCEEDED', 'OPERATION_TIME_LIMIT')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: dict[tuple, Any] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())]
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> list[str]:
+        # Gauge без меток выводится и до первого изменения
+        if not self.labels and not self._values:
+            return [f"{self.name} 0"]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # Счетчики по интервалам (последний — выше всех границ), сумма и число наблюдений
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total, observations) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(float(total))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {observations}")
+        return lines
+
+
+tool_duration = Histogram('bitrix_tool_duration_seconds', 'Время выполнения инструментов MCP',
+                          ('prefix', 'tool', 'status'))
+tools_in_flight = Gauge('bitrix_tools_in_flight', 'Выполняющиеся вызовы инструментов MCP')
+rest_duration = Histogram('bitrix_rest_request_duration_seconds', 'Задержка HTTP-запросов к REST API Bitrix24',
+                          ('method',))
+rest_in_flight = Gauge('bitrix_rest_requests_in_flight', 'HTTP-запросы к REST API Bitrix24 в работе')
+rest_errors = Counter('bitrix_rest_errors_total', 'Ответы REST API Bitrix24 с HTTP-статусом >= 400',
+                      ('method', 'status'))
+rate_limit_rejections = Counter('bitrix_rate_limit_rejections_total', 'Отказы портала по лимитам запросов',
+                                ('method', 'code'))
+operating_time = Counter('bitrix_operating_seconds_total', 'Operating-время портала Bitrix24 по методам',
+                         ('method',))
+operating_waits = Counter('bitrix_operating_wait_seconds_total', 'Ожидание бюджета operating-времени метода',
+                          ('method', 'priority'))
+list_pages = Histogram('bitrix_list_pages', 'Страниц по 50 строк в полной выборке списочного метода',
+                       ('method',), buckets=PAGE_BUCKETS)
+cache_requests = Counter('bitrix_cache_requests_total', 'Обращения к кэшу результатов', ('namespace', 'result'))
+cache_tier_hits = Counter('bitrix_cache_tier_hits_total', 'Попадания в кэш результатов по уровням', ('tier',))
+cache_evictions = Counter('bitrix_cache_evictions_total', 'Вытеснения из кэша результатов по уровням', ('tier',))
+cache_bytes = Gauge('bitrix_cache_bytes', 'Объем значений в кэше результатов по уровням, байты', ('tier',))
+delta_syncs = Counter('bitrix_delta_sync_total', 'Синхронизации списков сущностей по дате изменения',
+                      ('entity', 'mode'))
+mirror_queries = Counter('bitrix_mirror_queries_total', 'Выборки из локальной копии сущностей', ('entity', 'result'))
+mirror_syncs = Counter('bitrix_mirror_sync_total', 'Синхронизации локальной копии сущностей', ('entity', 'mode'))
+mirror_rows = Gauge('bitrix_mirror_rows', 'Строк в локальной копии сущностей', ('entity',))
+events = Counter('bitrix_events_total', 'События портала Bitrix24 (исходящие вебхуки)', ('entity', 'result'))
+
+METRICS = [tool_duration, tools_in_flight, rest_duration, rest_in_flight, rest_errors, rate_limit_rejections,
+           operating_time, operating_waits, list_pages, cache_requests, cache_tier_hits, cache_evictions, cache_bytes,
+           delta_syncs, mirror_queries, mirror_syncs, mirror_rows, events]
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def record_rest_response(method: str, elapsed: float, status: int, body: bytes) -> None:
+    """Учитывает ответ REST API: задержка, HTTP-ошибка и отказы по лимитам (в том числе в командах batch)"""
+    rest_duration.observe(elapsed, method=method)
+    if status >= 400:
+        rest_errors.inc(method=method, status=status)
+    for code in RATE_LIMIT_CODES:
+        # Ответы без отказов не разбираются: поиск подстроки в теле дешевле разбора JSON
+        rejections = body.count(f'"{code}"'.encode())
+        if rejections:
+            rate_limit_rejections.inc(rejections, method=method, code=code)
+
+
+def record_list_pages(method: str, rows: Any) -> None:
+    """Учитывает число страниц полной выборки списка"""
+    if isinstance(rows, list):
+        list_pages.observe(max((len(rows) + 49) // 50, 1), method=method)
+
+
+def record_cache(namespace: str, hit: bool) -> None:
+    cache_requests.inc(namespace=namespace, result='hit' if hit else 'miss')
+
+
+def cache_namespace(cache_key: str) -> str:
+    """Пространство ключа кэша: ключ без хэша параметров (`comments_deal_<md5>` -> `comments_deal`)"""
+    return cache_key.rsplit('_', 1)[0]
+
+
+def split_tool_name(name: str, prefixes: Iterable[str]) -> tuple[str, str]:
+    """Префикс подключенного сервера и имя инструмента (`deal_get_deals_at_risk` -> `deal`, `get_deals_at_risk`)"""
+    for prefix in sorted(prefixes, key=len, reverse=True):
+        if name.startswith(prefix + '_'):
+            return prefix, name[len(prefix) + 1:]
+    return '', name
+
+
+class ToolMetricsMiddleware(Middleware):
+    """Время вызовов инструментов MCP по префиксам подключенных серверов"""
+
+    def __init__(self, prefixes: Iterable[str]):
+        self.prefixes = tuple(prefixes)
+
+    async def on_call_tool(self, context: MiddlewareContext, call_next: CallNext) -> Any:
+        prefix, tool = split_tool_name(context.message.name, self.prefixes)
+        status = 'ok'
+        tools_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            return await call_next(context)
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            tools_in_flight.dec()
+            tool_duration.observe(time.perf_counter() - started, prefix=prefix, tool=tool, status=status)
+
+
+def metrics_enabled() -> bool:
+    return os.getenv('BITRIX_METRICS', '1').strip().lower() not in ('0', 'false', 'no')
+
+
+def install_metrics_route(server) -> None:
+    """Добавляет маршрут GET /metrics HTTP-серверу FastMCP"""
+    @server.custom_route('/metrics', methods=['GET'], include_in_schema=False)
+    async def metrics_endpoint(request: Request) -> Response:
+        return Response(render(), media_type=CONTENT_TYPE)
+
+    logger.debug("Метрики доступны по GET /metrics")
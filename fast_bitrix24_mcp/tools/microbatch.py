@@ -0,0 +1,139 @@
+"""
+Микробатчинг одиночных вызовов REST API Bitrix24
+
+Инструменты запрашивают комментарии (`crm.timeline.comment.list`) и календари (`calendar.section.get`,
+`calendar.event.get`) отдельным вызовом на каждую сделку, клиента или менеджера. `MicroBatcher.call`
+ставит такой вызов в общую очередь процесса: вызовы, пришедшие в течение короткого окна (`window`,
+по умолчанию 10 мс) от любых одновременно работающих инструментов, отправляются одним запросом `batch`
+до 50 команд, а результаты раздаются ожидающим корутинам. Очередь отправляется сразу, как только в ней
+набирается 50 команд.
+
+Каждый вызов получает ответ в том же виде, что и `bit.call(method, params, raw=True)`: `{'result': ...}`
+(с `total`/`next`, если они есть) или `{'error': ..., 'error_description': ...}` при ошибке команды.
+Если не удался весь batch-запрос, исключение получают все вызовы этого batch.
+
+С предохранителями (`breakers`, см. breaker.py) вызов метода с разомкнутым предохранителем сразу
+завершается `CircuitOpenError` и не попадает в очередь, а ответы команд учитываются по их методам.
+"""
+import asyncio
+from typing import Any
+
+from loguru import logger
+
+from .breaker import SERVER_ERROR_CODES, failure_errors
+
+# Максимальное число команд в одном batch-запросе Bitrix24
+BATCH_LIMIT = 50
+
+
+def _command_value(values: Any, label: str) -> Any:
+    """Значение команды из result/result_error/result_total (PHP отдает пустой словарь как [])"""
+    return values.get(label) if isinstance(values, dict) else None
+
+
+class MicroBatcher:
+    """Общая очередь одиночных вызовов, которая отправляется batch-запросами"""
+
+    def __init__(self, get_bit, window: float = 0.01, limit: int = BATCH_LIMIT, breakers=None):
+        # Клиент запрашивается при отправке: очередь создается при импорте, до клиента
+        self.get_bit = get_bit
+        self.breakers = breakers
+        self.window = window
+        self.limit = min(max(int(limit), 1), BATCH_LIMIT)
+        self.stats = {'calls': 0, 'batches': 0}
+        self._loop = None
+        self._pending: list[tuple[str, dict, asyncio.Future]] = []
+        self._flush_handle = None
+        self._sending: set[asyncio.Task] = set()
+
+    def _bind_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._pending = []
+            self._flush_handle = None
+            self._sending = set()
+        return loop
+
+    async def call(self, method: str, params: dict = None) -> dict:
+        """
+        Выполняет вызов метода в составе ближайшего batch-запроса
+
+        Args:
+            method: Метод REST API
+            params: Параметры вызова
+
+        Returns:
+            Ответ команды в формате `bit.call(..., raw=True)`
+        """
+        if self.breakers is not None:
+            self.breakers.check(method)
+        loop = self._bind_loop()
+        future = loop.create_future()
+        self._pending.append((method, params or {}, future))
+        self.stats['calls'] += 1
+
+        if len(self._pending) >= self.limit:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        """Отправляет накопленные вызовы batch-запросами по `limit` команд"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, []
+        for start in range(0, len(pending), self.limit):
+            task = self._loop.create_task(self._send(pending[start:start + self.limit]))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chunk: list[tuple[str, dict, asyncio.Future]]) -> None:
+        from fast_bitrix24.utils import http_build_query
+
+        commands = {
+            f"cmd{index}": f"{method}?{http_build_query(params)}"
+            for index, (method, params, _) in enumerate(chunk)
+        }
+        self.stats['batches'] += 1
+        try:
+            response = await self.get_bit().call('batch', {'halt': 0, 'cmd': commands}, raw=True)
+        except Exception as e:
+            logger.error(f"Ошибка при выполнении batch-запроса из {len(chunk)} команд: {e}")
+            if self.breakers is not None and isinstance(e, failure_errors()):
+                for method in {method for method, _, _ in chunk}:
+                    self.breakers.record_failure(method, e)
+            for _, _, future in chunk:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        batch = response.get('result') if isinstance(response, dict) else None
+        batch = batch if isinstance(batch, dict) else {}
+        for label, (method, _, future) in zip(commands, chunk):
+            error = _command_value(batch.get('result_error'), label)
+            if error is not None and not isinstance(error, dict):
+                error = {'error': str(error)}
+            if self.breakers is not None:
+                if error is not None and error.get('error') in SERVER_ERROR_CODES:
+                    self.breakers.record_failure(method, error.get('error'))
+                else:
+                    self.breakers.record_success(method)
+            if future.done():
+                continue
+            if error is not None:
+                future.set_result({'error': error.get('error'), 'error_description': error.get('error_description')})
+                continue
+
+            answer = {'result': _command_value(batch.get('result'), label)}
+            total = _command_value(batch.get('result_total'), label)
+            if total is not None:
+                answer['total'] = total
+            next_start = _command_value(batch.get('result_next'), label)
+            if next_start is not None:
+                answer['next'] = next_start
+            future.set_result(answer)
@@ -0,0 +1,696 @@
+"""
+Локальная копия сделок, лидов, контактов, компаний, активностей и задач в SQLite для аналитических инструментов
+
+`daily_summary`, `sales_funnel`, `top_clients`, `inactive_clients`, `manager_support`, `overdue_tasks`,
+`activity_decline` и отчет активности менеджеров на каждом вызове заново выбирают пересекающиеся части
+одних и тех же списков. `Mirror` держит копию этих списков в файле SQLite (BITRIX_MIRROR_PATH, по умолчанию
+`cache/mirror.sqlite3`): строка ответа REST API (JSON, все поля и `UF_*`) плюс колонки полей фильтров с
+индексами по ASSIGNED_BY_ID, DATE_CREATE, STAGE_ID/STATUS_ID, OWNER_TYPE_ID+OWNER_ID, RESPONSIBLE_ID и дате
+изменения. Даты хранятся как unix time, поэтому сравниваются с фильтрами в любом часовом поясе.
+
+Копию поддерживает фоновая задача (приоритет `background()`, см. operating.py), запущенная первым
+обращением: полная выборка сущности, затем раз в `interval` секунд (BITRIX_MIRROR_INTERVAL, по умолчанию
+60) строки, измененные с начала прошлой синхронизации минус `overlap` (300 с), и раз в `reconcile_interval`
+секунд (BITRIX_MIRROR_RECONCILE, по умолчанию 3600) сверка ID — удаленные на портале строки не попадают в
+выборку измененных. Копия переживает перезапуск процесса: после него досинхронизируются только изменения.
+
+`plan(method, params)` решает, можно ли ответить на выборку из копии: сущность загружена и
+синхронизирована не позже `max_lag` секунд назад (BITRIX_MIRROR_MAX_LAG, по умолчанию 300), все поля
+фильтра — колонки копии, поля `select` есть в строках, сортировка только по ID. Иначе вызов идет в REST
+API, как раньше. `query`/`pages` отдают строки в формате ответа REST API, `aggregate` считает SQL-агрегаты
+по группам без разбора строк. Запросы SQLite выполняются в потоках (`asyncio.to_thread`), база в режиме WAL.
+
+Копия выключена по умолчанию (BITRIX_MIRROR=1 включает): она занимает на диске объем всех строк
+сущностей и держит фоновую нагрузку на портал.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, NamedTuple, Optional
+
+from loguru import logger
+
+from . import metrics
+from .operating import background
+
+SCHEMA_VERSION = 1
+
+INTERVAL = 60.0
+MAX_LAG = 300.0
+RECONCILE_INTERVAL = 3600.0
+OVERLAP = 300.0
+
+PAGE_SIZE = 50
+# Строк за одно обращение к SQLite при постраничной выдаче
+CHUNK_SIZE = 1000
+
+FILTER_OPERATORS = ('>=', '<=', '!=', '!@', '!%', '>', '<', '=', '!', '@', '%')
+
+# Сколько полей select собирается в SQLite (у json_object не больше 127 аргументов), больше — в Python
+SQL_PROJECTION_KEYS = 60
+
+# Типы колонок: даты — unix time
+SQL_TYPES = {'int': 'INTEGER', 'real': 'REAL', 'date': 'REAL', 'text': 'TEXT'}
+
+
+class MirrorEntity(NamedTuple):
+    """Сущность копии: таблица, поле даты изменения, колонки фильтров (поле -> тип) и индексы"""
+    name: str
+    modified_field: str
+    columns: dict[str, str]
+    indexes: tuple[tuple[str, ...], ...]
+    # crm.*.list: пользовательские поля выбираются отдельно (`UF_*`); tasks.task.list: ключи в camelCase
+    user_fields: bool = True
+    camel: bool = False
+    # Ключ фильтра по списку ID: `@ID` у crm.*.list, `ID` со списком у tasks.task.list
+    ids_key: str = '@ID'
+
+    @property
+    def select(self) -> list[str]:
+        return ['*', 'UF_*'] if self.user_fields else ['*']
+
+    def ids_filter(self, ids: list[int]) -> dict:
+        """Фильтр строк по списку ID в синтаксисе метода сущности"""
+        return {self.ids_key: list(ids)}
+
+
+MIRROR_ENTITIES = {
+    'crm.deal.list': MirrorEntity('deal', 'DATE_MODIFY', {
+        'ASSIGNED_BY_ID': 'int', 'CREATED_BY_ID': 'int', 'CATEGORY_ID': 'int', 'STAGE_ID': 'text',
+        'STAGE_SEMANTIC_ID': 'text', 'TYPE_ID': 'text', 'SOURCE_ID': 'text', 'CLOSED': 'text',
+        'OPPORTUNITY': 'real', 'CURRENCY_ID': 'text', 'CONTACT_ID': 'int', 'COMPANY_ID': 'int', 'LEAD_ID': 'int',
+        'BEGINDATE': 'date', 'CLOSEDATE': 'date', 'DATE_CREATE': 'date', 'DATE_MODIFY': 'date',
+    }, (('ASSIGNED_BY_ID',), ('DATE_CREATE',), ('STAGE_ID',), ('COMPANY_ID',), ('DATE_MODIFY',))),
+    'crm.lead.list': MirrorEntity('lead', 'DATE_MODIFY', {
+        'ASSIGNED_BY_ID': 'int', 'CREATED_BY_ID': 'int', 'STATUS_ID': 'text', 'STATUS_SEMANTIC_ID': 'text',
+        'SOURCE_ID': 'text', 'OPPORTUNITY': 'real', 'CONTACT_ID': 'int', 'COMPANY_ID': 'int',
+        'DATE_CREATE': 'date', 'DATE_MODIFY': 'date', 'DATE_CLOSED': 'date',
+    }, (('ASSIGNED_BY_ID',), ('DATE_CREATE',), ('STATUS_ID',), ('DATE_MODIFY',))),
+    'crm.contact.list': MirrorEntity('contact', 'DATE_MODIFY', {
+        'ASSIGNED_BY_ID': 'int', 'CREATED_BY_ID': 'int', 'COMPANY_ID': 'int', 'TYPE_ID': 'text',
+        'SOURCE_ID': 'text', 'DATE_CREATE': 'date', 'DATE_MODIFY': 'date',
+    }, (('ASSIGNED_BY_ID',), ('DATE_CREATE',), ('COMPANY_ID',), ('DATE_MODIFY',))),
+    'crm.company.list': MirrorEntity('company', 'DATE_MODIFY', {
+        'ASSIGNED_BY_ID': 'int', 'CREATED_BY_ID': 'int', 'COMPANY_TYPE': 'text', 'INDUSTRY': 'text',
+        'REVENUE': 'real', 'DATE_CREATE': 'date', 'DATE_MODIFY': 'date',
+    }, (('ASSIGNED_BY_ID',), ('DATE_CREATE',), ('DATE_MODIFY',))),
+    'crm.activity.list': MirrorEntity('activity', 'LAST_UPDATED', {
+        'OWNER_ID': 'int', 'OWNER_TYPE_ID': 'int', 'TYPE_ID': 'int', 'DIRECTION': 'int', 'RESPONSIBLE_ID': 'int',
+        'AUTHOR_ID': 'int', 'COMPLETED': 'text', 'PROVIDER_ID': 'text', 'PROVIDER_TYPE_ID': 'text',
+        'CREATED': 'date', 'LAST_UPDATED': 'date', 'START_TIME': 'date', 'END_TIME': 'date', 'DEADLINE': 'date',
+    }, (('OWNER_TYPE_ID', 'OWNER_ID'), ('RESPONSIBLE_ID',), ('CREATED',), ('LAST_UPDATED',))),
+    'tasks.task.list': MirrorEntity('task', 'CHANGED_DATE', {
+        'STATUS': 'int', 'PRIORITY': 'int', 'RESPONSIBLE_ID': 'int', 'CREATED_BY': 'int', 'GROUP_ID': 'int',
+        'CREATED_DATE': 'date', 'CHANGED_DATE': 'date', 'CLOSED_DATE': 'date', 'DEADLINE': 'date',
+    }, (('RESPONSIBLE_ID',), ('CREATED_DATE',), ('CHANGED_DATE',)), user_fields=False, camel=True, ids_key='ID'),
+}
+
+
+class _NotServable(Exception):
+    """Выборку нельзя выполнить по копии (поле вне колонок, неподдерживаемый оператор или значение)"""
+
+
+class MirrorPlan(NamedTuple):
+    """Выборка из копии: условие WHERE, порядок и ключи строк ответа (None — строка целиком)"""
+    entity: MirrorEntity
+    where: str
+    args: list
+    descending: bool
+    keys: Optional[list[str]]
+
+
+def _sql_projection(plan: MirrorPlan) -> bool:
+    return plan.keys is not None and len(plan.keys) <= SQL_PROJECTION_KEYS
+
+
+def _quoted(columns) -> str:
+    return ', '.join(f'"{column}"' for column in columns)
+
+
+def _camel_case(name: str) -> str:
+    """RESPONSIBLE_ID -> responsibleId (ключи tasks.task.list)"""
+    parts = name.lower().split('_')
+    return parts[0] + ''.join(part.capitalize() for part in parts[1:])
+
+
+def _row_key(entity: MirrorEntity, field: str) -> str:
+    return _camel_case(field) if entity.camel else field
+
+
+def _is_user_field(key: str) -> bool:
+    return key.upper().startswith('UF_')
+
+
+def _split_filter_key(key: str) -> tuple[str, str]:
+    """`>=DATE_CREATE` -> (`>=`, `DATE_CREATE`); `!=` — то же, что `!`"""
+    key = str(key).strip()
+    for operator in FILTER_OPERATORS:
+        if key.startswith(operator):
+            return ('!' if operator == '!=' else operator), key[len(operator):].strip().upper()
+    return '=', key.upper()
+
+
+def _timestamp(value: Any, tz: timezone) -> Optional[float]:
+    """Дата ответа или фильтра Bitrix24 в unix time (даты без пояса — в поясе портала `tz`)"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    text = str(value).strip()
+    for fmt in ('%d.%m.%Y %H:%M:%S', '%d.%m.%Y'):
+        try:
+            moment = datetime.strptime(text, fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        moment = datetime.fromisoformat(text)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=tz)
+    return moment.timestamp()
+
+
+def _coerce(column_type: str, value: Any, tz: timezone) -> Any:
+    """Значение поля к типу колонки; ValueError/TypeError — значение не приводится"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise TypeError(value)
+    if column_type == 'int':
+        return int(float(value))
+    if column_type == 'real':
+        return float(value)
+    if column_type == 'date':
+        return _timestamp(value, tz)
+    return str(value)
+
+
+def _row_value(column_type: str, value: Any, tz: timezone) -> Any:
+    try:
+        return _coerce(column_type, value, tz)
+    except (TypeError, ValueError):
+        return None
+
+
+def _lower(value: Any) -> Optional[str]:
+    # lower() SQLite меняет регистр только латиницы
+    return None if value is None else str(value).lower()
+
+
+def _row_tz(entity: MirrorEntity, row: dict) -> Optional[timezone]:
+    """Часовой пояс портала по дате изменения строки"""
+    value = row.get(_row_key(entity, entity.modified_field))
+    try:
+        moment = datetime.fromisoformat(value) if isinstance(value, str) else None
+    except ValueError:
+        return None
+    if moment is None or moment.utcoffset() is None:
+        return None
+    return timezone(moment.utcoffset())
+
+
+class Mirror:
+    """Копия списков сущностей в SQLite с фоновой синхронизацией и выборками/агрегатами по ней"""
+
+    def __init__(self, path: str | Path, pages: Callable[[str, dict], AsyncIterator[list[dict]]],
+                 enabled: bool = False, interval: float = INTERVAL, max_lag: float = MAX_LAG,
+                 reconcile_interval: float = RECONCILE_INTERVAL, overlap: float = OVERLAP):
+        self.path = Path(path)
+        self._pages = pages
+        self.enabled = enabled
+        self.interval = interval
+        self.max_lag = max_lag
+        self.reconcile_interval = reconcile_interval
+        self.overlap = overlap
+        self.stats = Counter()
+        # Состояние синхронизации сущностей (копия таблицы sync_state)
+        self._states: Optional[dict[str, dict]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Схема создается и состояние читается один раз, даже если синхронизации начались одновременно
+        self._open_lock = threading.Lock()
+
+    # === SQLite ===
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.create_function('py_lower', 1, _lower, deterministic=True)
+        return conn
+
+    def _open(self) -> None:
+        """Создает схему (при смене SCHEMA_VERSION копия строится заново) и читает состояние синхронизации"""
+        with self._open_lock:
+            if self._states is None:
+                self._create()
+
+    def _create(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                if version:
+                    logger.info(f"Схема локальной копии {version} устарела, копия строится заново")
+                for entity in MIRROR_ENTITIES.values():
+                    conn.execute(f'DROP TABLE IF EXISTS "{entity.name}"')
+                conn.execute('DROP TABLE IF EXISTS sync_state')
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sync_state (entity TEXT PRIMARY KEY, loaded_at REAL, synced_at REAL, '
+                'reconciled_at REAL, high_water REAL, fields TEXT, tz_offset REAL)'
+            )
+            for entity in MIRROR_ENTITIES.values():
+                columns = ''.join(f', "{column}" {SQL_TYPES[kind]}' for column, kind in entity.columns.items())
+                conn.execute(f'CREATE TABLE IF NOT EXISTS "{entity.name}" (ID INTEGER PRIMARY KEY{columns}, '
+                             f'data TEXT NOT NULL)')
+                for index in entity.indexes:
+                    name = f'{entity.name}_{"_".join(index).lower()}'
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{entity.name}" ({_quoted(index)})')
+            states = {}
+            for name, loaded_at, synced_at, reconciled_at, high_water, fields, tz_offset in conn.execute(
+                    'SELECT entity, loaded_at, synced_at, reconciled_at, high_water, fields, tz_offset FROM sync_state'):
+                states[name] = {
+                    'loaded_at': loaded_at, 'synced_at': synced_at, 'reconciled_at': reconciled_at,
+                    'high_water': high_water, 'fields': json.loads(fields) if fields else [],
+                    'tz': timezone(timedelta(seconds=tz_offset or 0)),
+                }
+        self._states = states
+
+    def _save_state(self, conn: sqlite3.Connection, entity: MirrorEntity, state: dict) -> None:
+        conn.execute(
+            'INSERT OR REPLACE INTO sync_state (entity, loaded_at, synced_at, reconciled_at, high_water, fields, '
+            'tz_offset) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (entity.name, state['loaded_at'], state['synced_at'], state['reconciled_at'], state['high_water'],
+             json.dumps(state['fields']), state['tz'].utcoffset(None).total_seconds()),
+        )
+
+    def _records(self, entity: MirrorEntity, rows: list[dict], tz: timezone) -> list[tuple]:
+        records = []
+        for row in rows:
+            row_id = _row_value('int', row.get(_row_key(entity, 'ID')), tz)
+            if row_id is None:
+                continue
+            records.append((
+                row_id,
+                *(_row_value(kind, row.get(_row_key(entity, column)), tz) for column, kind in entity.columns.items()),
+                json.dumps(row, ensure_ascii=False),
+            ))
+        return records
+
+    def _write(self, entity: MirrorEntity, rows: list[dict], state: dict, clear: bool = False) -> None:
+        """Записывает строки (по ID с заменой) и состояние одной транзакцией"""
+        columns = f'ID, {_quoted(entity.columns)}, data'
+        placeholders = ', '.join('?' * (len(entity.columns) + 2))
+        with closing(self._connect()) as conn, conn:
+            if clear:
+                conn.execute(f'DELETE FROM "{entity.name}"')
+            conn.executemany(f'INSERT OR REPLACE INTO "{entity.name}" ({columns}) VALUES ({placeholders})',
+                             self._records(entity, rows, state['tz']))
+            self._save_state(conn, entity, state)
+
+    def _retain(self, entity: MirrorEntity, ids: set[int], state: dict) -> int:
+        """Удаляет строки, ID которых нет на портале; возвращает число удаленных"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('CREATE TEMP TABLE portal_ids (ID INTEGER PRIMARY KEY)')
+            conn.executemany('INSERT OR IGNORE INTO portal_ids VALUES (?)', ((row_id,) for row_id in ids))
+            removed = conn.execute(
+                f'DELETE FROM "{entity.name}" WHERE ID NOT IN (SELECT ID FROM portal_ids)').rowcount
+            self._save_state(conn, entity, state)
+        return removed
+
+    def _remove(self, entity: MirrorEntity, ids: set[int]) -> int:
+        """Удаляет строки по ID; возвращает число удаленных"""
+        with closing(self._connect()) as conn, conn:
+            return conn.executemany(f'DELETE FROM "{entity.name}" WHERE ID = ?',
+                                    ((row_id,) for row_id in ids)).rowcount
+
+    def _count_rows(self, entity: MirrorEntity) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM "{entity.name}"').fetchone()[0]
+
+    # === Синхронизация ===
+
+    def _ensure_started(self) -> None:
+        """
+        Запускает фоновую синхронизацию в текущем цикле событий (после смены цикла — заново)
+
+        Базу открывает сама синхронизация в потоке: до этого сущности не готовы и выборки идут в REST API.
+        """
+        loop = asyncio.get_running_loop()
+        if self._task is not None and self._loop is loop and not self._task.done():
+            return
+        self._loop = loop
+        with background():
+            self._task = loop.create_task(self._run(), name='bitrix-mirror-sync')
+
+    async def _run(self) -> None:
+        while True:
+            for method, entity in MIRROR_ENTITIES.items():
+                try:
+                    await self.sync(method)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка синхронизации локальной копии {entity.name}: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def _fetch(self, method: str, params: dict, on_page: Callable[[list[dict]], Any]) -> None:
+        async for page in self._pages(method, params):
+            await on_page(page)
+
+    def _count(self, entity: MirrorEntity, mode: str) -> None:
+        self.stats[mode] += 1
+        metrics.mirror_syncs.inc(entity=entity.name, mode=mode)
+
+    async def sync(self, method: str) -> None:
+        """Синхронизирует сущность: полная выборка, измененные строки или сверка ID — что пора"""
+        entity = MIRROR_ENTITIES[method]
+        if self._states is None:
+            await asyncio.to_thread(self._open)
+        state = self._states.get(entity.name)
+        now = time.time()
+        if state is None or not state['loaded_at']:
+            await self._full(method, entity)
+        elif now - state['synced_at'] >= self.interval:
+            await self._delta(method, entity, state)
+            if now - state['reconciled_at'] >= self.reconcile_interval:
+                await self._reconcile(method, entity, state)
+        else:
+            return
+        metrics.mirror_rows.set(await asyncio.to_thread(self._count_rows, entity), entity=entity.name)
+
+    async def _full(self, method: str, entity: MirrorEntity) -> None:
+        started = time.time()
+        state = {'loaded_at': None, 'synced_at': None, 'reconciled_at': None, 'high_water': None,
+                 'fields': [], 'tz': datetime.now().astimezone().tzinfo}
+        # Пока выборка не закончена, сущность не отдается (loaded_at пустой, в том числе после перезапуска)
+        self._states[entity.name] = state
+        fields: dict[str, None] = {}
+        loaded = 0
+        first = True
+
+        async def store(page: list[dict]) -> None:
+            nonlocal first, loaded
+            for row in page:
+                tz = _row_tz(entity, row)
+                if tz is not None:
+                    state['tz'] = tz
+                    break
+            for row in page[:1]:
+                fields.update(dict.fromkeys(row))
+            await asyncio.to_thread(self._write, entity, page, state, first)
+            first = False
+            loaded += len(page)
+
+        await self._fetch(method, {'filter': {}, 'select': entity.select}, store)
+        if first:
+            await asyncio.to_thread(self._write, entity, [], state, True)
+        # Строки актуальны на начало выборки: с него отсчитываются отставание и следующие изменения
+        state.update(loaded_at=time.time(), synced_at=started, reconciled_at=started, high_water=started,
+                     fields=list(fields) or state['fields'])
+        await asyncio.to_thread(self._write, entity, [], state)
+        self._count(entity, 'full')
+        logger.info(f"Локальная копия {entity.name}: загружено {loaded} строк за {time.time() - started:.1f} с")
+
+    async def _delta(self, method: str, entity: MirrorEntity, state: dict) -> None:
+        started = time.time()
+        since = datetime.fromtimestamp(state['high_water'] - self.overlap, state['tz']).isoformat()
+        changed = 0
+
+        async def store(page: list[dict]) -> None:
+            nonlocal changed
+            await asyncio.to_thread(self._write, entity, page, state)
+            changed += len(page)
+
+        await self._fetch(method, {'filter': {f'>={entity.modified_field}': since}, 'select': entity.select}, store)
+        state.update(synced_at=started, high_water=started)
+        await asyncio.to_thread(self._write, entity, [], state)
+        self._count(entity, 'delta')
+        if changed:
+            logger.info(f"Локальная копия {entity.name}: обновлено {changed} строк")
+
+    async def _reconcile(self, method: str, entity: MirrorEntity, state: dict) -> None:
+        ids: set[int] = set()
+
+        async def collect(page: list[dict]) -> None:
+            for row in page:
+                row_id = _row_value('int', row.get(_row_key(entity, 'ID')), state['tz'])
+                if row_id is not None:
+                    ids.add(row_id)
+
+        await self._fetch(method, {'filter': {}, 'select': ['ID']}, collect)
+        state['reconciled_at'] = time.time()
+        removed = await asyncio.to_thread(self._retain, entity, ids, state)
+        self._count(entity, 'reconcile')
+        if removed:
+            logger.info(f"Локальная копия {entity.name}: удалено {removed} строк, которых нет на портале")
+
+    async def refresh(self, method: str, ids: set[int]) -> None:
+        """
+        Перечитывает строки сущности по ID (изменения из событий портала, см. events.py)
+
+        Строки, которых нет в ответе, удаляются только после проверки: каждая запрашивается еще раз
+        диапазоном `>=ID`/`<=ID` (сравнения ID понимают все методы, ими идут курсоры pagination.py) и удаляется,
+        если ее нет и там.
+        Копия, которая еще не загружена, не меняется: полная выборка и так прочитает строки.
+        """
+        entity = MIRROR_ENTITIES.get(method)
+        state = self._states.get(entity.name) if entity is not None and self._states is not None else None
+        if not self.enabled or not ids or not state or not state['loaded_at']:
+            return
+        found: set[int] = set()
+
+        async def store(page: list[dict]) -> None:
+            for row in page:
+                row_id = _row_value('int', row.get(_row_key(entity, 'ID')), state['tz'])
+                if row_id is not None:
+                    found.add(row_id)
+            await asyncio.to_thread(self._write, entity, page, state)
+
+        ordered = sorted(ids)
+        for start in range(0, len(ordered), PAGE_SIZE):
+            chunk = ordered[start:start + PAGE_SIZE]
+            await self._fetch(method, {'filter': entity.ids_filter(chunk), 'select': entity.select}, store)
+        # Строки нет в ответе: удалена на портале или фильтр по списку ID не сработал — проверяем по одной
+        for row_id in sorted(ids - found):
+            await self._fetch(method, {'filter': {'>=ID': row_id, '<=ID': row_id}, 'select': entity.select}, store)
+        gone = ids - found
+        removed = await asyncio.to_thread(self._remove, entity, gone) if gone else 0
+        self._count(entity, 'event')
+        logger.info(f"Локальная копия {entity.name}: по событиям обновлено {len(found)} строк, удалено {removed}")
+
+    # === Выборки ===
+
+    def ready(self, method: str) -> bool:
+        """Загружена ли сущность и синхронизирована ли не позже max_lag секунд назад"""
+        entity = MIRROR_ENTITIES.get(method)
+        state = self._states.get(entity.name) if entity is not None and self._states is not None else None
+        return bool(state and state['loaded_at'] and time.time() - state['synced_at'] <= self.max_lag)
+
+    def _condition(self, entity: MirrorEntity, key: str, value: Any, tz: timezone) -> tuple[str, list]:
+        operator, field = _split_filter_key(key)
+        if field == 'ID':
+            kind = 'int'
+        elif field in entity.columns:
+            kind = entity.columns[field]
+        else:
+            raise _NotServable(field)
+        column = f'"{field}"'
+
+        if isinstance(value, dict):
+            value = list(value.values())
+        if isinstance(value, (list, tuple, set)):
+            operator = {'=': '@', '!': '!@'}.get(operator, operator)
+            if operator not in ('@', '!@'):
+                raise _NotServable(key)
+            values = [_coerce(kind, item, tz) for item in value]
+            if any(item is None for item in values):
+                raise _NotServable(key)
+            if not values:
+                return ('0' if operator == '@' else '1'), []
+            placeholders = ', '.join('?' * len(values))
+            if operator == '@':
+                return f'{column} IN ({placeholders})', values
+            return f'({column} IS NULL OR {column} NOT IN ({placeholders}))', values
+
+        if operator in ('%', '!%'):
+            if kind != 'text' or value is None or value == '':
+                raise _NotServable(key)
+            if operator == '%':
+                return f'instr(py_lower({column}), ?) > 0', [str(value).lower()]
+            return f'({column} IS NULL OR instr(py_lower({column}), ?) = 0)', [str(value).lower()]
+
+        value = _coerce(kind, value, tz)
+        if value is None:
+            # Пустое значение портал трактует по-своему для разных полей
+            raise _NotServable(key)
+        if operator in ('=', '@'):
+            return f'{column} = ?', [value]
+        if operator in ('!', '!@'):
+            return f'{column} IS NOT ?', [value]
+        return f'{column} {operator} ?', [value]
+
+    def _keys(self, entity: MirrorEntity, fields: list[str], select: Optional[list]) -> Optional[list[str]]:
+        """Ключи строк ответа для select (None — все поля строки копии)"""
+        id_key = _row_key(entity, 'ID')
+        known = set(fields)
+        keys: dict[str, None] = {id_key: None}
+        for name in [str(name) for name in select or []] or ['*']:
+            if name == '*':
+                keys.update(dict.fromkeys(key for key in fields if not (entity.user_fields and _is_user_field(key))))
+            elif name.upper() == 'UF_*' and entity.user_fields:
+                keys.update(dict.fromkeys(key for key in fields if _is_user_field(key)))
+            else:
+                key = name if name in known else _row_key(entity, name.upper())
+                if key not in known:
+                    # Поле, которого нет в выборке `*`/`UF_*` (например, COMMUNICATIONS активностей)
+                    raise _NotServable(name)
+                keys[key] = None
+        return None if set(keys) == known else list(keys)
+
+    def plan(self, method: str, params: Optional[dict] = None) -> Optional[MirrorPlan]:
+        """
+        План выборки из копии или None, если выборку нужно выполнить в REST API
+
+        Первое обращение запускает фоновую синхронизацию.
+        """
+        entity = MIRROR_ENTITIES.get(method)
+        if not self.enabled or entity is None:
+            return None
+        self._ensure_started()
+        if not self.ready(method):
+            self.stats['not_ready'] += 1
+            metrics.mirror_queries.inc(entity=entity.name, result='not_ready')
+            return None
+
+        params = params or {}
+        state = self._states[entity.name]
+        try:
+            order = {str(key).upper(): str(value).upper() for key, value in (params.get('order') or {}).items()}
+            if set(order) - {'ID'}:
+                raise _NotServable('order')
+            conditions, args = [], []
+            for key, value in (params.get('filter') or {}).items():
+                condition, values = self._condition(entity, key, value, state['tz'])
+                conditions.append(condition)
+                args.extend(values)
+            keys = self._keys(entity, state['fields'], params.get('select'))
+        except (_NotServable, TypeError, ValueError) as e:
+            self.stats['unsupported'] += 1
+            metrics.mirror_queries.inc(entity=entity.name, result='unsupported')
+            logger.debug(f"Выборка {method} выполняется в REST API: {e}")
+            return None
+
+        self.stats['hit'] += 1
+        metrics.mirror_queries.inc(entity=entity.name, result='hit')
+        return MirrorPlan(entity, ' AND '.join(conditions) or '1', args, order.get('ID') == 'DESC', keys)
+
+    def _select(self, plan: MirrorPlan, after: Optional[int], limit: Optional[int]) -> list[tuple[int, str]]:
+        where, args = plan.where, list(plan.args)
+        if after is not None:
+            where = f'({where}) AND ID {"<" if plan.descending else ">"} ?'
+            args.append(after)
+        data, keys = 'data', []
+        if _sql_projection(plan):
+            # Поля select собираются в SQLite: в Python разбирается JSON только запрошенных полей
+            data = f'json_object({", ".join(["?, json_extract(data, ?)"] * len(plan.keys))})'
+            for key in plan.keys:
+                keys.extend((key, '$."' + key.replace('"', '\\"') + '"'))
+        sql = (f'SELECT ID, {data} FROM "{plan.entity.name}" WHERE {where} '
+               f'ORDER BY ID {"DESC" if plan.descending else "ASC"}')
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        with closing(self._connect()) as conn:
+            return conn.execute(sql, keys + args).fetchall()
+
+    @staticmethod
+    def _render(plan: MirrorPlan, records: list[tuple[int, str]]) -> list[dict]:
+        rows = [json.loads(data) for _, data in records]
+        if plan.keys is None or _sql_projection(plan):
+            return rows
+        return [{key: row.get(key) for key in plan.keys} for row in rows]
+
+    async def execute(self, plan: MirrorPlan) -> list[dict]:
+        """Все строки выборки в формате ответа REST API, по ID"""
+        return self._render(plan, await asyncio.to_thread(self._select, plan, None, None))
+
+    async def pages(self, plan: MirrorPlan) -> AsyncIterator[list[dict]]:
+        """Строки выборки страницами по 50 (как `pagination.iter_list`), из SQLite — частями по ID"""
+        after = None
+        while True:
+            records = await asyncio.to_thread(self._select, plan, after, CHUNK_SIZE)
+            rows = self._render(plan, records)
+            for start in range(0, len(rows), PAGE_SIZE):
+                yield rows[start:start + PAGE_SIZE]
+            if len(records) < CHUNK_SIZE:
+                return
+            after = records[-1][0]
+
+    async def query(self, method: str, params: Optional[dict] = None) -> Optional[list[dict]]:
+        """Строки выборки из копии или None, если выборку нужно выполнить в REST API"""
+        plan = self.plan(method, params)
+        return None if plan is None else await self.execute(plan)
+
+    def _aggregate(self, plan: MirrorPlan, group_by: str, measures: dict[str, str]) -> list[tuple]:
+        expressions = ', '.join(f'{expression} AS "{name}"' for name, expression in measures.items())
+        sql = (f'SELECT "{group_by}", {expressions} FROM "{plan.entity.name}" WHERE {plan.where} '
+               f'GROUP BY "{group_by}"')
+        with closing(self._connect()) as conn:
+            return conn.execute(sql, plan.args).fetchall()
+
+    async def aggregate(self, method: str, filter_fields: dict, group_by: str,
+                        measures: dict[str, str]) -> Optional[dict[Any, dict[str, Any]]]:
+        """
+        SQL-агрегаты по группам строк фильтра или None, если копия не может выполнить выборку
+
+        Args:
+            method: Списочный метод сущности (`crm.deal.list` и т.д.)
+            filter_fields: Фильтр в формате REST API
+            group_by: Колонка группировки (`ASSIGNED_BY_ID`, `RESPONSIBLE_ID`)
+            measures: Имя -> SQL-выражение над колонками (`COUNT(*)`, `SUM(STATUS = 5)`)
+
+        Returns:
+            Значение колонки группировки -> {имя: значение}
+        """
+        entity = MIRROR_ENTITIES.get(method)
+        if entity is None or group_by not in entity.columns:
+            return None
+        plan = self.plan(method, {'filter': filter_fields, 'select': ['ID']})
+        if plan is None:
+            return None
+        rows = await asyncio.to_thread(self._aggregate, plan, group_by, measures)
+        return {row[0]: dict(zip(measures, row[1:])) for row in rows}
+
+    def reset(self) -> None:
+        """Сбрасывает счетчики (копия остается в файле)"""
+        self.stats = Counter()
+
+    def snapshot(self) -> dict:
+        states = self._states or {}
+        return {
+            **dict(self.stats),
+            'ready': sorted(entity.name for method, entity in MIRROR_ENTITIES.items() if self.ready(method)),
+            'loaded': sorted(name for name, state in states.items() if state['loaded_at']),
+        }
+
+
+def create_mirror_from_env(pages: Callable[[str, dict], AsyncIterator[list[dict]]]) -> Mirror:
+    """Локальная копия по переменным окружения (BITRIX_MIRROR, BITRIX_MIRROR_PATH, BITRIX_MIRROR_INTERVAL,
+    BITRIX_MIRROR_MAX_LAG, BITRIX_MIRROR_RECONCILE)"""
+    return Mirror(
+        os.getenv('BITRIX_MIRROR_PATH', os.path.join(os.getenv('BITRIX_CACHE_DIR', 'cache'), 'mirror.sqlite3')),
+        pages,
+        enabled=os.getenv('BITRIX_MIRROR', '0').strip().lower() in ('1', 'true', 'yes'),
+        interval=float(os.getenv('BITRIX_MIRROR_INTERVAL', str(INTERVAL))),
+        max_lag=float(os.getenv('BITRIX_MIRROR_MAX_LAG', str(MAX_LAG))),
+        reconcile_interval=float(os.getenv('BITRIX_MIRROR_RECONCILE', str(RECONCILE_INTERVAL))),
+        overlap=float(os.getenv('BITRIX_MIRROR_OVERLAP', str(OVERLAP))),
+    )
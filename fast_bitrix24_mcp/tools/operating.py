@@ -0,0 +1,254 @@
+"""
+Учет operating-времени Bitrix24 по методам и упреждающее замедление фоновой работы
+
+Каждый ответ REST API содержит `time.operating` — сколько секунд сервер портала выполнял запрос, а ответ
+batch-запроса — такое же время по каждой команде (`result.result_time`). Портал блокирует метод
+(`OPERATION_TIME_LIMIT`), когда сумма operating-времени метода за 10 минут превышает лимит (480 с), и
+блокировка действует для всех вызовов метода, в том числе интерактивных вызовов агента.
+
+fast_bitrix24 ждет только при достижении самого лимита и записывает время batch-запроса на метод `batch`,
+а не на методы его команд. `OperatingBudget` вместо этого:
+- записывает operating-время каждого ответа клиента `bit` на методы (для batch — по командам) и держит
+  скользящее окно `period` секунд (BITRIX_OPERATING_PERIOD, по умолчанию 600);
+- фоновые запросы (выгрузки, прогрев кэша — код внутри `background()`) ждут, пока использование метода
+  выше доли `background_share` лимита (BITRIX_OPERATING_BACKGROUND_SHARE, по умолчанию 0.5), и оставляют
+  остаток окна интерактивным вызовам;
+- интерактивные запросы ждут только у доли `interactive_share` (BITRIX_OPERATING_INTERACTIVE_SHARE,
+  по умолчанию 0.9): запас покрывает запросы, которые уже выполняются и еще не отчитались временем.
+
+Лимит — BITRIX_OPERATING_LIMIT (по умолчанию 480 с). Кроме ожидания бюджета фоновые запросы уступают
+очередь интерактивным в окне параллельности планировщика (scheduler.py). BITRIX_OPERATING_BUDGET=0
+возвращает учет operating-времени fast_bitrix24.
+"""
+import asyncio
+import os
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterable, Iterator
+
+from loguru import logger
+
+from . import metrics
+
+INTERACTIVE, BACKGROUND = 'interactive', 'background'
+
+_priority: ContextVar["str | SharedPriority"] = ContextVar('bitrix_request_priority', default=INTERACTIVE)
+
+
+class SharedPriority:
+    """Приоритет запроса, общего для нескольких вызовов (singleflight.py): фоновый, пока фоновые все вызовы"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value: str = INTERACTIVE):
+        self.value = value
+
+    def join(self, priority: str) -> None:
+        """Учитывает приоритет присоединившегося вызова: интерактивный повышает приоритет общего запроса"""
+        if priority == INTERACTIVE:
+            self.value = INTERACTIVE
+
+
+def current_priority() -> str:
+    """Приоритет запросов текущей задачи"""
+    priority = _priority.get()
+    return priority.value if isinstance(priority, SharedPriority) else priority
+
+
+@contextmanager
+def background() -> Iterator[None]:
+    """
+    Запросы внутри блока — фоновая работа (выгрузки, прогрев кэша)
+
+    Задачи asyncio, созданные внутри блока, наследуют приоритет.
+    """
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+@contextmanager
+def shared(priority: SharedPriority) -> Iterator[None]:
+    """
+    Запросы внутри блока — с приоритетом общего запроса
+
+    Задачи asyncio, созданные внутри блока, видят его изменения (`SharedPriority.join`).
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def request_methods(method: str, params: Any) -> list[str]:
+    """Методы, на которые расходуется operating-время запроса (для batch — методы команд)"""
+    method = method.strip().lower()
+    if method != 'batch':
+        return [method]
+    commands = params.get('cmd') if isinstance(params, dict) else None
+    if not isinstance(commands, dict):
+        return []
+    return sorted({command.split('?', 1)[0].strip().lower() for command in commands.values() if isinstance(command, str)})
+
+
+def _operating(block: Any) -> float:
+    if isinstance(block, dict):
+        try:
+            return float(block.get('operating') or 0)
+        except (TypeError, ValueError):
+            return 0.0
+    return 0.0
+
+
+def response_operating(method: str, params: Any, response: Any) -> list[tuple[str, float]]:
+    """Operating-время ответа по методам: `time.operating` или `result.result_time` команд batch"""
+    if not isinstance(response, dict):
+        return []
+    method = method.strip().lower()
+    if method != 'batch':
+        return [(method, _operating(response.get('time')))]
+    result = response.get('result')
+    times = result.get('result_time') if isinstance(result, dict) else None
+    commands = params.get('cmd') if isinstance(params, dict) else None
+    if not isinstance(times, dict) or not isinstance(commands, dict):
+        return []
+    return [
+        (commands[label].split('?', 1)[0].strip().lower(), _operating(block))
+        for label, block in times.items()
+        if isinstance(commands.get(label), str)
+    ]
+
+
+class OperatingBudget:
+    """Скользящее окно operating-времени по методам с порогами для интерактивных и фоновых запросов"""
+
+    def __init__(self, enabled: bool = True, limit: float = 480.0, period: float = 600.0,
+                 background_share: float = 0.5, interactive_share: float = 0.9):
+        self.enabled = enabled
+        self.limit = limit
+        self.period = period
+        self.shares = {INTERACTIVE: interactive_share, BACKGROUND: min(background_share, interactive_share)}
+        self.stats = {'recorded': 0.0, 'waits': Counter(), 'waited': Counter()}
+        # Записи метода (время ответа, operating-время), старые слева
+        self._records: dict[str, deque] = defaultdict(deque)
+        self._used: dict[str, float] = defaultdict(float)
+
+    def _expire(self, method: str, now: float) -> None:
+        records = self._records[method]
+        cut_off = now - self.period
+        while records and records[0][0] <= cut_off:
+            self._used[method] -= records.popleft()[1]
+        if not records:
+            self._used[method] = 0.0
+
+    def record(self, method: str, seconds: float) -> None:
+        """Учитывает operating-время ответа метода"""
+        if seconds <= 0:
+            return
+        now = time.monotonic()
+        self._records[method].append((now, seconds))
+        self._used[method] += seconds
+        self.stats['recorded'] += seconds
+        metrics.operating_time.inc(seconds, method=method)
+
+    def record_response(self, method: str, params: Any, response: Any) -> None:
+        for name, seconds in response_operating(method, params, response):
+            self.record(name, seconds)
+
+    def used(self, method: str) -> float:
+        """Operating-время метода в текущем окне, секунды"""
+        self._expire(method, time.monotonic())
+        return self._used[method]
+
+    def wait_time(self, method: str, priority: str = INTERACTIVE) -> float:
+        """Сколько ждать, пока использование метода опустится ниже порога приоритета"""
+        now = time.monotonic()
+        self._expire(method, now)
+        threshold = self.limit * self.shares.get(priority, self.shares[INTERACTIVE])
+        excess = self._used[method] - threshold
+        if excess < 0:
+            return 0.0
+        # Ждем, пока из окна выйдет достаточно старых записей
+        freed = 0.0
+        for when, seconds in self._records[method]:
+            freed += seconds
+            if freed > excess:
+                break
+        return max(when + self.period - now, 0.0)
+
+    async def admit(self, methods: Iterable[str]) -> None:
+        """Ожидает, пока у всех методов запроса есть бюджет для приоритета текущей задачи"""
+        if not self.enabled:
+            return
+        priority = current_priority()
+        for method in methods:
+            delay = self.wait_time(method, priority)
+            if delay <= 0:
+                continue
+            self.stats['waits'][priority] += 1
+            logger.info(f"Operating-время метода {method}: {self.used(method):.1f} из {self.limit:.0f} с за "
+                        f"{self.period:.0f} с, {priority} запрос ждет {delay:.1f} с")
+            while delay > 0:
+                await asyncio.sleep(delay)
+                self.stats['waited'][priority] += delay
+                metrics.operating_waits.inc(delay, method=method, priority=priority)
+                delay = self.wait_time(method, priority)
+
+    def reset(self) -> None:
+        """Очищает окно и счетчики"""
+        self.stats = {'recorded': 0.0, 'waits': Counter(), 'waited': Counter()}
+        self._records.clear()
+        self._used.clear()
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        for method in list(self._records):
+            self._expire(method, now)
+        return {
+            'recorded': round(self.stats['recorded'], 4),
+            'waits': dict(self.stats['waits']),
+            'waited': {priority: round(seconds, 4) for priority, seconds in self.stats['waited'].items()},
+            'used': {method: round(used, 4) for method, used in sorted(self._used.items()) if used > 0},
+        }
+
+
+def install_operating_budget(bit, budget: OperatingBudget) -> None:
+    """
+    Подставляет учет operating-времени `budget` в клиент fast_bitrix24
+
+    Попытка запроса (`srh.request_attempt`) ждет бюджета методов до места в окне планировщика, время из
+    ответа записывается вместо окон методов библиотеки (`respect_velocity_policy` отключается).
+    Ставится до `scheduler.install_scheduler`, который передает ответы дальше в `srh.add_throttler_records`.
+    """
+    if not budget.enabled:
+        return
+    srh = bit.srh
+    request_attempt = srh.request_attempt
+
+    async def budgeted_attempt(method: str, params=None) -> dict:
+        await budget.admit(request_methods(method, params))
+        return await request_attempt(method, params)
+
+    def records(method: str, params: dict, json: dict):
+        budget.record_response(method, params, json)
+
+    srh.respect_velocity_policy = False
+    srh.request_attempt = budgeted_attempt
+    srh.add_throttler_records = records
+
+
+def create_operating_budget_from_env() -> OperatingBudget:
+    """Бюджет operating-времени по переменным окружения (BITRIX_OPERATING_BUDGET, BITRIX_OPERATING_LIMIT,
+    BITRIX_OPERATING_PERIOD, BITRIX_OPERATING_BACKGROUND_SHARE, BITRIX_OPERATING_INTERACTIVE_SHARE)"""
+    return OperatingBudget(
+        enabled=os.getenv('BITRIX_OPERATING_BUDGET', '1').strip().lower() in ('1', 'true', 'yes'),
+        limit=float(os.getenv('BITRIX_OPERATING_LIMIT', '480')),
+        period=float(os.getenv('BITRIX_OPERATING_PERIOD', '600')),
+        background_share=float(os.getenv('BITRIX_OPERATING_BACKGROUND_SHARE', '0.5')),
+        interactive_share=float(os.getenv('BITRIX_OPERATING_INTERACTIVE_SHARE', '0.9')),
+    )
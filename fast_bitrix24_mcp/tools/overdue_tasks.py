@@ -1,6 +1,4 @@
 from mcp.server.fastmcp import FastMCP, Context
-from dotenv import load_dotenv
-load_dotenv()
 import os
 from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Any, Optional, Union
@@ -8,7 +6,6 @@ import asyncio
 from loguru import logger
 
 from .bitrixWork import (
-    bit, 
     get_users_by_filter,
     get_tasks_by_filter
 )
@@ -197,7 +194,7 @@ async def get_managers_with_overdue_tasks(
                     select_fields=['ID', 'TITLE', 'STATUS', 'DEADLINE', 'RESPONSIBLE_ID', 'CREATED_DATE']
                 )
             
-            # Выполняем запросы параллельно
+            # Выполняем запросы параллельно (параллельность ограничивает планировщик bitrixWork)
             tasks_results = await asyncio.gather(*[get_tasks_for_manager(mid) for mid in manager_ids_list])
             
             # Объединяем результаты
@@ -0,0 +1,311 @@
+"""
+Постраничная выборка списочных методов CRM (crm.*.list) с keyset-пагинацией по ID
+
+`bit.get_all` листает список смещением `start`: на каждой странице портал заново считает `total` и
+пропускает `start` строк, поэтому страницы в конце больших списков (сотни тысяч активностей) становятся
+все дороже по operating-времени и упираются в OPERATION_TIME_LIMIT.
+
+`fetch_list` запрашивает первую страницу с сортировкой `order: {ID: ASC}` — она дает `total`.
+Если список больше порога (`BITRIX_KEYSET_THRESHOLD`, по умолчанию 5000 строк), остальные страницы
+выбираются по курсору: `filter: {'>ID': последний ID}` и `start: -1` (без подсчета total). В одном
+batch-запросе до 50 страниц, каждая следующая ссылается на последний ID предыдущей
+(`$result[p0][49][ID]`), поэтому число запросов то же, что у `get_all`, а стоимость страниц не растет.
+Небольшие списки дочитываются смещением — одним-двумя batch-запросами, как в `get_all`.
+
+Цепочка страниц по курсору последовательна, поэтому большой список делится на диапазоны ID
+(`BITRIX_FETCH_SHARDS`, по умолчанию 4): наибольший ID узнается одним запросом (`order: {ID: DESC}`,
+`start: -1`), диапазон от последнего ID первой страницы до него делится на равные части, и каждая часть
+читается своей цепочкой (`>ID` + `<=ID`) параллельно под общим планировщиком. Время выборки растет с
+числом batch-запросов на диапазон, а не с числом страниц всего списка.
+
+Сортировка `order: {ID: DESC}` сохраняется: `iter_list` идет по курсору `<ID`, `fetch_list` выбирает
+диапазоны по возрастанию и разворачивает результат. Сортировка по другим полям выполняется через
+`bit.get_all`.
+
+`iter_list` — потоковый вариант: асинхронный генератор отдает список постранично, пока следующий
+batch-запрос уже выполняется, поэтому в памяти не больше двух batch (до 5000 строк) независимо от размера
+списка, а обработка страниц идет параллельно с сетью. Поддерживает и `tasks.task.list`
+(строки в `{'tasks': [...]}`, ключ `id`, поэтому курсор — `$result[p0][tasks][49][id]`).
+
+Совпадение выборки по курсору с `bit.get_all` для всех методов: `python -m benchmarks.consistency`.
+"""
+import asyncio
+import math
+import os
+from typing import Any, AsyncIterator, Optional
+
+from loguru import logger
+
+from .projection import track_select
+
+PAGE_SIZE = 50
+BATCH_LIMIT = 50
+
+# Начиная с какого числа строк список дочитывается по курсору ID, а не смещением
+KEYSET_THRESHOLD = int(os.getenv('BITRIX_KEYSET_THRESHOLD', '5000'))
+# На сколько диапазонов ID делится большой список для параллельной выборки
+FETCH_SHARDS = int(os.getenv('BITRIX_FETCH_SHARDS', '4'))
+
+
+def _page_rows(value: Any) -> list[dict]:
+    """Строки страницы: список (crm.*.list) или {'tasks': [...]} (tasks.task.list); PHP отдает пустое как []"""
+    if isinstance(value, dict):
+        value = value.get('tasks')
+    return list(value) if isinstance(value, list) else []
+
+
+def _row_id(row: dict) -> int:
+    """ID строки (у задач ключ `id`)"""
+    return int(row.get('ID') or row.get('id'))
+
+
+def _cursor(method: str, label: str) -> str:
+    """Ссылка batch на ID последней строки полной страницы команды `label`"""
+    if method == 'tasks.task.list':
+        return f"$result[{label}][tasks][{PAGE_SIZE - 1}][id]"
+    return f"$result[{label}][{PAGE_SIZE - 1}][ID]"
+
+
+def _batch_pages(response: dict) -> dict:
+    """Результаты команд batch-ответа (с проверкой ошибок команд)"""
+    from fast_bitrix24.server_response import ServerResponseParser
+
+    ServerResponseParser(response).raise_for_errors()
+    results = response.get('result', {}).get('result')
+    return results if isinstance(results, dict) else {}
+
+
+def _list_params(method: str, params: Optional[dict]) -> Optional[dict]:
+    """Параметры с сортировкой по ID (ASC или DESC из `order`) и ID в select; None — если задана сортировка не по ID"""
+    params = dict(params or {})
+    track_select(method, params.get('select'))
+    order = {str(key).upper(): str(value).upper() for key, value in (params.pop('order', None) or {}).items()}
+    if order and set(order) != {'ID'}:
+        return None
+    select = list(params.get('select') or [])
+    # Для курсора нужен ID (портал и так возвращает его в каждой строке, но не полагаемся на это)
+    if select and 'ID' not in select and '*' not in select:
+        params['select'] = [*select, 'ID']
+    params['filter'] = dict(params.get('filter') or {})
+    params['order'] = {'ID': 'DESC' if order.get('ID') == 'DESC' else 'ASC'}
+    return params
+
+
+def _descending(params: dict) -> bool:
+    return params['order']['ID'] == 'DESC'
+
+
+async def _first_page(bit, method: str, params: dict) -> tuple[list[dict], int]:
+    """Первая страница списка и total"""
+    first = await bit.call(method, {**params, 'start': 0}, raw=True)
+    rows = _page_rows(first.get('result'))
+    return rows, int(first.get('total') or len(rows))
+
+
+def _cancel(requests) -> None:
+    """Отменяет незавершенные запросы (генератор закрыт до конца выборки)"""
+    for request in requests:
+        if request is not None and not request.done():
+            request.cancel()
+
+
+async def _iter_offset(bit, method: str, params: dict, total: int) -> AsyncIterator[list[dict]]:
+    """Страницы после первой смещением `start` (batch-запросы по 50 страниц отправляются сразу)"""
+    from fast_bitrix24.utils import http_build_query
+
+    starts = list(range(PAGE_SIZE, total, PAGE_SIZE))
+    batches = []
+    for chunk_start in range(0, len(starts), BATCH_LIMIT):
+        commands = {
+            f"p{index}": f"{method}?{http_build_query({**params, 'start': start})}"
+            for index, start in enumerate(starts[chunk_start:chunk_start + BATCH_LIMIT])
+        }
+        batches.append((commands, asyncio.ensure_future(bit.call('batch', {'halt': 0, 'cmd': commands}, raw=True))))
+
+    try:
+        for commands, request in batches:
+            pages = _batch_pages(await request)
+            for label in commands:
+                page = _page_rows(pages.get(label))
+                if page:
+                    yield page
+    finally:
+        _cancel([request for _, request in batches])
+
+
+def _keyset_request(bit, method: str, params: dict, last_id: int, pages: int) -> asyncio.Future:
+    """batch-запрос из `pages` страниц по курсору: каждая следующая начинается после последнего ID предыдущей"""
+    from fast_bitrix24.utils import http_build_query
+
+    commands = {}
+    # При сортировке по убыванию ID следующая страница — строки с меньшими ID
+    key = '<ID' if _descending(params) else '>ID'
+    for index in range(pages):
+        cursor = last_id if index == 0 else _cursor(method, f"p{index - 1}")
+        page_params = {**params, 'filter': {**params['filter'], key: cursor}, 'start': -1}
+        commands[f"p{index}"] = f"{method}?{http_build_query(page_params)}"
+    return asyncio.ensure_future(bit.call('batch', {'halt': 0, 'cmd': commands}, raw=True))
+
+
+async def _iter_keyset(bit, method: str, params: dict, last_id: int, expected: int,
+                       exact: bool = True) -> AsyncIterator[list[dict]]:
+    """
+    Страницы после `last_id` по курсору `>ID` (`<ID` при сортировке по убыванию) без подсчета total
+
+    `expected` — ожидаемое число строк: точный остаток total (`exact=True`) или оценка для диапазона ID
+    (`exact=False`, выборка продолжается, пока страницы полные). Следующий batch-запрос отправляется
+    до того, как страницы текущего отданы вызывающему коду.
+    """
+    def batch_size(remaining: int) -> int:
+        # Число страниц в batch по остатку, чтобы не запрашивать страницы за концом списка;
+        # если оценка исчерпана, а страницы еще полные — дочитываем полными batch-запросами
+        if remaining <= 0:
+            return BATCH_LIMIT
+        return min(BATCH_LIMIT, math.ceil(remaining / PAGE_SIZE))
+
+    pages = batch_size(expected)
+    request = _keyset_request(bit, method, params, last_id, pages)
+    try:
+        while request is not None:
+            results = _batch_pages(await request)
+            request = None
+            batch = []
+            finished = False
+            for index in range(pages):
+                page = _page_rows(results.get(f"p{index}"))
+                if page:
+                    batch.append(page)
+                if len(page) < PAGE_SIZE:
+                    # Следующие команды ссылались на несуществующую строку — их результаты не нужны
+                    finished = True
+                    break
+
+            expected -= pages * PAGE_SIZE
+            # total прочитан целиком (строки, добавленные во время выборки, как и в get_all, не дочитываем)
+            if not finished and not (exact and expected <= 0):
+                pages = batch_size(expected)
+                request = _keyset_request(bit, method, params, _row_id(batch[-1][-1]), pages)
+
+            for page in batch:
+                yield page
+    finally:
+        _cancel([request])
+
+
+async def _collect(pages: AsyncIterator[list[dict]]) -> list[dict]:
+    return [row async for page in pages for row in page]
+
+
+async def _fetch_sharded(bit, method: str, params: dict, last_id: int, expected: int, shards: int) -> list[dict]:
+    """Дочитывает строки после `last_id` параллельными цепочками по диапазонам ID"""
+    # Не больше диапазонов, чем batch-запросов понадобилось бы одной цепочке
+    batches = math.ceil(expected / (PAGE_SIZE * BATCH_LIMIT))
+    shards = min(shards, batches)
+    if shards <= 1:
+        return await _collect(_iter_keyset(bit, method, params, last_id, expected))
+
+    last = await bit.call(method, {**params, 'select': ['ID'], 'order': {'ID': 'DESC'}, 'start': -1}, raw=True)
+    tail = _page_rows(last.get('result'))
+    max_id = _row_id(tail[0]) if tail else last_id
+    span = max_id - last_id
+    if span < shards:
+        return await _collect(_iter_keyset(bit, method, params, last_id, expected))
+
+    # Границы кратны batch-запросам (при равномерных ID каждая цепочка — целое число полных batch)
+    shares = [batches // shards + (1 if index < batches % shards else 0) for index in range(shards)]
+    bounds = [last_id]
+    for share in shares[:-1]:
+        bounds.append(bounds[-1] + span * share // batches)
+    bounds.append(max_id)
+    logger.info(f"Выборка {method}: {expected} строк после ID {last_id}, {shards} диапазонов ID параллельно")
+    parts = await asyncio.gather(*[
+        _collect(_iter_keyset(
+            bit, method,
+            {**params, 'filter': {**params['filter'], '<=ID': upper}},
+            lower,
+            math.ceil(expected * (upper - lower) / span),
+            exact=False,
+        ))
+        for lower, upper in zip(bounds, bounds[1:])
+    ])
+    # Диапазоны не пересекаются и идут по возрастанию ID
+    return [row for part in parts for row in part]
+
+
+async def fetch_list(bit, method: str, params: Optional[dict] = None, threshold: int = None,
+                     shards: int = None) -> list[dict]:
+    """
+    Полная выборка списочного метода CRM с keyset-пагинацией для больших списков
+
+    Args:
+        bit: Клиент fast_bitrix24
+        method: Списочный метод (`crm.deal.list`, `crm.activity.list` и т.д.)
+        params: Параметры метода (`filter`, `select`, `order` по ID); `order` по другим полям не
+            поддерживается — такие запросы выполняются через `bit.get_all`
+        threshold: Порог числа строк для keyset-пагинации (по умолчанию KEYSET_THRESHOLD)
+        shards: Число диапазонов ID для параллельной выборки больших списков (по умолчанию FETCH_SHARDS)
+
+    Returns:
+        Список строк, отсортированный по ID (по убыванию при `order: {ID: DESC}`)
+    """
+    list_params = _list_params(method, params)
+    if list_params is None:
+        return await bit.get_all(method, params=params)
+    if _descending(list_params):
+        # Диапазоны ID делятся по возрастанию: выбираем так же и разворачиваем
+        rows = await fetch_list(bit, method, {**list_params, 'order': {'ID': 'ASC'}}, threshold, shards)
+        rows.reverse()
+        return rows
+
+    threshold = KEYSET_THRESHOLD if threshold is None else threshold
+    shards = FETCH_SHARDS if shards is None else shards
+    rows, total = await _first_page(bit, method, list_params)
+
+    if len(rows) == PAGE_SIZE and total > PAGE_SIZE:
+        if total > threshold:
+            logger.info(f"Выборка {method}: {total} строк по курсору ID")
+            rows.extend(await _fetch_sharded(bit, method, list_params, _row_id(rows[-1]), total - PAGE_SIZE, shards))
+        else:
+            rows.extend(await _collect(_iter_offset(bit, method, list_params, total)))
+
+    return rows
+
+
+async def iter_list(bit, method: str, params: Optional[dict] = None,
+                    threshold: int = None) -> AsyncIterator[list[dict]]:
+    """
+    Постраничная выборка списочного метода (асинхронный генератор страниц по 50 строк)
+
+    Args:
+        bit: Клиент fast_bitrix24
+        method: Списочный метод (`crm.deal.list`, `crm.activity.list`, `tasks.task.list` и т.д.)
+        params: Параметры метода (`filter`, `select`, `order` по ID); при `order` по другим полям весь
+            список выбирается через `bit.get_all` и отдается одной страницей
+        threshold: Порог числа строк для keyset-пагинации (по умолчанию KEYSET_THRESHOLD)
+
+    Yields:
+        Непустые страницы строк в порядке ID (по убыванию при `order: {ID: DESC}`)
+    """
+    list_params = _list_params(method, params)
+    if list_params is None:
+        rows = await bit.get_all(method, params=params)
+        if rows:
+            yield rows
+        return
+
+    threshold = KEYSET_THRESHOLD if threshold is None else threshold
+    rows, total = await _first_page(bit, method, list_params)
+    if rows:
+        yield rows
+
+    if len(rows) == PAGE_SIZE and total > PAGE_SIZE:
+        if total > threshold:
+            pages = _iter_keyset(bit, method, list_params, _row_id(rows[-1]), total - PAGE_SIZE)
+        else:
+            pages = _iter_offset(bit, method, list_params, total)
+        try:
+            async for page in pages:
+                yield page
+        finally:
+            # Вызывающий код мог прервать выборку — отменяем уже отправленные запросы
+            await pages.aclose()
@@ -0,0 +1,60 @@
+"""
+Проекции полей для выборок из Bitrix24
+
+`select: ["*"]` у `crm.activity.list` возвращает `DESCRIPTION`, `SETTINGS`, `COMMUNICATIONS` и другие
+тяжелые поля, а `["*", "UF_*"]` у контактов, компаний и лидов — все пользовательские поля. Аналитическим
+инструментам обычно нужны два-три поля (`TYPE_ID`, `DIRECTION`, `RESPONSIBLE_ID`), поэтому каждый
+инструмент объявляет поля, которые читает (`projection(...)`), и передает их в `select_fields`.
+
+Слой выборки (`pagination`, `bitrixWork._get_all`) вызывает `track_select` для каждого запроса:
+запросы полных записей считаются в `stats['full']` по методам, и о каждом новом сочетании метода и
+`select` пишется сообщение в лог — так видно, какие вызовы еще тянут записи целиком.
+"""
+from collections import Counter
+from typing import Optional
+
+from loguru import logger
+
+# Значения select, означающие полные записи
+FULL_SELECT = ('*', 'UF_*')
+
+stats = {'projected': Counter(), 'full': Counter()}
+
+# Сочетания (метод, select), о которых уже написано в лог
+_reported: set[tuple[str, tuple]] = set()
+
+
+def projection(*fields: str) -> list[str]:
+    """
+    Список полей для `select_fields`: ID и перечисленные поля без повторов
+
+    Args:
+        *fields: Поля, которые читает инструмент
+
+    Returns:
+        Список полей, начинающийся с ID
+    """
+    selected = ['ID']
+    for field in fields:
+        if field not in selected:
+            selected.append(field)
+    return selected
+
+
+def is_full_select(select: Optional[list]) -> bool:
+    """Запрашивает ли select полные записи (пустой select портал тоже понимает как все поля)"""
+    return not select or any(field in FULL_SELECT for field in select)
+
+
+def track_select(method: str, select: Optional[list]) -> None:
+    """Учитывает запрос списка: проекция или полные записи (с сообщением в лог при первом таком запросе)"""
+    if not is_full_select(select):
+        stats['projected'][method] += 1
+        return
+
+    stats['full'][method] += 1
+    key = (method, tuple(select or ()))
+    if key not in _reported:
+        _reported.add(key)
+        logger.info(f"Запрос {method} выбирает полные записи (select={list(select or [])}); "
+                    f"если инструменту нужны не все поля, передайте projection(...)")
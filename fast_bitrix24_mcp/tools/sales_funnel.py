@@ -1,5 +1,4 @@
 from .bitrixWork import (
-    bit,
     get_leads_by_filter,
     get_deals_by_filter,
     get_stage_history
@@ -0,0 +1,233 @@
+"""
+Общий планировщик запросов к Bitrix24: token bucket + адаптивное окно параллельности (AIMD)
+
+Все REST-запросы клиента `bit` (включая `batch` и страницы `get_all`) проходят через один планировщик
+процесса, который подставляется вместо `bit.srh.acquire` (`install_scheduler`):
+- token bucket повторяет политику портала: `burst` запросов сразу, дальше `requests_per_second` в секунду;
+- окно параллельности ограничивает число одновременных запросов. Пока портал отвечает без ошибок, окно
+  растет: на 1 за каждый ответ до порога (медленный старт), выше порога — на 1 за окно ответов.
+  На `QUERY_LIMIT_EXCEEDED`/`OPERATION_TIME_LIMIT` (HTTP 503/429 или ошибка команды внутри batch)
+  окно, порог и скорость выдачи токенов уменьшаются вдвое, накопленные токены сбрасываются; скорость
+  возвращается к `requests_per_second` по шагу `RATE_RECOVERY_STEPS` за каждый успешный ответ.
+
+Фоновые запросы (`operating.background()`: выгрузки, прогрев кэша) получают место в окне только после
+интерактивных, которые ждут вместе с ними. Учет operating-времени по методам — `operating.OperatingBudget`
+(без него — `respect_velocity_policy` fast_bitrix24).
+Фиксированные паузы и семафоры в инструментах не нужны: планировщик сам замедляет запросы на
+загруженном портале и не тормозит их на свободном.
+
+Настройки (переменные окружения): BITRIX_RPS (по умолчанию 2), BITRIX_BURST (50),
+BITRIX_MAX_CONCURRENCY (50), BITRIX_INITIAL_CONCURRENCY (10).
+"""
+import asyncio
+import contextvars
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any
+
+from loguru import logger
+
+from .operating import BACKGROUND, current_priority
+
+# HTTP-статусы и коды ошибок Bitrix24, означающие перегрузку портала
+OVERLOAD_STATUSES = (429, 503)
+OVERLOAD_ERRORS = ("QUERY_LIMIT_EXCEEDED", "OPERATION_TIME_LIMIT")
+
+# Минимальная скорость запросов после уменьшений, запросов в секунду
+MIN_RATE = 0.2
+# За сколько успешных ответов скорость восстанавливается от нуля до requests_per_second
+RATE_RECOVERY_STEPS = 50
+
+# Эпоха окна, в которой был отправлен текущий запрос (для ошибок из batch-ответов)
+_request_epoch: contextvars.ContextVar = contextvars.ContextVar("bitrix_request_epoch", default=None)
+
+
+class RequestScheduler:
+    """Token bucket + окно параллельности AIMD для всех запросов процесса"""
+
+    def __init__(self, requests_per_second: float = 2.0, burst: int = 50,
+                 max_concurrency: int = 50, initial_concurrency: int = 10):
+        self.stats = {'requests': 0, 'overloads': 0, 'waited_tokens': 0.0, 'waited_window': 0.0}
+        self.configure(requests_per_second, burst, max_concurrency, initial_concurrency)
+
+    def configure(self, requests_per_second: float, burst: int,
+                  max_concurrency: int = 50, initial_concurrency: int = 10) -> None:
+        """Задает лимиты и сбрасывает состояние планировщика"""
+        self.requests_per_second = float(requests_per_second)
+        self.rate = self.requests_per_second
+        self.burst = max(int(burst), 1)
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.window = float(min(max(int(initial_concurrency), 1), self.max_concurrency))
+        self.threshold = float(self.max_concurrency)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        # Номер "эпохи" окна: уменьшение применяется один раз на волну ошибок от запросов одной эпохи
+        self.epoch = 0
+        self.in_flight = 0
+        self._loop = None
+        self._waiters: deque = deque()
+        self._background_waiters: deque = deque()
+
+    def _bind_loop(self) -> None:
+        """Планировщик общий для процесса, но ожидающие запросы привязаны к текущему циклу событий"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._waiters = deque()
+            self._background_waiters = deque()
+            self.in_flight = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _interactive_waiting(self) -> bool:
+        return any(not waiter.done() for waiter in self._waiters)
+
+    async def _wait_window(self) -> None:
+        background = current_priority() == BACKGROUND
+        # Фоновый запрос не занимает место, которого ждут интерактивные
+        while self.in_flight >= int(self.window) or (background and self._interactive_waiting()):
+            waiter = self._loop.create_future()
+            (self._background_waiters if background else self._waiters).append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Пробуждение, доставшееся отмененному запросу, передаем следующему
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+
+    async def _take_token(self) -> None:
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            delay = (1 - self.tokens) / self.rate
+            self.stats['waited_tokens'] += delay
+            await asyncio.sleep(delay)
+
+    def _wake(self) -> None:
+        free = int(self.window) - self.in_flight
+        for waiters in (self._waiters, self._background_waiters):
+            while free > 0 and waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    free -= 1
+
+    def on_success(self) -> None:
+        """Ответ без ошибок: увеличиваем окно и скорость"""
+        self._refill()
+        self.rate = min(self.rate + self.requests_per_second / RATE_RECOVERY_STEPS, self.requests_per_second)
+        if self.window < self.threshold:
+            self.window = min(self.window + 1, self.max_concurrency)
+        else:
+            self.window = min(self.window + 1 / self.window, self.max_concurrency)
+        self._wake()
+
+    def on_overload(self, epoch: int = None) -> None:
+        """Портал сообщил о превышении лимита: уменьшаем окно вдвое и сбрасываем токены"""
+        self.stats['overloads'] += 1
+        if epoch is not None and epoch != self.epoch:
+            # Ответ на запрос, отправленный до предыдущего уменьшения окна
+            return
+        self.epoch += 1
+        self.threshold = max(self.window / 2, 1.0)
+        self.window = self.threshold
+        self._refill()
+        self.rate = max(self.rate / 2, min(MIN_RATE, self.requests_per_second))
+        self.tokens = min(self.tokens, 0.0)
+        logger.warning(f"Портал Bitrix24 перегружен: окно параллельности {int(self.window)}, "
+                       f"скорость {self.rate:.2f} запросов/с")
+
+    @asynccontextmanager
+    async def slot(self):
+        """Ожидает место в окне и токен, затем учитывает результат запроса"""
+        # aiohttp загружается вместе с клиентом, не при импорте модуля
+        from aiohttp import ClientResponseError
+
+        self._bind_loop()
+        started = time.monotonic()
+        await self._wait_window()
+        self.stats['waited_window'] += time.monotonic() - started
+        # Место в окне занимается до ожидания токена, чтобы его не перехватил другой запрос
+        self.in_flight += 1
+        epoch = self.epoch
+        _request_epoch.set(epoch)
+        try:
+            await self._take_token()
+            self.stats['requests'] += 1
+            yield
+        except ClientResponseError as error:
+            if error.status in OVERLOAD_STATUSES:
+                self.on_overload(epoch)
+            raise
+        else:
+            self.on_success()
+        finally:
+            self.in_flight -= 1
+            self._wake()
+
+    def snapshot(self) -> dict:
+        """Текущее состояние планировщика (для логов и бенчмарков)"""
+        return {**self.stats, 'window': self.window, 'threshold': self.threshold, 'rate': self.rate, 'in_flight': self.in_flight}
+
+
+def _batch_overloaded(response: Any) -> bool:
+    """Есть ли среди ошибок команд batch-ответа ошибки лимитов"""
+    result = response.get('result') if isinstance(response, dict) else None
+    errors = result.get('result_error') if isinstance(result, dict) else None
+    if not isinstance(errors, dict):
+        return False
+    return any(isinstance(error, dict) and error.get('error') in OVERLOAD_ERRORS for error in errors.values())
+
+
+def create_scheduler_from_env() -> RequestScheduler:
+    """Создает планировщик с лимитами из переменных окружения"""
+    return RequestScheduler(
+        requests_per_second=float(os.getenv('BITRIX_RPS', '2')),
+        burst=int(os.getenv('BITRIX_BURST', '50')),
+        max_concurrency=int(os.getenv('BITRIX_MAX_CONCURRENCY', '50')),
+        initial_concurrency=int(os.getenv('BITRIX_INITIAL_CONCURRENCY', '10')),
+    )
+
+
+def install_scheduler(bit, scheduler: RequestScheduler) -> None:
+    """
+    Подставляет планировщик в клиент fast_bitrix24
+
+    Заменяет `srh.acquire` (собственные leaky bucket и autothrottle библиотеки) на `scheduler.slot()`,
+    сохраняя учет operating-времени по методам, и передает планировщику ошибки лимитов из batch-ответов.
+    """
+    from fast_bitrix24.srh import BITRIX_MEASUREMENT_PERIOD, SlidingWindowThrottler
+
+    srh = bit.srh
+    original_records = srh.add_throttler_records
+
+    @asynccontextmanager
+    async def acquire(method: str):
+        async with scheduler.slot():
+            if srh.respect_velocity_policy:
+                if method not in srh.method_throttlers:
+                    srh.method_throttlers[method] = SlidingWindowThrottler(
+                        srh.operating_time_limit, BITRIX_MEASUREMENT_PERIOD
+                    )
+                async with srh.method_throttlers[method].acquire():
+                    yield
+            else:
+                yield
+
+    def add_throttler_records(method: str, params: dict, json: dict):
+        if _batch_overloaded(json):
+            scheduler.on_overload(_request_epoch.get())
+        original_records(method, params, json)
+        # leaky bucket библиотеки больше не используется, его история запросов не нужна
+        srh.leaky_bucket_throttler._request_history.clear()
+
+    srh.acquire = acquire
+    srh.add_throttler_records = add_throttler_records
@@ -0,0 +1,120 @@
+"""
+Объединение одинаковых одновременных запросов к Bitrix24 (singleflight)
+
+Когда несколько инструментов одновременно запрашивают одни и те же данные (пользователи, воронки, стадии,
+поля сущностей), каждый вызов `bit.get_all` заново проходит всю пагинацию. `coalesce` объединяет такие
+вызовы: ключ строится по методу и каноническим параметрам (`transport.request_key`), первый вызов
+запускает запрос отдельной задачей, остальные ждут ее результат. Пачка из 20 одинаковых вызовов стоит
+одного прохода пагинации.
+
+Результат не кэшируется: ключ удаляется сразу после завершения запроса, следующий вызов идет в портал.
+Если результат получили несколько вызовов, каждый получает свою копию строк — вызывающий код дополняет
+словари (например, `CATEGORY_ID` у стадий) и не должен влиять на соседей.
+
+Общий запрос выполняется в чистом контексте, а не в контексте первого вызова:
+- приоритет (operating.py) — фоновый, только пока все ожидающие вызовы фоновые; интерактивный вызов,
+  присоединившийся к выгрузке, повышает приоритет ее оставшихся запросов;
+- методы, отклоненные предохранителями в общем запросе (breaker.py), отмечаются недоступными в
+  `collect_unavailable()` каждого ожидающего вызова;
+- спаны запросов — дочерние спана `shared <метод>` отдельной трассы, ее ID пишется атрибутом
+  `shared_trace_id` в текущий спан каждого вызова (tracing.py).
+"""
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Optional
+
+from loguru import logger
+
+from . import tracing
+from .breaker import collect_unavailable, mark_unavailable
+from .operating import SharedPriority, current_priority, shared
+
+# Активные запросы: (id цикла событий, ключ запроса) -> запрос
+_inflight: dict[tuple[int, str], "_Flight"] = {}
+
+stats = {'started': 0, 'coalesced': 0}
+
+
+class _Flight:
+    """Выполняющийся запрос, число вызовов, ожидающих его результат, и их общий приоритет"""
+
+    def __init__(self, priority: SharedPriority):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self.priority = priority
+        self.span = None
+        # Методы, отклоненные предохранителями в общем запросе
+        self.unavailable: set = set()
+
+
+def copy_rows(value: Any) -> Any:
+    """Копия результата на два уровня: список/словарь строк и сами строки"""
+    if isinstance(value, list):
+        return [dict(item) if isinstance(item, dict) else item for item in value]
+    if isinstance(value, dict):
+        return {key: dict(item) if isinstance(item, dict) else item for key, item in value.items()}
+    return value
+
+
+def _forget(flight_key: tuple[int, str], task: asyncio.Task) -> None:
+    """Снимает завершенный запрос с учета (вызывается до пробуждения ожидающих)"""
+    if _inflight.get(flight_key) is not None and _inflight[flight_key].task is task:
+        del _inflight[flight_key]
+    # Исключение получают ожидающие вызовы; если их отменили, не оставляем "Task exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+async def _run(method: str, factory: Callable[[], Awaitable[Any]], flight: _Flight) -> Any:
+    with (
+        shared(flight.priority),
+        collect_unavailable() as unavailable,
+        tracing.span(f"shared {method}", method=method) as span,
+    ):
+        flight.unavailable = unavailable
+        flight.span = span
+        # factory может вернуть корутину или уже запущенную задачу (синхронная обертка Bitrix в цикле событий)
+        return await factory()
+
+
+async def coalesce(method: str, params: Optional[dict], factory: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Выполняет `factory()` один раз для всех одновременных вызовов с теми же методом и параметрами
+
+    Args:
+        method: Метод REST API (входит в ключ объединения)
+        params: Параметры запроса (входят в ключ в каноническом виде)
+        factory: Функция, запускающая запрос
+
+    Returns:
+        Результат запроса (копия строк, если результат получили несколько вызовов)
+    """
+    from .transport import request_key
+
+    loop = asyncio.get_running_loop()
+    flight_key = (id(loop), request_key(method, params))
+
+    flight = _inflight.get(flight_key)
+    if flight is None:
+        flight = _Flight(SharedPriority(current_priority()))
+        task = loop.create_task(_run(method, factory, flight), context=contextvars.Context())
+        flight.task = task
+        _inflight[flight_key] = flight
+        task.add_done_callback(lambda done: _forget(flight_key, done))
+        stats['started'] += 1
+    else:
+        flight.priority.join(current_priority())
+        stats['coalesced'] += 1
+        logger.debug(f"Запрос {method} уже выполняется, ожидаем его результат")
+
+    flight.waiters += 1
+    try:
+        # shield: отмена одного вызова не должна отменять запрос остальных
+        result = await asyncio.shield(flight.task)
+    finally:
+        for name in flight.unavailable:
+            mark_unavailable(name)
+        trace_id = getattr(flight.span, 'trace_id', None)
+        if trace_id is not None:
+            tracing.set_attribute('shared_trace_id', trace_id)
+    return result if flight.waiters == 1 else copy_rows(result)
@@ -1,6 +1,4 @@
 from mcp.server.fastmcp import FastMCP, Context
-from dotenv import load_dotenv
-load_dotenv()
 import os
 import json
 from datetime import datetime, timedelta, timezone
@@ -10,7 +8,6 @@ from pprint import pprint
 from pathlib import Path
 from .userfields import get_all_info_fields
 from .bitrixWork import (
-    bit, 
     get_task_by_id, 
     get_tasks_by_filter, 
     create_task, 
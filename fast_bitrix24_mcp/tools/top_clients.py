@@ -1,5 +1,4 @@
 from .bitrixWork import (
-    bit,
     get_deals_by_filter,
     get_contacts_by_filter,
     get_companies_by_filter
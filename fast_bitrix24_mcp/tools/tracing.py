@@ -0,0 +1,281 @@
+"""
+Трассировка вызовов: инструмент MCP → функции bitrixWork → HTTP-запросы к REST API
+
+Метрики (metrics.py) показывают распределения, но не отвечают, почему конкретный вызов `get_deals_at_risk`
+шел 40 секунд. Трассировка записывает дерево спанов одного вызова:
+- `tool <имя>` — вызов инструмента (`ToolTracingMiddleware` главного сервера);
+- функции выборки bitrixWork (`@traced()`: `get_deals_by_filter`, `get_manager_full_activity`, ...) и полные
+  выборки `fetch <метод>` (`_get_all`, `_get_list`) с числом строк и статусом кэша;
+- `rest <метод>` — каждый HTTP-запрос транспорта (страница списка или batch-запрос) с номером страницы,
+  числом команд batch, байтами ответа и HTTP-статусом.
+
+Текущий спан хранится в ContextVar, поэтому задачи `asyncio.gather` наследуют родителя: параллельные выборки
+(например, шесть запросов `get_manager_full_activity`) видны как дочерние спаны с пересекающимся временем.
+
+Экспорт (BITRIX_TRACE): `jsonl` — по строке на спан в файл BITRIX_TRACE_FILE (по умолчанию
+`logs/traces.jsonl`), `otlp` — пачки спанов в формате OTLP/HTTP JSON на BITRIX_OTLP_ENDPOINT (по умолчанию
+`http://127.0.0.1:4318/v1/traces`, принимают OpenTelemetry Collector, Jaeger, Tempo). Спаны пишет фоновый
+поток раз в секунду, запросы к порталу его не ждут. Без BITRIX_TRACE трассировка выключена и `span()`
+возвращает общий пустой спан.
+"""
+import atexit
+import functools
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from fastmcp.server.middleware import CallNext, Middleware, MiddlewareContext
+from loguru import logger
+
+TRACE_EXPORTERS = ('jsonl', 'otlp')
+DEFAULT_TRACE_FILE = 'logs/traces.jsonl'
+DEFAULT_OTLP_ENDPOINT = 'http://127.0.0.1:4318/v1/traces'
+SERVICE_NAME = 'fast-bitrix24-mcp'
+
+# Как часто фоновый поток выгружает накопленные спаны, секунды
+FLUSH_INTERVAL = 1.0
+
+_current: ContextVar[Optional["Span"]] = ContextVar('bitrix_current_span', default=None)
+
+
+class Span:
+    """Спан: имя, родитель, время начала и конца, атрибуты"""
+
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes',
+                 'error', '_token')
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"], attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = 0
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error = None
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        self.start_ns = time.time_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current.reset(self._token)
+        self.tracer.finish(self)
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start_ns / 1e9,
+            'duration': round((self.end_ns - self.start_ns) / 1e9, 6),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class _NullSpan:
+    """Спан выключенной трассировки"""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_span(span: Span) -> dict:
+    data = {
+        'traceId': span.trace_id,
+        'spanId': span.span_id,
+        'name': span.name,
+        'kind': 1,
+        'startTimeUnixNano': str(span.start_ns),
+        'endTimeUnixNano': str(span.end_ns),
+        'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in span.attributes.items()],
+        'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+    }
+    if span.parent_id:
+        data['parentSpanId'] = span.parent_id
+    return data
+
+
+class Tracer:
+    """Создание спанов и фоновая выгрузка завершенных спанов"""
+
+    def __init__(self, exporter: Optional[str] = None, path: str = DEFAULT_TRACE_FILE,
+                 endpoint: str = DEFAULT_OTLP_ENDPOINT, flush_interval: float = FLUSH_INTERVAL):
+        if exporter is not None and exporter not in TRACE_EXPORTERS:
+            raise ValueError(f"Неизвестный экспорт трассировки {exporter!r}, ожидается одно из {TRACE_EXPORTERS}")
+        self.exporter = exporter
+        self.path = Path(path)
+        self.endpoint = endpoint
+        self.flush_interval = flush_interval
+        self.stats = {'spans': 0, 'exported': 0, 'export_errors': 0}
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def span(self, name: str, **attributes) -> Span | _NullSpan:
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, _current.get(), attributes)
+
+    def finish(self, span: Span) -> None:
+        self.stats['spans'] += 1
+        self._queue.put(span)
+        if self._thread is None:
+            self._start()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="bitrix-trace-export", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _drain(self) -> list[Span]:
+        spans = []
+        while True:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                return spans
+
+    def flush(self) -> None:
+        """Выгружает накопленные спаны (фоновый поток и завершение процесса)"""
+        spans = self._drain()
+        if not spans:
+            return
+        try:
+            if self.exporter == 'jsonl':
+                self._write_jsonl(spans)
+            else:
+                self._post_otlp(spans)
+            self.stats['exported'] += len(spans)
+        except Exception as e:
+            self.stats['export_errors'] += 1
+            logger.warning(f"Не удалось выгрузить {len(spans)} спанов трассировки ({self.exporter}): {e}")
+
+    def _write_jsonl(self, spans: list[Span]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open('a', encoding='utf-8') as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + '\n')
+
+    def _post_otlp(self, spans: list[Span]) -> None:
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [_otlp_span(span) for span in spans]}],
+        }]}
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(payload, default=str).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST',
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
+
+
+def create_tracer_from_env() -> Tracer:
+    """Трассировка по переменным окружения (BITRIX_TRACE, BITRIX_TRACE_FILE, BITRIX_OTLP_ENDPOINT)"""
+    exporter = os.getenv('BITRIX_TRACE', '').strip().lower() or None
+    return Tracer(
+        exporter=exporter,
+        path=os.getenv('BITRIX_TRACE_FILE', DEFAULT_TRACE_FILE),
+        endpoint=os.getenv('BITRIX_OTLP_ENDPOINT', DEFAULT_OTLP_ENDPOINT),
+    )
+
+
+# Общий для процесса трассировщик
+tracer = create_tracer_from_env()
+
+
+def span(name: str, **attributes) -> Span | _NullSpan:
+    """Дочерний спан текущего спана (`with span(...) as s:`)"""
+    return tracer.span(name, **attributes)
+
+
+def set_attribute(key: str, value: Any) -> None:
+    """Атрибут текущего спана (без активного спана ничего не делает)"""
+    current = _current.get()
+    if current is not None:
+        current.set_attribute(key, value)
+
+
+def result_size(result: Any) -> Optional[int]:
+    """Число строк результата выборки (список или словарь) для атрибута `rows`"""
+    return len(result) if isinstance(result, (list, dict)) else None
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Декоратор асинхронной функции: спан на вызов с атрибутом `rows` (размер результата)"""
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return await func(*args, **kwargs)
+            with tracer.span(span_name) as current:
+                result = await func(*args, **kwargs)
+                rows = result_size(result)
+                if rows is not None:
+                    current.set_attribute('rows', rows)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+class ToolTracingMiddleware(Middleware):
+    """Корневой спан на вызов инструмента MCP"""
+
+    async def on_call_tool(self, context: MiddlewareContext, call_next: CallNext) -> Any:
+        if not tracer.enabled:
+            return await call_next(context)
+        with tracer.span(f"tool {context.message.name}", tool=context.message.name):
+            return await call_next(context)
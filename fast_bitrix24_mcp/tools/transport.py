@@ -0,0 +1,567 @@
+"""
+HTTP-транспорт для клиента fast_bitrix24: пул соединений и режимы записи и воспроизведения (кассеты)
+
+Транспорт подставляется в `bit.srh.session` вместо `aiohttp.ClientSession` и реализует только тот
+интерфейс, который использует fast_bitrix24: `post(url=..., json=..., ssl=...)` как асинхронный
+контекстный менеджер с ответом, у которого есть `await response.json()`. Ответы с HTTP-статусом >= 400
+поднимают `aiohttp.ClientResponseError`, как сессия с `raise_for_status=True`.
+
+Режимы (переменная окружения BITRIX_TRANSPORT_MODE):
+- `live` — обычные запросы к порталу через пул соединений
+- `record` — запросы к порталу с записью ответов в кассету
+- `replay` — ответы берутся из кассеты, портал не используется
+
+Кассета (BITRIX_CASSETTE) — gzip-файл JSON Lines: заголовок с версией формата и по строке на запрос
+(метод, параметры, статус, тело ответа, время ответа). Вебхук в кассету не пишется.
+
+При воспроизведении ответ ищется по точному совпадению метода и параметров, затем — по порядку вызовов
+того же метода (даты в фильтрах вида "за последние 30 дней" меняются между записью и воспроизведением).
+Задержка ответа (BITRIX_LATENCY_PROFILE) задается JSON-файлом профиля
+`{"crm.deal.list": {"p50": 0.12, "p99": 0.9}, "default": {"p50": 0.1, "p99": 0.5}}` или значением
+`recorded` — тогда профиль p50/p99 по методам строится из времени ответов, сохраненного в кассете.
+
+Без транспорта fast_bitrix24 открывает сессию aiohttp на каждый внешний вызов и закрывает ее, когда
+активных вызовов не остается, поэтому последовательные вызовы инструментов каждый раз платят TCP/TLS
+рукопожатие. Транспорт держит одну сессию на цикл событий с пулом keep-alive соединений
+(BITRIX_POOL_SIZE, BITRIX_KEEPALIVE), общим и поменным таймаутами (BITRIX_TIMEOUT,
+BITRIX_CONNECT_TIMEOUT, BITRIX_METHOD_TIMEOUTS) и счетчиками соединений: создано, переиспользовано,
+открыто сейчас, ожидание свободного соединения (`connection_stats()`). BITRIX_HTTP2=1 включает HTTP/2
+через httpx (если установлены `httpx` и `h2`; иначе остается aiohttp с HTTP/1.1).
+"""
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import math
+import os
+import random
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+import aiohttp
+from loguru import logger
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from . import metrics, tracing
+
+CASSETTE_FORMAT = "bitrix24-cassette"
+CASSETTE_VERSION = 1
+TRANSPORT_MODES = ("live", "record", "replay")
+
+# Квантиль стандартного нормального распределения для 99-го перцентиля
+Z_99 = 2.326
+
+# Пул соединений по умолчанию: не меньше окна параллельности планировщика (BITRIX_MAX_CONCURRENCY)
+DEFAULT_POOL_SIZE = 50
+DEFAULT_KEEPALIVE = 60.0
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+
+
+class CassetteMissError(Exception):
+    """В кассете нет ответа для запроса"""
+
+
+def canonical_params(params: Any) -> str:
+    """Каноническое представление параметров запроса (ключи отсортированы, без пробелов)"""
+    return json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def request_key(method: str, params: Any) -> str:
+    """Ключ запроса: хэш метода и канонических параметров"""
+    return hashlib.sha1(f"{method}\n{canonical_params(params)}".encode("utf-8")).hexdigest()
+
+
+def _request_attributes(params: Any) -> dict:
+    """Атрибуты спана запроса: страница списка (`start`), курсор keyset (`>ID`), число команд batch"""
+    if not isinstance(params, dict):
+        return {}
+    attributes = {}
+    if isinstance(params.get("start"), int) and params["start"] >= 0:
+        attributes["page"] = params["start"] // 50
+    filter_fields = params.get("filter")
+    if isinstance(filter_fields, dict) and ">ID" in filter_fields:
+        attributes["after_id"] = filter_fields[">ID"]
+    if isinstance(params.get("cmd"), dict):
+        attributes["commands"] = len(params["cmd"])
+    return attributes
+
+
+def parse_method_timeouts(value: Optional[str]) -> dict[str, float]:
+    """Таймауты по методам из строки вида `batch=120,crm.activity.list=90`"""
+    timeouts = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        method, seconds = item.split("=", 1)
+        timeouts[method.strip().lower()] = float(seconds)
+    return timeouts
+
+
+class TransportResponse:
+    """Ответ транспорта с интерфейсом aiohttp.ClientResponse, который использует fast_bitrix24"""
+
+    def __init__(self, status: int, body: bytes):
+        self.status = status
+        self.body = body
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def text(self, encoding: str = "utf-8") -> str:
+        return self.body.decode(encoding or "utf-8")
+
+    async def json(self, encoding: str = "utf-8", **kwargs) -> Any:
+        return json.loads(self.body.decode(encoding or "utf-8"))
+
+
+class _RequestContext:
+    """Асинхронный контекстный менеджер, возвращаемый `BitrixTransport.post`"""
+
+    def __init__(self, coroutine):
+        self._coroutine = coroutine
+
+    async def __aenter__(self) -> TransportResponse:
+        return await self._coroutine
+
+    async def __aexit__(self, *exc_info) -> bool:
+        return False
+
+
+class LatencyProfile:
+    """Профиль задержек ответа по методам
+
+    Задержка выбирается из логнормального распределения с медианой p50 и 99-м перцентилем p99.
+    """
+
+    def __init__(self, profile: dict[str, dict[str, float]], seed: Optional[int] = None):
+        self.profile = profile
+        self._rng = random.Random(seed)
+
+    @classmethod
+    def from_file(cls, path: str | Path, seed: Optional[int] = None) -> "LatencyProfile":
+        with Path(path).open("r", encoding="utf-8") as f:
+            return cls(json.load(f), seed)
+
+    @classmethod
+    def from_interactions(cls, interactions: list[dict], seed: Optional[int] = None) -> "LatencyProfile":
+        """Строит профиль p50/p99 по методам из времени ответов, сохраненного в кассете"""
+        timings = defaultdict(list)
+        for interaction in interactions:
+            timings[interaction["method"]].append(interaction.get("elapsed", 0.0))
+        profile = {}
+        for method, values in timings.items():
+            values.sort()
+            profile[method] = {
+                "p50": values[len(values) // 2],
+                "p99": values[min(len(values) - 1, math.ceil(len(values) * 0.99) - 1)],
+            }
+        return cls(profile, seed)
+
+    def sample(self, method: str) -> float:
+        settings = self.profile.get(method) or self.profile.get("default")
+        if not settings:
+            return 0.0
+        p50 = float(settings.get("p50", 0.0))
+        p99 = float(settings.get("p99", p50))
+        if p50 <= 0:
+            return 0.0
+        sigma = math.log(p99 / p50) / Z_99 if p99 > p50 else 0.0
+        return p50 * math.exp(sigma * self._rng.gauss(0.0, 1.0))
+
+
+class Cassette:
+    """Кассета с записанными ответами портала (gzip JSON Lines)"""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.interactions: list[dict] = []
+        self._file = None
+
+    def load(self) -> "Cassette":
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("format") != CASSETTE_FORMAT:
+                raise ValueError(f"Файл {self.path} не является кассетой {CASSETTE_FORMAT}")
+            if header.get("version", 0) > CASSETTE_VERSION:
+                raise ValueError(f"Неподдерживаемая версия кассеты {header.get('version')} (поддерживается до {CASSETTE_VERSION})")
+            self.interactions = [json.loads(line) for line in f if line.strip()]
+        logger.info(f"Загружена кассета {self.path}: {len(self.interactions)} запросов")
+        return self
+
+    def append(self, interaction: dict) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = gzip.open(self.path, "wt", encoding="utf-8")
+            header = {
+                "format": CASSETTE_FORMAT,
+                "version": CASSETTE_VERSION,
+                "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            self._file.write(json.dumps(header, ensure_ascii=False) + "\n")
+            atexit.register(self.close)
+        self._file.write(json.dumps(interaction, ensure_ascii=False) + "\n")
+        # Сбрасываем буфер после каждого запроса, чтобы кассета была читаемой и при аварийном завершении
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class BitrixTransport:
+    """Транспорт запросов fast_bitrix24 (подставляется в `bit.srh.session`)
+
+    Args:
+        webhook: URL вебхука (нужен, чтобы выделить имя метода из URL запроса)
+        mode: `live`, `record` или `replay`
+        cassette_path: Путь к кассете (для `record` и `replay`)
+        latency_profile: Профиль задержек при воспроизведении
+        pool_size: Максимум одновременно открытых соединений с порталом
+        keepalive: Сколько секунд держать простаивающее соединение открытым
+        timeout: Общий таймаут запроса, секунды
+        connect_timeout: Таймаут установки соединения, секунды
+        method_timeouts: Таймауты отдельных методов (например, `{"batch": 120}`)
+        http2: HTTP/2 через httpx (если установлен), иначе aiohttp с HTTP/1.1
+    """
+
+    def __init__(
+        self,
+        webhook: str,
+        mode: str = "live",
+        cassette_path: Optional[str | Path] = None,
+        latency_profile: Optional[LatencyProfile] = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        keepalive: float = DEFAULT_KEEPALIVE,
+        timeout: float = DEFAULT_TIMEOUT,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        method_timeouts: Optional[dict[str, float]] = None,
+        http2: bool = False,
+    ):
+        if mode not in TRANSPORT_MODES:
+            raise ValueError(f"Неизвестный режим транспорта {mode!r}, допустимые: {', '.join(TRANSPORT_MODES)}")
+        if mode != "live" and not cassette_path:
+            raise ValueError(f"Для режима {mode!r} нужен путь к кассете")
+
+        self.webhook = webhook if webhook.endswith("/") else webhook + "/"
+        self.mode = mode
+        self.latency_profile = latency_profile
+        self.cassette = Cassette(cassette_path) if cassette_path else None
+        self.pool_size = max(int(pool_size), 1)
+        self.keepalive = float(keepalive)
+        self.timeout = float(timeout)
+        self.connect_timeout = float(connect_timeout)
+        self.method_timeouts = {method.lower(): float(seconds) for method, seconds in (method_timeouts or {}).items()}
+        self.http2 = bool(http2) and _http2_available()
+        # Дублирующие запросы для хвостовых задержек (hedging.RequestHedger), устанавливаются снаружи
+        self.hedger = None
+        self.stats = {}
+        self.reset_stats()
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._http2_client = None
+        self._http2_loop: Optional[asyncio.AbstractEventLoop] = None
+        atexit.register(self._release_stale_session)
+        self._by_key: dict[str, deque] = defaultdict(deque)
+        self._by_method: dict[str, deque] = defaultdict(deque)
+        self._last_by_key: dict[str, dict] = {}
+        self._used: set[int] = set()
+
+        if mode == "replay":
+            self.cassette.load()
+            for index, interaction in enumerate(self.cassette.interactions):
+                self._by_key[interaction["key"]].append(index)
+                self._by_method[interaction["method"]].append(index)
+
+    @property
+    def closed(self) -> bool:
+        return False
+
+    def post(self, url: str, json: Any = None, ssl: Any = None, **kwargs) -> _RequestContext:
+        return _RequestContext(self._post(str(url), json, ssl))
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self._http2_client is not None:
+            await self._http2_client.aclose()
+            self._http2_client = None
+        if self.cassette is not None:
+            self.cassette.close()
+
+    def _method_from_url(self, url: str) -> str:
+        method = url[len(self.webhook):] if url.startswith(self.webhook) else url.rsplit("/", 1)[-1]
+        return method.strip().lower()
+
+    def reset_stats(self) -> None:
+        """Сбрасывает счетчики запросов и соединений"""
+        self.stats = {
+            "requests": 0,
+            "bytes_received": 0,
+            "errors": 0,
+            "methods": defaultdict(int),
+            "connections_created": 0,
+            "connections_reused": 0,
+            "connect_time": 0.0,
+            "queued": 0,
+            "queue_delay": 0.0,
+            "queue_delay_max": 0.0,
+        }
+
+    def connection_stats(self) -> dict:
+        """Счетчики соединений: создано, переиспользовано, доля переиспользования, открыто, ожидание пула"""
+        created = self.stats["connections_created"]
+        reused = self.stats["connections_reused"]
+        queued = self.stats["queued"]
+        return {
+            "pool_size": self.pool_size,
+            "http2": self.http2,
+            "open_connections": self._open_connections(),
+            "connections_created": created,
+            "connections_reused": reused,
+            "reuse_ratio": round(reused / (created + reused), 4) if created + reused else 0.0,
+            "avg_connect_time": round(self.stats["connect_time"] / created, 6) if created else 0.0,
+            "queued": queued,
+            "avg_queue_delay": round(self.stats["queue_delay"] / queued, 6) if queued else 0.0,
+            "max_queue_delay": round(self.stats["queue_delay_max"], 6),
+        }
+
+    def _open_connections(self) -> int:
+        """Число открытых соединений пула (занятых и простаивающих)"""
+        if self._session is None or self._session.closed:
+            return 0
+        connector = self._session.connector
+        idle = sum(len(connections) for connections in getattr(connector, "_conns", {}).values())
+        return idle + len(getattr(connector, "_acquired", ()))
+
+    def _request_timeout(self, method: str) -> float:
+        return self.method_timeouts.get(method, self.timeout)
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        """Счетчики соединений по событиям трассировки aiohttp"""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_queued_start(session, context, params):
+            context.queued_at = time.perf_counter()
+
+        async def on_queued_end(session, context, params):
+            delay = time.perf_counter() - context.queued_at
+            self.stats["queued"] += 1
+            self.stats["queue_delay"] += delay
+            self.stats["queue_delay_max"] = max(self.stats["queue_delay_max"], delay)
+
+        async def on_create_start(session, context, params):
+            context.connect_started = time.perf_counter()
+
+        async def on_create_end(session, context, params):
+            self.stats["connections_created"] += 1
+            self.stats["connect_time"] += time.perf_counter() - context.connect_started
+
+        async def on_reuse(session, context, params):
+            self.stats["connections_reused"] += 1
+
+        trace_config.on_connection_queued_start.append(on_queued_start)
+        trace_config.on_connection_queued_end.append(on_queued_end)
+        trace_config.on_connection_create_start.append(on_create_start)
+        trace_config.on_connection_create_end.append(on_create_end)
+        trace_config.on_connection_reuseconn.append(on_reuse)
+        return trace_config
+
+    def _release_stale_session(self) -> None:
+        """
+        Освобождает пул сессии, цикл событий которой уже закрыт (синхронные вызовы Bitrix через asyncio.run,
+        завершение процесса): закрыть соединения на нем нельзя, а без этого aiohttp предупреждает о незакрытой сессии
+        """
+        if self._session is not None and not self._session.closed and self._session_loop.is_closed():
+            self._session.connector._close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Сессия aiohttp привязана к циклу событий, поэтому при смене цикла создается заново"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._release_stale_session()
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=self.keepalive,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=self.connect_timeout),
+                trace_configs=[self._trace_config()],
+            )
+            self._session_loop = loop
+        return self._session
+
+    def _get_http2_client(self, ssl: Any):
+        """Клиент httpx с HTTP/2: запросы мультиплексируются в нескольких соединениях"""
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        if self._http2_client is None or self._http2_loop is not loop:
+            self._http2_client = httpx.AsyncClient(
+                http2=True,
+                verify=ssl is not False,
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=self.keepalive,
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            )
+            self._http2_loop = loop
+        return self._http2_client
+
+    async def _send(self, url: str, method: str, params: Any, ssl: Any) -> tuple[int, bytes]:
+        """Запрос к порталу: статус и тело ответа"""
+        timeout = self._request_timeout(method)
+        if not self.http2:
+            async with self._get_session().post(
+                url, json=params, ssl=ssl, timeout=aiohttp.ClientTimeout(total=timeout, sock_connect=self.connect_timeout)
+            ) as response:
+                return response.status, await response.read()
+
+        import httpx
+
+        try:
+            response = await self._get_http2_client(ssl).post(url, json=params, timeout=timeout)
+        except httpx.TimeoutException as error:
+            # fast_bitrix24 повторяет запросы при TimeoutError и ClientConnectionError
+            raise TimeoutError(str(error)) from error
+        except httpx.TransportError as error:
+            raise aiohttp.ClientConnectionError(str(error)) from error
+        return response.status_code, response.content
+
+    async def _post(self, url: str, params: Any, ssl: Any) -> TransportResponse:
+        method = self._method_from_url(url)
+        self.stats["requests"] += 1
+        self.stats["methods"][method] += 1
+
+        started = time.perf_counter()
+        metrics.rest_in_flight.inc()
+        try:
+            with tracing.span(f"rest {method}", method=method, **_request_attributes(params)) as span:
+                if self.mode == "replay":
+                    status, body = await self._replay(method, params)
+                elif self.hedger is not None:
+                    status, body = await self.hedger.run(method, params, lambda: self._send(url, method, params, ssl))
+                else:
+                    status, body = await self._send(url, method, params, ssl)
+                span.set_attribute("status", status)
+                span.set_attribute("bytes", len(body))
+        finally:
+            metrics.rest_in_flight.dec()
+        metrics.record_rest_response(method, time.perf_counter() - started, status, body)
+
+        if self.mode == "record":
+            self.cassette.append({
+                "method": method,
+                "key": request_key(method, params),
+                "params": params,
+                "status": status,
+                "elapsed": round(time.perf_counter() - started, 6),
+                "body": body.decode("utf-8", errors="replace"),
+            })
+
+        self.stats["bytes_received"] += len(body)
+        if status >= 400:
+            self.stats["errors"] += 1
+            raise aiohttp.ClientResponseError(
+                aiohttp.RequestInfo(URL(url), "POST", CIMultiDictProxy(CIMultiDict()), URL(url)),
+                (),
+                status=status,
+                message=body.decode("utf-8", errors="replace")[:200],
+            )
+        return TransportResponse(status, body)
+
+    def _next_unused(self, queue: deque) -> Optional[int]:
+        while queue:
+            index = queue.popleft()
+            if index not in self._used:
+                self._used.add(index)
+                return index
+        return None
+
+    async def _replay(self, method: str, params: Any) -> tuple[int, bytes]:
+        key = request_key(method, params)
+        index = self._next_unused(self._by_key[key])
+        if index is None:
+            index = self._next_unused(self._by_method[method])
+        if index is not None:
+            interaction = self.cassette.interactions[index]
+            self._last_by_key[key] = interaction
+        else:
+            # Повторный запрос сверх записанных — отдаем последний ответ на такой же запрос
+            interaction = self._last_by_key.get(key)
+            if interaction is None:
+                raise CassetteMissError(f"В кассете {self.cassette.path} нет ответа для {method}")
+
+        if self.latency_profile is not None:
+            await asyncio.sleep(self.latency_profile.sample(method))
+        return interaction["status"], interaction["body"].encode("utf-8")
+
+
+def _http2_available() -> bool:
+    """Установлены ли httpx и h2 (необязательные зависимости для HTTP/2)"""
+    try:
+        import h2  # noqa: F401
+        import httpx  # noqa: F401
+    except ImportError:
+        logger.warning("HTTP/2 недоступен: не установлены httpx и h2 (pip install 'httpx[http2]'), используется HTTP/1.1")
+        return False
+    return True
+
+
+def create_transport_from_env(webhook: str) -> BitrixTransport:
+    """Создает транспорт по переменным окружения
+
+    - BITRIX_TRANSPORT_MODE: `live` (по умолчанию), `record`, `replay`
+    - BITRIX_CASSETTE: путь к кассете (по умолчанию `cassettes/bitrix24.jsonl.gz`)
+    - BITRIX_LATENCY_PROFILE: путь к JSON-профилю задержек или `recorded`
+    - BITRIX_LATENCY_SEED: зерно генератора задержек
+    - BITRIX_POOL_SIZE: размер пула соединений (по умолчанию 50)
+    - BITRIX_KEEPALIVE: время жизни простаивающего соединения, секунды (по умолчанию 60)
+    - BITRIX_TIMEOUT, BITRIX_CONNECT_TIMEOUT: общий таймаут запроса и таймаут соединения (60 и 10 секунд)
+    - BITRIX_METHOD_TIMEOUTS: таймауты методов, например `batch=120,crm.activity.list=90`
+    - BITRIX_HTTP2: `1` — HTTP/2 через httpx
+    """
+    mode = os.getenv("BITRIX_TRANSPORT_MODE", "live").strip().lower()
+    pool_options = {
+        "pool_size": int(os.getenv("BITRIX_POOL_SIZE", str(DEFAULT_POOL_SIZE))),
+        "keepalive": float(os.getenv("BITRIX_KEEPALIVE", str(DEFAULT_KEEPALIVE))),
+        "timeout": float(os.getenv("BITRIX_TIMEOUT", str(DEFAULT_TIMEOUT))),
+        "connect_timeout": float(os.getenv("BITRIX_CONNECT_TIMEOUT", str(DEFAULT_CONNECT_TIMEOUT))),
+        "method_timeouts": parse_method_timeouts(os.getenv("BITRIX_METHOD_TIMEOUTS")),
+        "http2": os.getenv("BITRIX_HTTP2", "0").strip().lower() in ("1", "true", "yes"),
+    }
+    if mode == "live":
+        return BitrixTransport(webhook, mode=mode, **pool_options)
+
+    cassette_path = os.getenv("BITRIX_CASSETTE", "cassettes/bitrix24.jsonl.gz")
+    profile_setting = os.getenv("BITRIX_LATENCY_PROFILE")
+    seed = os.getenv("BITRIX_LATENCY_SEED")
+    seed = int(seed) if seed else None
+
+    transport = BitrixTransport(webhook, mode=mode, cassette_path=cassette_path, **pool_options)
+    if mode == "replay" and profile_setting:
+        if profile_setting.strip().lower() == "recorded":
+            transport.latency_profile = LatencyProfile.from_interactions(transport.cassette.interactions, seed)
+        else:
+            transport.latency_profile = LatencyProfile.from_file(profile_setting, seed)
+    logger.info(f"Транспорт Bitrix24 в режиме {mode}, кассета {cassette_path}")
+    return transport
+
+
+def install_transport(bit, transport: BitrixTransport) -> None:
+    """Подставляет транспорт в клиента fast_bitrix24 вместо сессии aiohttp, которую библиотека открывает и закрывает на каждый вызов"""
+    bit.srh.session = transport
+    # Клиент считается переданным пользователем, поэтому fast_bitrix24 не создает и не закрывает сессии сам
+    bit.srh.client_provided_by_user = True
@@ -1,4 +1,4 @@
-from .bitrixWork import bit, get_fields_by_user, get_users_by_filter, get_manager_full_activity, get_all_managers_activity
+from .bitrixWork import get_fields_by_user, get_users_by_filter, get_manager_full_activity, get_all_managers_activity
 from mcp.server.fastmcp import FastMCP, Context
 from pprint import pprint
 from .userfields import get_all_info_fields
@@ -2,17 +2,9 @@ import asyncio
 import os
 import traceback
 from pprint import pprint
-from dotenv import load_dotenv
 import json
 # from bitrixWork import get_fields_by_deal
 from .bitrixWork import get_fields_by_deal, get_fields_by_user, get_fields_by_contact, get_fields_by_company, get_fields_by_task, get_fields_by_lead
-load_dotenv()
-# Инициализация клиента Bitrix24
-webhook = os.getenv("WEBHOOK")
-if not webhook:
-    print("Необходимо установить переменную окружения WEBHOOK")
-    exit()
-
 from mcp.server.fastmcp import FastMCP, Context
 
 mcp = FastMCP("userfields")
@@ -1,6 +1,7 @@
-from fast_bitrix24_mcp.main import mcp
+from fast_bitrix24_mcp.main import mcp, mounts
 
 
 if __name__ == "__main__":  
+    mounts.preload()
     mcp.run(transport="http", host="0.0.0.0", port=8000)
     # mcp.run(transport="streamable-http", host="127.0.0.1", port=9000)